@@ -17,16 +17,20 @@ module Ram #(
     localparam DEPTH_MEM = 1 << DEPTH;
     reg [WIDTH-1:0] mem [0:DEPTH_MEM-1];
 
- 
+    // The contents start out zero (simulation only; RamModel does the same)
+    integer i;
+    initial begin
+        for (i = 0; i < DEPTH_MEM; i = i + 1) begin
+            mem[i] = 0;
+        end
+    end
 
-    integer k;
+    // reset_n only clears the output registers; the contents are kept
+    // (load them with $readmemh)
     always @(posedge clk or negedge reset_n) begin
         if (!reset_n) begin
             data_out <= 0;
             valid_out <= 1'b0;
-            for (k = 0; k < DEPTH_MEM; k=k+1) begin
-                mem[k] <= 0;
-            end
         end
         else begin
             valid_out <= 1'b0;
@@ -44,6 +48,124 @@ module Ram #(
     
 endmodule
 
+// Ram behind a ready/valid handshake, for simulating a Cache with
+// HANDSHAKE = 1 against realistic memory timing.  A request on
+// read_enable / write_enable is taken on an edge where ready is high.  A
+// read returns LATENCY cycles later (1 = the timing of Ram) plus 0..JITTER
+// random cycles.  With COL_BITS > 0 a DRAM-style row buffer (row = adress
+// >> COL_BITS) adds T_RCD cycles to open a row, and T_RP more to close the
+// open one first; the next request waits for that too.  Up to OUTSTANDING
+// reads are in flight (1 = one at a time).  Responses come back in order
+// on data_out / valid_out, at most one per cycle.
+module LatencyRam #(
+    parameter WIDTH = 32,
+    parameter DEPTH = 4,
+    parameter LATENCY = 1,       // cycles from a taken read to data_out (>= 1)
+    parameter JITTER = 0,        // random extra read cycles, 0..JITTER
+    parameter SEED = 16'hACE1,   // LFSR seed for the jitter
+    parameter COL_BITS = 0,      // 0 = no row buffer
+    parameter T_RCD = 3,         // cycles to open a row
+    parameter T_RP = 3,          // cycles to close the open row
+    parameter OUTSTANDING = 4    // reads in flight
+)(
+    input wire [WIDTH-1:0] data_in,
+    input wire [DEPTH-1:0] adress,
+    input wire write_enable,
+    input wire read_enable,
+    input wire clk,
+    input wire reset_n,
+    output wire ready,
+    output reg [WIDTH-1:0] data_out,
+    output reg valid_out
+);
+
+    localparam DEPTH_MEM = 1 << DEPTH;
+    localparam SLOT_ID = (OUTSTANDING > 1) ? $clog2(OUTSTANDING) : 1;
+    reg [WIDTH-1:0] mem [0:DEPTH_MEM-1];
+
+    // Reads in flight: data (read when taken) and the edge it is output on
+    reg [WIDTH-1:0]   rq_data [0:OUTSTANDING-1];
+    reg [31:0]        rq_due  [0:OUTSTANDING-1];
+    reg [SLOT_ID-1:0] rq_head = 0;
+    reg [SLOT_ID-1:0] rq_tail = 0;
+    reg [SLOT_ID:0]   rq_count = 0;
+
+    reg [31:0]      now = 0;          // edges since reset
+    reg [31:0]      next_free = 0;    // first edge the next response may use
+    reg [31:0]      busy_until = 0;   // row buffer: no request before this edge
+    reg [15:0]      lfsr = SEED;
+    reg [DEPTH-1:0] open_row = 0;
+    reg             row_open = 1'b0;
+
+    // The contents start out zero (simulation only), as in Ram
+    integer i;
+    initial begin
+        for (i = 0; i < DEPTH_MEM; i = i + 1) begin
+            mem[i] = 0;
+        end
+    end
+
+    wire [DEPTH-1:0] row = adress >> COL_BITS;
+    wire [31:0] row_wait = (COL_BITS == 0 || row_open && open_row == row) ? 0 :
+                           row_open ? T_RP + T_RCD : T_RCD;
+    wire [31:0] jitter = (JITTER > 0) ? lfsr % (JITTER + 1) : 0;
+    wire [31:0] min_due = now + LATENCY - 1 + row_wait + jitter;
+    wire [31:0] due = (min_due > next_free) ? min_due : next_free;
+    wire        pop = (rq_count != 0) && (rq_due[rq_head] == now);
+
+    assign ready = (rq_count < OUTSTANDING) && (now >= busy_until);
+    wire take = ready && (read_enable || write_enable);
+
+    // reset_n only clears the control registers; the contents are kept
+    always @(posedge clk or negedge reset_n) begin
+        if (!reset_n) begin
+            data_out <= 0;
+            valid_out <= 1'b0;
+            rq_head <= 0;
+            rq_tail <= 0;
+            rq_count <= 0;
+            now <= 0;
+            next_free <= 0;
+            busy_until <= 0;
+            lfsr <= SEED;
+            row_open <= 1'b0;
+        end
+        else begin
+            now <= now + 1;
+            valid_out <= 1'b0;
+            if (pop) begin
+                data_out <= rq_data[rq_head];
+                valid_out <= 1'b1;
+                rq_head <= (rq_head == OUTSTANDING - 1) ? 0 : rq_head + 1;
+            end
+            if (take && COL_BITS > 0) begin
+                open_row <= row;
+                row_open <= 1'b1;
+                busy_until <= now + 1 + row_wait;
+            end
+            if (take && write_enable) begin
+                mem[adress] <= data_in;
+            end
+            if (take && read_enable) begin
+                lfsr <= {1'b0, lfsr[15:1]} ^ (lfsr[0] ? 16'hB400 : 16'h0000);
+                next_free <= due + 1;
+                if (due == now) begin
+                    // LATENCY 1 and nothing queued: straight to data_out
+                    data_out <= mem[adress];
+                    valid_out <= 1'b1;
+                end
+                else begin
+                    rq_data[rq_tail] <= mem[adress];
+                    rq_due[rq_tail] <= due;
+                    rq_tail <= (rq_tail == OUTSTANDING - 1) ? 0 : rq_tail + 1;
+                end
+            end
+            rq_count <= rq_count + (take && read_enable && due != now) - pop;
+        end
+    end
+
+endmodule
+
 module Cache
 #(
   // Cache parameters
@@ -58,8 +180,51 @@ module Cache
   parameter INDEX_WIDTH = 10,
   parameter TAG_WIDTH = 19,
   parameter OFFSET_WIDTH = 3,
-  parameter WORD1 = 3,
-  parameter WORD2 = 7
+  parameter WORD1 = 3,   // unused: the word is selected by the upper OFFSET bits
+  parameter WORD2 = 7,   // unused
+  // Memory beats of MWIDTH bits per cache line (1, 2, 4, 8, ...); a line is
+  // MWIDTH*BURST bits and OFFSET_WIDTH must address all of its bytes
+  parameter BURST = 1,
+  // Replacement: 0 = log2(NWAYS)-bit LRU counters per way, 1 = tree pseudo-LRU (NWAYS-1 bits per set)
+  parameter PLRU = 0,
+  // Miss status holding registers: 0 = blocking cache (hold the request until
+  // hit_miss), N > 0 = non-blocking with up to N outstanding misses
+  parameter NMSHR = 0,
+  // Write buffer entries for dirty victims: 0 = write back before the fetch
+  parameter WBUF = 0,
+  // Victim cache entries (fully associative, FIFO replacement, 4-16 is
+  // typical): 0 = evicted lines leave the cache
+  parameter VICTIM = 0,
+  // Prefetcher: 0 = off, 1 = next line, 2 = constant stride between demand
+  // misses; PF_DEGREE lines are prefetched per trigger, starting
+  // PF_DISTANCE lines (strides) ahead of the miss
+  parameter PREFETCH = 0,
+  parameter PF_DEGREE = 2,
+  parameter PF_DISTANCE = 1,
+  // Hit path: 0 = tag compare and data select in the cycle the request is
+  // taken, 1 = two stages (set read into registers, then compare and select)
+  parameter PIPE = 0,
+  // Memory interface: 0 = fixed timing (a beat is taken every cycle and
+  // read data is on mq one cycle after mrden, like Ram), 1 = ready/valid
+  // handshake (mready / mvalid, see LatencyRam)
+  parameter HANDSHAKE = 0,
+  // Snoop port: 1 = another agent can take lines out of the cache (write
+  // back if dirty, then invalidate), 2 = it drops them (invalidate only,
+  // the snooper has the data); needs NMSHR = 0, PIPE = 0, VICTIM = 0
+  parameter SNOOP = 0,
+  // 1 = every evicted line is written back, clean or not (the L1 of an
+  // exclusive hierarchy, see CacheHierarchy)
+  parameter EVICT_ALL = 0,
+  // 1 = the CPU writes whole lines, word after word (the L2 of a
+  // CacheHierarchy): a write miss takes the line without fetching it
+  parameter LINE_WRITES = 0,
+  // 1 = coherent cache on a CoherentBus: MESI line states, misses wait for
+  // the bus grant, snoops keep (Shared) or invalidate lines and hand out
+  // Modified data; needs HANDSHAKE = 1, NMSHR = 0, PIPE = 0, WBUF = 0,
+  // VICTIM = 0, PREFETCH = 0, SNOOP = 0
+  parameter MESI = 0,
+  // 1 = performance counters, read and cleared through the CSR port
+  parameter PERF = 0
 )
 (
   input  wire                      clk,          // renamed from clock
@@ -70,6 +235,7 @@ module Cache
   input  wire                      wren,       // 1 if st instruction
   output wire                      hit_miss,   // 1 if hit, 0 while handling miss
   output wire [WIDTH-1:0]          q,          // data from cache to CPU
+  output wire                      ready,      // 0 while the sets are cleared after reset
   
   // Memory Interface miss or write back
   output wire [MWIDTH-1:0]         mdout,      // data from cache to memory (write back)
@@ -77,7 +243,54 @@ module Cache
   output wire                      mrden,      // read enable, 1 if reading from memory (miss)
   output wire [WIDTH-1:0]          mwraddress, // memory write address 
   output wire                      mwren,      // write enable, 1 if writing to memory (write back)
-  input  wire [MWIDTH-1:0]         mq          // data coming from memory (miss)
+  input  wire [MWIDTH-1:0]         mq,         // data coming from memory (miss)
+  input  wire                      mready,     // HANDSHAKE = 1: memory takes the beat on mrden / mwren
+  input  wire                      mvalid,     // HANDSHAKE = 1: mq holds a read beat
+
+  // Snoop port (SNOOP > 0 or MESI = 1): hold snoop until snoop_done
+  input  wire                      snoop,         // take the line at snoop_address out
+  input  wire [WIDTH-1:0]          snoop_address,
+  output wire                      snoop_done,    // line written back (if dirty) and invalid
+  output wire                      snoop_hit,     // the line was in the cache
+  // MESI = 1: snoop_share keeps the line Shared instead of invalidating it;
+  // a Modified line is handed out on snoop_data (snoop_dirty) and is
+  // clean afterwards
+  input  wire                      snoop_share,
+  output wire                      snoop_dirty,
+  output wire [MWIDTH*BURST-1:0]   snoop_data,
+  // Coherent bus (MESI = 1): a miss is started only while mgnt is high,
+  // mexcl marks the fetch of a write (the other copies are invalidated)
+  // and mshared says that other caches keep the line
+  output wire                      mreq,
+  input  wire                      mgnt,
+  output wire                      mexcl,
+  input  wire                      mshared,
+  // Pulses when a valid line leaves the cache to make room for a fill
+  output wire                      evict,
+  output wire [WIDTH-1:0]          evict_address, // its line address
+
+  // Non-blocking interface (NMSHR > 0)
+  output wire                      accept,     // request taken (hit or miss queued); hit_miss when NMSHR = 0
+  output wire [((NMSHR > 1) ? $clog2(NMSHR) : 1)-1:0] miss_id,   // MSHR of the accepted miss
+  output wire                      resp_valid, // a queued miss completed
+  output wire [((NMSHR > 1) ? $clog2(NMSHR) : 1)-1:0] resp_id,   // its MSHR
+  output wire [WIDTH-1:0]          resp_q,     // read data of the completed miss
+
+  // Prefetch counters (PREFETCH > 0): accuracy = pf_useful / pf_issued,
+  // coverage = pf_useful / (pf_useful + demand_misses)
+  output reg  [31:0]               pf_issued,     // lines prefetched
+  output reg  [31:0]               pf_useful,     // prefetched lines hit by a demand access
+  output reg  [31:0]               demand_misses, // lines fetched for demand misses
+
+  // Performance counter CSR port (PERF = 1): csr_addr picks a 32-bit
+  // counter (map below), csr_rdata holds it one cycle after csr_rden.  A
+  // write loads csr_wdata into the counter, a write to PERF_CLEAR clears
+  // them all; reset clears them too
+  input  wire [4:0]                csr_addr,
+  input  wire                      csr_rden,
+  input  wire                      csr_wren,
+  input  wire [31:0]               csr_wdata,
+  output reg  [31:0]               csr_rdata
 );
 
   // Address Decoding Parameters
@@ -89,37 +302,146 @@ module Cache
   localparam TAG_LOW = INDEX_WIDTH + OFFSET_WIDTH;
 
 
+  // Way / replacement widths (NWAYS must be a power of two)
+  localparam WAY_WIDTH = (NWAYS > 1) ? $clog2(NWAYS) : 1;
+  localparam LRU_WIDTH = WAY_WIDTH;
+  localparam PLRU_BITS = (NWAYS > 1) ? NWAYS - 1 : 1;
+
+  // Line layout: LINE_WORDS CPU words, BURST memory beats
+  localparam LINE_WIDTH = MWIDTH * BURST;
+  localparam LINE_WORDS = LINE_WIDTH / WIDTH;
+  localparam WSEL_WIDTH = (LINE_WORDS > 1) ? $clog2(LINE_WORDS) : 0;
+  localparam BEAT_WIDTH = (BURST > 1) ? $clog2(BURST) : 1;
+  localparam BEAT_LOW   = OFFSET_WIDTH - ((BURST > 1) ? $clog2(BURST) : 0);
+
+  // MSHR queue
+  localparam MSHR_SLOTS = (NMSHR > 0) ? NMSHR : 1;
+  localparam MSHR_ID    = (NMSHR > 1) ? $clog2(NMSHR) : 1;
+
+  // Write buffer
+  localparam WB_SLOTS = (WBUF > 0) ? WBUF : 1;
+  localparam WB_ID    = (WBUF > 1) ? $clog2(WBUF) : 1;
+
+  // Victim cache
+  localparam VC_SLOTS = (VICTIM > 0) ? VICTIM : 1;
+  localparam VC_ID    = (VICTIM > 1) ? $clog2(VICTIM) : 1;
+
+  // Prefetcher: line numbers are address[TAG_HIGH:INDEX_LOW]
+  localparam LINE_BITS = WIDTH - OFFSET_WIDTH;
+  localparam PFL_WIDTH = $clog2(PF_DEGREE + 1);
+
+
 /*******************************************************************
 * Global Parameters and Initializations
 *******************************************************************/
 
-// WAY 1 cache data
-reg                 valid1 [0:NSETS-1];
-reg                 dirty1 [0:NSETS-1];
-reg [1:0]           lru1   [0:NSETS-1];
-reg [TAG_WIDTH-1:0] tag1   [0:NSETS-1];
-reg [MWIDTH-1:0]    mem1   [0:NSETS-1] /* synthesis ramstyle = "M20K" */;
+// Pipelined hit path (PIPE = 1): stage 1 registers the request and the
+// addressed set of every way, stage 2 compares the tags and selects the word
+reg              s1_valid = 1'b0;
+reg              s1_rden = 1'b0;
+reg              s1_wren = 1'b0;
+reg [WIDTH-1:0]  s1_addr = {WIDTH{1'b0}};
+reg [WIDTH-1:0]  s1_din = {WIDTH{1'b0}};
+wire [INDEX_WIDTH-1:0] in_index = address[INDEX_HIGH:INDEX_LOW];
+
+// Request in the lookup stage: the CPU inputs, or stage 1 when pipelined
+wire             req_rden    = PIPE ? s1_valid && s1_rden : rden;
+wire             req_wren    = PIPE ? s1_valid && s1_wren : wren;
+wire [WIDTH-1:0] req_address = PIPE ? s1_addr : address;
+wire [WIDTH-1:0] req_din     = PIPE ? s1_din : din;
+
+wire [INDEX_WIDTH-1:0] index = req_address[INDEX_HIGH:INDEX_LOW];
+wire [OFFSET_WIDTH-1:0] offset = req_address[OFFSET_HIGH:OFFSET_LOW];
+// Word of the line addressed by the CPU: the upper WSEL_WIDTH offset bits
+wire [OFFSET_WIDTH-1:0] word_sel = offset >> (OFFSET_WIDTH - WSEL_WIDTH);
+
+// Per-way read ports of the addressed set, packed way-major
+wire [NWAYS-1:0]           way_valid;
+wire [NWAYS-1:0]           way_excl;   // MESI = 1: Exclusive or Modified
+wire [NWAYS*LRU_WIDTH-1:0] way_lru;
+wire [NWAYS*TAG_WIDTH-1:0] way_tag;
+wire [NWAYS*LINE_WIDTH-1:0] way_mem;
+wire [NWAYS-1:0]           hit_vec;    // one-hot: way holds the addressed block
+
+// Tree pseudo-LRU state (PLRU = 1), heap order with bit 0 as the root:
+// a node bit of 0 points the victim to its left subtree (lower ways)
+reg [PLRU_BITS-1:0] plru [0:NSETS-1];
+
+// Miss status holding registers, a FIFO served in allocation order by the
+// miss FSM (NMSHR > 0)
+reg [WIDTH-1:0]      mshr_addr [0:MSHR_SLOTS-1];
+reg                  mshr_wren [0:MSHR_SLOTS-1];
+reg [WIDTH-1:0]      mshr_din  [0:MSHR_SLOTS-1];
+reg [MSHR_SLOTS-1:0] mshr_valid = 0;
+reg [MSHR_ID-1:0]    mshr_head = 0;   // miss being served
+reg [MSHR_ID-1:0]    mshr_tail = 0;   // next free slot
+
+// Prefetch engine: demand misses train it (last miss line and stride), a
+// trigger loads PF_DEGREE lines starting at pf_next, and IDLE issues them
+// one at a time through the miss FSM (pf_active) when no demand miss and
+// no write buffer drain is waiting.  The first demand hit on a prefetched
+// line asks for the next line of its stream (tagged prefetching)
+reg                  pf_active = 1'b0;        // the miss FSM is serving pf_addr
+reg [WIDTH-1:0]      pf_addr = {WIDTH{1'b0}};
+reg [LINE_BITS-1:0]  pf_last = 0;             // line of the last demand miss
+reg [LINE_BITS-1:0]  pf_stride = 0;           // its distance to the one before
+reg [LINE_BITS-1:0]  pf_next = 0;             // next line to prefetch
+reg [LINE_BITS-1:0]  pf_step = 0;
+reg [PFL_WIDTH-1:0]  pf_left = 0;             // lines still to prefetch
+
+// Snoop port (SNOOP > 0): IDLE takes a snoop before any other work.  A
+// clean line is invalidated right away, a dirty one is written back by
+// WRITE_BACK first (sn_active).  The fill read port looks at the snooped set.
+reg              sn_active = 1'b0;
+reg [WIDTH-1:0]  sn_addr = {WIDTH{1'b0}};
+reg              _snoop_done = 1'b0;
+reg              _snoop_hit = 1'b0;
+reg              _snoop_dirty = 1'b0;
+reg [MWIDTH*BURST-1:0] _snoop_data = {MWIDTH*BURST{1'b0}};
+wire             sn_req  = (SNOOP || MESI) && snoop;
+wire             sn_look = (SNOOP || MESI) && (sn_active || currentState == IDLE && snoop);
+
+// Request served by the miss FSM: a snooped line, a prefetch, else the held
+// CPU request when blocking and the oldest MSHR otherwise
+wire [WIDTH-1:0] fill_address = sn_look ? (sn_active ? sn_addr : snoop_address) :
+                                pf_active ? pf_addr : (NMSHR > 0) ? mshr_addr[mshr_head] : req_address;
+wire             fill_wren    = !pf_active && ((NMSHR > 0) ? mshr_wren[mshr_head] : req_wren);
+wire [WIDTH-1:0] fill_din     = (NMSHR > 0) ? mshr_din[mshr_head] : req_din;
+wire [INDEX_WIDTH-1:0] fill_index = fill_address[INDEX_HIGH:INDEX_LOW];
+wire [OFFSET_WIDTH-1:0] fill_word = fill_address[OFFSET_HIGH:OFFSET_LOW] >> (OFFSET_WIDTH - WSEL_WIDTH);
 
-// WAY 2 cache data
-reg                 valid2 [0:NSETS-1];
-reg                 dirty2 [0:NSETS-1];
-reg [1:0]           lru2   [0:NSETS-1];
-reg [TAG_WIDTH-1:0] tag2   [0:NSETS-1];
-reg [MWIDTH-1:0]    mem2   [0:NSETS-1] /* synthesis ramstyle = "M20K" */;
+// Write buffer: dirty victims parked until the memory port is idle.  The
+// fetch of a line still in the buffer takes it from there (and swaps the
+// new victim in), so the buffer never holds a line that is in the cache.
+reg [WIDTH-1:0]      wb_addr [0:WB_SLOTS-1];   // line address, offset 0
+reg [LINE_WIDTH-1:0] wb_data [0:WB_SLOTS-1];
+reg [WB_SLOTS-1:0]   wb_valid = 0;
+reg                  wb_fwd = 1'b0;            // this refill comes from wb_slot
+reg [WB_ID-1:0]      wb_slot = 0;
 
-// WAY 3 cache data
-reg                 valid3 [0:NSETS-1];
-reg                 dirty3 [0:NSETS-1];
-reg [1:0]           lru3   [0:NSETS-1];
-reg [TAG_WIDTH-1:0] tag3   [0:NSETS-1];
-reg [MWIDTH-1:0]    mem3   [0:NSETS-1] /* synthesis ramstyle = "M20K" */;
+// Victim cache: every line the ways evict moves here (clean or dirty) and
+// pushes out the entry at vc_ptr, which is written back if dirty.  A miss
+// that finds its line here swaps it with the victim way's line, without a
+// Ram access.  A line is never in the ways and the victim cache at once.
+reg [WIDTH-1:0]      vc_addr [0:VC_SLOTS-1];   // line address, offset 0
+reg [LINE_WIDTH-1:0] vc_data [0:VC_SLOTS-1];
+reg [VC_SLOTS-1:0]   vc_valid = 0;
+reg [VC_SLOTS-1:0]   vc_dirty = 0;
+reg [VC_ID-1:0]      vc_ptr = 0;               // next entry to replace
+reg                  vc_fwd = 1'b0;            // this refill comes from vc_slot
+reg [VC_ID-1:0]      vc_slot = 0;
 
-// WAY 4 cache data
-reg                 valid4 [0:NSETS-1];
-reg                 dirty4 [0:NSETS-1];
-reg [1:0]           lru4   [0:NSETS-1];
-reg [TAG_WIDTH-1:0] tag4   [0:NSETS-1];
-reg [MWIDTH-1:0]    mem4   [0:NSETS-1] /* synthesis ramstyle = "M20K" */;
+// LINE_WRITES: this refill writes a line that is not fetched
+reg                  nf_fwd = 1'b0;
+
+// Per-way read ports of the set being filled
+wire [NWAYS-1:0]           fill_valid;
+wire [NWAYS-1:0]           fill_dirty;
+wire [NWAYS*LRU_WIDTH-1:0] fill_lru;
+wire [NWAYS*TAG_WIDTH-1:0] fill_tag;
+wire [NWAYS*LINE_WIDTH-1:0] fill_mem;
+wire [NWAYS-1:0]           fill_hit_vec;  // way already holds the line being filled
+wire [NWAYS-1:0]           way_pref;      // line was prefetched and not used yet
 
 
 
@@ -131,7 +453,26 @@ reg [WIDTH-1:0]  _mwraddress = {WIDTH{1'b0}};
 reg [WIDTH-1:0]  _mrdaddress = {WIDTH{1'b0}};
 reg              _mwren = 1'b0;
 reg              _mrden = 1'b0;
-reg [MWIDTH-1:0] new_block; 
+reg              _accept = 1'b0;
+reg [MSHR_ID-1:0] _miss_id = 0;
+reg              _resp_valid = 1'b0;
+reg [MSHR_ID-1:0] _resp_id = 0;
+reg [WIDTH-1:0]  _resp_q = {WIDTH{1'b0}};
+reg              _evict = 1'b0;
+reg [WIDTH-1:0]  _evict_address = {WIDTH{1'b0}};
+reg [LINE_WIDTH-1:0] new_block;
+
+// Burst refill: beats arrive one cycle after the Ram sampled mrden and are
+// shifted into line_buf from the top, so beat 0 ends up in the low bits
+reg [BEAT_WIDTH-1:0] beat = 0;            // beat issued by WRITE_BACK / FETCH
+reg                  mrden_d = 1'b0;      // _mrden one cycle ago: mq holds a beat
+reg [BEAT_WIDTH-1:0] rbeat = 0;           // HANDSHAKE = 1: beats received so far
+// HANDSHAKE = 1: the FSM waits while memory has not taken the beat on
+// mrden / mwren, and REFILL waits for the last read beat
+wire mem_stall  = HANDSHAKE && (_mwren || _mrden) && !mready;
+reg [LINE_WIDTH-1:0] line_buf = {LINE_WIDTH{1'b0}};
+wire [LINE_WIDTH-1:0] mq_line = mq;
+wire [LINE_WIDTH-1:0] fill_block = (line_buf >> MWIDTH) | (mq_line << (LINE_WIDTH - MWIDTH));
 
 // output assignments of internal registers
 assign hit_miss = _hit_miss;
@@ -141,6 +482,18 @@ assign mwraddress = _mwraddress;
 assign mrden = _mrden;
 assign mrdaddress = _mrdaddress;
 assign q = _q;
+assign accept = (NMSHR > 0 || PIPE) ? _accept : _hit_miss;
+assign ready = (currentState != INIT);
+assign miss_id = _miss_id;
+assign resp_valid = _resp_valid;
+assign resp_id = _resp_id;
+assign resp_q = _resp_q;
+assign snoop_done = _snoop_done;
+assign snoop_hit = _snoop_hit;
+assign snoop_dirty = _snoop_dirty;
+assign snoop_data = _snoop_data;
+assign evict = _evict;
+assign evict_address = _evict_address;
 
 // state parameters
 localparam IDLE       = 3'b000;
@@ -149,215 +502,593 @@ localparam WRITE_BACK = 3'b010; // Writing dirty line to memory
 localparam FETCH      = 3'b011; // Fetching new line from memory (sending read)
 localparam FETCH_WAIT = 3'b100; // Wait for RAM latency
 localparam REFILL     = 3'b101; // Capturing memory data and updating cache
+localparam DRAIN      = 3'b110; // Writing a write buffer entry to memory
+localparam INIT       = 3'b111; // After reset: clearing one set per cycle
 
 // state register
 reg [2:0] currentState = IDLE;
+reg [INDEX_WIDTH-1:0] init_index = 0;     // set cleared by INIT
 
 // Helper variables for FSM
-reg [1:0] victim_way;
+reg [WAY_WIDTH-1:0] victim_way = 0;
+
+/*******************************************************************
+* Hit detection, victim selection and output muxes
+*******************************************************************/
+reg [WAY_WIDTH-1:0] hit_way;        // lowest hitting way (way 1 has priority)
+reg [WAY_WIDTH-1:0] invalid_way;    // lowest invalid way
+reg                 has_invalid;
+reg [WAY_WIDTH-1:0] lru_victim;     // first way whose counter is NWAYS-1, else the last way
+reg [WAY_WIDTH-1:0] plru_victim;
+reg [PLRU_BITS-1:0] plru_next;      // tree bits after a hit on hit_way
+reg [PLRU_BITS-1:0] plru_fill_next; // tree bits after a non-blocking refill of victim_way
+reg                 line_pending;   // the addressed line already has an MSHR
+reg                 wb_hit;         // the line being filled is in the write buffer
+reg [WB_ID-1:0]     wb_hit_slot;
+reg                 wb_free;        // the write buffer has a free entry
+reg [WB_ID-1:0]     wb_free_slot;
+reg [WB_ID-1:0]     wb_drain_slot;  // lowest valid entry
+reg                 vc_hit;         // the line being filled is in the victim cache
+reg [VC_ID-1:0]     vc_hit_slot;
+reg                 fill_pending;   // the line being filled has an MSHR
+reg [WAY_WIDTH-1:0] fill_hit_way;   // way holding the line being filled (snooped)
+wire [PLRU_BITS-1:0] plru_bits = plru[index];
+wire [PLRU_BITS-1:0] plru_fill_bits = plru[fill_index];
+integer w, node;
+
+always @(*) begin
+    hit_way = 0;
+    for (w = NWAYS - 1; w >= 0; w = w - 1)
+        if (hit_vec[w]) hit_way = w;
+
+    fill_hit_way = 0;
+    for (w = NWAYS - 1; w >= 0; w = w - 1)
+        if (fill_hit_vec[w]) fill_hit_way = w;
+
+    has_invalid = 1'b0;
+    invalid_way = 0;
+    for (w = NWAYS - 1; w >= 0; w = w - 1)
+        if (!fill_valid[w]) begin
+            has_invalid = 1'b1;
+            invalid_way = w;
+        end
+
+    lru_victim = NWAYS - 1;
+    for (w = NWAYS - 2; w >= 0; w = w - 1)
+        if (fill_lru[w*LRU_WIDTH +: LRU_WIDTH] == NWAYS - 1) lru_victim = w;
+
+    // Walk the tree from the root to a leaf
+    node = 0;
+    for (w = 0; w < WAY_WIDTH; w = w + 1)
+        if (NWAYS > 1) node = 2*node + 1 + plru_fill_bits[node];
+    plru_victim = (NWAYS > 1) ? node - (NWAYS - 1) : 0;
+
+    // Point every node on the hit way's path away from it
+    plru_next = plru_bits;
+    node = hit_way + NWAYS - 1;
+    for (w = 0; w < WAY_WIDTH; w = w + 1)
+        if (NWAYS > 1) begin
+            plru_next[(node - 1) / 2] = node[0];
+            node = (node - 1) / 2;
+        end
+
+    plru_fill_next = plru_fill_bits;
+    node = victim_way + NWAYS - 1;
+    for (w = 0; w < WAY_WIDTH; w = w + 1)
+        if (NWAYS > 1) begin
+            plru_fill_next[(node - 1) / 2] = node[0];
+            node = (node - 1) / 2;
+        end
+
+    line_pending = 1'b0;
+    fill_pending = 1'b0;
+    for (w = 0; w < MSHR_SLOTS; w = w + 1) begin
+        if (mshr_valid[w] && mshr_addr[w][TAG_HIGH:INDEX_LOW] == req_address[TAG_HIGH:INDEX_LOW])
+            line_pending = 1'b1;
+        if (mshr_valid[w] && mshr_addr[w][TAG_HIGH:INDEX_LOW] == fill_address[TAG_HIGH:INDEX_LOW])
+            fill_pending = 1'b1;
+    end
+
+    wb_hit = 1'b0;
+    wb_hit_slot = 0;
+    wb_free = 1'b0;
+    wb_free_slot = 0;
+    wb_drain_slot = 0;
+    for (w = WB_SLOTS - 1; w >= 0; w = w - 1) begin
+        if (wb_valid[w] && wb_addr[w][TAG_HIGH:INDEX_LOW] == fill_address[TAG_HIGH:INDEX_LOW]) begin
+            wb_hit = 1'b1;
+            wb_hit_slot = w;
+        end
+        if (!wb_valid[w]) begin
+            wb_free = (WBUF > 0);
+            wb_free_slot = w;
+        end
+        else wb_drain_slot = w;
+    end
+
+    vc_hit = 1'b0;
+    vc_hit_slot = 0;
+    for (w = VC_SLOTS - 1; w >= 0; w = w - 1)
+        if (vc_valid[w] && vc_addr[w][TAG_HIGH:INDEX_LOW] == fill_address[TAG_HIGH:INDEX_LOW]) begin
+            vc_hit = (VICTIM > 0);
+            vc_hit_slot = w;
+        end
+end
+
+// MESI = 1: a write to a Shared line is a miss (fetched again for ownership)
+wire                 hit         = |hit_vec && !(MESI && req_wren && !way_excl[hit_way]);
+wire [LINE_WIDTH-1:0] hit_block  = way_mem[hit_way*LINE_WIDTH +: LINE_WIDTH];
+wire [LRU_WIDTH-1:0] hit_lru     = way_lru[hit_way*LRU_WIDTH +: LRU_WIDTH];
+wire [LRU_WIDTH-1:0] victim_lru  = fill_lru[victim_way*LRU_WIDTH +: LRU_WIDTH];
+wire [WAY_WIDTH-1:0] full_victim = PLRU ? plru_victim : lru_victim;
+wire [LINE_WIDTH-1:0] victim_block = fill_mem[victim_way*LINE_WIDTH +: LINE_WIDTH];
+wire [TAG_WIDTH-1:0] victim_tag   = fill_tag[victim_way*TAG_WIDTH +: TAG_WIDTH];
+wire                 victim_dirty = fill_valid[victim_way] && fill_dirty[victim_way];
+wire [WIDTH-1:0]     victim_addr  = {victim_tag, fill_index, {OFFSET_WIDTH{1'b0}}};
+wire                 vc_out_dirty = vc_valid[vc_ptr] && vc_dirty[vc_ptr];
+wire [VC_ID-1:0]     vc_in        = vc_fwd ? vc_slot : vc_ptr;  // entry the victim way's line goes to
+
+// Coherent bus (MESI = 1): wanted from a miss in IDLE until its refill
+assign mreq  = MESI && (currentState == IDLE ? (req_rden || req_wren) && !hit : currentState != INIT);
+assign mexcl = MESI && fill_wren;
+
+// A prefetch is dropped when its line is already cached, buffered, has an
+// MSHR or its tag does not fit in TAG_WIDTH bits
+wire [LINE_BITS-1:0] fill_line = fill_address[TAG_HIGH:INDEX_LOW];
+wire [LINE_BITS-1:0] miss_stride = fill_line - pf_last;
+wire pf_drop = pf_active && ((|fill_hit_vec) || vc_hit || wb_hit || fill_pending
+                             || (fill_address >> (TAG_LOW + TAG_WIDTH)) != 0);
+
+// Line this fill pushes out to Ram (written back, parked or swapped into the
+// write buffer): the victim way's line, or with a victim cache the entry at
+// vc_ptr the victim way's line replaces.  park_* is the MISS-state view
+// (victim_way is not registered yet), evict_* the one of the later states.
+wire [LINE_WIDTH-1:0] park_block  = (VICTIM > 0) ? vc_data[vc_ptr] : fill_mem[full_victim*LINE_WIDTH +: LINE_WIDTH];
+wire [WIDTH-1:0]     park_addr    = (VICTIM > 0) ? vc_addr[vc_ptr] :
+                                    {fill_tag[full_victim*TAG_WIDTH +: TAG_WIDTH], fill_index, {OFFSET_WIDTH{1'b0}}};
+wire                 park_dirty   = !has_invalid && !vc_hit && !pf_drop && ((VICTIM > 0) ? vc_out_dirty : fill_dirty[full_victim]);
+wire [LINE_WIDTH-1:0] evict_block = (VICTIM > 0) ? vc_data[vc_ptr] : victim_block;
+wire [WIDTH-1:0]     evict_addr   = (VICTIM > 0) ? vc_addr[vc_ptr] : victim_addr;
+wire                 evict_dirty  = (VICTIM > 0) ? fill_valid[victim_way] && vc_out_dirty : victim_dirty;
+
+// Requests are served in IDLE, while the write buffer drains and next to a
+// prefetch.  Requests to the set the miss FSM is working on and, in
+// non-blocking mode, to lines that already have an MSHR are not accepted
+// (the CPU holds them)
+wire port_idle  = (currentState == IDLE) || (currentState == DRAIN);
+wire set_busy   = !port_idle && (fill_index == index);
+wire can_serve  = ((NMSHR > 0) ? ready && !set_busy && !line_pending : port_idle || pf_active && !set_busy) && !sn_req;
+
+// Array write strobes (the arrays live in the per-way generate blocks)
+wire hit_access = can_serve && (req_rden || req_wren) && hit;
+wire hit_write  = hit_access && !req_rden;
+wire fill_ready = !HANDSHAKE || wb_fwd || vc_fwd || nf_fwd || mvalid && rbeat == BURST - 1;
+wire do_refill  = (currentState == REFILL) && fill_ready;
+wire do_init    = (currentState == INIT);
+wire fill_touch = do_refill && (NMSHR > 0 || pf_active);   // a refill counts as a use
+wire hit_pref   = hit_access && way_pref[hit_way];         // first use of a prefetched line
+// Snoops: taken in IDLE (held snoop, not the one just finished); the line
+// is invalidated now if clean (or dropped), after its last WRITE_BACK
+// beat if dirty
+wire sn_take    = sn_req && !_snoop_done && currentState == IDLE && !mem_stall;
+wire sn_dirty   = (SNOOP == 1) && |(fill_hit_vec & fill_dirty);
+wire sn_wb_done = sn_active && currentState == WRITE_BACK && beat == BURST - 1 && !mem_stall;
+
+always @(*) begin
+    // From memory (last beat straight from mq), the write buffer or the
+    // victim cache; nothing for a LINE_WRITES write miss
+    new_block = wb_fwd ? wb_data[wb_slot] : vc_fwd ? vc_data[vc_slot] :
+                nf_fwd ? {LINE_WIDTH{1'b0}} : fill_block;
+    if (fill_wren) new_block[fill_word*WIDTH +: WIDTH] = fill_din;
+end
+
+// Performance counters (PERF = 1).  Counter map (csr_addr):
+//    0 read hits          1 write hits
+//    2 read misses        3 write misses   (demand lines refilled)
+//    4 writebacks (lines written to memory)
+//    5 evictions (valid lines replaced, see evict)
+//    8 + s cycles spent in FSM state s (IDLE .. INIT)
+//   31 PERF_CLEAR (write only)
+// A blocking miss ends with its request hitting in IDLE; that hit is not
+// counted (perf_retry)
+localparam PERF_COUNTERS = 16;
+localparam PERF_CLEAR    = 5'd31;
+reg                       perf_retry = 1'b0;
+wire [PERF_COUNTERS-1:0]  perf_inc;
+wire [PERF_COUNTERS*32-1:0] perf_count;
+wire perf_refill = do_refill && !pf_active;
+wire perf_wb     = (currentState == WRITE_BACK || currentState == DRAIN) && beat == BURST - 1 && !mem_stall;
+assign perf_inc[0] = hit_access && !hit_write && !perf_retry;
+assign perf_inc[1] = hit_write && !perf_retry;
+assign perf_inc[2] = perf_refill && !fill_wren;
+assign perf_inc[3] = perf_refill && fill_wren;
+assign perf_inc[4] = perf_wb;
+assign perf_inc[5] = _evict;
+assign perf_inc[7:6] = 2'b00;
+
+genvar pc;
+generate
+    for (pc = 0; pc < 8; pc = pc + 1) begin : perf_state
+        assign perf_inc[8 + pc] = (currentState == pc);
+    end
+    for (pc = 0; pc < PERF_COUNTERS; pc = pc + 1) begin : perf
+        reg [31:0] count = 32'd0;
+        if (PERF) begin : on
+            always @(posedge clk or negedge reset_n) begin
+                if (!reset_n)
+                    count <= 0;
+                else if (csr_wren && csr_addr == pc)
+                    count <= csr_wdata;
+                else if (csr_wren && csr_addr == PERF_CLEAR)
+                    count <= 0;
+                else
+                    count <= count + perf_inc[pc];
+            end
+        end
+        assign perf_count[pc*32 +: 32] = count;
+    end
+endgenerate
+
+always @(posedge clk or negedge reset_n) begin
+    if (!reset_n) begin
+        perf_retry <= 0;
+        csr_rdata <= 0;
+    end
+    else begin
+        if (PERF && csr_rden)
+            csr_rdata <= (csr_addr < PERF_COUNTERS) ? perf_count[csr_addr*32 +: 32] : 32'd0;
+        // Set when the blocking FSM takes a demand miss, cleared by the
+        // request's hit after the refill
+        if (NMSHR == 0 && !mem_stall && currentState == IDLE && !sn_take
+            && (req_rden || req_wren) && !hit && (!MESI || mgnt))
+            perf_retry <= 1;
+        else if (hit_access)
+            perf_retry <= 0;
+    end
+end
+
+// Stage 1 takes the next request when the lookup stage is empty or its
+// request leaves it this cycle (a hit, or a miss queued in an MSHR)
+wire req_done = hit_access || (NMSHR > 0) && can_serve && (req_rden || req_wren) && !mshr_valid[mshr_tail];
+wire s1_take  = PIPE && (rden || wren) && (!s1_valid || req_done);
+
+/*******************************************************************
+* Way storage
+*******************************************************************/
+genvar g;
+generate
+    for (g = 0; g < NWAYS; g = g + 1) begin : way
+        reg                 valid [0:NSETS-1];
+        reg                 dirty [0:NSETS-1];
+        reg                 excl  [0:NSETS-1];
+        reg [LRU_WIDTH-1:0] lru   [0:NSETS-1];
+        reg [TAG_WIDTH-1:0] tag   [0:NSETS-1];
+        reg [LINE_WIDTH-1:0] mem  [0:NSETS-1] /* synthesis ramstyle = "M20K" */;
+        reg                 pref  [0:NSETS-1];
+        // Stage 1 copy of the set (PIPE = 1), kept equal to the arrays:
+        // this edge's hit write and refill are forwarded into it
+        reg [TAG_WIDTH-1:0]  s1_tag;
+        reg [LINE_WIDTH-1:0] s1_mem;
+        wire fill_in = do_refill && victim_way == g && fill_index == in_index;
+        wire fill_s1 = do_refill && victim_way == g && fill_index == index;
+        reg [LINE_WIDTH-1:0] in_line;
+
+        always @(*) begin
+            in_line = mem[in_index];
+            if (hit_write && hit_way == g && index == in_index)
+                in_line[word_sel*WIDTH +: WIDTH] = req_din;
+            if (fill_in) in_line = new_block;
+        end
+
+        always @(posedge clk) begin
+            if (s1_take) begin
+                s1_tag <= fill_in ? fill_address[TAG_HIGH:TAG_LOW] : tag[in_index];
+                s1_mem <= in_line;
+            end
+            else if (fill_s1) begin
+                s1_tag <= fill_address[TAG_HIGH:TAG_LOW];
+                s1_mem <= new_block;
+            end
+        end
+
+        assign way_valid[g] = valid[index];
+        assign way_excl[g] = excl[index];
+        assign way_lru[g*LRU_WIDTH +: LRU_WIDTH] = lru[index];
+        assign way_tag[g*TAG_WIDTH +: TAG_WIDTH] = PIPE ? s1_tag : tag[index];
+        assign way_mem[g*LINE_WIDTH +: LINE_WIDTH] = PIPE ? s1_mem : mem[index];
+        // Second read port for the miss FSM (same set when blocking)
+        assign fill_valid[g] = valid[fill_index];
+        assign fill_dirty[g] = dirty[fill_index];
+        assign fill_lru[g*LRU_WIDTH +: LRU_WIDTH] = lru[fill_index];
+        assign fill_tag[g*TAG_WIDTH +: TAG_WIDTH] = tag[fill_index];
+        assign fill_mem[g*LINE_WIDTH +: LINE_WIDTH] = mem[fill_index];
+        assign way_pref[g] = pref[index];
+        // Parallel tag compare
+        assign hit_vec[g] = valid[index] && (way_tag[g*TAG_WIDTH +: TAG_WIDTH] == req_address[TAG_HIGH:TAG_LOW]);
+        assign fill_hit_vec[g] = valid[fill_index] && (tag[fill_index] == fill_address[TAG_HIGH:TAG_LOW]);
+
+        // No reset: INIT clears the valid bits and LRU counters one set per
+        // cycle after reset_n.  Tag, data, dirty and pref bits only count
+        // for valid lines and are never reset.
+        always @(posedge clk) begin
+            if (do_init) begin
+                valid[init_index] <= 0;
+                lru[init_index] <= g ^ (g >> 1);  // reset order 0, 1, 3, 2, ...
+            end
+            else begin
+                if (hit_write && hit_way == g) begin
+                    dirty[index] <= 1;
+                    mem[index][word_sel*WIDTH +: WIDTH] <= req_din;
+                end
+                if (hit_access && hit_way == g) pref[index] <= 0;
+                if (sn_take && fill_hit_vec[g] && !(SNOOP == 1 && fill_dirty[g]) && !(MESI && snoop_share)
+                    || sn_wb_done && victim_way == g)
+                    valid[fill_index] <= 0;
+                // MESI: a read snoop leaves the line Shared (and clean)
+                if (MESI && sn_take && snoop_share && fill_hit_vec[g]) begin
+                    dirty[fill_index] <= 0;
+                    excl[fill_index] <= 0;
+                end
+                // Update LRU: ways younger than the hit way age by one
+                if (hit_access && !PLRU) begin
+                    if (hit_way == g) lru[index] <= 0;
+                    else if (lru[index] <= hit_lru) lru[index] <= lru[index] + 1;
+                end
+                if (fill_touch && !PLRU) begin
+                    if (victim_way == g) lru[fill_index] <= 0;
+                    else if (lru[fill_index] <= victim_lru) lru[fill_index] <= lru[fill_index] + 1;
+                end
+                if (do_refill && victim_way == g) begin
+                    mem[fill_index] <= new_block;
+                    tag[fill_index] <= fill_address[TAG_HIGH:TAG_LOW];
+                    valid[fill_index] <= 1;
+                    dirty[fill_index] <= EVICT_ALL || fill_wren || wb_fwd || vc_fwd && vc_dirty[vc_slot];
+                    excl[fill_index] <= !MESI || fill_wren || !mshared;
+                    pref[fill_index] <= pf_active;
+                end
+            end
+        end
+    end
+endgenerate
 
 /*******************************************************************
 * State Machine
 *******************************************************************/
-integer k;
 always @(posedge clk or negedge reset_n)
 begin   
     if (!reset_n) begin
-        currentState <= IDLE;
+        currentState <= INIT;  // the arrays are cleared by INIT, one set per cycle
+        init_index <= 0;
         _mwren <= 0;
         _mrden <= 0;
         
         _hit_miss <= 0;
-      	 
-       for(k = 0; k < NSETS; k = k +1)
-    	begin
-          valid1[k] = 0;
-          valid2[k] = 0;
-          valid3[k] = 0;
-          valid4[k] = 0;
-          dirty1[k] = 0;
-          dirty2[k] = 0;
-          dirty3[k] = 0;
-          dirty4[k] = 0;
-          lru1[k] = 2'b00;
-          lru2[k] = 2'b01;
-          lru3[k] = 2'b11;
-          lru4[k] = 2'b10;
-          tag1[k]=0;
-          tag2[k]=0;
-          tag3[k]=0;
-          tag4[k]=0;
-          mem1[k] =0;
-          mem2[k] =0;
-          mem3[k] =0;
-          mem4[k] =0;
-    	end
+        beat <= 0;
+        mrden_d <= 0;
+        rbeat <= 0;
+        line_buf <= 0;
+        _accept <= 0;
+        s1_valid <= 0;
+        _resp_valid <= 0;
+        mshr_valid <= 0;
+        mshr_head <= 0;
+        mshr_tail <= 0;
+        wb_valid <= 0;
+        wb_fwd <= 0;
+        vc_valid <= 0;
+        vc_dirty <= 0;
+        vc_ptr <= 0;
+        vc_fwd <= 0;
+        nf_fwd <= 0;
+        sn_active <= 0;
+        _snoop_done <= 0;
+        _evict <= 0;
+        pf_active <= 0;
+        pf_last <= 0;
+        pf_stride <= 0;
+        pf_left <= 0;
+        pf_issued <= 0;
+        pf_useful <= 0;
+        demand_misses <= 0;
     end 
     else begin
+        mrden_d <= _mrden;
+        if (HANDSHAKE ? mvalid : mrden_d) line_buf <= fill_block;
+        if (HANDSHAKE) begin
+            if (do_refill) rbeat <= 0;
+            else if (mvalid) rbeat <= rbeat + 1;
+        end
+        if (hit_pref) pf_useful <= pf_useful + 1;
+        _snoop_done <= 0;
+        _evict <= 0;
+
+        // ---- Non-blocking front end: runs next to the miss FSM ----
+        if (NMSHR > 0) begin
+            _resp_valid <= 0;
+            if (!req_rden && !req_wren || !can_serve) begin
+                _hit_miss <= 0;
+                _accept <= 0;
+            end
+            else if (hit) begin
+                // Hit-under-miss (data/dirty/LRU writes happen in the way blocks)
+                _hit_miss <= 1;
+                _accept <= 1;
+                if (req_rden) _q <= hit_block[word_sel*WIDTH +: WIDTH];
+                if (PLRU) plru[index] <= plru_next;
+            end
+            else begin
+                // Miss: queue it if an MSHR is free (rden has priority over wren)
+                _hit_miss <= 0;
+                _accept <= !mshr_valid[mshr_tail];
+                if (!mshr_valid[mshr_tail]) begin
+                    mshr_valid[mshr_tail] <= 1;
+                    mshr_addr[mshr_tail] <= req_address;
+                    mshr_wren[mshr_tail] <= !req_rden;
+                    mshr_din[mshr_tail] <= req_din;
+                    _miss_id <= mshr_tail;
+                    mshr_tail <= (mshr_tail == MSHR_SLOTS - 1) ? 0 : mshr_tail + 1;
+                end
+            end
+        end
+
+        // ---- Blocking front end: IDLE, DRAIN, or next to a prefetch ----
+        else if (can_serve) begin
+            // Do nothing if no request
+            if (!req_rden && !req_wren) begin
+               _hit_miss <= 0;
+            end
+            
+            // Check Hit (data/dirty/LRU writes happen in the way blocks)
+            else if (hit) begin
+                _hit_miss <= 1;
+                if (req_rden) begin
+                    _q <= hit_block[word_sel*WIDTH +: WIDTH];
+                end
+                if (PLRU) plru[index] <= plru_next;
+            end
+            else _hit_miss <= 0; // miss, handled by the FSM from IDLE
+        end
+        else _hit_miss <= 0;
+
+        // ---- Stage 1 (PIPE = 1): accept overrides the front end's ----
+        if (PIPE) begin
+            _accept <= s1_take;
+            if (s1_take) begin
+                s1_valid <= 1;
+                s1_rden <= rden;
+                s1_wren <= wren;
+                s1_addr <= address;
+                s1_din <= din;
+            end
+            else if (req_done) s1_valid <= 0;
+        end
+
+        if (!mem_stall)
         case (currentState)
             IDLE: begin
                 _mwren <= 0;
                 _mrden <= 0;
-                
-                // Do nothing if no request
-                if (!rden && !wren) begin
-                   _hit_miss <= 0;
-                  currentState<=IDLE;
-                end
-                
-                // Check Hit
-                else if (valid1[address[INDEX_HIGH:INDEX_LOW]] && (tag1[address[INDEX_HIGH:INDEX_LOW]] == address[TAG_HIGH:TAG_LOW])) begin
-                    // ---- WAY 1 HIT ----
-                    _hit_miss <= 1;
-                    if (rden) begin
-                        _q <= (address[OFFSET_HIGH:OFFSET_LOW] <= WORD1) ? mem1[address[INDEX_HIGH:INDEX_LOW]][WIDTH-1:0] : mem1[address[INDEX_HIGH:INDEX_LOW]][2*WIDTH-1:WIDTH];
-                    end else if (wren) begin
-                        dirty1[address[INDEX_HIGH:INDEX_LOW]] <= 1;
-                        if (address[OFFSET_HIGH:OFFSET_LOW] <= WORD1) mem1[address[INDEX_HIGH:INDEX_LOW]][WIDTH-1:0] <= din;
-                        else mem1[address[INDEX_HIGH:INDEX_LOW]][2*WIDTH-1:WIDTH] <= din;
-                    end
-                    // Update LRU
-                    if (lru2[address[INDEX_HIGH:INDEX_LOW]] <= lru1[address[INDEX_HIGH:INDEX_LOW]]) lru2[address[INDEX_HIGH:INDEX_LOW]] <= lru2[address[INDEX_HIGH:INDEX_LOW]] + 1;
-                    if (lru3[address[INDEX_HIGH:INDEX_LOW]] <= lru1[address[INDEX_HIGH:INDEX_LOW]]) lru3[address[INDEX_HIGH:INDEX_LOW]] <= lru3[address[INDEX_HIGH:INDEX_LOW]] + 1;
-                    if (lru4[address[INDEX_HIGH:INDEX_LOW]] <= lru1[address[INDEX_HIGH:INDEX_LOW]]) lru4[address[INDEX_HIGH:INDEX_LOW]] <= lru4[address[INDEX_HIGH:INDEX_LOW]] + 1;
-                    lru1[address[INDEX_HIGH:INDEX_LOW]] <= 0;
-                end
-                else if (valid2[address[INDEX_HIGH:INDEX_LOW]] && (tag2[address[INDEX_HIGH:INDEX_LOW]] == address[TAG_HIGH:TAG_LOW])) begin
-                    // ---- WAY 2 HIT ----
-                    _hit_miss <= 1;
-                    if (rden) begin
-                        _q <= (address[OFFSET_HIGH:OFFSET_LOW] <= WORD1) ? mem2[address[INDEX_HIGH:INDEX_LOW]][WIDTH-1:0] : mem2[address[INDEX_HIGH:INDEX_LOW]][2*WIDTH-1:WIDTH];
-                    end else if (wren) begin
-                        dirty2[address[INDEX_HIGH:INDEX_LOW]] <= 1;
-                        if (address[OFFSET_HIGH:OFFSET_LOW] <= WORD1) mem2[address[INDEX_HIGH:INDEX_LOW]][WIDTH-1:0] <= din;
-                        else mem2[address[INDEX_HIGH:INDEX_LOW]][2*WIDTH-1:WIDTH] <= din;
-                    end
-                    // Update LRU
-                    if (lru1[address[INDEX_HIGH:INDEX_LOW]] <= lru2[address[INDEX_HIGH:INDEX_LOW]]) lru1[address[INDEX_HIGH:INDEX_LOW]] <= lru1[address[INDEX_HIGH:INDEX_LOW]] + 1;
-                    if (lru3[address[INDEX_HIGH:INDEX_LOW]] <= lru2[address[INDEX_HIGH:INDEX_LOW]]) lru3[address[INDEX_HIGH:INDEX_LOW]] <= lru3[address[INDEX_HIGH:INDEX_LOW]] + 1;
-                    if (lru4[address[INDEX_HIGH:INDEX_LOW]] <= lru2[address[INDEX_HIGH:INDEX_LOW]]) lru4[address[INDEX_HIGH:INDEX_LOW]] <= lru4[address[INDEX_HIGH:INDEX_LOW]] + 1;
-                    lru2[address[INDEX_HIGH:INDEX_LOW]] <= 0;
-                end
-                else if (valid3[address[INDEX_HIGH:INDEX_LOW]] && (tag3[address[INDEX_HIGH:INDEX_LOW]] == address[TAG_HIGH:TAG_LOW])) begin
-                    // ---- WAY 3 HIT ----
-                    _hit_miss <= 1;
-                    if (rden) begin
-                        _q <= (address[OFFSET_HIGH:OFFSET_LOW] <= WORD1) ? mem3[address[INDEX_HIGH:INDEX_LOW]][WIDTH-1:0] : mem3[address[INDEX_HIGH:INDEX_LOW]][2*WIDTH-1:WIDTH];
-                    end else if (wren) begin
-                        dirty3[address[INDEX_HIGH:INDEX_LOW]] <= 1;
-                        if (address[OFFSET_HIGH:OFFSET_LOW] <= WORD1) mem3[address[INDEX_HIGH:INDEX_LOW]][WIDTH-1:0] <= din;
-                        else mem3[address[INDEX_HIGH:INDEX_LOW]][2*WIDTH-1:WIDTH] <= din;
-                    end
-                    // Update LRU
-                    if (lru1[address[INDEX_HIGH:INDEX_LOW]] <= lru3[address[INDEX_HIGH:INDEX_LOW]]) lru1[address[INDEX_HIGH:INDEX_LOW]] <= lru1[address[INDEX_HIGH:INDEX_LOW]] + 1;
-                    if (lru2[address[INDEX_HIGH:INDEX_LOW]] <= lru3[address[INDEX_HIGH:INDEX_LOW]]) lru2[address[INDEX_HIGH:INDEX_LOW]] <= lru2[address[INDEX_HIGH:INDEX_LOW]] + 1;
-                    if (lru4[address[INDEX_HIGH:INDEX_LOW]] <= lru3[address[INDEX_HIGH:INDEX_LOW]]) lru4[address[INDEX_HIGH:INDEX_LOW]] <= lru4[address[INDEX_HIGH:INDEX_LOW]] + 1;
-                    lru3[address[INDEX_HIGH:INDEX_LOW]] <= 0;
-                end
-                else if (valid4[address[INDEX_HIGH:INDEX_LOW]] && (tag4[address[INDEX_HIGH:INDEX_LOW]] == address[TAG_HIGH:TAG_LOW])) begin
-                    // ---- WAY 4 HIT ----
-                    _hit_miss <= 1;
-                    if (rden) begin
-                        _q <= (address[OFFSET_HIGH:OFFSET_LOW] <= WORD1) ? mem4[address[INDEX_HIGH:INDEX_LOW]][WIDTH-1:0] : mem4[address[INDEX_HIGH:INDEX_LOW]][2*WIDTH-1:WIDTH];
-                    end else if (wren) begin
-                        dirty4[address[INDEX_HIGH:INDEX_LOW]] <= 1;
-                        if (address[OFFSET_HIGH:OFFSET_LOW] <= WORD1) mem4[address[INDEX_HIGH:INDEX_LOW]][WIDTH-1:0] <= din;
-                        else mem4[address[INDEX_HIGH:INDEX_LOW]][2*WIDTH-1:WIDTH] <= din;
+
+                // A snoop: done unless the line is dirty (valid bits are
+                // cleared in the way blocks; MESI hands a dirty line out on
+                // snoop_data instead)
+                if (sn_take) begin
+                    _snoop_hit <= |fill_hit_vec;
+                    _snoop_dirty <= MESI && |(fill_hit_vec & fill_dirty);
+                    _snoop_data <= fill_mem[fill_hit_way*LINE_WIDTH +: LINE_WIDTH];
+                    if (sn_dirty) begin
+                        sn_active <= 1;
+                        sn_addr <= snoop_address;
+                        victim_way <= fill_hit_way;
+                        currentState <= WRITE_BACK;
                     end
-                    // Update LRU
-                    if (lru1[address[INDEX_HIGH:INDEX_LOW]] <= lru4[address[INDEX_HIGH:INDEX_LOW]]) lru1[address[INDEX_HIGH:INDEX_LOW]] <= lru1[address[INDEX_HIGH:INDEX_LOW]] + 1;
-                    if (lru2[address[INDEX_HIGH:INDEX_LOW]] <= lru4[address[INDEX_HIGH:INDEX_LOW]]) lru2[address[INDEX_HIGH:INDEX_LOW]] <= lru2[address[INDEX_HIGH:INDEX_LOW]] + 1;
-                    if (lru3[address[INDEX_HIGH:INDEX_LOW]] <= lru4[address[INDEX_HIGH:INDEX_LOW]]) lru3[address[INDEX_HIGH:INDEX_LOW]] <= lru3[address[INDEX_HIGH:INDEX_LOW]] + 1;
-                    lru4[address[INDEX_HIGH:INDEX_LOW]] <= 0;
+                    else _snoop_done <= 1;
                 end
-                else begin
-                    // ---- MISS ----
-                    _hit_miss <= 0;
+                // Non-blocking: serve the oldest MSHR; blocking: the held request
+                else if ((NMSHR > 0) ? mshr_valid[mshr_head] : (req_rden || req_wren) && !hit && (!MESI || mgnt)) begin
                     currentState <= MISS; // next postive_edge/state we will handle the miss
                 end
+                // Memory port idle: drain the write buffer, then prefetch
+                else if (wb_valid != 0) currentState <= DRAIN;
+                else if (pf_left != 0) begin
+                    pf_active <= 1;
+                    pf_addr <= {pf_next, {OFFSET_WIDTH{1'b0}}};
+                    pf_next <= pf_next + pf_step;
+                    pf_left <= pf_left - 1;
+                    currentState <= MISS;
+                end
             end
         
             MISS: begin
-                // Check if any way is invalid (Empty)
-                if (!valid1[address[INDEX_HIGH:INDEX_LOW]]) begin
-                    victim_way <= 2'b00; 
+                // Fill an invalid (empty) way first
+                if (has_invalid) begin
+                    victim_way <= invalid_way;
                     currentState <= FETCH;
                 end
-                else if (!valid2[address[INDEX_HIGH:INDEX_LOW]]) begin
-                    victim_way <= 2'b01;
-                    currentState <= FETCH;
+                // If all valid, Check LRU / pseudo-LRU and Dirty Status
+                else begin
+                    victim_way <= full_victim;
+                    if (park_dirty) begin
+                        currentState <= WRITE_BACK;
+                    end else currentState <= FETCH;
                 end
-                else if (!valid3[address[INDEX_HIGH:INDEX_LOW]]) begin
-                    victim_way <= 2'b10;
-                    currentState <= FETCH;
+                // Write buffer: a buffered line is refilled from the buffer,
+                // a dirty victim is parked instead of written back (unless
+                // the buffer is full)
+                if (WBUF > 0) begin
+                    wb_fwd <= wb_hit;
+                    wb_slot <= wb_hit_slot;
+                    if (wb_hit) currentState <= REFILL;
+                    else if (park_dirty && wb_free) begin
+                        wb_valid[wb_free_slot] <= 1;
+                        wb_addr[wb_free_slot] <= park_addr;
+                        wb_data[wb_free_slot] <= park_block;
+                        currentState <= FETCH;
+                    end
                 end
-                else if (!valid4[address[INDEX_HIGH:INDEX_LOW]]) begin
-                    victim_way <= 2'b11;
-                    currentState <= FETCH;
+                // Victim cache hit: swap the line back in, no Ram access
+                if (VICTIM > 0) begin
+                    vc_fwd <= vc_hit;
+                    vc_slot <= vc_hit_slot;
+                    if (vc_hit) currentState <= REFILL;
                 end
-                // If all valid, Check LRU and Dirty Status
-                else begin
-                    // LRU is Way 1
-                    if (lru1[address[INDEX_HIGH:INDEX_LOW]] == 3) begin
-                        victim_way <= 2'b00;
-                        if (dirty1[address[INDEX_HIGH:INDEX_LOW]]) begin
-                            currentState <= WRITE_BACK;
-                        end else currentState <= FETCH;
-                    end
-                    // LRU is Way 2
-                    else if (lru2[address[INDEX_HIGH:INDEX_LOW]] == 3) begin
-                        victim_way <= 2'b01;
-                        if (dirty2[address[INDEX_HIGH:INDEX_LOW]]) begin
-                            currentState <= WRITE_BACK;
-                        end else currentState <= FETCH;
-                    end
-                    // LRU is Way 3
-                    else if (lru3[address[INDEX_HIGH:INDEX_LOW]] == 3) begin
-                        victim_way <= 2'b10;
-                        if (dirty3[address[INDEX_HIGH:INDEX_LOW]]) begin
-                            currentState <= WRITE_BACK;
-                        end else currentState <= FETCH;
-                    end
-                    // LRU is Way 4
-                    else begin
-                        victim_way <= 2'b11;
-                        if (dirty4[address[INDEX_HIGH:INDEX_LOW]]) begin
-                            currentState <= WRITE_BACK;
-                        end else currentState <= FETCH;
+                // Whole-line writes: the rest of the line is written next,
+                // so a write miss skips the fetch (after the write-back)
+                if (LINE_WRITES && fill_wren && !wb_hit && !vc_hit) begin
+                    nf_fwd <= 1;
+                    if (!park_dirty || wb_free) currentState <= REFILL;
+                end
+                // Prefetcher: a demand miss trains it and triggers PF_DEGREE
+                // prefetches (next line, or a stride seen twice in a row)
+                if (PREFETCH > 0 && !pf_active) begin
+                    pf_last <= fill_line;
+                    pf_stride <= miss_stride;
+                    if (PREFETCH == 1 || miss_stride == pf_stride && miss_stride != 0) begin
+                        pf_step <= (PREFETCH == 1) ? 1 : miss_stride;
+                        pf_next <= fill_line + ((PREFETCH == 1) ? 1 : miss_stride) * PF_DISTANCE;
+                        pf_left <= PF_DEGREE;
                     end
                 end
+                // MESI: a write to a Shared line refetches it into its own way
+                if (MESI && |fill_hit_vec) begin
+                    victim_way <= fill_hit_way;
+                    currentState <= FETCH;
+                end
+                // Nothing to prefetch: back to IDLE
+                if (pf_drop) begin
+                    pf_active <= 0;
+                    wb_fwd <= 0;
+                    vc_fwd <= 0;
+                    currentState <= IDLE;
+                end
             end
 
+            // One beat per cycle, BURST cycles
             WRITE_BACK: begin
                 _mwren <= 1;
-                
-                case (victim_way)
-                    2'b00: begin
-                         _mdout <= mem1[address[INDEX_HIGH:INDEX_LOW]];
-                         _mwraddress <= {tag1[address[INDEX_HIGH:INDEX_LOW]], address[INDEX_HIGH:INDEX_LOW], {OFFSET_WIDTH{1'b0}}};
-                    end
-                    2'b01: begin
-                         _mdout <= mem2[address[INDEX_HIGH:INDEX_LOW]];
-                         _mwraddress <= {tag2[address[INDEX_HIGH:INDEX_LOW]], address[INDEX_HIGH:INDEX_LOW], {OFFSET_WIDTH{1'b0}}};
-                    end
-                    2'b10: begin
-                         _mdout <= mem3[address[INDEX_HIGH:INDEX_LOW]];
-                         _mwraddress <= {tag3[address[INDEX_HIGH:INDEX_LOW]], address[INDEX_HIGH:INDEX_LOW], {OFFSET_WIDTH{1'b0}}};
+                _mdout <= evict_block[beat*MWIDTH +: MWIDTH];
+                _mwraddress <= evict_addr | (beat << BEAT_LOW);
+                if (beat == BURST - 1) begin
+                    beat <= 0;
+                    currentState <= sn_active ? IDLE : nf_fwd ? REFILL : FETCH;
+                    if (sn_active) begin
+                        sn_active <= 0;
+                        _snoop_done <= 1;
                     end
-                    2'b11: begin
-                         _mdout <= mem4[address[INDEX_HIGH:INDEX_LOW]];
-                         _mwraddress <= {tag4[address[INDEX_HIGH:INDEX_LOW]], address[INDEX_HIGH:INDEX_LOW], {OFFSET_WIDTH{1'b0}}};
-                    end
-                endcase
-                
-                currentState <= FETCH;
+                end
+                else beat <= beat + 1;
             end
 
+            // Back-to-back beat reads, BURST cycles
             FETCH: begin
                 _mwren <= 0; 
                 _mrden <= 1;
-                _mrdaddress <= {address[TAG_HIGH:TAG_LOW], address[INDEX_HIGH:INDEX_LOW], {OFFSET_WIDTH{1'b0}}};
-                currentState <= FETCH_WAIT;
+                _mrdaddress <= {fill_address[TAG_HIGH:TAG_LOW], fill_index, {OFFSET_WIDTH{1'b0}}} | (beat << BEAT_LOW);
+                if (beat == BURST - 1) begin
+                    beat <= 0;
+                    currentState <= FETCH_WAIT;
+                end
+                else beat <= beat + 1;
             end
             
             FETCH_WAIT: begin
@@ -365,47 +1096,913 @@ begin
                 currentState <= REFILL;
             end
             
-            REFILL: begin
+            REFILL: if (fill_ready) begin
                 _mrden <= 0;
-                
-                new_block = mq; // From memory
-                
-                if (wren) begin
-                    if (address[OFFSET_HIGH:OFFSET_LOW] <= WORD1) new_block[WIDTH-1:0] = din;
-                    else new_block[2*WIDTH-1:WIDTH] = din;
+                // The last beat is on mq: new_block is written into way
+                // victim_way by the way blocks
+                if (pf_active) begin
+                    pf_active <= 0;
+                    pf_issued <= pf_issued + 1;
+                    if (PLRU) plru[fill_index] <= plru_fill_next;
                 end
-                
-                case (victim_way)
-                    2'b00: begin // Way 1
-                        mem1[address[INDEX_HIGH:INDEX_LOW]] <= new_block;
-                        tag1[address[INDEX_HIGH:INDEX_LOW]] <= address[TAG_HIGH:TAG_LOW];
-                        valid1[address[INDEX_HIGH:INDEX_LOW]] <= 1;
-                        dirty1[address[INDEX_HIGH:INDEX_LOW]] <= wren; 
-                    end
-                    2'b01: begin // Way 2
-                        mem2[address[INDEX_HIGH:INDEX_LOW]] <= new_block;
-                        tag2[address[INDEX_HIGH:INDEX_LOW]] <= address[TAG_HIGH:TAG_LOW];
-                        valid2[address[INDEX_HIGH:INDEX_LOW]] <= 1;
-                        dirty2[address[INDEX_HIGH:INDEX_LOW]] <= wren;
-                    end
-                    2'b10: begin // Way 3
-                        mem3[address[INDEX_HIGH:INDEX_LOW]] <= new_block;
-                        tag3[address[INDEX_HIGH:INDEX_LOW]] <= address[TAG_HIGH:TAG_LOW];
-                        valid3[address[INDEX_HIGH:INDEX_LOW]] <= 1;
-                        dirty3[address[INDEX_HIGH:INDEX_LOW]] <= wren;
+                else if (NMSHR > 0) begin
+                    _resp_valid <= 1;
+                    _resp_id <= mshr_head;
+                    _resp_q <= new_block[fill_word*WIDTH +: WIDTH];
+                    if (PLRU) plru[fill_index] <= plru_fill_next;
+                    mshr_valid[mshr_head] <= 0;
+                    mshr_head <= (mshr_head == MSHR_SLOTS - 1) ? 0 : mshr_head + 1;
+                end
+                else _q<=new_block;
+                nf_fwd <= 0;
+                if (!pf_active) demand_misses <= demand_misses + 1;
+                // The line that leaves the cache: the victim way's, or with
+                // a victim cache the entry the victim way's line replaces
+                // (nothing for a MESI upgrade: the way keeps its line)
+                _evict <= (VICTIM > 0) ? !vc_fwd && fill_valid[victim_way] && vc_valid[vc_ptr]
+                                       : fill_valid[victim_way] && !(MESI && |fill_hit_vec);
+                _evict_address <= evict_addr;
+                // A refill from the write buffer swaps a dirty victim in
+                if (wb_fwd) begin
+                    wb_fwd <= 0;
+                    if (evict_dirty) begin
+                        wb_addr[wb_slot] <= evict_addr;
+                        wb_data[wb_slot] <= evict_block;
                     end
-                    2'b11: begin // Way 4
-                        mem4[address[INDEX_HIGH:INDEX_LOW]] <= new_block;
-                        tag4[address[INDEX_HIGH:INDEX_LOW]] <= address[TAG_HIGH:TAG_LOW];
-                        valid4[address[INDEX_HIGH:INDEX_LOW]] <= 1;
-                        dirty4[address[INDEX_HIGH:INDEX_LOW]] <= wren;
+                    else wb_valid[wb_slot] <= 0;
+                end
+                // The victim way's line moves to the victim cache: into the
+                // entry it was swapped with, else over the FIFO entry
+                if (VICTIM > 0) begin
+                    vc_fwd <= 0;
+                    if (vc_fwd || fill_valid[victim_way]) begin
+                        vc_valid[vc_in] <= fill_valid[victim_way];
+                        vc_dirty[vc_in] <= victim_dirty;
+                        vc_addr[vc_in] <= victim_addr;
+                        vc_data[vc_in] <= victim_block;
                     end
-                endcase
-                _q<=new_block;
+                    if (!vc_fwd && fill_valid[victim_way])
+                        vc_ptr <= (vc_ptr == VC_SLOTS - 1) ? 0 : vc_ptr + 1;
+                end
                 currentState <= IDLE;
             end
+
+            // Clear the valid bits (way blocks) and tree bits of one set per
+            // cycle; requests wait for ready
+            INIT: begin
+                plru[init_index] <= 0;
+                init_index <= init_index + 1;
+                if (init_index == NSETS - 1) currentState <= IDLE;
+            end
+
+            // Write back one buffered line, BURST cycles
+            DRAIN: begin
+                _mwren <= 1;
+                _mdout <= wb_data[wb_drain_slot][beat*MWIDTH +: MWIDTH];
+                _mwraddress <= wb_addr[wb_drain_slot] | (beat << BEAT_LOW);
+                if (beat == BURST - 1) begin
+                    beat <= 0;
+                    wb_valid[wb_drain_slot] <= 0;
+                    currentState <= IDLE;
+                end
+                else beat <= beat + 1;
+            end
         endcase
+
+        // A demand hit on a prefetched line keeps its stream going: one
+        // more line, PF_DISTANCE + PF_DEGREE - 1 steps ahead of the hit
+        if (PREFETCH > 0 && hit_pref) begin
+            pf_next <= req_address[TAG_HIGH:INDEX_LOW] + pf_step * (PF_DISTANCE + PF_DEGREE - 1);
+            pf_left <= 1;
+        end
     end
 end
 
-endmodule
\ No newline at end of file
+endmodule
+
+// NBANKS address-interleaved Cache banks behind two CPU ports.  The bank
+// of an address is its line number mod NBANKS (NBANKS a power of two, >= 2)
+// and every bank is a blocking Cache with NSETS / NBANKS sets, which sees
+// the address with the bank bits taken out.  Requests of the two ports to
+// different banks are served in the same cycle.  Both ports on one bank is
+// a bank conflict: the bank serves one port (round robin; a miss keeps its
+// bank until it is served) and the other holds its request.  Every port
+// works like the blocking Cache port: hold the request until hit_miss.
+// The banks share one memory port with the ready/valid handshake (see
+// LatencyRam; Ram works with mready = 1 and mvalid = valid_out): one bank
+// at a time, a bank keeps it while it has beats to send, and read beats
+// are routed back in request order.
+module BankedCache
+#(
+  parameter NBANKS = 2,
+  parameter NWAYS = 4,
+  parameter NSETS = 1024,
+  parameter WIDTH = 32,
+  parameter MWIDTH = 64,
+  parameter INDEX_WIDTH = 10,
+  parameter TAG_WIDTH = 19,
+  parameter OFFSET_WIDTH = 3,
+  parameter BURST = 1,
+  parameter PLRU = 0,
+  parameter WBUF = 0,
+  parameter VICTIM = 0,
+  parameter PREFETCH = 0,
+  parameter PF_DEGREE = 2,
+  parameter PF_DISTANCE = 1,
+  parameter RQ_SLOTS = 4        // memory reads in flight
+)
+(
+  input  wire                      clk,
+  input  wire                      reset_n,
+
+  // Port A
+  input  wire [WIDTH-1:0]          address_a,
+  input  wire [WIDTH-1:0]          din_a,
+  input  wire                      rden_a,
+  input  wire                      wren_a,
+  output wire                      hit_miss_a,
+  output wire [WIDTH-1:0]          q_a,
+
+  // Port B
+  input  wire [WIDTH-1:0]          address_b,
+  input  wire [WIDTH-1:0]          din_b,
+  input  wire                      rden_b,
+  input  wire                      wren_b,
+  output wire                      hit_miss_b,
+  output wire [WIDTH-1:0]          q_b,
+
+  output wire                      ready,      // every bank is ready after reset
+
+  // Shared memory interface (ready/valid handshake)
+  output wire [MWIDTH-1:0]         mdout,
+  output wire [WIDTH-1:0]          mrdaddress,
+  output wire                      mrden,
+  output wire [WIDTH-1:0]          mwraddress,
+  output wire                      mwren,
+  input  wire [MWIDTH-1:0]         mq,
+  input  wire                      mready,
+  input  wire                      mvalid,
+
+  output reg  [31:0]               bank_conflicts  // cycles both ports wanted the same bank
+);
+
+  localparam BANK_BITS = $clog2(NBANKS);
+  localparam RQ_ID     = (RQ_SLOTS > 1) ? $clog2(RQ_SLOTS) : 1;
+  localparam OFFSET_MASK = (1 << OFFSET_WIDTH) - 1;
+
+  // Bank of a CPU address, the address a bank sees (bank bits taken out)
+  // and a bank's memory address back in the CPU address space
+  function [BANK_BITS-1:0] bank_of(input [WIDTH-1:0] a);
+      bank_of = a >> OFFSET_WIDTH;
+  endfunction
+  function [WIDTH-1:0] squeeze(input [WIDTH-1:0] a);
+      squeeze = ((a >> (OFFSET_WIDTH + BANK_BITS)) << OFFSET_WIDTH) | (a & OFFSET_MASK);
+  endfunction
+  function [WIDTH-1:0] expand(input [WIDTH-1:0] a, input [BANK_BITS-1:0] b);
+      expand = ((a >> OFFSET_WIDTH) << (OFFSET_WIDTH + BANK_BITS))
+               | (b << OFFSET_WIDTH) | (a & OFFSET_MASK);
+  endfunction
+
+  // Per-bank ports, packed bank-major
+  wire [NBANKS-1:0]        b_rden, b_wren, b_hit_miss, b_ready;
+  wire [NBANKS*WIDTH-1:0]  b_address, b_din, b_q;
+  wire [NBANKS-1:0]        b_mrden, b_mwren, b_mready, b_mvalid;
+  wire [NBANKS*WIDTH-1:0]  b_mrdaddress, b_mwraddress;
+  wire [NBANKS*MWIDTH-1:0] b_mdout;
+
+  // Bank arbitration state: the port a bank took a request from on the
+  // last edge, and the port that wins the next conflict
+  reg [NBANKS-1:0] last_valid = 0;
+  reg [NBANKS-1:0] last_port = 0;     // 0 = A, 1 = B
+  reg [NBANKS-1:0] rr = 0;
+  // Bank each port's request went to on the last edge
+  reg                 a_valid = 1'b0;
+  reg [BANK_BITS-1:0] a_bank = 0;
+  reg                 b_valid = 1'b0;
+  reg [BANK_BITS-1:0] b_bank = 0;
+
+  wire req_a = rden_a || wren_a;
+  wire req_b = rden_b || wren_b;
+  wire [BANK_BITS-1:0] bank_a = bank_of(address_a);
+  wire [BANK_BITS-1:0] bank_b = bank_of(address_b);
+  wire conflict = req_a && req_b && (bank_a == bank_b);
+  // The contested bank stays with the port whose request it is still
+  // working on, else round robin
+  wire sticky   = last_valid[bank_a] && !b_hit_miss[bank_a];
+  wire win_b    = sticky ? last_port[bank_a] : rr[bank_a];
+  wire grant_a  = req_a && (!conflict || !win_b);
+  wire grant_b  = req_b && (!conflict || win_b);
+
+  assign hit_miss_a = a_valid && b_hit_miss[a_bank];
+  assign q_a = b_q[a_bank*WIDTH +: WIDTH];
+  assign hit_miss_b = b_valid && b_hit_miss[b_bank];
+  assign q_b = b_q[b_bank*WIDTH +: WIDTH];
+  assign ready = &b_ready;
+
+  // Memory port: the bank that had it keeps it while it has a beat to
+  // send, else the next requesting bank after it.  A read is only let
+  // through when the read queue can hold its bank number.
+  reg [BANK_BITS-1:0] mem_owner = 0;
+  reg [BANK_BITS-1:0] mem_sel;
+  reg [BANK_BITS-1:0] rq_bank [0:RQ_SLOTS-1];
+  reg [RQ_ID-1:0]     rq_head = 0;
+  reg [RQ_ID-1:0]     rq_tail = 0;
+  reg [RQ_ID:0]       rq_count = 0;
+  wire [NBANKS-1:0] b_mreq = b_mrden | b_mwren;
+  wire rq_full = (rq_count == RQ_SLOTS);
+  integer w;
+
+  always @(*) begin
+      mem_sel = mem_owner;
+      if (!b_mreq[mem_owner])
+          for (w = NBANKS - 1; w >= 0; w = w - 1)
+              if (b_mreq[(mem_owner + 1 + w) % NBANKS]) mem_sel = (mem_owner + 1 + w) % NBANKS;
+  end
+
+  assign mrden = b_mrden[mem_sel] && !rq_full;
+  assign mwren = b_mwren[mem_sel];
+  assign mdout = b_mdout[mem_sel*MWIDTH +: MWIDTH];
+  assign mrdaddress = expand(b_mrdaddress[mem_sel*WIDTH +: WIDTH], mem_sel);
+  assign mwraddress = expand(b_mwraddress[mem_sel*WIDTH +: WIDTH], mem_sel);
+
+  genvar g;
+  generate
+      for (g = 0; g < NBANKS; g = g + 1) begin : bank
+          wire sel_a = grant_a && (bank_a == g);
+          wire sel_b = grant_b && (bank_b == g);
+          assign b_rden[g] = sel_a ? rden_a : sel_b && rden_b;
+          assign b_wren[g] = sel_a ? wren_a : sel_b && wren_b;
+          assign b_address[g*WIDTH +: WIDTH] = squeeze(sel_b ? address_b : address_a);
+          assign b_din[g*WIDTH +: WIDTH] = sel_b ? din_b : din_a;
+          assign b_mready[g] = (mem_sel == g) && mready && !(b_mrden[g] && rq_full);
+          assign b_mvalid[g] = mvalid && (rq_count != 0) && (rq_bank[rq_head] == g);
+
+          Cache #(
+              .NWAYS(NWAYS), .NSETS(NSETS / NBANKS), .WIDTH(WIDTH), .MWIDTH(MWIDTH),
+              .INDEX_WIDTH(INDEX_WIDTH - BANK_BITS), .TAG_WIDTH(TAG_WIDTH),
+              .OFFSET_WIDTH(OFFSET_WIDTH), .BURST(BURST), .PLRU(PLRU), .WBUF(WBUF),
+              .VICTIM(VICTIM), .PREFETCH(PREFETCH), .PF_DEGREE(PF_DEGREE),
+              .PF_DISTANCE(PF_DISTANCE), .HANDSHAKE(1)
+          ) c (
+              .clk(clk), .reset_n(reset_n),
+              .address(b_address[g*WIDTH +: WIDTH]), .din(b_din[g*WIDTH +: WIDTH]),
+              .rden(b_rden[g]), .wren(b_wren[g]),
+              .hit_miss(b_hit_miss[g]), .q(b_q[g*WIDTH +: WIDTH]), .ready(b_ready[g]),
+              .mdout(b_mdout[g*MWIDTH +: MWIDTH]),
+              .mrdaddress(b_mrdaddress[g*WIDTH +: WIDTH]), .mrden(b_mrden[g]),
+              .mwraddress(b_mwraddress[g*WIDTH +: WIDTH]), .mwren(b_mwren[g]),
+              .mq(mq), .mready(b_mready[g]), .mvalid(b_mvalid[g])
+          );
+      end
+  endgenerate
+
+  always @(posedge clk or negedge reset_n) begin
+      if (!reset_n) begin
+          last_valid <= 0;
+          rr <= 0;
+          a_valid <= 0;
+          b_valid <= 0;
+          mem_owner <= 0;
+          rq_head <= 0;
+          rq_tail <= 0;
+          rq_count <= 0;
+          bank_conflicts <= 0;
+      end
+      else begin
+          for (w = 0; w < NBANKS; w = w + 1) begin
+              last_valid[w] <= grant_a && bank_a == w || grant_b && bank_b == w;
+              last_port[w] <= grant_b && bank_b == w;
+          end
+          if (conflict) begin
+              bank_conflicts <= bank_conflicts + 1;
+              if (!sticky) rr[bank_a] <= !win_b;
+          end
+          a_valid <= grant_a;
+          a_bank <= bank_a;
+          b_valid <= grant_b;
+          b_bank <= bank_b;
+
+          // Read queue: bank of every read the memory took, in order
+          mem_owner <= mem_sel;
+          if (mrden && mready) begin
+              rq_bank[rq_tail] <= mem_sel;
+              rq_tail <= (rq_tail == RQ_SLOTS - 1) ? 0 : rq_tail + 1;
+          end
+          if (mvalid && rq_count != 0)
+              rq_head <= (rq_head == RQ_SLOTS - 1) ? 0 : rq_head + 1;
+          rq_count <= rq_count + (mrden && mready) - (mvalid && rq_count != 0);
+      end
+  end
+
+endmodule
+
+// Connects the memory port of an L1 Cache (HANDSHAKE = 1) to the CPU port
+// of an L2 Cache.  Every L1 beat of MWIDTH bits becomes MWIDTH / WIDTH word
+// requests to L2 (held until hit_miss), so the two levels can have any
+// line and beat sizes.  INCLUSION selects the policy:
+//   0: non-inclusive, L1 fetches and write-backs go through L2 as they are
+//   1: inclusive, every line L2 evicts is taken out of L1 (back-invalidation
+//      on the L1 snoop port, L1_LINE bytes at a time)
+//   2: exclusive, a line L1 fetched leaves L2 (L2 snoop port) and L1 writes
+//      every line it evicts back into L2 (L1 EVICT_ALL = 1)
+module L2Bridge
+#(
+  parameter WIDTH = 32,
+  parameter MWIDTH = 64,        // L1 memory beat
+  parameter L1_LINE = 8,        // L1 line bytes
+  parameter L2_LINE = 8,        // L2 line bytes (>= L1_LINE)
+  parameter INCLUSION = 0,
+  parameter BI_SLOTS = 4        // INCLUSION = 1: L2 evictions waiting for L1
+)
+(
+  input  wire                      clk,
+  input  wire                      reset_n,
+
+  // L1 memory port
+  input  wire [MWIDTH-1:0]         mdout,
+  input  wire [WIDTH-1:0]          mrdaddress,
+  input  wire                      mrden,
+  input  wire [WIDTH-1:0]          mwraddress,
+  input  wire                      mwren,
+  output reg  [MWIDTH-1:0]         mq,
+  output wire                      mready,
+  output reg                       mvalid,
+  // L1 snoop port
+  output wire                      l1_snoop,
+  output wire [WIDTH-1:0]          l1_snoop_address,
+  input  wire                      l1_snoop_done,
+  input  wire                      l1_snoop_hit,
+
+  // L2 CPU port
+  output wire [WIDTH-1:0]          l2_address,
+  output wire [WIDTH-1:0]          l2_din,
+  output wire                      l2_rden,
+  output wire                      l2_wren,
+  input  wire                      l2_hit_miss,
+  input  wire [WIDTH-1:0]          l2_q,
+  // L2 snoop port and evictions
+  output wire                      l2_snoop,
+  output wire [WIDTH-1:0]          l2_snoop_address,
+  input  wire                      l2_snoop_done,
+  input  wire                      l2_evict,
+  input  wire [WIDTH-1:0]          l2_evict_address,
+
+  output reg  [31:0]               back_invals  // L1 lines taken out by back-invalidation
+);
+
+  localparam WORDS     = MWIDTH / WIDTH;
+  localparam WORD_BITS = (WORDS > 1) ? $clog2(WORDS) : 1;
+  localparam SUBLINES  = L2_LINE / L1_LINE;   // L1 lines per L2 line
+  localparam SUB_BITS  = (SUBLINES > 1) ? $clog2(SUBLINES) : 1;
+  localparam BI_ID     = (BI_SLOTS > 1) ? $clog2(BI_SLOTS) : 1;
+
+  localparam B_IDLE  = 2'd0;
+  localparam B_READ  = 2'd1;   // word reads of an L1 beat
+  localparam B_WRITE = 2'd2;   // word writes of an L1 beat
+  localparam B_DROP  = 2'd3;   // INCLUSION = 2: L2 gives up the line L1 took
+
+  reg [1:0]           bstate = B_IDLE;
+  reg [WIDTH-1:0]     baddr = {WIDTH{1'b0}};   // beat address
+  reg [MWIDTH-1:0]    bdata = {MWIDTH{1'b0}};
+  reg [WORD_BITS-1:0] bword = 0;               // word in flight
+  reg                 l2_wait = 1'b0;          // a word request was presented on the last edge
+
+  // The word presented on the last edge is done: present the next one now
+  wire l2_ack    = l2_wait && l2_hit_miss;
+  wire last_word = l2_ack && bword == WORDS - 1;
+  wire [WORD_BITS-1:0] cur = last_word ? 0 : bword + l2_ack;
+  wire line_end  = ((baddr + MWIDTH / 8) & (L1_LINE - 1)) == 0;   // last beat of an L1 line
+
+  assign mready     = (bstate == B_IDLE);
+  assign l2_rden    = (bstate == B_READ) && !last_word;
+  assign l2_wren    = (bstate == B_WRITE) && !last_word;
+  assign l2_address = baddr + cur * (WIDTH / 8);
+  assign l2_din     = bdata[cur*WIDTH +: WIDTH];
+  assign l2_snoop   = (bstate == B_DROP);
+  assign l2_snoop_address = baddr & ~(L1_LINE - 1);
+
+  // Back-invalidations (INCLUSION = 1): L2 evictions queued for the L1
+  // snoop port, one L1 line of the evicted L2 line at a time.  L1 takes
+  // snoops in IDLE only, so at most three entries are ever waiting.
+  reg [WIDTH-1:0]  bi_addr [0:BI_SLOTS-1];
+  reg [BI_ID-1:0]  bi_head = 0;
+  reg [BI_ID-1:0]  bi_tail = 0;
+  reg [BI_ID:0]    bi_count = 0;
+  reg [SUB_BITS-1:0] bi_sub = 0;
+  wire bi_push = (INCLUSION == 1) && l2_evict;
+  wire bi_pop  = l1_snoop_done && bi_count != 0 && bi_sub == SUBLINES - 1;
+
+  assign l1_snoop = (INCLUSION == 1) && bi_count != 0;
+  assign l1_snoop_address = bi_addr[bi_head] + bi_sub * L1_LINE;
+
+  reg [MWIDTH-1:0] beat_q;
+  always @(*) begin
+      beat_q = bdata;
+      beat_q[bword*WIDTH +: WIDTH] = l2_q;
+  end
+
+  always @(posedge clk or negedge reset_n) begin
+      if (!reset_n) begin
+          bstate <= B_IDLE;
+          bword <= 0;
+          l2_wait <= 0;
+          mvalid <= 0;
+          bi_head <= 0;
+          bi_tail <= 0;
+          bi_count <= 0;
+          bi_sub <= 0;
+          back_invals <= 0;
+      end
+      else begin
+          mvalid <= 0;
+          l2_wait <= l2_rden || l2_wren;
+          case (bstate)
+              B_IDLE: begin
+                  if (mwren) begin
+                      baddr <= mwraddress;
+                      bdata <= mdout;
+                      bstate <= B_WRITE;
+                  end
+                  else if (mrden) begin
+                      baddr <= mrdaddress;
+                      bstate <= B_READ;
+                  end
+              end
+              B_READ, B_WRITE: if (l2_ack) begin
+                  if (bstate == B_READ) bdata[bword*WIDTH +: WIDTH] <= l2_q;
+                  bword <= cur;
+                  if (last_word) begin
+                      if (bstate == B_READ) begin
+                          mq <= beat_q;
+                          mvalid <= 1;
+                      end
+                      bstate <= (bstate == B_READ && INCLUSION == 2 && line_end) ? B_DROP : B_IDLE;
+                  end
+              end
+              B_DROP: if (l2_snoop_done) bstate <= B_IDLE;
+          endcase
+
+          if (bi_push) begin
+              bi_addr[bi_tail] <= l2_evict_address;
+              bi_tail <= (bi_tail == BI_SLOTS - 1) ? 0 : bi_tail + 1;
+          end
+          if (l1_snoop_done && bi_count != 0) begin
+              bi_sub <= (bi_sub == SUBLINES - 1) ? 0 : bi_sub + 1;
+              if (l1_snoop_hit) back_invals <= back_invals + 1;
+          end
+          if (bi_pop) bi_head <= (bi_head == BI_SLOTS - 1) ? 0 : bi_head + 1;
+          bi_count <= bi_count + bi_push - bi_pop;
+      end
+  end
+
+endmodule
+
+// Two-level cache: an L1 Cache whose memory port drives an L2 Cache through
+// L2Bridge, and the L2's memory port on the outside (Ram timing, or the
+// ready/valid handshake with HANDSHAKE = 1).  Both levels are blocking
+// caches; the CPU port works like the Cache port.  Line sizes are
+// MWIDTH * BURST bits per level (the L1 line may not be larger than the L2
+// line), INCLUSION picks the policy (see L2Bridge).  An inclusive L2 must
+// not prefetch (its evictions are only queued during requests).
+module CacheHierarchy
+#(
+  parameter WIDTH = 32,
+  parameter INCLUSION = 0,      // 0 = non-inclusive, 1 = inclusive, 2 = exclusive
+  // L1
+  parameter L1_NWAYS = 4,
+  parameter L1_NSETS = 64,
+  parameter L1_INDEX_WIDTH = 6,
+  parameter L1_TAG_WIDTH = 23,
+  parameter L1_OFFSET_WIDTH = 3,
+  parameter L1_MWIDTH = 64,     // L1 beat = L2 words per bridge transfer
+  parameter L1_BURST = 1,
+  parameter L1_PLRU = 0,
+  parameter L1_WBUF = 0,
+  parameter L1_PREFETCH = 0,
+  // L2
+  parameter L2_NWAYS = 8,
+  parameter L2_NSETS = 512,
+  parameter L2_INDEX_WIDTH = 9,
+  parameter L2_TAG_WIDTH = 18,
+  parameter L2_OFFSET_WIDTH = 5,
+  parameter MWIDTH = 64,        // L2 memory beat
+  parameter L2_BURST = 4,
+  parameter L2_PLRU = 0,
+  parameter L2_WBUF = 0,
+  parameter L2_VICTIM = 0,
+  parameter L2_PREFETCH = 0,
+  parameter HANDSHAKE = 0
+)
+(
+  input  wire                      clk,
+  input  wire                      reset_n,
+  input  wire [WIDTH-1:0]          address,
+  input  wire [WIDTH-1:0]          din,
+  input  wire                      rden,
+  input  wire                      wren,
+  output wire                      hit_miss,
+  output wire [WIDTH-1:0]          q,
+  output wire                      ready,
+
+  // L2 memory interface
+  output wire [MWIDTH-1:0]         mdout,
+  output wire [WIDTH-1:0]          mrdaddress,
+  output wire                      mrden,
+  output wire [WIDTH-1:0]          mwraddress,
+  output wire                      mwren,
+  input  wire [MWIDTH-1:0]         mq,
+  input  wire                      mready,
+  input  wire                      mvalid,
+
+  // Per-level statistics
+  output wire [31:0]               l1_misses,    // lines L1 fetched for demand misses
+  output wire [31:0]               l2_misses,    // lines L2 fetched for L1 requests
+  output wire [31:0]               back_invals   // INCLUSION = 1: L1 lines taken out
+);
+
+  // With equal lines an L1 victim is a whole L2 line: the L2 takes it
+  // without a fetch, and the exclusive L2 drops the lines L1 fetched
+  // without writing them back (L1 has them)
+  localparam SAME_LINE = (L1_MWIDTH * L1_BURST == MWIDTH * L2_BURST);
+
+  wire [L1_MWIDTH-1:0] l1_mdout, l1_mq;
+  wire [WIDTH-1:0]     l1_mrdaddress, l1_mwraddress, l1_snoop_address;
+  wire                 l1_mrden, l1_mwren, l1_mready, l1_mvalid, l1_ready;
+  wire                 l1_snoop, l1_snoop_done, l1_snoop_hit;
+  wire [WIDTH-1:0]     l2_address, l2_din, l2_q, l2_snoop_address, l2_evict_address;
+  wire                 l2_rden, l2_wren, l2_hit_miss, l2_ready;
+  wire                 l2_snoop, l2_snoop_done, l2_evict;
+
+  assign ready = l1_ready && l2_ready;
+
+  Cache #(
+      .NWAYS(L1_NWAYS), .NSETS(L1_NSETS), .WIDTH(WIDTH), .MWIDTH(L1_MWIDTH),
+      .INDEX_WIDTH(L1_INDEX_WIDTH), .TAG_WIDTH(L1_TAG_WIDTH), .OFFSET_WIDTH(L1_OFFSET_WIDTH),
+      .BURST(L1_BURST), .PLRU(L1_PLRU), .WBUF(L1_WBUF), .PREFETCH(L1_PREFETCH),
+      .HANDSHAKE(1), .SNOOP(INCLUSION == 1), .EVICT_ALL(INCLUSION == 2)
+  ) l1 (
+      .clk(clk), .reset_n(reset_n), .address(address), .din(din), .rden(rden), .wren(wren),
+      .hit_miss(hit_miss), .q(q), .ready(l1_ready),
+      .mdout(l1_mdout), .mrdaddress(l1_mrdaddress), .mrden(l1_mrden),
+      .mwraddress(l1_mwraddress), .mwren(l1_mwren), .mq(l1_mq), .mready(l1_mready), .mvalid(l1_mvalid),
+      .snoop(l1_snoop), .snoop_address(l1_snoop_address), .snoop_done(l1_snoop_done),
+      .snoop_hit(l1_snoop_hit), .demand_misses(l1_misses)
+  );
+
+  L2Bridge #(
+      .WIDTH(WIDTH), .MWIDTH(L1_MWIDTH), .L1_LINE(L1_MWIDTH * L1_BURST / 8),
+      .L2_LINE(MWIDTH * L2_BURST / 8), .INCLUSION(INCLUSION)
+  ) bridge (
+      .clk(clk), .reset_n(reset_n),
+      .mdout(l1_mdout), .mrdaddress(l1_mrdaddress), .mrden(l1_mrden),
+      .mwraddress(l1_mwraddress), .mwren(l1_mwren), .mq(l1_mq), .mready(l1_mready), .mvalid(l1_mvalid),
+      .l1_snoop(l1_snoop), .l1_snoop_address(l1_snoop_address),
+      .l1_snoop_done(l1_snoop_done), .l1_snoop_hit(l1_snoop_hit),
+      .l2_address(l2_address), .l2_din(l2_din), .l2_rden(l2_rden), .l2_wren(l2_wren),
+      .l2_hit_miss(l2_hit_miss), .l2_q(l2_q),
+      .l2_snoop(l2_snoop), .l2_snoop_address(l2_snoop_address), .l2_snoop_done(l2_snoop_done),
+      .l2_evict(l2_evict), .l2_evict_address(l2_evict_address),
+      .back_invals(back_invals)
+  );
+
+  Cache #(
+      .NWAYS(L2_NWAYS), .NSETS(L2_NSETS), .WIDTH(WIDTH), .MWIDTH(MWIDTH),
+      .INDEX_WIDTH(L2_INDEX_WIDTH), .TAG_WIDTH(L2_TAG_WIDTH), .OFFSET_WIDTH(L2_OFFSET_WIDTH),
+      .BURST(L2_BURST), .PLRU(L2_PLRU), .WBUF(L2_WBUF), .VICTIM(L2_VICTIM),
+      .PREFETCH(L2_PREFETCH), .HANDSHAKE(HANDSHAKE),
+      .SNOOP((INCLUSION != 2) ? 0 : SAME_LINE ? 2 : 1), .LINE_WRITES(SAME_LINE)
+  ) l2 (
+      .clk(clk), .reset_n(reset_n), .address(l2_address), .din(l2_din),
+      .rden(l2_rden), .wren(l2_wren), .hit_miss(l2_hit_miss), .q(l2_q), .ready(l2_ready),
+      .mdout(mdout), .mrdaddress(mrdaddress), .mrden(mrden),
+      .mwraddress(mwraddress), .mwren(mwren), .mq(mq), .mready(mready), .mvalid(mvalid),
+      .snoop(l2_snoop), .snoop_address(l2_snoop_address), .snoop_done(l2_snoop_done),
+      .evict(l2_evict), .evict_address(l2_evict_address), .demand_misses(l2_misses)
+  );
+
+endmodule
+
+// Snooping bus that keeps NCORES MESI Caches (MESI = 1, HANDSHAKE = 1)
+// coherent in front of one memory port (ready/valid handshake).  One cache
+// owns the bus at a time (round robin over mreq) and keeps it from its
+// miss to its refill: its write-back beats go to memory, then its first
+// read beat is held while every other cache is snooped for the line
+// (snoop_share for a read, invalidate for a write).  A Modified copy is
+// sent to the owner in place of the memory read (intervention) and, on a
+// read, written to memory after it, so Shared lines are always clean.  The
+// owner fills the line Exclusive when no other cache kept it (mshared).
+// Caches are only snooped while they do not own the bus, so they are in
+// IDLE and take the snoop at once.
+module CoherentBus
+#(
+  parameter NCORES = 2,
+  parameter WIDTH = 32,
+  parameter MWIDTH = 64,
+  parameter BURST = 1
+)
+(
+  input  wire                      clk,
+  input  wire                      reset_n,
+
+  // Cache memory ports and bus signals, packed core-major
+  input  wire [NCORES*MWIDTH-1:0]  c_mdout,
+  input  wire [NCORES*WIDTH-1:0]   c_mrdaddress,
+  input  wire [NCORES-1:0]         c_mrden,
+  input  wire [NCORES*WIDTH-1:0]   c_mwraddress,
+  input  wire [NCORES-1:0]         c_mwren,
+  output wire [MWIDTH-1:0]         c_mq,
+  output wire [NCORES-1:0]         c_mready,
+  output wire [NCORES-1:0]         c_mvalid,
+  input  wire [NCORES-1:0]         c_mreq,
+  output wire [NCORES-1:0]         c_mgnt,
+  input  wire [NCORES-1:0]         c_mexcl,
+  output wire                      c_mshared,
+
+  // Cache snoop ports
+  output wire [NCORES-1:0]         snoop,
+  output wire [WIDTH-1:0]          snoop_address,
+  output wire                      snoop_share,
+  input  wire [NCORES-1:0]         snoop_done,
+  input  wire [NCORES-1:0]         snoop_hit,
+  input  wire [NCORES-1:0]         snoop_dirty,
+  input  wire [NCORES*MWIDTH*BURST-1:0] snoop_data,
+
+  // Memory interface (ready/valid handshake)
+  output wire [MWIDTH-1:0]         mdout,
+  output wire [WIDTH-1:0]          mrdaddress,
+  output wire                      mrden,
+  output wire [WIDTH-1:0]          mwraddress,
+  output wire                      mwren,
+  input  wire [MWIDTH-1:0]         mq,
+  input  wire                      mready,
+  input  wire                      mvalid,
+
+  // Coherence traffic
+  output reg  [31:0]               bus_reads,      // line fetches for reads
+  output reg  [31:0]               bus_readx,      // line fetches for writes (other copies invalidated)
+  output reg  [31:0]               invalidations,  // copies taken out of other caches
+  output reg  [31:0]               interventions   // Modified lines sent cache to cache
+);
+
+  localparam CORE_ID    = (NCORES > 1) ? $clog2(NCORES) : 1;
+  localparam LINE_WIDTH = MWIDTH * BURST;
+  localparam BEAT_LOW   = $clog2(MWIDTH / 8);
+  localparam BEAT_WIDTH = (BURST > 1) ? $clog2(BURST) : 1;
+  localparam LINE_MASK  = LINE_WIDTH / 8 - 1;
+
+  localparam X_IDLE  = 3'd0;
+  localparam X_OWNED = 3'd1;   // owner's write-backs, waiting for its first read beat
+  localparam X_SNOOP = 3'd2;   // snooping the other caches
+  localparam X_READ  = 3'd3;   // owner reads the line from memory
+  localparam X_FWD   = 3'd4;   // owner gets the Modified line from the bus
+  localparam X_FLUSH = 3'd5;   // Modified line written to memory (shared read)
+
+  reg [2:0]            xstate = X_IDLE;
+  reg [CORE_ID-1:0]    owner = 0;
+  reg [WIDTH-1:0]      x_addr = {WIDTH{1'b0}};
+  reg                  x_excl = 1'b0;
+  reg                  x_shared = 1'b0;
+  reg                  x_dirty = 1'b0;
+  reg [LINE_WIDTH-1:0] x_data = {LINE_WIDTH{1'b0}};
+  reg [NCORES-1:0]     sn_wait = {NCORES{1'b0}};   // caches still to answer the snoop
+  reg [BEAT_WIDTH-1:0] xbeat = 0;
+  reg                  fwd_valid = 1'b0;
+  reg [MWIDTH-1:0]     fwd_q = {MWIDTH{1'b0}};
+
+  wire [WIDTH-1:0] own_rdaddress = c_mrdaddress[owner*WIDTH +: WIDTH];
+  wire             own_mrden     = c_mrden[owner];
+  wire             own_mwren     = c_mwren[owner];
+  wire             owned         = (xstate == X_OWNED || xstate == X_SNOOP
+                                    || xstate == X_READ || xstate == X_FWD);
+
+  // Next owner: the first requester after the last one
+  reg [CORE_ID-1:0] pick;
+  reg               pick_any;
+  integer i, k;
+  always @(*) begin
+      pick = owner;
+      pick_any = 0;
+      for (k = NCORES; k >= 1; k = k - 1) begin
+          i = (owner + k) % NCORES;
+          if (c_mreq[i]) begin
+              pick = i;
+              pick_any = 1;
+          end
+      end
+  end
+
+  assign c_mgnt    = owned ? {{(NCORES-1){1'b0}}, 1'b1} << owner : {NCORES{1'b0}};
+  assign c_mshared = x_shared;
+  assign c_mq      = (xstate == X_FWD) ? fwd_q : mq;
+  assign c_mvalid  = (xstate == X_READ && mvalid || xstate == X_FWD && fwd_valid)
+                     ? {{(NCORES-1){1'b0}}, 1'b1} << owner : {NCORES{1'b0}};
+  // Write-backs pass while the bus is owned; the first read beat waits for
+  // the snoops
+  assign c_mready  = (xstate == X_OWNED && own_mwren && mready || xstate == X_READ && mready
+                      || xstate == X_FWD) ? {{(NCORES-1){1'b0}}, 1'b1} << owner : {NCORES{1'b0}};
+
+  assign snoop         = (xstate == X_SNOOP) ? sn_wait : {NCORES{1'b0}};
+  assign snoop_address = x_addr;
+  assign snoop_share   = !x_excl;
+
+  assign mdout      = (xstate == X_FLUSH) ? x_data[xbeat*MWIDTH +: MWIDTH] : c_mdout[owner*MWIDTH +: MWIDTH];
+  assign mwraddress = (xstate == X_FLUSH) ? x_addr | (xbeat << BEAT_LOW) : c_mwraddress[owner*WIDTH +: WIDTH];
+  assign mwren      = (xstate == X_FLUSH) || (xstate == X_OWNED) && own_mwren;
+  assign mrdaddress = own_rdaddress;
+  assign mrden      = (xstate == X_READ) && own_mrden;
+
+  // Snoop answers of this cycle
+  reg [31:0]           n_inval, n_interv;
+  reg                  a_hit, a_dirty;
+  reg [LINE_WIDTH-1:0] a_data;
+  always @(*) begin
+      n_inval = 0;
+      n_interv = 0;
+      a_hit = 0;
+      a_dirty = 0;
+      a_data = x_data;
+      for (k = 0; k < NCORES; k = k + 1)
+          if (snoop_done[k] && sn_wait[k]) begin
+              a_hit = a_hit || snoop_hit[k];
+              n_inval = n_inval + (x_excl && snoop_hit[k]);
+              if (snoop_dirty[k]) begin
+                  a_dirty = 1;
+                  n_interv = n_interv + 1;
+                  a_data = snoop_data[k*LINE_WIDTH +: LINE_WIDTH];
+              end
+          end
+  end
+
+  always @(posedge clk or negedge reset_n) begin
+      if (!reset_n) begin
+          xstate <= X_IDLE;
+          owner <= 0;
+          sn_wait <= 0;
+          xbeat <= 0;
+          fwd_valid <= 0;
+          bus_reads <= 0;
+          bus_readx <= 0;
+          invalidations <= 0;
+          interventions <= 0;
+      end
+      else begin
+          fwd_valid <= 0;
+          case (xstate)
+              X_IDLE: if (pick_any) begin
+                  owner <= pick;
+                  xstate <= X_OWNED;
+              end
+              X_OWNED: begin
+                  if (own_mrden) begin
+                      x_addr <= own_rdaddress & ~LINE_MASK;
+                      x_excl <= c_mexcl[owner];
+                      x_shared <= 0;
+                      x_dirty <= 0;
+                      sn_wait <= ~({{(NCORES-1){1'b0}}, 1'b1} << owner);
+                      xstate <= X_SNOOP;
+                  end
+                  else if (!c_mreq[owner]) xstate <= X_IDLE;
+              end
+              X_SNOOP: begin
+                  x_shared <= x_shared || a_hit;
+                  x_dirty <= x_dirty || a_dirty;
+                  x_data <= a_data;
+                  sn_wait <= sn_wait & ~snoop_done;
+                  invalidations <= invalidations + n_inval;
+                  interventions <= interventions + n_interv;
+                  if (sn_wait == 0) begin
+                      if (x_excl) bus_readx <= bus_readx + 1;
+                      else bus_reads <= bus_reads + 1;
+                      xbeat <= 0;
+                      xstate <= x_dirty ? X_FWD : X_READ;
+                  end
+              end
+              X_READ: if (mvalid) begin
+                  xbeat <= xbeat + 1;
+                  if (xbeat == BURST - 1) xstate <= X_IDLE;
+              end
+              X_FWD: begin
+                  // One beat back per beat asked for, a cycle later
+                  if (own_mrden) begin
+                      fwd_valid <= 1;
+                      fwd_q <= x_data[((own_rdaddress >> BEAT_LOW) % BURST)*MWIDTH +: MWIDTH];
+                  end
+                  if (fwd_valid) begin
+                      xbeat <= xbeat + 1;
+                      if (xbeat == BURST - 1) begin
+                          xbeat <= 0;
+                          xstate <= x_excl ? X_IDLE : X_FLUSH;
+                      end
+                  end
+              end
+              X_FLUSH: if (mready) begin
+                  xbeat <= xbeat + 1;
+                  if (xbeat == BURST - 1) xstate <= X_IDLE;
+              end
+          endcase
+      end
+  end
+
+endmodule
+
+// NCORES MESI Caches (one CPU port each, see Cache) kept coherent by a
+// CoherentBus in front of one memory port with the ready/valid handshake
+// (see LatencyRam; Ram works with mready = 1 and mvalid = valid_out).
+// CPU ports are packed core-major.
+module CoherentCaches
+#(
+  parameter NCORES = 4,
+  parameter NWAYS = 4,
+  parameter NSETS = 64,
+  parameter WIDTH = 32,
+  parameter MWIDTH = 64,
+  parameter INDEX_WIDTH = 6,
+  parameter TAG_WIDTH = 23,
+  parameter OFFSET_WIDTH = 3,
+  parameter BURST = 1,
+  parameter PLRU = 0
+)
+(
+  input  wire                      clk,
+  input  wire                      reset_n,
+  input  wire [NCORES*WIDTH-1:0]   address,
+  input  wire [NCORES*WIDTH-1:0]   din,
+  input  wire [NCORES-1:0]         rden,
+  input  wire [NCORES-1:0]         wren,
+  output wire [NCORES-1:0]         hit_miss,
+  output wire [NCORES*WIDTH-1:0]   q,
+  output wire [NCORES-1:0]         ready,
+
+  // Memory interface (ready/valid handshake)
+  output wire [MWIDTH-1:0]         mdout,
+  output wire [WIDTH-1:0]          mrdaddress,
+  output wire                      mrden,
+  output wire [WIDTH-1:0]          mwraddress,
+  output wire                      mwren,
+  input  wire [MWIDTH-1:0]         mq,
+  input  wire                      mready,
+  input  wire                      mvalid,
+
+  // Per-core lines fetched for demand misses and the bus traffic
+  output wire [NCORES*32-1:0]      demand_misses,
+  output wire [31:0]               bus_reads,
+  output wire [31:0]               bus_readx,
+  output wire [31:0]               invalidations,
+  output wire [31:0]               interventions
+);
+
+  localparam LINE_WIDTH = MWIDTH * BURST;
+
+  wire [NCORES*MWIDTH-1:0]     c_mdout;
+  wire [NCORES*WIDTH-1:0]      c_mrdaddress, c_mwraddress;
+  wire [NCORES-1:0]            c_mrden, c_mwren, c_mready, c_mvalid;
+  wire [NCORES-1:0]            c_mreq, c_mgnt, c_mexcl;
+  wire [MWIDTH-1:0]            c_mq;
+  wire                         c_mshared;
+  wire [NCORES-1:0]            snoop, snoop_done, snoop_hit, snoop_dirty;
+  wire [WIDTH-1:0]             snoop_address;
+  wire                         snoop_share;
+  wire [NCORES*LINE_WIDTH-1:0] snoop_data;
+
+  genvar g;
+  generate
+      for (g = 0; g < NCORES; g = g + 1) begin : core
+          Cache #(
+              .NWAYS(NWAYS), .NSETS(NSETS), .WIDTH(WIDTH), .MWIDTH(MWIDTH),
+              .INDEX_WIDTH(INDEX_WIDTH), .TAG_WIDTH(TAG_WIDTH), .OFFSET_WIDTH(OFFSET_WIDTH),
+              .BURST(BURST), .PLRU(PLRU), .HANDSHAKE(1), .MESI(1)
+          ) cache (
+              .clk(clk), .reset_n(reset_n),
+              .address(address[g*WIDTH +: WIDTH]), .din(din[g*WIDTH +: WIDTH]),
+              .rden(rden[g]), .wren(wren[g]), .hit_miss(hit_miss[g]),
+              .q(q[g*WIDTH +: WIDTH]), .ready(ready[g]),
+              .mdout(c_mdout[g*MWIDTH +: MWIDTH]), .mrdaddress(c_mrdaddress[g*WIDTH +: WIDTH]),
+              .mrden(c_mrden[g]), .mwraddress(c_mwraddress[g*WIDTH +: WIDTH]), .mwren(c_mwren[g]),
+              .mq(c_mq), .mready(c_mready[g]), .mvalid(c_mvalid[g]),
+              .snoop(snoop[g]), .snoop_address(snoop_address), .snoop_done(snoop_done[g]),
+              .snoop_hit(snoop_hit[g]), .snoop_share(snoop_share), .snoop_dirty(snoop_dirty[g]),
+              .snoop_data(snoop_data[g*LINE_WIDTH +: LINE_WIDTH]),
+              .mreq(c_mreq[g]), .mgnt(c_mgnt[g]), .mexcl(c_mexcl[g]), .mshared(c_mshared),
+              .demand_misses(demand_misses[g*32 +: 32])
+          );
+      end
+  endgenerate
+
+  CoherentBus #(
+      .NCORES(NCORES), .WIDTH(WIDTH), .MWIDTH(MWIDTH), .BURST(BURST)
+  ) bus (
+      .clk(clk), .reset_n(reset_n),
+      .c_mdout(c_mdout), .c_mrdaddress(c_mrdaddress), .c_mrden(c_mrden),
+      .c_mwraddress(c_mwraddress), .c_mwren(c_mwren), .c_mq(c_mq),
+      .c_mready(c_mready), .c_mvalid(c_mvalid),
+      .c_mreq(c_mreq), .c_mgnt(c_mgnt), .c_mexcl(c_mexcl), .c_mshared(c_mshared),
+      .snoop(snoop), .snoop_address(snoop_address), .snoop_share(snoop_share),
+      .snoop_done(snoop_done), .snoop_hit(snoop_hit), .snoop_dirty(snoop_dirty),
+      .snoop_data(snoop_data),
+      .mdout(mdout), .mrdaddress(mrdaddress), .mrden(mrden),
+      .mwraddress(mwraddress), .mwren(mwren), .mq(mq), .mready(mready), .mvalid(mvalid),
+      .bus_reads(bus_reads), .bus_readx(bus_readx),
+      .invalidations(invalidations), .interventions(interventions)
+  );
+
+endmodule
@@ -0,0 +1,112 @@
+"""
+Measure the coherence traffic of ``CoherentCaches`` (MESI caches on a
+snooping bus) for 1 to 16 cores on the cycle-accurate model.
+
+    python bench_coherence.py                          # all workloads, 1..16 cores
+    python bench_coherence.py --cores 2,8 --workloads false-sharing,migratory
+    python bench_coherence.py --accesses 5000 --latency 40
+
+Every workload gives each core its own trace, replayed together through
+``CoherentSystem.stream()`` (points run on a process pool).  Main memory is
+a ``LatencyRamModel`` (--latency cycles per read).  Per point it prints the
+miss rate, the share of misses that are coherence misses (lines the core
+lost to another core's write), the bus transactions per 1000 accesses --
+line fetches for reads and for writes (upgrades of Shared lines included),
+copies invalidated and Modified lines sent cache to cache -- the lines
+read from and written to memory and the cycles per access of one core.
+"""
+
+import argparse
+import itertools
+import os
+from multiprocessing import Pool
+
+import numpy as np
+
+from cache_model import L1_PARAMS, CoherentSystem, LatencyRamModel
+
+RAM_DEPTH = 20
+LINE = L1_PARAMS.LINE_WIDTH // 8
+
+
+def workload(name, ncores, n, seed=0):
+    """One ``(addresses, writes)`` trace per core."""
+    rng = np.random.default_rng(seed)
+    traces = []
+    for core in range(ncores):
+        writes = rng.random(n) < 0.3
+        if name == "private":
+            # 1 KiB per core, nothing shared
+            addresses = (core << 12) + (rng.integers(0, 1 << 10, n) & ~3)
+        elif name == "read-mostly":
+            # 1 KiB table read by everyone, 2% writes
+            addresses = rng.integers(0, 1 << 10, n) & ~3
+            writes = rng.random(n) < 0.02
+        elif name == "producer-consumer":
+            # Core i fills its 256 B buffer, core i + 1 reads it
+            i = np.arange(n)
+            mine = (core << 8) + (i * 4) % 256
+            theirs = (((core - 1) % ncores) << 8) + (i * 4) % 256
+            writes = i % 2 == 0
+            addresses = np.where(writes, mine, theirs)
+        elif name == "false-sharing":
+            # Private counters packed next to each other: the words of a
+            # line belong to different cores
+            slot = core % (LINE // 4)
+            group = core // (LINE // 4)
+            addresses = (group * 16 + rng.integers(0, 16, n)) * LINE + slot * 4
+            writes = rng.random(n) < 0.5
+        elif name == "migratory":
+            # Read-modify-write of 16 shared counters
+            counters = np.repeat(rng.integers(0, 16, (n + 1) // 2), 2)[:n]
+            addresses = counters * LINE
+            writes = np.arange(n) % 2 == 1
+        else:
+            raise ValueError(f"unknown workload {name!r}")
+        traces.append((addresses.tolist(), writes.astype(int).tolist(), None))
+    return traces
+
+
+WORKLOADS = ("private", "read-mostly", "producer-consumer", "false-sharing", "migratory")
+
+
+def run_point(task):
+    """Replay one workload on ``ncores`` cores; returns the table row."""
+    name, ncores, n, latency, outstanding = task
+    ram = LatencyRamModel(L1_PARAMS.MWIDTH, RAM_DEPTH, LATENCY=latency, OUTSTANDING=outstanding)
+    system = CoherentSystem(L1_PARAMS, ncores, ram=ram)
+    system.reset()
+    cycles = system.stream(workload(name, ncores, n))
+    return name, ncores, system.stats(), cycles / n
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--cores", default="1,2,4,8,16", help="core counts")
+    ap.add_argument("--workloads", default=",".join(WORKLOADS), help="workloads to run")
+    ap.add_argument("--accesses", type=int, default=2000, help="accesses per core")
+    ap.add_argument("--latency", type=int, default=20, help="memory read latency in cycles")
+    ap.add_argument("--outstanding", type=int, default=4, help="memory reads in flight")
+    ap.add_argument("-j", "--jobs", type=int, default=os.cpu_count())
+    args = ap.parse_args()
+
+    tasks = [(name, ncores, args.accesses, args.latency, args.outstanding)
+             for name, ncores in itertools.product(args.workloads.split(","),
+                                                   map(int, args.cores.split(",")))]
+
+    print(f"per core: NWAYS={L1_PARAMS.NWAYS} NSETS={L1_PARAMS.NSETS} line={LINE}B  "
+          f"memory latency={args.latency}  bus events per 1000 accesses")
+    print(f"{'workload':<18}{'cores':>6}{'miss':>8}{'coh':>7}{'BusRd':>8}{'BusRdX':>8}"
+          f"{'inval':>8}{'c2c':>8}{'mem rd':>8}{'mem wr':>8}{'cyc/acc':>9}")
+    with Pool(args.jobs) as pool:
+        for name, ncores, s, cpa in pool.imap(run_point, tasks):
+            k = 1000 / max(s["accesses"], 1)
+            print(f"{name:<18}{ncores:>6}{s['miss_rate']:>8.4f}"
+                  f"{s['coherence_misses'] / max(s['misses'], 1):>7.2f}"
+                  f"{s['bus_reads'] * k:>8.1f}{s['bus_readx'] * k:>8.1f}"
+                  f"{s['invalidations'] * k:>8.1f}{s['interventions'] * k:>8.1f}"
+                  f"{s['mem_reads'] * k:>8.1f}{s['mem_writes'] * k:>8.1f}{cpa:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
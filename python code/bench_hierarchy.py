@@ -0,0 +1,118 @@
+"""
+Compare L2 sizes and inclusion policies of ``CacheHierarchy`` on the
+cycle-accurate model.
+
+    python bench_hierarchy.py                         # built-in synthetic traces
+    python bench_hierarchy.py --l2-sets 128,512 --inclusion 0,1 a.trc b.trc
+    python bench_hierarchy.py --l2-line 8 --latency 40
+
+Every trace is replayed through the L1 alone (``CacheSystem.run()``) and
+through ``HierarchySystem.stream()`` once per L2 size x inclusion policy
+(points run on a process pool).  Main memory is a ``LatencyRamModel``
+(--latency cycles per read) behind the L1 alone and behind the L2.  Per
+level it prints the local miss rate (L1: per CPU access, L2: lines fetched
+per L1 line moved over the bridge), the writebacks to the next level and,
+for L2, the evictions and the L1 lines taken out by back-invalidation.
+AMAT is in cycles per CPU access.
+"""
+
+import argparse
+import itertools
+import os
+from dataclasses import replace
+from multiprocessing import Pool
+
+import numpy as np
+
+from cache_model import (INCLUSION_NAMES, L1_PARAMS, L2_PARAMS, CacheSystem,
+                         HierarchySystem, LatencyRamModel)
+from trace_format import open_trace
+
+RAM_DEPTH = 20
+
+
+def synthetic_traces(n=20_000, seed=0):
+    """Working sets around the L1 (2 KiB) and L2 (128 KiB) capacities."""
+    rng = np.random.default_rng(seed)
+    i = np.arange(n)
+    writes = rng.random(n) < 0.3
+    for size in (1 << 10, 1 << 13, 1 << 16, 1 << 18):
+        yield f"random-{size >> 10}K", rng.integers(0, size, n) & ~3, writes
+    yield "sequential", i * 4, writes
+    # 80% of the accesses to 4 KiB, the rest over 64 KiB
+    yield "hot/cold", np.where(rng.random(n) < 0.8, rng.integers(0, 1 << 12, n),
+                               rng.integers(0, 1 << 16, n)) & ~3, writes
+
+
+def file_traces(paths, limit):
+    for path in paths:
+        trace = open_trace(path)[:limit]
+        yield os.path.basename(path), trace["address"], trace["op"]
+
+
+def l2_params(nsets, line):
+    """L2_PARAMS with NSETS sets of ``line``-byte lines."""
+    index = nsets.bit_length() - 1
+    offset = line.bit_length() - 1
+    return replace(L2_PARAMS, NSETS=nsets, HANDSHAKE=1, INDEX_WIDTH=index, OFFSET_WIDTH=offset,
+                   BURST=max(line * 8 // L2_PARAMS.MWIDTH, 1),
+                   TAG_WIDTH=L2_PARAMS.WIDTH - index - offset)
+
+
+def run_point(task):
+    """Replay one trace on one configuration; returns the table row."""
+    name, nsets, inclusion, line, mem, addresses, ops = task
+    n = len(addresses)
+    if nsets is None:
+        params = replace(L1_PARAMS, HANDSHAKE=1)
+        ram = LatencyRamModel(params.MWIDTH, RAM_DEPTH, **mem)
+        system = CacheSystem(params, ram_depth=RAM_DEPTH, ram=ram)
+        hits, misses, writebacks, cycles = system.run(addresses, ops)
+        return name, "-", "L1 only", misses / max(n, 1), writebacks, None, cycles / max(n, 1)
+    l2 = l2_params(nsets, line)
+    ram = LatencyRamModel(l2.MWIDTH, RAM_DEPTH, **mem)
+    system = HierarchySystem(L1_PARAMS, l2, inclusion, ram=ram)
+    system.reset()
+    _, _, cycles = system.stream(addresses, ops, itertools.repeat(0))
+    s1, s2 = system.stats()
+    size = l2.NSETS * l2.NWAYS * l2.LINE_WIDTH // 8 >> 10
+    return (name, f"{size}K", INCLUSION_NAMES[inclusion], s1["miss_rate"], s1["writebacks"],
+            s2, cycles / max(n, 1), s1["back_invals"])
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("traces", nargs="*", help="binary traces (trace_format.py)")
+    ap.add_argument("--l2-sets", default="128,512,2048", help="L2 NSETS values")
+    ap.add_argument("--inclusion", default="0,1,2",
+                    help="0 = non-inclusive, 1 = inclusive, 2 = exclusive")
+    ap.add_argument("--l2-line", type=int, default=32, help="L2 line bytes (8 = the L1 line)")
+    ap.add_argument("--latency", type=int, default=20, help="memory read latency in cycles")
+    ap.add_argument("--outstanding", type=int, default=4, help="memory reads in flight")
+    ap.add_argument("--limit", type=int, default=100_000, help="records per trace file")
+    ap.add_argument("-j", "--jobs", type=int, default=os.cpu_count())
+    args = ap.parse_args()
+
+    grid = [(None, 0)] + list(itertools.product(map(int, args.l2_sets.split(",")),
+                                                map(int, args.inclusion.split(","))))
+    traces = (file_traces(args.traces, args.limit) if args.traces else synthetic_traces())
+    mem = dict(LATENCY=args.latency, OUTSTANDING=args.outstanding)
+    tasks = [(name, nsets, inc, args.l2_line, mem, a.tolist(), o.astype(int).tolist())
+             for name, a, o in traces for nsets, inc in grid]
+
+    print(f"L1: NWAYS={L1_PARAMS.NWAYS} NSETS={L1_PARAMS.NSETS} line={L1_PARAMS.LINE_WIDTH // 8}B  "
+          f"L2: NWAYS={L2_PARAMS.NWAYS} line={args.l2_line}B  memory latency={args.latency}")
+    print(f"{'trace':<12}{'L2':>6}{'policy':>15}{'L1 miss':>9}{'L1 wb':>8}"
+          f"{'L2 miss':>9}{'L2 wb':>8}{'evict':>8}{'b-inv':>7}{'amat':>8}")
+    with Pool(args.jobs) as pool:
+        for row in pool.imap(run_point, tasks):
+            name, size, policy, miss1, wb1, s2, amat = row[:7]
+            if s2 is None:
+                l2 = f"{'-':>9}{'-':>8}{'-':>8}{'-':>7}"
+            else:
+                l2 = f"{s2['miss_rate']:>9.4f}{s2['writebacks']:>8}{s2['evictions']:>8}{row[7]:>7}"
+            print(f"{name:<12}{size:>6}{policy:>15}{miss1:>9.4f}{wb1:>8}{l2}{amat:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
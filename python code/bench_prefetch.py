@@ -0,0 +1,107 @@
+"""
+Tune the Cache prefetcher (PREFETCH / PF_DEGREE / PF_DISTANCE) on the
+cycle-accurate model before changing the RTL.
+
+    python bench_prefetch.py                          # built-in synthetic traces
+    python bench_prefetch.py --degree 1,2,4 --distance 1,2,4 a.trc b.trc
+    python bench_prefetch.py --latency 20 --jitter 10 --outstanding 4
+
+Every trace is replayed through ``CacheSystem.run()`` once without
+prefetching and once per point of the mode x degree x distance grid (points
+run on a process pool).  Per point it prints the demand miss rate, the
+prefetcher's accuracy (useful / issued) and coverage (useful / (useful +
+demand misses)) from the same counters the RTL exposes, and AMAT in cycles.
+With --latency / --jitter / --col-bits the cache uses the ready/valid
+memory handshake against a ``LatencyRamModel`` (every request is stepped,
+so this is slower).
+"""
+
+import argparse
+import itertools
+import os
+from dataclasses import replace
+from multiprocessing import Pool
+
+import numpy as np
+
+from cache_model import CacheParams, CacheSystem, LatencyRamModel
+from trace_format import open_trace
+
+MODES = {"next": 1, "stride": 2}
+
+
+def synthetic_traces(n=20_000, seed=0):
+    """Access patterns a next-line or stride prefetcher should (or should not) cover."""
+    rng = np.random.default_rng(seed)
+    i = np.arange(n)
+    yield "sequential", i * 4, rng.random(n) < 0.2
+    yield "stride-3", i * 24, np.zeros(n, dtype=bool)
+    # Two interleaved sequential streams
+    yield "2-streams", np.where(i & 1, 1 << 20, 0) + (i >> 1) * 8, np.zeros(n, dtype=bool)
+    yield "random", rng.integers(0, 1 << 22, n) & ~3, rng.random(n) < 0.3
+    yield "seq+random", np.where(rng.random(n) < 0.7, i * 8, rng.integers(0, 1 << 22, n) & ~3), \
+        rng.random(n) < 0.2
+
+
+def file_traces(paths, limit):
+    for path in paths:
+        trace = open_trace(path)[:limit]
+        yield os.path.basename(path), trace["address"], trace["op"]
+
+
+def run_point(task):
+    """Replay one trace with one parameter set; returns the counters."""
+    name, params, mem, addresses, ops = task
+    ram = LatencyRamModel(params.MWIDTH, 16, **mem) if params.HANDSHAKE else None
+    system = CacheSystem(params, ram_depth=16, ram=ram)
+    hits, misses, _, cycles = system.run(addresses, ops)
+    c = system.cache
+    n = hits + misses
+    return (name, params.PREFETCH, params.PF_DEGREE, params.PF_DISTANCE,
+            c.demand_misses / max(n, 1), c.pf_issued, c.pf_useful,
+            c.pf_useful / max(c.pf_issued, 1),
+            c.pf_useful / max(c.pf_useful + c.demand_misses, 1), cycles / max(n, 1))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("traces", nargs="*", help="binary traces (trace_format.py)")
+    ap.add_argument("--mode", default="next,stride", help="prefetch modes: next, stride")
+    ap.add_argument("--degree", default="1,2,4", help="PF_DEGREE values")
+    ap.add_argument("--distance", default="1,2,4", help="PF_DISTANCE values")
+    ap.add_argument("--limit", type=int, default=200_000, help="records per trace file")
+    ap.add_argument("--latency", type=int, default=1, help="memory read latency in cycles")
+    ap.add_argument("--jitter", type=int, default=0, help="random extra read cycles, 0..JITTER")
+    ap.add_argument("--col-bits", type=int, default=0,
+                    help="DRAM row buffer: row = address >> COL_BITS (0 = off)")
+    ap.add_argument("--outstanding", type=int, default=4, help="memory reads in flight")
+    ap.add_argument("-j", "--jobs", type=int, default=os.cpu_count())
+    args = ap.parse_args()
+
+    mem = dict(LATENCY=args.latency, JITTER=args.jitter, COL_BITS=args.col_bits,
+               OUTSTANDING=args.outstanding)
+    # A Ram with the plain timing needs no handshake (and runs much faster)
+    base = CacheParams(HANDSHAKE=int(args.latency > 1 or args.jitter > 0 or args.col_bits > 0))
+    grid = [replace(base, PREFETCH=0)] + [
+        replace(base, PREFETCH=MODES[m], PF_DEGREE=deg, PF_DISTANCE=dist)
+        for m, deg, dist in itertools.product(args.mode.split(","),
+                                              map(int, args.degree.split(",")),
+                                              map(int, args.distance.split(",")))]
+    traces = (file_traces(args.traces, args.limit) if args.traces else synthetic_traces())
+    tasks = [(name, p, mem, a.tolist(), o.tolist()) for name, a, o in traces for p in grid]
+
+    print(f"NWAYS={base.NWAYS} NSETS={base.NSETS} MWIDTH={base.MWIDTH}")
+    print(f"{'trace':<12}{'mode':>8}{'deg':>5}{'dist':>5}{'miss':>9}"
+          f"{'issued':>9}{'useful':>9}{'accuracy':>10}{'coverage':>10}{'amat':>8}")
+    names = {v: k for k, v in MODES.items()}
+    with Pool(args.jobs) as pool:
+        for row in pool.imap(run_point, tasks):
+            name, mode, deg, dist, miss, issued, useful, acc, cov, amat = row
+            if not mode:
+                deg = dist = "-"
+            print(f"{name:<12}{names.get(mode, 'off'):>8}{deg:>5}{dist:>5}{miss:>9.4f}"
+                  f"{issued:>9}{useful:>9}{acc:>10.3f}{cov:>10.3f}{amat:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
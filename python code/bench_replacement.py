@@ -0,0 +1,108 @@
+"""
+Compare the two replacement modes of Cache (PLRU=0 counters vs PLRU=1 tree
+pseudo-LRU) on traces.
+
+    python bench_replacement.py                 # built-in synthetic traces
+    python bench_replacement.py a.trc b.trc     # binary traces (trace_format.py)
+    python bench_replacement.py --ways 8 --sets 256 a.trc
+
+For every trace it prints miss rate, writebacks and AMAT of both modes and the
+replacement state each mode keeps per set.
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+from cache_model import CacheParams
+from trace_format import chunks, open_trace
+from trace_sim import TraceSimulator
+
+MODES = ("lru", "plru")
+
+
+def state_bits(params, plru):
+    """Replacement bits per set: NWAYS log2(NWAYS)-bit counters or NWAYS-1 tree bits."""
+    return params.NWAYS - 1 if plru else params.NWAYS * max(1, (params.NWAYS - 1).bit_length())
+
+
+def synthetic_traces(params, n=1_000_000, seed=0):
+    """A few access patterns that separate the two policies."""
+    rng = np.random.default_rng(seed)
+    block = 1 << params.OFFSET_WIDTH
+    nsets = params.NSETS
+    set_stride = nsets * block
+    hot_ways = max(1, params.NWAYS - 1)
+    loop_ways = params.NWAYS + 1
+    yield "random-64K", rng.integers(0, 1 << 16, n), rng.random(n) < 0.3
+    # NWAYS-1 hot lines per set plus a stream of one-shot lines through the same sets
+    hot = rng.integers(0, hot_ways, n) * set_stride + rng.integers(0, nsets, n) * block
+    cold = (rng.integers(hot_ways, 1 << 12, n) * set_stride + rng.integers(0, nsets, n) * block)
+    yield "hot+stream", np.where(rng.random(n) < 0.8, hot, cold), rng.random(n) < 0.2
+    # Cyclic loop over NWAYS+1 lines per set: thrashes true LRU
+    loop = (np.arange(n) % loop_ways) * set_stride + (np.arange(n) // loop_ways % nsets) * block
+    yield f"loop-{loop_ways}way", loop, np.zeros(n, dtype=bool)
+    # Zipf-like reuse
+    zipf = np.minimum(rng.zipf(1.2, n), 1 << 20) * block
+    yield "zipf", zipf, rng.random(n) < 0.3
+
+
+def file_traces(paths):
+    for path in paths:
+        trace = open_trace(path)
+        yield os.path.basename(path), trace
+
+
+def run(name, trace, params):
+    row = [name]
+    for policy in MODES:
+        sim = TraceSimulator(params, policy)
+        n = misses = writebacks = cycles = 0
+        if isinstance(trace, tuple):
+            parts = [trace]
+        else:
+            parts = ((a, o) for a, o, _ in chunks(trace))
+        for addresses, ops in parts:
+            r = sim.feed(addresses, ops)
+            n += r.accesses
+            misses += r.misses
+            writebacks += r.writebacks
+            cycles += r.cycles
+        row += [misses / max(n, 1), writebacks, cycles / max(n, 1)]
+    return row
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("traces", nargs="*", help="binary traces (trace_format.py)")
+    ap.add_argument("--ways", type=int, help="NWAYS (default: CacheParams')")
+    ap.add_argument("--sets", type=int, help="NSETS (default: CacheParams')")
+    args = ap.parse_args()
+
+    params = CacheParams()
+    if args.ways and args.ways & (args.ways - 1):
+        ap.error(f"NWAYS={args.ways} is not a power of two (tree pseudo-LRU)")
+    if args.ways or args.sets:
+        from sweep import make_params
+        try:
+            params = make_params(args.ways or params.NWAYS, args.sets or params.NSETS, params.MWIDTH)
+        except ValueError as e:
+            ap.error(str(e))
+    traces = file_traces(args.traces) if args.traces else (
+        (name, (a, o)) for name, a, o in synthetic_traces(params))
+    print(f"NWAYS={params.NWAYS} NSETS={params.NSETS}: replacement state "
+          f"{state_bits(params, 0)} bits/set (lru) vs {state_bits(params, 1)} bits/set (plru)")
+    header = f"{'trace':<14}" + "".join(
+        f"{m + ' miss':>11}{m + ' wb':>10}{m + ' amat':>10}" for m in MODES) + f"{'delta':>9}"
+    print(header)
+    for name, trace in traces:
+        row = run(name, trace, params)
+        lru, plru = row[1:4], row[4:7]
+        print(f"{name:<14}"
+              + "".join(f"{m[0]:>11.5f}{m[1]:>10}{m[2]:>10.3f}" for m in (lru, plru))
+              + f"{plru[0] - lru[0]:>+9.5f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+Workload suite: synthetic and kernel-derived access patterns run on the
+Python model and, when Icarus Verilog is installed, on the RTL.
+
+    python bench_workloads.py                           # all workloads, tb cache
+    python bench_workloads.py --workloads matmul,stack --accesses 200000
+    python bench_workloads.py --ways 1,2,4 --sets 64,256 --no-rtl
+    python bench_workloads.py -o ../traces               # also save the traces
+
+The workloads cover the usual shapes of program behaviour:
+- sequential scan and a fixed stride;
+- uniform random and a dependent pointer chase;
+- blocked matrix multiply and a stack;
+- a hot/cold mix.
+Every workload touches ``--footprint`` bytes.  The default of 16 KiB fits
+the 16-bit address bus of tb_cache_system.v and is 16 times its 1 KiB cache.
+
+Each workload is replayed through ``CacheSystem.run()``.  The default cache
+is the tb's (``TB_PARAMS``); --ways / --sets / --mwidth give a grid of model
+configurations instead.  If ``iverilog`` is on PATH, the tb configuration
+is also run on ``Cache`` + ``Ram``: design.v is compiled with
+tb_cache_system.v once, and every workload is streamed as a ``+trace``
+stimulus file, with dumping off.
+
+Per run it prints the miss rate, cycles per access and simulated accesses
+per second.  Runs are sequential, so the speeds are comparable.
+"""
+
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+from cache_model import TB_PARAMS, CacheSystem
+from sweep import make_params
+from trace_format import RECORD, write_memh, write_trace
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+WORD = 4
+
+
+def sequential(n, footprint, rng):
+    """Read every word in order, wrapping around."""
+    return np.arange(n) * WORD % footprint, np.zeros(n, dtype=bool)
+
+
+def strided(n, footprint, rng, stride=72):
+    """Read every ``stride`` bytes (not a power of two, so all sets are used)."""
+    return np.arange(n) * stride % footprint, np.zeros(n, dtype=bool)
+
+
+def random(n, footprint, rng):
+    """Uniform random words, 30% writes."""
+    return rng.integers(0, footprint // WORD, n) * WORD, rng.random(n) < 0.3
+
+
+def pointer_chase(n, footprint, rng, node=16):
+    """Follow the next pointers of a linked list laid out in random order
+    (one cycle through every node): no spatial locality."""
+    nodes = footprint // node
+    order = rng.permutation(nodes)
+    return order[np.arange(n) % nodes] * node, np.zeros(n, dtype=bool)
+
+
+def matmul(n, footprint, rng, block=8):
+    """C += A * B on square word matrices, blocked: per element of C one
+    read, ``block`` reads of A and B each per block of k, one write."""
+    size = max(block, int((footprint // (3 * WORD)) ** 0.5) // block * block)
+    a, b, c = 0, size * size * WORD, 2 * size * size * WORD
+    addresses, writes = [], []
+    while len(addresses) < n:
+        for i0 in range(0, size, block):
+            for j0 in range(0, size, block):
+                for k0 in range(0, size, block):
+                    for i in range(i0, i0 + block):
+                        for j in range(j0, j0 + block):
+                            cij = c + (i * size + j) * WORD
+                            addresses.append(cij)
+                            writes.append(False)
+                            for k in range(k0, k0 + block):
+                                addresses += (a + (i * size + k) * WORD, b + (k * size + j) * WORD)
+                                writes += (False, False)
+                            addresses.append(cij)
+                            writes.append(True)
+                if len(addresses) >= n:
+                    break
+            if len(addresses) >= n:
+                break
+    return np.array(addresses[:n]), np.array(writes[:n])
+
+
+def stack(n, footprint, rng):
+    """Pushes (writes) and pops (reads) at a stack pointer that does a random
+    walk, with occasional deep calls."""
+    addresses = np.empty(n, dtype=np.int64)
+    writes = rng.random(n) < 0.5
+    calls = rng.random(n) < 0.01
+    depth, top = 0, footprint // WORD - 1
+    for i in range(n):
+        if calls[i]:
+            depth = min(top, depth + int(rng.integers(16, 256)))
+        if writes[i] and depth < top:
+            depth += 1
+        elif depth > 0:
+            depth -= 1
+            writes[i] = False
+        else:
+            writes[i] = True
+            depth += 1
+        addresses[i] = depth * WORD
+    return addresses, writes
+
+
+def hot_cold(n, footprint, rng, hot=512):
+    """90% of the accesses to a ``hot``-byte region, the rest anywhere; 20%
+    writes."""
+    is_hot = rng.random(n) < 0.9
+    addresses = np.where(is_hot, rng.integers(0, hot // WORD, n),
+                         rng.integers(0, footprint // WORD, n)) * WORD
+    return addresses, rng.random(n) < 0.2
+
+
+WORKLOADS = {
+    "sequential": sequential,
+    "strided": strided,
+    "random": random,
+    "pointer-chase": pointer_chase,
+    "matmul": matmul,
+    "stack": stack,
+    "hot-cold": hot_cold,
+}
+
+
+def workload(name, n, footprint, seed=0):
+    """``(addresses, writes)`` arrays of a workload."""
+    addresses, writes = WORKLOADS[name](n, footprint, np.random.default_rng(seed))
+    return addresses.astype(np.uint32), writes.astype(bool)
+
+
+def run_model(params, addresses, writes):
+    """``(misses, cycles, seconds)`` of the trace on ``CacheSystem.run()``."""
+    system = CacheSystem(params)
+    system.reset()
+    t = time.perf_counter()
+    _, misses, _, cycles = system.run(addresses.tolist(), writes.astype(int).tolist())
+    return misses, cycles, time.perf_counter() - t
+
+
+class RtlBench:
+    """tb_cache_system.v built once with Icarus, run once per trace."""
+
+    SUMMARY = re.compile(r"(\d+) requests, (\d+) hits, (\d+) misses, (\d+) cycles")
+
+    def __init__(self, tb_params=None):
+        """``tb_params`` overrides parameters of tb_cache_system (``{name: value}``)."""
+        self.dir = tempfile.mkdtemp(prefix="bench_workloads_")
+        self.vvp = os.path.join(self.dir, "tb.vvp")
+        overrides = [f"-Ptb_cache_system.{k}={v}" for k, v in (tb_params or {}).items()]
+        subprocess.run(["iverilog", "-o", self.vvp, *overrides, os.path.join(ROOT, "design.v"),
+                        os.path.join(ROOT, "tb_cache_system.v")], check=True)
+        # The tb loads Test1.mem from its working directory
+        shutil.copy(os.path.join(ROOT, "Test1.mem"), self.dir)
+
+    def stimulus(self, addresses, writes, data=None):
+        """Write a trace as the tb's stimulus file; returns its path."""
+        trace = np.zeros(len(addresses), dtype=RECORD)
+        trace["address"] = addresses
+        trace["op"] = writes
+        if data is not None:
+            trace["data"] = data
+        memh = os.path.join(self.dir, "trace.memh")
+        write_memh(trace, memh)
+        return memh
+
+    def command(self, memh, *plusargs):
+        """vvp command line running the tb on a stimulus file (no VCD dump)."""
+        return ["vvp", "-n", self.vvp, "-none", "+trace=" + memh, *plusargs]
+
+    def run(self, addresses, writes):
+        """``(misses, cycles, seconds)`` of the trace on the RTL."""
+        memh = self.stimulus(addresses, writes)
+        t = time.perf_counter()
+        out = subprocess.run(self.command(memh), cwd=self.dir, capture_output=True,
+                             text=True, check=True).stdout
+        seconds = time.perf_counter() - t
+        m = self.SUMMARY.search(out)
+        if m is None:
+            raise RuntimeError("no summary line from tb_cache_system:\n" + out[-2000:])
+        return int(m.group(3)), int(m.group(4)), seconds
+
+    def close(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--workloads", default=",".join(WORKLOADS), help="workloads to run")
+    ap.add_argument("--accesses", type=int, default=50_000, help="accesses per workload")
+    ap.add_argument("--footprint", type=int, default=16 << 10, help="bytes touched")
+    ap.add_argument("--ways", help="NWAYS values of a model-only grid")
+    ap.add_argument("--sets", help="NSETS values of a model-only grid")
+    ap.add_argument("--mwidth", help="MWIDTH values of a model-only grid")
+    ap.add_argument("--no-rtl", action="store_true", help="skip the RTL even with iverilog")
+    ap.add_argument("-o", "--save", help="directory to write every workload to as a .trc")
+    args = ap.parse_args()
+
+    if args.ways or args.sets or args.mwidth:
+        ints = lambda s, d: [int(v) for v in s.split(",")] if s else [d]
+        configs = [make_params(w, s, m)
+                   for w in ints(args.ways, TB_PARAMS.NWAYS)
+                   for s in ints(args.sets, TB_PARAMS.NSETS)
+                   for m in ints(args.mwidth, TB_PARAMS.MWIDTH)]
+    else:
+        configs = [TB_PARAMS]
+    rtl = None
+    if not args.no_rtl and TB_PARAMS in configs and shutil.which("iverilog"):
+        rtl = RtlBench()
+    elif not args.no_rtl and TB_PARAMS in configs:
+        print("iverilog not found: model only")
+
+    print(f"{args.accesses} accesses per workload, footprint {args.footprint} B")
+    print(f"{'workload':<15}{'config':>14}{'sim':>6}{'miss':>9}{'cyc/acc':>9}{'acc/s':>12}")
+    try:
+        for name in args.workloads.split(","):
+            addresses, writes = workload(name, args.accesses, args.footprint)
+            if args.save:
+                write_trace(os.path.join(args.save, name + ".trc"), addresses, writes.astype(np.uint8))
+            for params in configs:
+                config = ("tb" if params == TB_PARAMS
+                          else f"{params.NWAYS}x{params.NSETS}x{params.MWIDTH}")
+                runs = [("model", run_model(params, addresses, writes))]
+                if rtl is not None and params == TB_PARAMS:
+                    runs.append(("rtl", rtl.run(addresses, writes)))
+                for sim, (misses, cycles, seconds) in runs:
+                    n = len(addresses)
+                    print(f"{name:<15}{config:>14}{sim:>6}{misses / n:>9.4f}{cycles / n:>9.2f}"
+                          f"{n / max(seconds, 1e-9):>12.0f}")
+    finally:
+        if rtl is not None:
+            rtl.close()
+
+
+if __name__ == "__main__":
+    main()
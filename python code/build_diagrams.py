@@ -0,0 +1,189 @@
+"""
+Headless build of every cache diagram from the parameters in design.v.
+
+    python build_diagrams.py                        # ../build/diagrams
+    python build_diagrams.py -o ../images --jobs 4
+    python build_diagrams.py --only cache3,graphviz --force
+
+The ``Cache`` parameter defaults are read from design.v, so the diagrams
+follow the RTL instead of the numbers typed into each script.  Each diagram is
+built by its own script's drawing function, in a pool of worker processes:
+matplotlib with the Agg backend, pygame with the dummy video driver and
+graphviz through ``dot``.  None of them is imported here, only in the
+workers, and only for the diagrams that are out of date.
+
+A diagram is up to date when its output exists and the hash of its script,
+cache_model.py and the parameters matches the one recorded in
+``.hashes.json`` of the output directory.  --force rebuilds everything.
+"""
+
+import argparse
+import ast
+import contextlib
+import hashlib
+import importlib
+import io
+import json
+import operator
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import fields
+
+from cache_model import CacheParams
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+
+# name -> (script, drawing function taking (params, path))
+DIAGRAMS = {
+    "cache": ("cache", "draw_cache_structure"),
+    "cache2": ("cache2", "draw_cache_structure"),
+    "cache3": ("cache3", "draw_cache_hardware"),
+    "cache4": ("cache4", "draw_cache_hardware"),
+    "schematic": ("cache_schematic", "visualize_hardware"),
+    "graphviz": ("visualize_cache_graphviz", "create_cache_schematic"),
+    "graphviz2": ("visualize_cache_graphviz2", "create_master_cache_schematic"),
+    "pygame": ("visualize_cache_pygame", "render"),
+}
+
+HASHES = ".hashes.json"
+
+_OPS = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+    ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod, ast.Pow: operator.pow,
+    ast.LShift: operator.lshift, ast.RShift: operator.rshift,
+    ast.BitOr: operator.or_, ast.BitAnd: operator.and_, ast.BitXor: operator.xor,
+    ast.USub: operator.neg, ast.UAdd: operator.pos, ast.Invert: operator.invert,
+}
+_SIZED = re.compile(r"\d*'[sS]?([bBoOdDhH])([0-9a-fA-F_]+)")
+_BASES = {"b": 2, "o": 8, "d": 10, "h": 16}
+
+
+def _evaluate(expr, env):
+    """Value of a constant Verilog expression; ``None`` if not understood."""
+    expr = _SIZED.sub(lambda m: str(int(m.group(2).replace("_", ""), _BASES[m.group(1).lower()])), expr)
+    expr = expr.replace("**", "^^").replace("/", "//").replace("^^", "**")
+
+    def value(node):
+        if isinstance(node, ast.Constant) and isinstance(node.value, int):
+            return node.value
+        if isinstance(node, ast.Name):
+            return env[node.id]
+        if isinstance(node, ast.BinOp):
+            return _OPS[type(node.op)](value(node.left), value(node.right))
+        if isinstance(node, ast.UnaryOp):
+            return _OPS[type(node.op)](value(node.operand))
+        raise ValueError(expr)
+
+    try:
+        return value(ast.parse(expr.strip(), mode="eval").body)
+    except (SyntaxError, KeyError, ValueError, ZeroDivisionError):
+        return None
+
+
+def read_params(path=os.path.join(ROOT, "design.v"), module="Cache"):
+    """``CacheParams`` with the parameter defaults of ``module`` in design.v."""
+    with open(path) as f:
+        text = f.read()
+    text = re.sub(r"/\*.*?\*/", "", re.sub(r"//[^\n]*", "", text), flags=re.S)
+    m = re.search(rf"\bmodule\s+{module}\s*#\s*\(", text)
+    if m is None:
+        raise ValueError(f"no parameterized module {module} in {path}")
+    # The parameter list runs to the matching parenthesis
+    depth, end = 1, m.end()
+    while depth:
+        depth += {"(": 1, ")": -1}.get(text[end], 0)
+        end += 1
+    env = {}
+    for name, expr in re.findall(r"\bparameter\s+(?:integer\s+)?(\w+)\s*=\s*([^,]+)",
+                                 text[m.end():end - 1]):
+        v = _evaluate(expr, env)
+        if v is not None:
+            env[name] = v
+    known = {f.name for f in fields(CacheParams)}
+    return CacheParams(**{k: v for k, v in env.items() if k in known})
+
+
+def content_hash(name, params):
+    """Hash of everything a diagram is drawn from."""
+    h = hashlib.sha256()
+    for script in (DIAGRAMS[name][0], "cache_model"):
+        with open(os.path.join(HERE, script + ".py"), "rb") as f:
+            h.update(f.read())
+    h.update(repr(params).encode())
+    return h.hexdigest()
+
+
+def build(name, params, path):
+    """Draw one diagram to ``path`` (run in a worker); returns the seconds."""
+    t = time.perf_counter()
+    module, function = DIAGRAMS[name]
+    with contextlib.redirect_stdout(io.StringIO()):
+        getattr(importlib.import_module(module), function)(params, path)
+    return time.perf_counter() - t
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("-o", "--output", default=os.path.join(ROOT, "build", "diagrams"),
+                    help="output directory")
+    ap.add_argument("--only", help=f"diagrams to build (of {','.join(DIAGRAMS)})")
+    ap.add_argument("--design", default=os.path.join(ROOT, "design.v"), help="Verilog source")
+    ap.add_argument("--jobs", type=int, help="worker processes (default: one per CPU)")
+    ap.add_argument("--force", action="store_true", help="rebuild up-to-date diagrams too")
+    args = ap.parse_args()
+
+    names = args.only.split(",") if args.only else list(DIAGRAMS)
+    unknown = [n for n in names if n not in DIAGRAMS]
+    if unknown:
+        ap.error(f"unknown diagrams {','.join(unknown)} (of {','.join(DIAGRAMS)})")
+    params = read_params(args.design)
+    os.makedirs(args.output, exist_ok=True)
+    hash_file = os.path.join(args.output, HASHES)
+    try:
+        with open(hash_file) as f:
+            hashes = json.load(f)
+    except (OSError, ValueError):
+        hashes = {}
+
+    jobs = {}
+    for name in names:
+        path = os.path.abspath(os.path.join(args.output, name + ".png"))
+        digest = content_hash(name, params)
+        if not args.force and hashes.get(name) == digest and os.path.exists(path):
+            print(f"{name:<12}up to date")
+        else:
+            jobs[name] = (path, digest)
+
+    # Inherited by the workers, before any of them imports a backend
+    os.environ["MPLBACKEND"] = "Agg"
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    os.environ["SDL_AUDIODRIVER"] = "dummy"
+    os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "1"
+    failed = 0
+    if jobs:
+        with ProcessPoolExecutor(min(len(jobs), args.jobs or os.cpu_count())) as pool:
+            futures = {name: pool.submit(build, name, params, path)
+                       for name, (path, _) in jobs.items()}
+            for name, future in futures.items():
+                path, digest = jobs[name]
+                try:
+                    seconds = future.result()
+                except Exception as e:
+                    failed += 1
+                    hashes.pop(name, None)
+                    print(f"{name:<12}failed: {type(e).__name__}: {e}")
+                    continue
+                hashes[name] = digest
+                print(f"{name:<12}built {os.path.relpath(path)} in {seconds:.2f} s")
+        with open(hash_file, "w") as f:
+            json.dump(hashes, f, indent=1, sort_keys=True)
+    print(f"{len(names) - len(jobs)} up to date, {len(jobs) - failed} built, {failed} failed")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
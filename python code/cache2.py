@@ -1,31 +1,33 @@
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
 
-def draw_cache_structure():
+from cache_model import CacheParams
+
+def draw_cache_structure(params=CacheParams(), path=None):
     fig, ax = plt.subplots(figsize=(12, 8))
     
     # Define Dimensions based on Verilog parameters
-    n_ways = 4
-    n_sets = 8 # Simplified for drawing (actually 1024)
+    n_ways = params.NWAYS
+    n_sets = 8 # Simplified for drawing (actually NSETS)
     
     # 1. Address Breakdown (Top)
     ax.add_patch(patches.Rectangle((2, 9), 6, 0.6, edgecolor='black', facecolor='white', lw=2))
-    ax.text(5, 9.7, "CPU Address (32 bits)", fontsize=12, ha='center', weight='bold')
+    ax.text(5, 9.7, f"CPU Address ({params.WIDTH} bits)", fontsize=12, ha='center', weight='bold')
     # Labeling address segments
-    ax.text(3, 9.2, "Tag (19 bits)", ha='center', fontsize=9)
-    ax.text(5, 9.2, "Index (10 bits)", ha='center', fontsize=9)
-    ax.text(7, 9.2, "Offset (3 bits)", ha='center', fontsize=9)
+    ax.text(3, 9.2, f"Tag ({params.TAG_WIDTH} bits)", ha='center', fontsize=9)
+    ax.text(5, 9.2, f"Index ({params.INDEX_WIDTH} bits)", ha='center', fontsize=9)
+    ax.text(7, 9.2, f"Offset ({params.OFFSET_WIDTH} bits)", ha='center', fontsize=9)
     ax.plot([4, 4], [9, 9.6], color='black', lw=1)
     ax.plot([6, 6], [9, 9.6], color='black', lw=1)
 
-    # 2. Drawing the 4 Ways (Rectangles)
-    way_labels = ["Way 1", "Way 2", "Way 3", "Way 4"]
+    # 2. Drawing the Ways (Rectangles)
+    way_labels = [f"Way {i + 1}" for i in range(n_ways)]
     colors = ['#e1f5fe', '#e8f5e9', '#fff3e0', '#fce4ec']
     
     for i in range(n_ways):
         x_offset = i * 2.5 + 0.5
         # Draw Way Container
-        ax.add_patch(patches.Rectangle((x_offset, 4), 2, 4, edgecolor='black', facecolor=colors[i], alpha=0.5))
+        ax.add_patch(patches.Rectangle((x_offset, 4), 2, 4, edgecolor='black', facecolor=colors[i % len(colors)], alpha=0.5))
         ax.text(x_offset + 1, 8.2, way_labels[i], ha='center', weight='bold')
         
         # Columns inside each way
@@ -52,18 +54,23 @@ def draw_cache_structure():
     # MUX
     mux = patches.FancyBboxPatch((3, 1.5), 4, 0.8, boxstyle="round,pad=0.1", fc="lightgray", ec="black")
     ax.add_patch(mux)
-    ax.text(5, 1.8, "4-to-1 Multiplexor", ha='center', weight='bold')
+    ax.text(5, 1.8, f"{n_ways}-to-1 Multiplexor", ha='center', weight='bold')
 
     # 4. Final Data Output
     ax.annotate('', xy=(5, 0.5), xytext=(5, 1.5), arrowprops=dict(arrowstyle='->', lw=2))
-    ax.text(5, 0.2, "Output Data (32 bits / WIDTH)", ha='center', weight='bold', color='blue')
+    ax.text(5, 0.2, f"Output Data ({params.WIDTH} bits / WIDTH)", ha='center', weight='bold', color='blue')
 
     # Formatting
-    ax.set_xlim(0, 11)
+    ax.set_xlim(0, max(11, 2.5 * n_ways + 1))
     ax.set_ylim(0, 10)
     ax.axis('off')
-    plt.title("4-Way Set Associative Cache Architecture (Verilog Mapping)", fontsize=14)
+    plt.title(f"{n_ways}-Way Set Associative Cache Architecture (Verilog Mapping)", fontsize=14)
     plt.tight_layout()
-    plt.show()
+    if path:
+        plt.savefig(path, dpi=150)
+        plt.close(fig)
+    else:
+        plt.show()
 
-draw_cache_structure()
\ No newline at end of file
+if __name__ == "__main__":
+    draw_cache_structure()
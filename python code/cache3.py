@@ -1,31 +1,36 @@
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
 
+from cache_model import CacheParams
+
 def draw_component(ax, x, y, width, height, label, color='white', fontsize=10):
     rect = patches.Rectangle((x, y), width, height, linewidth=1, edgecolor='black', facecolor=color)
     ax.add_patch(rect)
     ax.text(x + width/2, y + height/2, label, ha='center', va='center', fontsize=fontsize)
     return x + width/2, y + height/2
 
-def draw_cache_hardware():
+def draw_cache_hardware(params=CacheParams(), path=None):
     fig, ax = plt.subplots(figsize=(16, 12))
+    p = params
+    n_ways = p.NWAYS
+    mid = 2 * n_ways  # centre of the output logic
     
     # ---------------------------------------------------------
     # 1. CPU Address
     # ---------------------------------------------------------
-    ax.text(8, 11.5, "CPU Address (WIDTH=32)", ha='center', fontsize=14, weight='bold')
+    ax.text(8, 11.5, f"CPU Address (WIDTH={p.WIDTH})", ha='center', fontsize=14, weight='bold')
     
     # Address Register breakdown
-    # Tag (19), Index (10), Offset (3)
+    # Tag, Index, Offset
     # Total width used for drawing = 10 units
-    draw_component(ax, 3, 10.5, 5, 0.8, "Tag (19 bits)\naddress[31:13]", '#ffccbc')
-    draw_component(ax, 8, 10.5, 3, 0.8, "Index (10 bits)\naddress[12:3]", '#fff9c4')
-    draw_component(ax, 11, 10.5, 2, 0.8, "Offset (3 bits)\naddress[2:0]", '#e1bee7')
+    draw_component(ax, 3, 10.5, 5, 0.8, f"Tag ({p.TAG_WIDTH} bits)\naddress[{p.TAG_HIGH}:{p.TAG_LOW}]", '#ffccbc')
+    draw_component(ax, 8, 10.5, 3, 0.8, f"Index ({p.INDEX_WIDTH} bits)\naddress[{p.INDEX_HIGH}:{p.INDEX_LOW}]", '#fff9c4')
+    draw_component(ax, 11, 10.5, 2, 0.8, f"Offset ({p.OFFSET_WIDTH} bits)\naddress[{p.OFFSET_HIGH}:0]", '#e1bee7')
     
     # Lines dropping down
     # Tag Line
     ax.plot([5.5, 5.5], [10.5, 9.5], 'k-') # Tag out
-    ax.plot([1.5, 14.5], [9.5, 9.5], 'k-') # Tag distribution bus
+    ax.plot([1.5, 4 * n_ways - 1.5], [9.5, 9.5], 'k-') # Tag distribution bus
     
     # Index Line
     ax.plot([9.5, 9.5], [10.5, 6.0], 'k--') 
@@ -35,14 +40,14 @@ def draw_cache_hardware():
     # 2. Cache Ways (Hardware Arrays)
     # ---------------------------------------------------------
     way_colors = ['#e3f2fd', '#e0f2f1', '#f3e5f5', '#fbe9e7']
-    way_names = ["1", "2", "3", "4"]
+    way_names = [str(i + 1) for i in range(n_ways)]
     
     # Way X starting positions
-    x_starts = [0.5, 4.5, 8.5, 12.5]
+    x_starts = [0.5 + 4 * i for i in range(n_ways)]
     
     for i, x in enumerate(x_starts):
         way_num = way_names[i]
-        color = way_colors[i]
+        color = way_colors[i % len(way_colors)]
         
         # Way Container Outline
         rect = patches.Rectangle((x, 3), 3.5, 6, linewidth=2, edgecolor='gray', facecolor='none', linestyle=':')
@@ -60,16 +65,16 @@ def draw_cache_hardware():
         draw_component(ax, x+0.6, y_set, 0.5, 1, f"D{way_num}\n[1]", '#ffcdd2', 8)
         
         # LRU Bits
-        draw_component(ax, x+1.1, y_set, 0.6, 1, f"L{way_num}\n[2]", '#e1bee7', 8)
+        draw_component(ax, x+1.1, y_set, 0.6, 1, f"L{way_num}\n[{p.LRU_WIDTH}]", '#e1bee7', 8)
         
         # Tag Array
-        draw_component(ax, x+1.7, y_set, 1.7, 1, f"tag{way_num}\n[19]", '#ffccbc', 8)
+        draw_component(ax, x+1.7, y_set, 1.7, 1, f"tag{way_num}\n[{p.TAG_WIDTH}]", '#ffccbc', 8)
         
         # Data Block (Visualized slightly below or same line? Same line is better for "Set")
-        # But Data is huge (64 bits). Let's put it below to save width, or squeeze.
+        # But Data is huge (a whole line). Let's put it below to save width, or squeeze.
         # Let's widen the diagram.
         # Actually, let's put Data in the same block but below the tag for compactness.
-        draw_component(ax, x+0.1, y_set-1.2, 3.3, 1, f"mem{way_num} [64 bits] (MWIDTH)", '#c8e6c9', 9)
+        draw_component(ax, x+0.1, y_set-1.2, 3.3, 1, f"mem{way_num} [{p.LINE_WIDTH} bits] (MWIDTH)", '#c8e6c9', 9)
         
         # Comparator
         # Compares Tag Register with CPU Tag
@@ -103,49 +108,59 @@ def draw_cache_hardware():
     # ---------------------------------------------------------
     
     # MUX
-    draw_component(ax, 5, 0.5, 6, 1.5, "4-to-1 MUX", '#ffe0b2')
+    draw_component(ax, mid - 3, 0.5, 6, 1.5, f"{n_ways}-to-1 MUX", '#ffe0b2')
     
-    # Inputs to Mux (Data mem1..mem4)
-    # mem1
-    ax.arrow(2.2, 4.3, 3.0, -2.5, head_width=0.1, color='green') # Way 1 Data -> Mux
-    ax.arrow(6.2, 4.3, 0.5, -2.3, head_width=0.1, color='green') # Way 2 Data
-    ax.arrow(10.2, 4.3, -2.5, -2.3, head_width=0.1, color='green') # Way 3 Data
-    ax.arrow(14.2, 4.3, -5.0, -2.5, head_width=0.1, color='green') # Way 4 Data
+    # Inputs to Mux (Data mem1..memN), spread over the top of the MUX
+    for i, x in enumerate(x_starts):
+        ax.arrow(x + 1.7, 4.3, mid - 2.5 + 5 * (i + 0.5) / n_ways - (x + 1.7), -2.3,
+                 head_width=0.1, color='green') # Way Data -> Mux
     
     # Hit Signals controlling Mux
-    ax.plot([3.0, 8.0], [2.5, 2.5], 'r-', linewidth=2) # Bus for hit signals
-    ax.arrow(8.0, 2.5, 0, -0.5, head_width=0.2, color='red') # Mux Select
+    ax.plot([3.0, mid], [2.5, 2.5], 'r-', linewidth=2) # Bus for hit signals
+    ax.arrow(mid, 2.5, 0, -0.5, head_width=0.2, color='red') # Mux Select
 
     # Output Q
-    ax.arrow(8, 0.5, 0, -0.4, head_width=0.2, color='blue', linewidth=2)
-    ax.text(8, -0.1, "q [32 bits]", ha='center', weight='bold', color='blue')
+    ax.arrow(mid, 0.5, 0, -0.4, head_width=0.2, color='blue', linewidth=2)
+    ax.text(mid, -0.1, f"q [{p.WIDTH} bits]", ha='center', weight='bold', color='blue')
     
     # ---------------------------------------------------------
     # 4. Word Select (Offset Logic)
     # ---------------------------------------------------------
-    # Offset selects lower or upper 32 bits of 64-bit block
-    ax.text(12, 1.0, "Word Select Logic", fontsize=10, style='italic')
-    ax.plot([12, 11], [10.5, 1.25], 'k:', alpha=0.5) # Line from Offset
-    ax.text(12.2, 0.5, "mem[Offset <= 3 ? 31:0 : 63:32]", fontsize=9, bbox=dict(facecolor='white', alpha=0.8))
+    # The upper Offset bits select a WIDTH-bit word of the line
+    ax.text(mid + 4, 1.0, "Word Select Logic", fontsize=10, style='italic')
+    ax.plot([12, mid + 3], [10.5, 1.25], 'k:', alpha=0.5) # Line from Offset
+    if p.WSEL_WIDTH == 1:
+        select = (f"mem[Offset[{p.OFFSET_HIGH}] ? {2 * p.WIDTH - 1}:{p.WIDTH} "
+                  f": {p.WIDTH - 1}:0]")
+    elif p.WSEL_WIDTH:
+        select = (f"mem[Offset[{p.OFFSET_HIGH}:{p.OFFSET_WIDTH - p.WSEL_WIDTH}] * {p.WIDTH} "
+                  f"+: {p.WIDTH}]")
+    else:
+        select = f"mem[{p.WIDTH - 1}:0]"
+    ax.text(mid + 4.2, 0.5, select, fontsize=9, bbox=dict(facecolor='white', alpha=0.8))
 
     # Title and Parameters
     plt.text(0.5, 12, "Verilog Cache Hardware Visualization", fontsize=16, weight='bold')
     param_text = (
         "Parameters matching Cache.v:\n"
-        "NWAYS = 4\n"
-        "NSETS = 1024\n"
-        "BLOCK_SIZE = 64 bits (MWIDTH)\n"
-        "TAG_WIDTH = 19\n"
-        "INDEX_WIDTH = 10\n"
-        "OFFSET_WIDTH = 3"
+        f"NWAYS = {p.NWAYS}\n"
+        f"NSETS = {p.NSETS}\n"
+        f"BLOCK_SIZE = {p.LINE_WIDTH} bits (MWIDTH)\n"
+        f"TAG_WIDTH = {p.TAG_WIDTH}\n"
+        f"INDEX_WIDTH = {p.INDEX_WIDTH}\n"
+        f"OFFSET_WIDTH = {p.OFFSET_WIDTH}"
     )
     plt.text(0.5, 10.5, param_text, fontsize=10, family='monospace', bbox=dict(facecolor='#eceff1'))
 
-    ax.set_xlim(0, 16.5)
+    ax.set_xlim(0, max(16.5, 4 * n_ways + 0.5))
     ax.set_ylim(-1, 13)
     ax.axis('off')
     
     plt.tight_layout()
+    if path:
+        plt.savefig(path, dpi=150)
+        plt.close(fig)
+        return
     plt.savefig('cache_hardware_diagram.png', dpi=150)
     plt.show()
 
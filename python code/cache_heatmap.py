@@ -0,0 +1,331 @@
+"""
+Heatmap of the whole cache array (NSETS x NWAYS) over a sliding window of a
+trace.
+
+    python cache_heatmap.py ../traces/tb_cache_system.trc --tb      # live, pygame
+    python cache_heatmap.py --workload hot-cold --accesses 5000000
+    python cache_heatmap.py x.trc --save heat.png                    # last window, matplotlib
+    python cache_heatmap.py x.trc --save heat.png --every 64         # heat_0001.png, ...
+
+One cell per line (set, way), over the last ``--window`` requests:
+- hit-rate: hits on the way per access to the set (a row of the array sums
+  to the set's hit rate);
+- miss-rate: refills of the way per access to the set;
+- evictions: valid lines the way replaced;
+- dirty: share of the window's steps that ended with the line dirty;
+- lru-age: mean LRU rank, 0 = most recently used.
+
+The trace goes through ``TraceSimulator`` (exact for the RTL's LRU)
+``--step`` requests at a time.  The counts of a step are NumPy bincounts over
+``set * NWAYS + way``.  The dirty bits and LRU ranks are sampled at the end
+of the step.  The window sums add the newest step and subtract the one that
+drops out, so an update costs one step whatever the window.
+
+In the pygame view the axes and colour bar are drawn once; a frame blits the
+array through ``pygame.surfarray`` and updates only the array, the colour
+bar labels and the status line.  Keys: space play / pause, right one step,
+up / down twice / half the steps per frame, 1-5 metric, home restart, esc
+quit.  With --save the figure is drawn with matplotlib (Agg) instead.
+"""
+
+import argparse
+import os
+import time
+from collections import deque
+
+import numpy as np
+
+from cache_model import TB_PARAMS, CacheParams
+from trace_sim import TraceSimulator, split_addresses
+
+METRICS = ("hit-rate", "miss-rate", "evictions", "dirty", "lru-age")
+
+# Anchors of the colour map (viridis), low to high
+_ANCHORS = np.array([(68, 1, 84), (59, 82, 139), (33, 145, 140), (94, 201, 98), (253, 231, 37)])
+LUT = np.stack([np.interp(np.linspace(0, 1, 256), np.linspace(0, 1, len(_ANCHORS)), _ANCHORS[:, c])
+                for c in range(3)], axis=1).astype(np.uint8)
+
+
+class Heatmap:
+    """Per-line statistics of a trace fed step by step, over a window of
+    the last ``window`` requests (whole steps)."""
+
+    def __init__(self, params=CacheParams(), window=1 << 16):
+        self.params = params
+        self.window = window
+        self.sim = TraceSimulator(params)
+        self.history = deque()
+        self.in_window = 0
+        self.requests = 0
+        shape = (params.NSETS, params.NWAYS)
+        self.sums = dict(accesses=np.zeros(params.NSETS, dtype=np.int64),
+                         hits=np.zeros(shape, dtype=np.int64),
+                         fills=np.zeros(shape, dtype=np.int64),
+                         evictions=np.zeros(shape, dtype=np.int64),
+                         dirty=np.zeros(shape, dtype=np.int64),
+                         age=np.zeros(shape, dtype=np.int64))
+
+    def ages(self):
+        """LRU rank of every line: the ways of its set used after it."""
+        stamp = self.sim.stamp
+        return (stamp[:, None, :] > stamp[:, :, None]).sum(axis=2)
+
+    def feed(self, addresses, ops=None):
+        """Simulate the next step of the trace and slide the window."""
+        p = self.params
+        shape = (p.NSETS, p.NWAYS)
+        valid = self.sim.valid.copy()
+        result = self.sim.feed(addresses, ops)
+        _, index, _ = split_addresses(addresses, p)
+        cell = index * p.NWAYS + result.way
+        fills = np.bincount(cell[~result.hit], minlength=p.NSETS * p.NWAYS).reshape(shape)
+        counts = dict(accesses=np.bincount(index, minlength=p.NSETS),
+                      hits=np.bincount(cell[result.hit], minlength=p.NSETS * p.NWAYS).reshape(shape),
+                      fills=fills,
+                      # Every refill replaces a line except the first one of a way
+                      evictions=fills - (self.sim.valid & ~valid),
+                      dirty=self.sim.dirty.astype(np.int64),
+                      age=self.ages())
+        self.history.append((len(addresses), counts))
+        self.in_window += len(addresses)
+        self.requests += len(addresses)
+        for name, value in counts.items():
+            self.sums[name] += value
+        while self.in_window - self.history[0][0] >= self.window:
+            n, old = self.history.popleft()
+            self.in_window -= n
+            for name, value in old.items():
+                self.sums[name] -= value
+        return result
+
+    def metric(self, name):
+        """NSETS x NWAYS float array of one of ``METRICS``."""
+        s = self.sums
+        per_set = np.maximum(s["accesses"], 1)[:, None]
+        samples = max(len(self.history), 1)
+        if name == "hit-rate":
+            return s["hits"] / per_set
+        if name == "miss-rate":
+            return s["fills"] / per_set
+        if name == "evictions":
+            return s["evictions"].astype(float)
+        if name == "dirty":
+            return s["dirty"] / samples
+        if name == "lru-age":
+            return s["age"] / samples
+        raise ValueError(f"unknown metric {name!r}")
+
+    def limits(self, name, values):
+        """Colour scale ``(low, high)`` of a metric."""
+        if name == "evictions":
+            return 0, max(float(values.max()), 1.0)
+        if name == "lru-age":
+            return 0, self.params.NWAYS - 1
+        return 0, 1
+
+
+def colors(values, low, high):
+    """RGB uint8 array of ``values`` through ``LUT``."""
+    scaled = (values - low) * (255 / max(high - low, 1e-12))
+    return LUT[np.clip(scaled, 0, 255).astype(np.uint8)]
+
+
+def steps(trace, step):
+    """``(addresses, ops)`` pieces of a trace."""
+    addresses, ops = trace
+    for i in range(0, len(addresses), step):
+        yield addresses[i:i + step], ops[i:i + step]
+
+
+def save(heatmap, source, path, every=None):
+    """Run the trace and draw all metrics with matplotlib, at the end or
+    every ``every`` steps (numbered files)."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    p = heatmap.params
+    fig, axes = plt.subplots(len(METRICS), 1, figsize=(14, 2 + 1.6 * len(METRICS)),
+                             squeeze=False, constrained_layout=True)
+    images = []
+    for ax, name in zip(axes[:, 0], METRICS):
+        image = ax.imshow(np.zeros((p.NWAYS, p.NSETS)), aspect="auto", interpolation="nearest",
+                          cmap="viridis", origin="lower")
+        fig.colorbar(image, ax=ax, pad=0.01)
+        ax.set_title(name, fontsize=10, loc="left")
+        ax.set_ylabel("way")
+        ax.set_yticks(range(p.NWAYS))
+        images.append(image)
+    axes[-1, 0].set_xlabel("set")
+    root, ext = os.path.splitext(path)
+    frame = 0
+
+    def draw(out):
+        for image, name in zip(images, METRICS):
+            values = heatmap.metric(name)
+            image.set_data(values.T)
+            image.set_clim(*heatmap.limits(name, values))
+        fig.suptitle(f"{p.NSETS} sets x {p.NWAYS} ways, requests "
+                     f"{heatmap.requests - heatmap.in_window:,} - {heatmap.requests:,}")
+        fig.savefig(out, dpi=100)
+        print(out)
+
+    for i, (addresses, ops) in enumerate(source, 1):
+        heatmap.feed(addresses, ops)
+        if every and i % every == 0:
+            frame += 1
+            draw(f"{root}_{frame:04d}{ext}")
+    if not every:
+        draw(path)
+    plt.close(fig)
+
+
+def show(heatmap, make_source):
+    """Live pygame view of the trace (``make_source()`` restarts it)."""
+    import pygame
+
+    pygame.init()
+    width, height = 1600, 1000
+    font = pygame.font.SysFont('Arial', 14)
+    bold = pygame.font.SysFont('Arial', 18, bold=True)
+    screen = pygame.display.set_mode((width, height))
+    pygame.display.set_caption("Cache Heatmap")
+    p = heatmap.params
+
+    def text(surface, s, x, y, f=font, align="left"):
+        obj = f.render(str(s), True, (0, 0, 0))
+        rect = obj.get_rect()
+        setattr(rect, {"left": "topleft", "center": "center", "right": "topright"}[align], (x, y))
+        surface.blit(obj, rect)
+
+    # Static part: axes, way and set labels, colour bar
+    array = pygame.Rect(100, 90, 1360, 760)
+    bar = pygame.Rect(1490, 90, 24, 760)
+    status = pygame.Rect(100, 40, 1400, 24)
+    labels = pygame.Rect(bar.right + 4, bar.y - 10, width - bar.right - 4, bar.h + 20)
+    background = pygame.Surface((width, height))
+    background.fill((255, 255, 255))
+    pygame.draw.rect(background, (0, 0, 0), array.inflate(2, 2), 1)
+    row = array.h / p.NWAYS
+    for w in range(p.NWAYS):
+        text(background, f"way {w}", array.x - 10, array.y + int((w + 0.5) * row), font, "right")
+    ticks = min(p.NSETS, 16)
+    for k in range(ticks + 1):
+        s = k * p.NSETS // ticks
+        x = array.x + array.w * s // p.NSETS
+        pygame.draw.line(background, (0, 0, 0), (x, array.bottom), (x, array.bottom + 5))
+        if s < p.NSETS:
+            text(background, s, x, array.bottom + 16, font, "center")
+    text(background, "set", array.centerx, array.bottom + 36, bold, "center")
+    gradient = pygame.Surface((1, 256))
+    pygame.surfarray.blit_array(gradient, LUT[::-1][None, :, :])
+    background.blit(pygame.transform.scale(gradient, bar.size), bar)
+    pygame.draw.rect(background, (0, 0, 0), bar, 1)
+    text(background, "space play/pause   right step   up/down speed   1-5 metric   "
+         "home restart   esc quit", width // 2, 960, font, "center")
+    background = background.convert()
+    screen.blit(background, (0, 0))
+    pygame.display.flip()
+
+    cells = pygame.Surface((p.NSETS, p.NWAYS)).convert()
+    source = make_source()
+    metric = METRICS[0]
+    playing, per_frame, done = True, 1, False
+    clock = pygame.time.Clock()
+    drawn = None
+    running = True
+    while running:
+        advance = 0
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_ESCAPE:
+                    running = False
+                elif event.key == pygame.K_SPACE:
+                    playing = not playing
+                elif event.key == pygame.K_RIGHT:
+                    playing, advance = False, 1
+                elif event.key == pygame.K_UP:
+                    per_frame = min(per_frame * 2, 1024)
+                elif event.key == pygame.K_DOWN:
+                    per_frame = max(per_frame // 2, 1)
+                elif event.key == pygame.K_HOME:
+                    heatmap = Heatmap(heatmap.params, heatmap.window)
+                    source, done, drawn = make_source(), False, None
+                elif pygame.K_1 <= event.key < pygame.K_1 + len(METRICS):
+                    metric = METRICS[event.key - pygame.K_1]
+        if playing:
+            advance = per_frame
+        # Leave half of the frame for drawing
+        t = time.perf_counter()
+        for _ in range(advance if not done else 0):
+            piece = next(source, None)
+            if piece is None:
+                done = True
+                break
+            heatmap.feed(*piece)
+            if time.perf_counter() - t > 0.5 / 60:
+                break
+
+        key = (metric, heatmap.requests)
+        rects = []
+        if key != drawn:
+            drawn = key
+            values = heatmap.metric(metric)
+            low, high = heatmap.limits(metric, values)
+            # surfarray is indexed [x, y]: sets across, ways down
+            pygame.surfarray.blit_array(cells, colors(values, low, high))
+            screen.blit(pygame.transform.scale(cells, array.size), array)
+            screen.blit(background, labels, labels)
+            for k in range(5):
+                text(screen, f"{low + (high - low) * k / 4:.3g}", labels.x,
+                     bar.bottom - bar.h * k // 4 - 8)
+            rects += [array, labels]
+        screen.blit(background, status, status)
+        state = "done" if done else "playing" if playing else "paused"
+        text(screen, f"{metric}   {state}   requests {heatmap.requests:,}   window "
+             f"{heatmap.in_window:,}   {per_frame} steps/frame   {clock.get_fps():.0f} FPS",
+             status.x, status.y, bold)
+        rects.append(status)
+        pygame.display.update(rects)
+        clock.tick(60)
+    pygame.quit()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("trace", nargs="?", help="binary trace")
+    ap.add_argument("--workload", default="random", help="bench_workloads.py workload instead")
+    ap.add_argument("--accesses", type=int, default=1_000_000, help="accesses of --workload")
+    ap.add_argument("--footprint", type=int, default=64 << 10, help="bytes --workload touches")
+    ap.add_argument("--window", type=int, default=1 << 16, help="requests per window")
+    ap.add_argument("--step", type=int, default=1 << 12, help="requests per update")
+    ap.add_argument("--tb", action="store_true", help="tb_cache_system.v parameters")
+    ap.add_argument("--ways", type=int, help="NWAYS (default: design.v's)")
+    ap.add_argument("--sets", type=int, help="NSETS (default: design.v's)")
+    ap.add_argument("--save", help="image to save with matplotlib instead of the live view")
+    ap.add_argument("--every", type=int, help="with --save: one numbered image every N steps")
+    args = ap.parse_args()
+
+    params = TB_PARAMS if args.tb else CacheParams()
+    if args.ways or args.sets:
+        from sweep import make_params
+        params = make_params(args.ways or params.NWAYS, args.sets or params.NSETS, params.MWIDTH)
+    if args.trace:
+        from trace_format import open_trace
+        trace = open_trace(args.trace)
+        trace = trace["address"], trace["op"]
+    else:
+        from bench_workloads import workload
+        trace = workload(args.workload, args.accesses, args.footprint)
+
+    heatmap = Heatmap(params, args.window)
+    if args.save:
+        save(heatmap, steps(trace, args.step), args.save, args.every)
+    else:
+        show(heatmap, lambda: steps(trace, args.step))
+
+
+if __name__ == "__main__":
+    main()
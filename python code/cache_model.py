@@ -0,0 +1,2079 @@
+"""
+Cycle-accurate Python model of the Cache and Ram modules in design.v.
+
+The model reproduces the Cache FSM (IDLE / MISS / WRITE_BACK / FETCH /
+FETCH_WAIT / REFILL), the per-way LRU counters (or the tree pseudo-LRU bits
+with PLRU=1), the valid/dirty/tag arrays of any power-of-two NWAYS, the
+word select over the OFFSET field and the BURST-beat line transfers one clock
+edge at a time, so its outputs can be compared signal for signal with the RTL.
+With NMSHR > 0 it models the non-blocking front end and the MSHR queue too,
+with WBUF > 0 the write buffer for dirty victims, with VICTIM > 0 the
+victim cache and with PREFETCH > 0 the next-line / stride prefetcher and its
+counters.  PIPE = 1 adds the stage 1 request register of the pipelined hit
+path, HANDSHAKE = 1 the ready/valid memory port; ``LatencyRamModel`` models
+the ``LatencyRam`` memory behind it.  ``BankedCacheSystem`` models
+``BankedCache``: NBANKS interleaved banks behind two CPU ports,
+``HierarchySystem`` the two-level ``CacheHierarchy`` and ``CoherentSystem``
+the MESI caches of ``CoherentCaches`` on their ``CoherentBus``.
+
+Way state lives in flat arrays indexed by ``set * NWAYS + way`` (the data
+array has one more level for the words of a block), never in per-line
+objects.
+
+Two ways of driving the model:
+
+* ``CacheModel.step()`` / ``CacheSystem.step()`` -- one rising clock edge with
+  arbitrary rden/wren/address/din stimulus, like the testbench.
+* ``CacheSystem.access()`` -- one complete CPU request using the "hold the
+  request until hit_miss goes high" protocol.  It updates exactly the same
+  state as stepping the FSM through the miss sequence, but without walking the
+  intermediate states, which makes it fast enough for long traces.
+"""
+
+from array import array
+from collections import deque
+from itertools import repeat
+from dataclasses import dataclass, replace
+
+# FSM encodings (match the localparams in design.v)
+IDLE = 0
+MISS = 1
+WRITE_BACK = 2
+FETCH = 3
+FETCH_WAIT = 4
+REFILL = 5
+DRAIN = 6
+INIT = 7
+
+STATE_NAMES = ("IDLE", "MISS", "WRITE_BACK", "FETCH", "FETCH_WAIT", "REFILL", "DRAIN", "INIT")
+
+# Performance counter map of the Cache CSR port (PERF = 1, csr_addr)
+PERF_READ_HITS = 0
+PERF_WRITE_HITS = 1
+PERF_READ_MISSES = 2
+PERF_WRITE_MISSES = 3
+PERF_WRITEBACKS = 4
+PERF_EVICTIONS = 5
+PERF_STATE = 8      # + state: cycles spent in it
+PERF_COUNTERS = 16
+PERF_CLEAR = 31     # write only: clears every counter
+
+
+def lru_reset(nways):
+    """LRU counter values of ways 0..NWAYS-1 after reset (``w ^ (w >> 1)``,
+    0, 1, 3, 2 for four ways)."""
+    return tuple(w ^ (w >> 1) for w in range(nways))
+
+
+def plru_touch(nways):
+    """Tree pseudo-LRU update per hit way: ``(bits kept, bits set)``.
+
+    The NWAYS-1 tree bits are in heap order with bit 0 as the root; a node
+    bit of 0 sends the victim to its left subtree (lower ways).  A hit points
+    every node on its path away from it.
+    """
+    table = []
+    for way in range(nways):
+        keep, set_ = (1 << max(nways - 1, 1)) - 1, 0
+        node = way + nways - 1
+        while node:
+            parent = (node - 1) >> 1
+            keep &= ~(1 << parent)
+            set_ |= (node & 1) << parent  # odd nodes are left children
+            node = parent
+        table.append((keep, set_))
+    return tuple(table)
+
+
+@dataclass(frozen=True)
+class CacheParams:
+    """Parameter set of the Verilog ``Cache`` module (defaults match design.v)."""
+
+    NWAYS: int = 4
+    NSETS: int = 1024
+    WIDTH: int = 32
+    MWIDTH: int = 64
+    INDEX_WIDTH: int = 10
+    TAG_WIDTH: int = 19
+    OFFSET_WIDTH: int = 3
+    WORD1: int = 3   # unused by the RTL, kept for old parameter sets
+    WORD2: int = 7
+    BURST: int = 1   # MWIDTH-bit memory beats per line
+    PLRU: int = 0
+    NMSHR: int = 0   # 0 = blocking, else MSHRs of the non-blocking mode
+    WBUF: int = 0    # write buffer entries for dirty victims
+    VICTIM: int = 0  # victim cache entries
+    PREFETCH: int = 0     # 0 = off, 1 = next line, 2 = stride
+    PF_DEGREE: int = 2    # lines prefetched per trigger
+    PF_DISTANCE: int = 1  # lines (strides) ahead of the miss
+    PIPE: int = 0    # 1 = two-stage hit path (one cycle more latency)
+    HANDSHAKE: int = 0  # 1 = ready/valid memory interface (mready / mvalid)
+    SNOOP: int = 0      # snoop port: 1 = write back and invalidate, 2 = invalidate only
+    EVICT_ALL: int = 0  # 1 = clean lines are written back too (exclusive L1)
+    LINE_WRITES: int = 0  # 1 = writes come in whole lines, a write miss is not fetched
+    MESI: int = 0       # 1 = coherent cache on a CoherentBus (MESI line states)
+    PERF: int = 0       # 1 = performance counters on the CSR port
+
+    # Address decoding localparams
+    @property
+    def OFFSET_LOW(self):
+        return 0
+
+    @property
+    def INDEX_LOW(self):
+        return self.OFFSET_WIDTH
+
+    @property
+    def TAG_LOW(self):
+        return self.INDEX_WIDTH + self.OFFSET_WIDTH
+
+    @property
+    def OFFSET_HIGH(self):
+        return self.OFFSET_WIDTH - 1
+
+    @property
+    def INDEX_HIGH(self):
+        return self.INDEX_WIDTH + self.OFFSET_WIDTH - 1
+
+    @property
+    def TAG_HIGH(self):
+        return self.WIDTH - 1
+
+    @property
+    def LRU_WIDTH(self):
+        return max(1, (self.NWAYS - 1).bit_length())
+
+    @property
+    def WSEL_WIDTH(self):
+        return (self.words_per_block - 1).bit_length()
+
+    @property
+    def LINE_WIDTH(self):
+        return self.MWIDTH * self.BURST
+
+    @property
+    def words_per_block(self):
+        return max(1, self.LINE_WIDTH // self.WIDTH)
+
+    def split(self, address):
+        """Return ``(tag, index, offset)`` exactly as the RTL slices ``address``."""
+        address &= (1 << self.WIDTH) - 1
+        return (address >> self.TAG_LOW,
+                (address >> self.INDEX_LOW) & ((1 << self.INDEX_WIDTH) - 1),
+                address & ((1 << self.OFFSET_WIDTH) - 1))
+
+
+# Parameter override block used by tb_cache_system.v
+TB_PARAMS = CacheParams(NSETS=64, MWIDTH=32, INDEX_WIDTH=6, TAG_WIDTH=8)
+TB_RAM_DEPTH = 16
+
+
+def _word_array(width, n):
+    return array("I" if width <= 32 else "Q", bytes((4 if width <= 32 else 8) * n))
+
+
+class CacheModel:
+    """Register-level model of ``Cache``.
+
+    Outputs are plain attributes named after the RTL ports (``hit_miss``,
+    ``q``, ``mdout``, ``mrdaddress``, ``mrden``, ``mwraddress``, ``mwren``,
+    ``miss_id``, ``resp_valid``, ``resp_id``, ``resp_q``; ``accept`` is a
+    property) and hold the values the registers have after the last
+    ``step()``.
+    """
+
+    def __init__(self, params=CacheParams()):
+        if params.NWAYS < 1 or params.NWAYS & (params.NWAYS - 1):
+            raise ValueError("NWAYS must be a power of two")
+        self.params = params
+        p = params
+        n = p.NSETS * p.NWAYS
+        # Set base in the flat arrays is index << _way_shift
+        self._way_shift = p.NWAYS.bit_length() - 1
+        self._lru_mask = (1 << max(self._way_shift, 1)) - 1
+        self._lru_reset = bytes(lru_reset(p.NWAYS))
+        # Word select = upper OFFSET bits, beat number sits at _beat_low
+        self._sel_shift = p.OFFSET_WIDTH - (p.words_per_block - 1).bit_length()
+        self._beat_low = p.OFFSET_WIDTH - (p.BURST - 1).bit_length()
+        self._beat_mask = (1 << p.MWIDTH) - 1
+        # Cycles of a clean miss (IDLE, MISS, BURST x FETCH, FETCH_WAIT,
+        # REFILL, IDLE); a dirty victim adds BURST WRITE_BACK cycles
+        self.miss_cycles = 5 + p.BURST
+        self._plru_touch = plru_touch(p.NWAYS)
+        # Address decoding, precomputed for the hot paths
+        self._addr_mask = (1 << p.WIDTH) - 1
+        self._tag_low = p.TAG_LOW
+        self._index_low = p.INDEX_LOW
+        self._index_mask = (1 << p.INDEX_WIDTH) - 1
+        self._offset_mask = (1 << p.OFFSET_WIDTH) - 1
+        self._word_mask = (1 << p.WIDTH) - 1
+        self._wpb = p.words_per_block
+        self.valid = bytearray(n)
+        self.dirty = bytearray(n)
+        self.excl = bytearray(n)   # MESI: Exclusive / Modified (valid and not Shared)
+        self.lru = bytearray(self._lru_reset * p.NSETS)
+        self.plru = array("Q", bytes(8 * p.NSETS))
+        self.tag = array("Q", bytes(8 * n))
+        self.data = _word_array(p.WIDTH, n * p.words_per_block)
+        self.pref = bytearray(n)
+
+        # Output registers (initial values from the reg declarations)
+        self.hit_miss = 0
+        self.q = 0
+        self.mdout = 0
+        self.mwraddress = 0
+        self.mrdaddress = 0
+        self.mwren = 0
+        self.mrden = 0
+        self.state = IDLE
+        self.victim_way = 0
+        # Burst counters and the refill shift register
+        self.beat = 0
+        self.mrden_d = 0
+        self.rbeat = 0   # read beats received (HANDSHAKE = 1)
+        self.line_buf = 0
+        # MSHR FIFO and the non-blocking outputs
+        slots = max(p.NMSHR, 1)
+        self.mshr_valid = bytearray(slots)
+        self.mshr_addr = [0] * slots
+        self.mshr_wren = bytearray(slots)
+        self.mshr_din = [0] * slots
+        self.mshr_head = 0
+        self.mshr_tail = 0
+        self._accept = 0
+        self.miss_id = 0
+        self.resp_valid = 0
+        self.resp_id = 0
+        self.resp_q = 0
+        # Write buffer (line address, line data per entry)
+        slots = max(p.WBUF, 1)
+        self.wb_valid = bytearray(slots)
+        self.wb_addr = [0] * slots
+        self.wb_data = [0] * slots
+        self.wb_fwd = 0
+        self.wb_slot = 0
+        # Victim cache (line address, line data, dirty bit per entry)
+        slots = max(p.VICTIM, 1)
+        self.vc_valid = bytearray(slots)
+        self.vc_dirty = bytearray(slots)
+        self.vc_addr = [0] * slots
+        self.vc_data = [0] * slots
+        self.vc_ptr = 0
+        self.vc_fwd = 0
+        self.vc_slot = 0
+        self.nf_fwd = 0  # LINE_WRITES: this refill is not fetched
+        # Dirty lines evicted to Ram so far (written back or parked),
+        # misses served by the victim cache and LINE_WRITES misses that
+        # were not fetched
+        self.dirty_evictions = 0
+        self.victim_hits = 0
+        self.write_allocs = 0
+        self.upgrades = 0  # MESI: writes to Shared lines fetched again for ownership
+        # Prefetch engine (line numbers) and its counters
+        self._line_mask = (1 << (p.WIDTH - p.OFFSET_WIDTH)) - 1
+        self.pf_active = 0
+        self.pf_addr = 0
+        self.pf_last = 0
+        self.pf_stride = 0
+        self.pf_next = 0
+        self.pf_step = 0
+        self.pf_left = 0
+        self.pf_issued = 0
+        self.pf_useful = 0
+        self.demand_misses = 0
+        # Performance counters (PERF_* map; the model always counts) and
+        # the flag that skips the hit ending a blocking miss
+        self.perf = [0] * PERF_COUNTERS
+        self.perf_retry = 0
+        self._pf_trigger = -1  # line of a prefetched-line hit in this step()
+        # Stage 1 of the pipelined hit path (PIPE = 1): the request waiting
+        # for the lookup stage.  The RTL also registers the addressed set
+        # there, with writes forwarded, so the model looks the set up live.
+        self.s1_valid = 0
+        self.s1_rden = 0
+        self.s1_wren = 0
+        self.s1_addr = 0
+        self.s1_din = 0
+        # Snoop port (SNOOP > 0 or MESI = 1) and the eviction outputs
+        self.sn_active = 0
+        self.sn_addr = 0
+        self.snoop_done = 0
+        self.snoop_hit = 0
+        self.snoop_dirty = 0
+        self.snoop_data = 0
+        self.evict = 0
+        self.evict_address = 0
+        # Set cleared by the INIT sequence after reset
+        self.init_index = 0
+        # A new model starts as after reset and a finished INIT sequence
+        self.reset()
+        self.finish_init()
+
+    @property
+    def ready(self):
+        """Low while INIT clears the sets after reset."""
+        return int(self.state != INIT)
+
+    def csr_read(self, addr):
+        """``csr_rdata`` after a CSR read of ``addr`` (0 with PERF = 0 and
+        for addresses without a counter)."""
+        if not self.params.PERF or addr >= PERF_COUNTERS:
+            return 0
+        return self.perf[addr] & 0xFFFFFFFF
+
+    def csr_write(self, addr, value=0):
+        """CSR write: load ``value`` into counter ``addr`` or, at
+        ``PERF_CLEAR``, clear them all (the edge's own counts are lost, as
+        in the RTL)."""
+        if not self.params.PERF:
+            return
+        if addr == PERF_CLEAR:
+            self.perf = [0] * PERF_COUNTERS
+        elif addr < PERF_COUNTERS:
+            self.perf[addr] = value & 0xFFFFFFFF
+
+    @property
+    def accept(self):
+        """Request taken on the last edge (``hit_miss`` when blocking and
+        not pipelined)."""
+        p = self.params
+        return self._accept if p.NMSHR or p.PIPE else self.hit_miss
+
+    # ------------------------------------------------------------------
+    # Reset
+    # ------------------------------------------------------------------
+    def reset(self):
+        """Apply ``reset_n = 0``: clears the FSM control regs and starts INIT,
+        which clears the valid bits and replacement state of one set per
+        cycle.  Tags, data, dirty and pref bits are not reset."""
+        self.state = INIT
+        self.init_index = 0
+        self.mwren = 0
+        self.mrden = 0
+        self.hit_miss = 0
+        self.beat = 0
+        self.mrden_d = 0
+        self.rbeat = 0
+        self.line_buf = 0
+        self._accept = 0
+        self.s1_valid = 0
+        self.resp_valid = 0
+        self.mshr_valid[:] = bytes(len(self.mshr_valid))
+        self.mshr_head = 0
+        self.mshr_tail = 0
+        self.wb_valid[:] = bytes(len(self.wb_valid))
+        self.wb_fwd = 0
+        self.vc_valid[:] = bytes(len(self.vc_valid))
+        self.vc_dirty[:] = bytes(len(self.vc_dirty))
+        self.vc_ptr = 0
+        self.vc_fwd = 0
+        self.nf_fwd = 0
+        self.sn_active = 0
+        self.snoop_done = 0
+        self.evict = 0
+        self.pf_active = 0
+        self.pf_last = 0
+        self.pf_stride = 0
+        self.pf_left = 0
+        self.pf_issued = 0
+        self.pf_useful = 0
+        self.demand_misses = 0
+        self.perf = [0] * PERF_COUNTERS
+        self.perf_retry = 0
+
+    def finish_init(self):
+        """Run the rest of the INIT sequence at once, as ``step()`` without
+        requests would.  Returns the number of cycles that takes."""
+        if self.state != INIT:
+            return 0
+        p = self.params
+        first = self.init_index
+        start = first << self._way_shift
+        n = p.NSETS - first
+        self.valid[start:] = bytes(n * p.NWAYS)
+        self.lru[start:] = self._lru_reset * n
+        self.plru[first:] = array("Q", bytes(8 * n))
+        self.perf[PERF_STATE + INIT] += n
+        self.state = IDLE
+        self.init_index = 0
+        return n
+
+    # ------------------------------------------------------------------
+    # Helpers shared by step() and CacheSystem.access()
+    # ------------------------------------------------------------------
+    def _word_sel(self, offset):
+        return offset >> self._sel_shift
+
+    def decode(self, address):
+        """Same as ``CacheParams.split`` using the precomputed masks."""
+        address &= self._addr_mask
+        return (address >> self._tag_low,
+                (address >> self._index_low) & self._index_mask,
+                address & self._offset_mask)
+
+    def find(self, base, tag):
+        """Return the way of the set starting at ``base`` holding ``tag`` or -1.
+
+        The lowest way has priority, like the hit priority encoder in the RTL.
+        """
+        valid = self.valid
+        tags = self.tag
+        for w in range(self.params.NWAYS):
+            if valid[base + w] and tags[base + w] == tag:
+                return w
+        return -1
+
+    def lookup(self, address):
+        """Return the hitting way for ``address`` or -1."""
+        tag, index, _ = self.decode(address)
+        return self.find(index << self._way_shift, tag)
+
+    def victim(self, index):
+        """Victim way chosen by the MISS state for set ``index``."""
+        nways = self.params.NWAYS
+        base = index << self._way_shift
+        valid = self.valid
+        for w in range(nways):
+            if not valid[base + w]:
+                return w
+        if self.params.PLRU:
+            bits = self.plru[index]
+            node = 0
+            for _ in range(self._way_shift):
+                node = 2 * node + 1 + ((bits >> node) & 1)
+            return node - (nways - 1)
+        lru = self.lru
+        for w in range(nways - 1):
+            if lru[base + w] == nways - 1:
+                return w
+        return nways - 1
+
+    def _touch(self, base, way):
+        """LRU update of a hit: ages every way not older than ``way``."""
+        if self.params.PLRU:
+            keep, set_ = self._plru_touch[way]
+            index = base >> self._way_shift
+            self.plru[index] = (self.plru[index] & keep) | set_
+            return
+        lru = self.lru
+        mask = self._lru_mask
+        mine = lru[base + way]
+        for i in range(base, base + self.params.NWAYS):
+            if lru[i] <= mine:
+                lru[i] = (lru[i] + 1) & mask
+        lru[base + way] = 0
+
+    def read_block(self, line):
+        """Return the block stored in flat line slot ``line`` as an integer."""
+        p = self.params
+        wpb = p.words_per_block
+        block = 0
+        for i in range(wpb - 1, -1, -1):
+            block = (block << p.WIDTH) | self.data[line * wpb + i]
+        return block
+
+    def write_block(self, line, block):
+        p = self.params
+        wpb = p.words_per_block
+        mask = (1 << p.WIDTH) - 1
+        for i in range(wpb):
+            self.data[line * wpb + i] = (block >> (i * p.WIDTH)) & mask
+
+    def _hit(self, base, way, rden, wren, offset, din):
+        wpb = self._wpb
+        sel = offset >> self._sel_shift
+        line = base + way
+        self.hit_miss = 1
+        if self.perf_retry:
+            self.perf_retry = 0
+        else:
+            self.perf[PERF_READ_HITS if rden else PERF_WRITE_HITS] += 1
+        if self.pref[line]:
+            # First demand use of a prefetched line
+            self.pref[line] = 0
+            self.pf_useful += 1
+            self._pf_trigger = (self.tag[line] << self.params.INDEX_WIDTH) | (base >> self._way_shift)
+        if rden:
+            self.q = self.data[line * wpb + sel]
+        elif wren:
+            self.dirty[line] = 1
+            self.data[line * wpb + sel] = din & self._word_mask
+        self._touch(base, way)
+
+    def _refill(self, base, way, tag, wren, offset, din, block):
+        """Write the fetched line ``block`` (merged with a held store)."""
+        p = self.params
+        if wren:
+            shift = self._word_sel(offset) * p.WIDTH
+            wmask = ((1 << p.WIDTH) - 1) << shift
+            block = (block & ~wmask) | ((din << shift) & wmask)
+        line = base + way
+        self.write_block(line, block)
+        self.tag[line] = tag & ((1 << p.TAG_WIDTH) - 1)
+        self.valid[line] = 1
+        self.dirty[line] = 1 if wren or p.EVICT_ALL else 0
+        return block
+
+    def _line_address(self, tag, index):
+        p = self.params
+        return ((tag << p.TAG_LOW) | (index << p.INDEX_LOW)) & ((1 << p.WIDTH) - 1)
+
+    # ------------------------------------------------------------------
+    # One rising clock edge
+    # ------------------------------------------------------------------
+    def mreq(self, rden, wren, address):
+        """``mreq`` output (MESI = 1) for the request on the inputs: the bus
+        is wanted from a miss in IDLE until its refill."""
+        if not self.params.MESI or self.state == INIT:
+            return 0
+        if self.state != IDLE:
+            return 1
+        return int(bool(rden or wren) and self._mesi_hit(wren, address) < 0)
+
+    def _mesi_hit(self, wren, address):
+        """Hitting way for ``address`` or -1; with MESI = 1 a write to a
+        Shared line is a miss."""
+        tag, index, _ = self.decode(address)
+        base = index << self._way_shift
+        way = self.find(base, tag)
+        if way >= 0 and self.params.MESI and wren and not self.excl[base + way]:
+            return -1
+        return way
+
+    def step(self, rden, wren, address, din, mq, mready=1, mvalid=0, snoop=0, snoop_address=0,
+             snoop_share=0, mgnt=0, mshared=0):
+        """Advance the FSM by one ``posedge clk`` with the given input values
+        (``mready`` / ``mvalid`` only matter with HANDSHAKE = 1, ``snoop`` /
+        ``snoop_address`` with SNOOP > 0 or MESI = 1, ``snoop_share``,
+        ``mgnt`` and ``mshared`` with MESI = 1)."""
+        p = self.params
+        nmshr = p.NMSHR
+        state = self.state
+        # A held snoop is taken again only after the cycle its snoop_done
+        # was high in
+        sn_req = (p.SNOOP or p.MESI) and snoop
+        sn_take = sn_req and not self.snoop_done and state == IDLE
+        self.snoop_done = 0
+        perf = self.perf
+        perf[PERF_STATE + state] += 1
+        if self.evict:
+            perf[PERF_EVICTIONS] += 1
+        self.evict = 0
+        if p.PIPE:
+            # The lookup stage serves the request stage 1 took on an earlier
+            # edge; the CPU inputs only go to stage 1
+            in_rden, in_wren, in_address, in_din = rden, wren, address, din
+            rden = self.s1_valid and self.s1_rden
+            wren = self.s1_valid and self.s1_wren
+            address, din = self.s1_addr, self.s1_din
+        # Refill shift register: the beat on mq enters from the top
+        fill = (self.line_buf >> p.MWIDTH) | ((mq & self._beat_mask) << (p.LINE_WIDTH - p.MWIDTH))
+        hs = p.HANDSHAKE
+        if mvalid if hs else self.mrden_d:
+            self.line_buf = fill
+        self.mrden_d = self.mrden
+        # HANDSHAKE = 1: the FSM waits while memory has not taken the beat
+        # on mrden / mwren, and REFILL waits for the last read beat
+        stall = hs and (self.mwren or self.mrden) and not mready
+        fill_ready = (not hs or self.wb_fwd or self.vc_fwd or self.nf_fwd
+                      or mvalid and self.rbeat == p.BURST - 1)
+        if hs:
+            if state == REFILL and fill_ready:
+                self.rbeat = 0
+            elif mvalid:
+                self.rbeat += 1
+
+        # Request served by the miss FSM: a prefetch, else the held CPU
+        # request when blocking and the oldest MSHR otherwise (sampled
+        # before the edge)
+        pf = self.pf_active
+        self._pf_trigger = -1
+        if nmshr:
+            head = self.mshr_head
+            head_valid = self.mshr_valid[head]
+            fill_address = self.pf_addr if pf else self.mshr_addr[head]
+            wren_f, din_f = (0 if pf else self.mshr_wren[head]), self.mshr_din[head]
+        else:
+            fill_address = self.pf_addr if pf else address
+            wren_f, din_f = (0 if pf else wren), din
+        if self.sn_active:
+            fill_address = self.sn_addr
+        elif sn_req and state == IDLE:
+            fill_address = snoop_address
+        tag, index, offset = self.decode(fill_address)
+        base = index << self._way_shift
+
+        demand = 0
+        if nmshr:
+            self._front(rden, wren, address, din, index)
+        elif sn_req:
+            # A snoop holds the CPU requests back (IDLE still sees a miss)
+            self.hit_miss = 0
+            demand = (rden or wren) and self._mesi_hit(wren, address) < 0
+        elif state == IDLE or state == DRAIN or pf and self.decode(address)[1] != index:
+            # Blocking front end: serves requests in IDLE, DRAIN and next to
+            # a prefetch (not to its set)
+            if not rden and not wren:
+                self.hit_miss = 0
+            else:
+                r_tag, r_index, r_offset = self.decode(address)
+                r_base = r_index << self._way_shift
+                way = self._mesi_hit(wren, address) if p.MESI else self.find(r_base, r_tag)
+                if way >= 0:
+                    self._hit(r_base, way, rden, wren, r_offset, din)
+                else:
+                    self.hit_miss = 0
+                    demand = 1
+        else:
+            self.hit_miss = 0
+
+        if p.PIPE:
+            # Stage 1 takes the next request when the lookup stage is empty
+            # or its request left it (a hit, or a miss queued in an MSHR)
+            done = self._accept if nmshr else self.hit_miss
+            take = (in_rden or in_wren) and (not self.s1_valid or done)
+            self._accept = 1 if take else 0
+            if take:
+                self.s1_valid = 1
+                self.s1_rden, self.s1_wren = in_rden, in_wren
+                self.s1_addr, self.s1_din = in_address, in_din
+            elif done:
+                self.s1_valid = 0
+
+        if stall:
+            pass
+
+        elif state == IDLE:
+            self.mwren = 0
+            self.mrden = 0
+            if sn_take:
+                # Snoop: a dirty line is written back first, a clean one
+                # (or any with SNOOP = 2) is invalidated now
+                way = self.find(base, tag)
+                self.snoop_hit = 1 if way >= 0 else 0
+                if p.MESI:
+                    # Modified data goes out on snoop_data
+                    self.snoop_dirty = int(way >= 0 and self.dirty[base + way])
+                    self.snoop_data = self.read_block(base + max(way, 0))
+                if way >= 0 and p.SNOOP == 1 and self.dirty[base + way]:
+                    self.sn_active = 1
+                    self.sn_addr = snoop_address
+                    self.victim_way = way
+                    self.dirty_evictions += 1
+                    self.state = WRITE_BACK
+                else:
+                    if way >= 0 and p.MESI and snoop_share:
+                        # A read snoop leaves the line Shared (and clean)
+                        self.dirty[base + way] = 0
+                        self.excl[base + way] = 0
+                    elif way >= 0:
+                        self.valid[base + way] = 0
+                    self.snoop_done = 1
+            elif (head_valid if nmshr else demand and (not p.MESI or mgnt)):
+                self.perf_retry = int(not nmshr)
+                self.state = MISS
+            elif any(self.wb_valid):
+                # Memory port idle: drain the write buffer, then prefetch
+                self.state = DRAIN
+            elif self.pf_left:
+                self.pf_active = 1
+                self.pf_addr = self.pf_next << p.OFFSET_WIDTH
+                self.pf_next = (self.pf_next + self.pf_step) & self._line_mask
+                self.pf_left -= 1
+                self.state = MISS
+
+        elif state == MISS and pf and self._pf_drop(base, tag, index):
+            # Nothing to prefetch
+            self.pf_active = 0
+            self.state = IDLE
+
+        elif state == MISS and p.MESI and self.find(base, tag) >= 0:
+            # MESI: a write to a Shared line refetches it into its own way
+            self.victim_way = self.find(base, tag)
+            self.upgrades += 1
+            self.state = FETCH
+
+        elif state == MISS:
+            if p.PREFETCH and not pf:
+                self._train(fill_address >> p.OFFSET_WIDTH & self._line_mask)
+            way = self.victim(index)
+            self.victim_way = way
+            vslot = self._find_line(self.vc_valid, self.vc_addr, self._line_address(tag, index))
+            dirty = vslot < 0 and self._evict_dirty(base + way)
+            self.state = WRITE_BACK if dirty else FETCH
+            if dirty:
+                self.dirty_evictions += 1
+            if p.WBUF:
+                # A buffered line is refilled from the buffer, a dirty victim
+                # is parked instead of written back (unless the buffer is full)
+                slot = self._wb_find(self._line_address(tag, index))
+                self.wb_fwd = 1 if slot >= 0 else 0
+                self.wb_slot = max(slot, 0)
+                if slot >= 0:
+                    self.state = REFILL
+                elif dirty and 0 in self.wb_valid:
+                    free = self.wb_valid.index(0)
+                    self.wb_valid[free] = 1
+                    self.wb_addr[free], self.wb_data[free] = self._evicted(base + way, index)
+                    self.state = FETCH
+            if p.VICTIM:
+                # Victim cache hit: swap the line back in, no Ram access
+                self.vc_fwd = 1 if vslot >= 0 else 0
+                self.vc_slot = max(vslot, 0)
+                if vslot >= 0:
+                    self.victim_hits += 1
+                    self.state = REFILL
+            if p.LINE_WRITES and wren_f and not (self.wb_fwd or self.vc_fwd):
+                # Whole-line writes: the rest of the line is written next,
+                # so a write miss skips the fetch (after the write-back)
+                self.nf_fwd = 1
+                self.write_allocs += 1
+                if self.state == FETCH:
+                    self.state = REFILL
+
+        elif state == WRITE_BACK:
+            address, block = self._evicted(base + self.victim_way, index)
+            beat = self.beat
+            self.mwren = 1
+            self.mdout = (block >> (beat * p.MWIDTH)) & self._beat_mask
+            self.mwraddress = address | (beat << self._beat_low)
+            if beat == p.BURST - 1:
+                perf[PERF_WRITEBACKS] += 1
+            if self.sn_active and beat == p.BURST - 1:
+                self.valid[base + self.victim_way] = 0
+                self.sn_active = 0
+                self.snoop_done = 1
+                self._next_beat(IDLE)
+            else:
+                self._next_beat(REFILL if self.nf_fwd else FETCH)
+
+        elif state == FETCH:
+            self.mwren = 0
+            self.mrden = 1
+            self.mrdaddress = self._line_address(tag, index) | (self.beat << self._beat_low)
+            self._next_beat(FETCH_WAIT)
+
+        elif state == FETCH_WAIT:
+            self.mrden = 0
+            self.state = REFILL
+
+        elif state == REFILL and not fill_ready:
+            pass
+
+        elif state == REFILL:
+            self.mrden = 0
+            way = self.victim_way
+            line = base + way
+            fwd = self.wb_fwd
+            vfwd = self.vc_fwd
+            fill_dirty = fwd
+            # The line that leaves the cache: the victim way's, or with a
+            # victim cache the entry the victim way's line replaces
+            if p.VICTIM:
+                ptr = self.vc_ptr
+                self.evict = int(not vfwd and self.valid[line] and self.vc_valid[ptr])
+                self.evict_address = self.vc_addr[ptr]
+            else:
+                # (nothing for a MESI upgrade: the way keeps its line)
+                self.evict = int(self.valid[line] and not (p.MESI and self.tag[line] == tag))
+                self.evict_address = self._line_address(self.tag[line], index)
+            if fwd:
+                # Refill from the write buffer, swapping a dirty victim in
+                slot = self.wb_slot
+                fill = self.wb_data[slot]
+                self.wb_fwd = 0
+                if self._evict_dirty(line):
+                    self.wb_addr[slot], self.wb_data[slot] = self._evicted(line, index)
+                else:
+                    self.wb_valid[slot] = 0
+            elif vfwd:
+                fill = self.vc_data[self.vc_slot]
+                fill_dirty = self.vc_dirty[self.vc_slot]
+            elif self.nf_fwd:
+                fill = 0
+            self.nf_fwd = 0
+            if p.VICTIM:
+                # The victim way's line moves to the victim cache: into the
+                # entry it was swapped with, else over the FIFO entry
+                self.vc_fwd = 0
+                old = self.valid[line]
+                if vfwd or old:
+                    slot = self.vc_slot if vfwd else self.vc_ptr
+                    self.vc_valid[slot] = old
+                    self.vc_dirty[slot] = old and self.dirty[line]
+                    self.vc_addr[slot] = self._line_address(self.tag[line], index)
+                    self.vc_data[slot] = self.read_block(line)
+                if old and not vfwd:
+                    self.vc_ptr = 0 if self.vc_ptr == p.VICTIM - 1 else self.vc_ptr + 1
+            block = self._refill(base, way, tag, wren_f, offset, din_f, fill)
+            if fill_dirty:
+                self.dirty[line] = 1
+            self.excl[line] = int(not p.MESI or wren_f or not mshared)
+            self.pref[line] = pf
+            if pf:
+                # A prefetched line enters as most recently used
+                self.pf_active = 0
+                self.pf_issued += 1
+                self._touch(base, way)
+            elif nmshr:
+                # Hand the word back and retire the MSHR; the fill is a use
+                self.resp_valid = 1
+                self.resp_id = head
+                self.resp_q = (block >> (self._word_sel(offset) * p.WIDTH)) & self._word_mask
+                self._touch(base, way)
+                self.mshr_valid[head] = 0
+                self.mshr_head = 0 if head == nmshr - 1 else head + 1
+            else:
+                self.q = block & self._word_mask
+            if not pf:
+                self.demand_misses += 1
+                perf[PERF_WRITE_MISSES if wren_f else PERF_READ_MISSES] += 1
+            self.state = IDLE
+
+        elif state == INIT:
+            # Clear one set; requests wait for ready
+            i = self.init_index
+            base = i << self._way_shift
+            self.valid[base:base + p.NWAYS] = bytes(p.NWAYS)
+            self.lru[base:base + p.NWAYS] = self._lru_reset
+            self.plru[i] = 0
+            if i == p.NSETS - 1:
+                self.state = IDLE
+                self.init_index = 0
+            else:
+                self.init_index = i + 1
+
+        elif state == DRAIN:
+            slot = self.wb_valid.index(1)
+            beat = self.beat
+            self.mwren = 1
+            self.mdout = (self.wb_data[slot] >> (beat * p.MWIDTH)) & self._beat_mask
+            self.mwraddress = self.wb_addr[slot] | (beat << self._beat_low)
+            if beat == p.BURST - 1:
+                self.wb_valid[slot] = 0
+                perf[PERF_WRITEBACKS] += 1
+            self._next_beat(IDLE)
+
+        if self._pf_trigger >= 0:
+            # The hit's stream update wins over the FSM's
+            self._pf_hit(self._pf_trigger)
+
+    def _train(self, line):
+        """Prefetcher update on the demand miss of ``line``: next-line
+        prefetches on every miss, stride prefetches once the same stride was
+        seen twice in a row."""
+        p = self.params
+        stride = (line - self.pf_last) & self._line_mask
+        if p.PREFETCH == 1 or stride and stride == self.pf_stride:
+            step = 1 if p.PREFETCH == 1 else stride
+            self.pf_step = step
+            self.pf_next = (line + step * p.PF_DISTANCE) & self._line_mask
+            self.pf_left = p.PF_DEGREE
+        self.pf_last = line
+        self.pf_stride = stride
+
+    def _pf_hit(self, line):
+        """Tagged prefetching: a demand hit on a prefetched ``line`` asks for
+        one more line, PF_DISTANCE + PF_DEGREE - 1 steps ahead of it."""
+        p = self.params
+        self.pf_next = (line + self.pf_step * (p.PF_DISTANCE + p.PF_DEGREE - 1)) & self._line_mask
+        self.pf_left = 1
+
+    def _pf_drop(self, base, tag, index):
+        """True if the prefetch of the line in the MISS state is dropped: the
+        line is cached, buffered or has an MSHR, or its tag does not fit."""
+        address = self._line_address(tag, index)
+        return (tag >> self.params.TAG_WIDTH or self.find(base, tag) >= 0
+                or self._find_line(self.vc_valid, self.vc_addr, address) >= 0
+                or self._wb_find(address) >= 0
+                or any(v and a & self._addr_mask & ~self._offset_mask == address
+                       for v, a in zip(self.mshr_valid, self.mshr_addr)))
+
+    def busy(self):
+        """True while the FSM has work of its own left (a state other than
+        IDLE, a last Ram write, buffered lines or prefetches) that later
+        requests must be stepped through."""
+        return bool(self.state != IDLE or self.mwren or self.pf_left or 1 in self.wb_valid)
+
+    def _wb_find(self, address):
+        """Write buffer entry holding the line at ``address`` or -1."""
+        return self._find_line(self.wb_valid, self.wb_addr, address)
+
+    @staticmethod
+    def _find_line(valid, addresses, address):
+        for slot, (v, a) in enumerate(zip(valid, addresses)):
+            if v and a == address:
+                return slot
+        return -1
+
+    def _evict_dirty(self, line):
+        """True if evicting way slot ``line`` pushes a dirty line out to Ram:
+        the line itself, or with a victim cache the entry at ``vc_ptr``."""
+        if not self.valid[line]:
+            return False
+        if self.params.VICTIM:
+            return bool(self.vc_valid[self.vc_ptr] and self.vc_dirty[self.vc_ptr])
+        return bool(self.dirty[line])
+
+    def _evicted(self, line, index):
+        """``(line address, block)`` of the line ``_evict_dirty`` is about."""
+        if self.params.VICTIM:
+            return self.vc_addr[self.vc_ptr], self.vc_data[self.vc_ptr]
+        return self._line_address(self.tag[line], index), self.read_block(line)
+
+    def _front(self, rden, wren, address, din, fill_index):
+        """Non-blocking front end: hit-under-miss and MSHR allocation.
+
+        Requests to the set the miss FSM is working on, and to lines that
+        already have an MSHR, are not accepted and must be held.
+        """
+        p = self.params
+        self.resp_valid = 0
+        tag, index, offset = self.decode(address)
+        line = address & self._addr_mask & ~self._offset_mask
+        pending = any(v and (a & self._addr_mask & ~self._offset_mask) == line
+                      for v, a in zip(self.mshr_valid, self.mshr_addr))
+        busy = self.state == INIT or self.state not in (IDLE, DRAIN) and index == fill_index
+        if (not rden and not wren) or busy or pending:
+            self.hit_miss = 0
+            self._accept = 0
+            return
+        base = index << self._way_shift
+        way = self.find(base, tag)
+        if way >= 0:
+            self._hit(base, way, rden, wren, offset, din)
+            self._accept = 1
+            return
+        self.hit_miss = 0
+        tail = self.mshr_tail
+        if self.mshr_valid[tail]:
+            self._accept = 0
+            return
+        self._accept = 1
+        self.mshr_valid[tail] = 1
+        self.mshr_addr[tail] = address & self._addr_mask
+        self.mshr_wren[tail] = 0 if rden else 1
+        self.mshr_din[tail] = din
+        self.miss_id = tail
+        self.mshr_tail = 0 if tail == p.NMSHR - 1 else tail + 1
+
+    def _next_beat(self, next_state):
+        if self.beat == self.params.BURST - 1:
+            self.beat = 0
+            self.state = next_state
+        else:
+            self.beat += 1
+
+
+class RamModel:
+    """Model of ``Ram``: one registered read port, one write port."""
+
+    ready = 1  # takes a request every cycle
+
+    def __init__(self, WIDTH=32, DEPTH=4):
+        self.WIDTH = WIDTH
+        self.DEPTH = DEPTH
+        size = 1 << DEPTH
+        self.mem = array("Q", bytes(8 * size)) if WIDTH <= 64 else [0] * size
+        self.data_out = 0
+        self.valid_out = 0
+
+    def reset(self):
+        """``reset_n = 0`` clears the output registers, not the contents."""
+        self.data_out = 0
+        self.valid_out = 0
+
+    def step(self, data_in, adress, write_enable, read_enable):
+        addr = adress & ((1 << self.DEPTH) - 1)
+        self.valid_out = 0
+        if read_enable:
+            self.data_out = self.mem[addr]
+            self.valid_out = 1
+        if write_enable:
+            self.mem[addr] = data_in & ((1 << self.WIDTH) - 1)
+
+    def load_memh(self, path, start=0):
+        """Equivalent of ``$readmemh(path, mem)``."""
+        addr = start
+        mask = (1 << self.WIDTH) - 1
+        with open(path) as f:
+            for line in f:
+                line = line.split("//", 1)[0]
+                for token in line.split():
+                    if token.startswith("@"):
+                        addr = int(token[1:], 16)
+                        continue
+                    self.mem[addr] = int(token.replace("_", ""), 16) & mask
+                    addr += 1
+
+
+class LatencyRamModel(RamModel):
+    """Model of ``LatencyRam``: ``Ram`` behind a ready/valid handshake with
+    fixed or random read latency, an optional DRAM row buffer and up to
+    ``OUTSTANDING`` reads in flight (see design.v for the parameters)."""
+
+    def __init__(self, WIDTH=32, DEPTH=4, LATENCY=1, JITTER=0, SEED=0xACE1,
+                 COL_BITS=0, T_RCD=3, T_RP=3, OUTSTANDING=4):
+        if LATENCY < 1 or OUTSTANDING < 1:
+            raise ValueError("LATENCY and OUTSTANDING must be at least 1")
+        super().__init__(WIDTH, DEPTH)
+        self.LATENCY = LATENCY
+        self.JITTER = JITTER
+        self.SEED = SEED
+        self.COL_BITS = COL_BITS
+        self.T_RCD = T_RCD
+        self.T_RP = T_RP
+        self.OUTSTANDING = OUTSTANDING
+        self.reset()
+
+    def reset(self):
+        super().reset()
+        self.reads = deque()     # (due edge, data) of the reads in flight
+        self.now = 0
+        self.next_free = 0
+        self.busy_until = 0
+        self.lfsr = self.SEED
+        self.open_row = 0
+        self.row_open = 0
+
+    @property
+    def ready(self):
+        return int(len(self.reads) < self.OUTSTANDING and self.now >= self.busy_until)
+
+    def step(self, data_in, adress, write_enable, read_enable):
+        addr = adress & ((1 << self.DEPTH) - 1)
+        now = self.now
+        take = self.ready and (read_enable or write_enable)
+        self.valid_out = 0
+        if self.reads and self.reads[0][0] == now:
+            self.data_out = self.reads.popleft()[1]
+            self.valid_out = 1
+        if take:
+            row = addr >> self.COL_BITS
+            if not self.COL_BITS or self.row_open and self.open_row == row:
+                row_wait = 0
+            else:
+                row_wait = self.T_RP + self.T_RCD if self.row_open else self.T_RCD
+            if self.COL_BITS:
+                self.open_row = row
+                self.row_open = 1
+                self.busy_until = now + 1 + row_wait
+            if read_enable:
+                jitter = self.lfsr % (self.JITTER + 1) if self.JITTER else 0
+                self.lfsr = (self.lfsr >> 1) ^ (0xB400 if self.lfsr & 1 else 0)
+                due = max(now + self.LATENCY - 1 + row_wait + jitter, self.next_free)
+                self.next_free = due + 1
+                if due == now:
+                    self.data_out = self.mem[addr]
+                    self.valid_out = 1
+                else:
+                    self.reads.append((due, self.mem[addr]))
+            if write_enable:
+                self.mem[addr] = data_in & ((1 << self.WIDTH) - 1)
+        self.now = now + 1
+
+
+class CacheSystem:
+    """``Cache`` + ``Ram`` wired like tb_cache_system.v.
+
+    The Ram shares one address bus between the two Cache memory ports:
+    ``mwren ? mwraddress : mrdaddress``.
+    """
+
+    def __init__(self, params=TB_PARAMS, ram_depth=TB_RAM_DEPTH, ram=None):
+        """``ram`` replaces the default ``RamModel``, e.g. with a
+        ``LatencyRamModel`` for a cache with HANDSHAKE = 1."""
+        self.params = params
+        self.cache = CacheModel(params)
+        self.ram = RamModel(WIDTH=params.MWIDTH, DEPTH=ram_depth) if ram is None else ram
+        self.cycle = 0
+
+    def reset(self):
+        """Reset both modules and wait (without requests) until the cache
+        is ready again."""
+        self.cache.reset()
+        self.ram.reset()
+        self.cycle += self.cache.finish_init()
+
+    def step(self, rden=0, wren=0, address=0, din=0):
+        """One rising clock edge of the whole system."""
+        c = self.cache
+        ram = self.ram
+        # Both modules sample the other's outputs from before the edge
+        mq, mvalid, mready = ram.data_out, ram.valid_out, ram.ready
+        ram_addr = c.mwraddress if c.mwren else c.mrdaddress
+        ram.step(c.mdout, ram_addr, c.mwren, c.mrden)
+        c.step(rden, wren, address, din, mq, mready, mvalid)
+        self.cycle += 1
+
+    def access(self, address, wren=0, din=0):
+        """Issue one request and hold it until ``hit_miss`` goes high.
+
+        Must be called with the FSM in IDLE.  Returns ``(hit, q, cycles)``
+        where ``hit`` says whether the first lookup hit and ``cycles`` is the
+        number of clock edges until ``hit_miss`` was seen high.
+        """
+        c = self.cache
+        if self.params.NMSHR or self.params.PIPE:
+            raise ValueError("access() models the blocking, unpipelined cache; use stream()")
+        tag, index, offset = c.decode(address)
+        base = index << c._way_shift
+        rden = 0 if wren else 1
+        p = self.params
+        if tag >> p.TAG_WIDTH:
+            # The truncated tag never matches again: the RTL would spin forever
+            raise ValueError("address tag does not fit in TAG_WIDTH bits")
+        way = c.find(base, tag)
+        if ((p.WBUF or p.PREFETCH) and (way < 0 or c.busy())
+                or p.VICTIM and way < 0 or p.HANDSHAKE):
+            # The write buffer drains and prefetches run under later
+            # requests (and a last beat may still be on its way to the
+            # Ram), misses go through the victim cache, and with the
+            # handshake the memory timing is the Ram model's: step
+            return self._access_stepped(address, rden, wren, din)
+        c.mwren = 0
+        c.mrden = 0
+
+        perf = c.perf
+        if way >= 0:
+            c._pf_trigger = -1
+            c._hit(base, way, rden, wren, offset, din)
+            if c._pf_trigger >= 0:
+                c._pf_hit(c._pf_trigger)
+            perf[PERF_STATE + IDLE] += 1
+            self.cycle += 1
+            return True, c.q, 1
+
+        ram = self.ram
+
+        # MISS
+        way = c.victim(index)
+        c.victim_way = way
+        line = base + way
+        cycles = c.miss_cycles
+        burst = p.BURST
+        # IDLE twice (the miss, then the request's hit), one cycle each in
+        # MISS, FETCH_WAIT and REFILL, BURST beats of FETCH
+        perf[PERF_STATE + IDLE] += 2
+        perf[PERF_STATE + MISS] += 1
+        perf[PERF_STATE + FETCH] += burst
+        perf[PERF_STATE + FETCH_WAIT] += 1
+        perf[PERF_STATE + REFILL] += 1
+        perf[PERF_EVICTIONS] += c.valid[line]
+        mwidth = p.MWIDTH
+        beat_mask = c._beat_mask
+        beat_low = c._beat_low
+        ram_mask = (1 << ram.DEPTH) - 1
+        if c.valid[line] and c.dirty[line]:
+            # WRITE_BACK: one beat per edge, each lands in Ram an edge later
+            c.dirty_evictions += 1
+            perf[PERF_WRITEBACKS] += 1
+            perf[PERF_STATE + WRITE_BACK] += burst
+            block = c.read_block(line)
+            address = c._line_address(c.tag[line], index)
+            for beat in range(burst):
+                c.mdout = (block >> (beat * mwidth)) & beat_mask
+                c.mwraddress = address | (beat << beat_low)
+                ram.mem[c.mwraddress & ram_mask] = c.mdout & ((1 << ram.WIDTH) - 1)
+            cycles += burst
+        # FETCH / FETCH_WAIT: Ram answers every beat one edge after mrden
+        address = c._line_address(tag, index)
+        block = 0
+        for beat in range(burst):
+            c.mrdaddress = address | (beat << beat_low)
+            ram.data_out = ram.mem[c.mrdaddress & ram_mask]
+            block |= (ram.data_out & beat_mask) << (beat * mwidth)
+        ram.valid_out = 0
+        c.line_buf = block
+        c.mrden_d = 0
+        # REFILL, then the held request hits in IDLE
+        c.q = c._refill(base, way, tag, wren, offset, din, block) & c._word_mask
+        c.pref[line] = 0
+        c.demand_misses += 1
+        perf[PERF_WRITE_MISSES if wren else PERF_READ_MISSES] += 1
+        c.perf_retry = 1
+        c._hit(base, way, rden, wren, offset, din)
+        c.state = IDLE
+        self.cycle += cycles
+        return False, c.q, cycles
+
+    def _access_stepped(self, address, rden, wren, din):
+        c = self.cache
+        n = 0
+        while True:
+            self.step(rden, wren, address, din)
+            n += 1
+            if c.hit_miss:
+                return n == 1, c.q, n
+
+    def run(self, addresses, wrens=None, dins=None, hits_out=None):
+        """Replay a whole trace through ``access()`` semantics.
+
+        ``wrens``/``dins`` are optional per-access sequences (all reads when
+        omitted).  The hit path is inlined here because the per-call overhead
+        of ``access()`` dominates on hit-heavy traces.  When ``hits_out`` is a
+        list, one bool per access is appended to it.
+
+        Returns ``(hits, misses, writebacks, cycles)``.
+        """
+        c = self.cache
+        if self.params.NMSHR or self.params.PIPE:
+            raise ValueError("run() models the blocking, unpipelined cache; use stream()")
+        valid = c.valid
+        tags = c.tag
+        lru = c.lru
+        plru = c.plru if self.params.PLRU else None
+        touch = c._plru_touch
+        lru_mask = c._lru_mask
+        way_shift = c._way_shift
+        ways = range(self.params.NWAYS)
+        data = c.data
+        dirty = c.dirty
+        amask = c._addr_mask
+        tag_low = c._tag_low
+        index_low = c._index_low
+        index_mask = c._index_mask
+        offset_mask = c._offset_mask
+        word_mask = c._word_mask
+        wpb = c._wpb
+        sel_shift = c._sel_shift
+        busy = c.busy if self.params.WBUF or self.params.PREFETCH else None
+        if self.params.HANDSHAKE:
+            # The Ram model keeps time too: step every request
+            busy = lambda: True
+        pref = c.pref if self.params.PREFETCH else None
+        record = hits_out.append if hits_out is not None else None
+        hits = misses = inline = inline_writes = 0
+        last_inline = False
+        start = self.cycle
+        evictions = c.dirty_evictions
+        q = c.q
+
+        if wrens is None:
+            wrens = repeat(0)
+        if dins is None:
+            dins = repeat(0)
+        for address, wren, din in zip(addresses, wrens, dins):
+            a = address & amask
+            tag = a >> tag_low
+            index = (a >> index_low) & index_mask
+            base = index << way_shift
+            for way in ways:
+                if valid[base + way] and tags[base + way] == tag:
+                    break
+            else:
+                way = -1
+            if way < 0 or (busy is not None and busy()):
+                c.q = q
+                hit, q, _ = self.access(address, wren, din)
+                if hit:
+                    hits += 1
+                else:
+                    misses += 1
+                if record:
+                    record(hit)
+                last_inline = False
+                continue
+
+            hits += 1
+            inline += 1
+            last_inline = True
+            line = base + way
+            sel = (a & offset_mask) >> sel_shift
+            if pref is not None and pref[line]:
+                pref[line] = 0
+                c.pf_useful += 1
+                c._pf_hit((tag << self.params.INDEX_WIDTH) | index)
+            if wren:
+                dirty[line] = 1
+                data[line * wpb + sel] = din & word_mask
+                inline_writes += 1
+            else:
+                q = data[line * wpb + sel]
+            if plru is not None:
+                keep, set_ = touch[way]
+                plru[index] = (plru[index] & keep) | set_
+            else:
+                mine = lru[line]
+                if mine:
+                    # The counters of a set are always a permutation of
+                    # 0..NWAYS-1, so a hit on the MRU way (mine == 0) leaves
+                    # them unchanged
+                    for j in range(base, base + len(ways)):
+                        if lru[j] <= mine:
+                            lru[j] = (lru[j] + 1) & lru_mask
+                    lru[line] = 0
+            if record:
+                record(True)
+
+        if last_inline:
+            c.hit_miss = 1
+            c.mwren = 0
+            c.mrden = 0
+        c.q = q
+        c.perf[PERF_READ_HITS] += inline - inline_writes
+        c.perf[PERF_WRITE_HITS] += inline_writes
+        c.perf[PERF_STATE + IDLE] += inline
+        self.cycle += inline
+        return hits, misses, c.dirty_evictions - evictions, self.cycle - start
+
+    def stream(self, addresses, wrens=None, dins=None):
+        """Present requests back to back through ``step()``, each held until
+        ``accept``, then run until every queued miss has completed.
+
+        Works for both modes, so it measures what the non-blocking front end
+        saves: a blocking miss holds up the requests behind it, a
+        non-blocking one only occupies an MSHR.  Returns
+        ``(hits, misses, cycles)``; a request counts as a hit if it was
+        served from the cache when it was accepted.  With ``PIPE = 1`` a
+        request is accepted into stage 1 before its lookup, so the misses
+        are taken from ``demand_misses`` instead.
+        """
+        c = self.cache
+        step = self.step
+        nmshr = self.params.NMSHR
+        hits = misses = 0
+        start = self.cycle
+        start_misses = c.demand_misses
+        if wrens is None:
+            wrens = repeat(0)
+        if dins is None:
+            dins = repeat(0)
+        for address, wren, din in zip(addresses, wrens, dins):
+            rden = 0 if wren else 1
+            n = 0
+            while True:
+                step(rden, wren, address, din)
+                n += 1
+                if c.accept:
+                    break
+            if c.hit_miss if nmshr else n == 1:
+                hits += 1
+            else:
+                misses += 1
+        while c.state != IDLE or any(c.mshr_valid) or c.s1_valid:
+            step()
+        if self.params.PIPE:
+            hits, misses = hits + misses - (c.demand_misses - start_misses), c.demand_misses - start_misses
+        return hits, misses, self.cycle - start
+
+
+class BankedCacheSystem:
+    """``BankedCache`` (NBANKS interleaved ``Cache`` banks, two CPU ports)
+    + one memory on its shared ready/valid memory port.
+
+    ``params`` describes the whole cache; bank ``g`` is a ``CacheModel``
+    with ``NSETS / NBANKS`` sets and ``HANDSHAKE = 1`` that sees addresses
+    with the bank bits taken out.
+    """
+
+    def __init__(self, params=TB_PARAMS, nbanks=2, ram_depth=TB_RAM_DEPTH, ram=None,
+                 rq_slots=4):
+        if nbanks < 2 or nbanks & (nbanks - 1) or params.NSETS % nbanks:
+            raise ValueError("NBANKS must be a power of two >= 2 that divides NSETS")
+        if params.NMSHR or params.PIPE:
+            raise ValueError("the banks are blocking, unpipelined caches")
+        self.params = params
+        self.NBANKS = nbanks
+        self.RQ_SLOTS = rq_slots
+        self._bank_bits = nbanks.bit_length() - 1
+        bank = replace(params, NSETS=params.NSETS // nbanks,
+                       INDEX_WIDTH=params.INDEX_WIDTH - self._bank_bits, HANDSHAKE=1)
+        self.banks = [CacheModel(bank) for _ in range(nbanks)]
+        self.ram = RamModel(WIDTH=params.MWIDTH, DEPTH=ram_depth) if ram is None else ram
+        self.cycle = 0
+        # Not reset in the RTL
+        self.last_port = [0] * nbanks
+        self.a_bank = self.b_bank = 0
+        self._regs()
+
+    def _regs(self):
+        """Registers cleared by ``reset_n``."""
+        n = self.NBANKS
+        self.last_valid = [0] * n
+        self.rr = [0] * n
+        self.a_valid = self.b_valid = 0
+        self.mem_owner = 0
+        self.rq = deque()        # bank of every read in flight, oldest first
+        self.conflicts = 0       # bank_conflicts
+
+    def reset(self):
+        """Reset everything and wait until the banks are ready again."""
+        for c in self.banks:
+            c.reset()
+        self.ram.reset()
+        self._regs()
+        self.cycle += max(c.finish_init() for c in self.banks)
+
+    def bank_of(self, address):
+        return (address >> self.params.OFFSET_WIDTH) & (self.NBANKS - 1)
+
+    def squeeze(self, address):
+        """Address as bank ``bank_of(address)`` sees it."""
+        off = self.params.OFFSET_WIDTH
+        return ((address >> (off + self._bank_bits)) << off) | (address & ((1 << off) - 1))
+
+    def expand(self, address, bank):
+        """A bank's memory address in the CPU address space."""
+        off = self.params.OFFSET_WIDTH
+        return (((address >> off) << (off + self._bank_bits)) | (bank << off)
+                | (address & ((1 << off) - 1)))
+
+    @property
+    def ready(self):
+        return int(all(c.ready for c in self.banks))
+
+    @property
+    def hit_miss_a(self):
+        return int(self.a_valid and self.banks[self.a_bank].hit_miss)
+
+    @property
+    def q_a(self):
+        return self.banks[self.a_bank].q
+
+    @property
+    def hit_miss_b(self):
+        return int(self.b_valid and self.banks[self.b_bank].hit_miss)
+
+    @property
+    def q_b(self):
+        return self.banks[self.b_bank].q
+
+    @property
+    def demand_misses(self):
+        return sum(c.demand_misses for c in self.banks)
+
+    def mem_port(self):
+        """The shared memory port as the RTL drives it now: ``(bank, mrden,
+        mwren, mrdaddress, mwraddress, mdout)``.  The bank that had it keeps
+        it while it has a beat to send, else the next requesting bank."""
+        banks = self.banks
+        n = self.NBANKS
+        sel = self.mem_owner
+        if not (banks[sel].mrden or banks[sel].mwren):
+            for w in range(1, n):
+                g = (self.mem_owner + w) % n
+                if banks[g].mrden or banks[g].mwren:
+                    sel = g
+                    break
+        s = banks[sel]
+        return (sel, int(s.mrden and len(self.rq) < self.RQ_SLOTS), s.mwren,
+                self.expand(s.mrdaddress, sel), self.expand(s.mwraddress, sel), s.mdout)
+
+    def step(self, a=(0, 0, 0, 0), b=(0, 0, 0, 0)):
+        """One rising clock edge; ``a``/``b`` are the ``(rden, wren,
+        address, din)`` of the two ports."""
+        banks = self.banks
+        ram = self.ram
+        rden_a, wren_a, address_a, din_a = a
+        rden_b, wren_b, address_b, din_b = b
+        req_a = rden_a or wren_a
+        req_b = rden_b or wren_b
+        bank_a = self.bank_of(address_a)
+        bank_b = self.bank_of(address_b)
+
+        # Bank arbitration
+        conflict = req_a and req_b and bank_a == bank_b
+        sticky = self.last_valid[bank_a] and not banks[bank_a].hit_miss
+        win_b = self.last_port[bank_a] if sticky else self.rr[bank_a]
+        grant_a = req_a and (not conflict or not win_b)
+        grant_b = req_b and (not conflict or win_b)
+
+        # Memory port arbitration, from the banks' outputs before the edge
+        n = self.NBANKS
+        sel, mrden, mwren, mrdaddress, mwraddress, mdout = self.mem_port()
+        rq = self.rq
+        rq_full = len(rq) == self.RQ_SLOTS
+        mq, mvalid, mready = ram.data_out, ram.valid_out, ram.ready
+        head = rq[0] if rq else -1
+        ram.step(mdout, mwraddress if mwren else mrdaddress, mwren, mrden)
+
+        for g, c in enumerate(banks):
+            if grant_a and bank_a == g:
+                req = (rden_a, wren_a, self.squeeze(address_a), din_a)
+            elif grant_b and bank_b == g:
+                req = (rden_b, wren_b, self.squeeze(address_b), din_b)
+            else:
+                req = (0, 0, self.squeeze(address_a), din_a)
+            c.step(*req, mq, int(sel == g and mready and not (c.mrden and rq_full)),
+                   int(mvalid and head == g))
+
+        for g in range(n):
+            self.last_valid[g] = int(grant_a and bank_a == g or grant_b and bank_b == g)
+            self.last_port[g] = int(grant_b and bank_b == g)
+        if conflict:
+            self.conflicts += 1
+            if not sticky:
+                self.rr[bank_a] = int(not win_b)
+        self.a_valid, self.a_bank = int(bool(grant_a)), bank_a
+        self.b_valid, self.b_bank = int(bool(grant_b)), bank_b
+        self.mem_owner = sel
+        if mvalid and rq:
+            rq.popleft()
+        if mrden and mready:
+            rq.append(sel)
+        self.cycle += 1
+
+    def stream(self, addresses, wrens=None, dins=None):
+        """Issue a request stream on both ports and run until it is done.
+
+        Every port takes the next request of the stream as soon as its
+        previous one saw ``hit_miss``, so the stream is served two requests
+        at a time.  The ports are independent: a read may pass an earlier
+        write to the same word on the other port.  Returns ``(hits,
+        misses, cycles)``, misses counted by the banks' ``demand_misses``.
+        """
+        if wrens is None:
+            wrens = repeat(0)
+        if dins is None:
+            dins = repeat(0)
+        requests = ((0 if w else 1, int(bool(w)), a, d)
+                    for a, w, d in zip(addresses, wrens, dins))
+        idle = (0, 0, 0, 0)
+        start = self.cycle
+        start_misses = self.demand_misses
+        a = next(requests, idle)
+        b = next(requests, idle)
+        n = 0
+        while a is not idle or b is not idle:
+            self.step(a, b)
+            if self.hit_miss_a and a is not idle:
+                n += 1
+                a = next(requests, idle)
+            if self.hit_miss_b and b is not idle:
+                n += 1
+                b = next(requests, idle)
+        while any(c.busy() for c in self.banks):
+            self.step()
+        misses = self.demand_misses - start_misses
+        return n - misses, misses, self.cycle - start
+
+
+
+# L2Bridge states
+B_IDLE = 0
+B_READ = 1
+B_WRITE = 2
+B_DROP = 3
+
+
+class L2BridgeModel:
+    """Model of ``L2Bridge``: L1 memory beats to L2 word requests, plus the
+    back-invalidation queue (INCLUSION = 1) and the L2 drop of lines L1
+    took (INCLUSION = 2).  ``outputs()`` gives the L2 CPU port inputs,
+    which depend on the L2's ``hit_miss``; the rest are attributes."""
+
+    def __init__(self, WIDTH=32, MWIDTH=64, L1_LINE=8, L2_LINE=8, INCLUSION=0, BI_SLOTS=4):
+        self.WIDTH = WIDTH
+        self.MWIDTH = MWIDTH
+        self.L1_LINE = L1_LINE
+        self.SUBLINES = L2_LINE // L1_LINE
+        self.INCLUSION = INCLUSION
+        self.BI_SLOTS = BI_SLOTS
+        self.WORDS = MWIDTH // WIDTH
+        self.reset()
+
+    def reset(self):
+        self.bstate = B_IDLE
+        self.baddr = 0
+        self.bdata = 0
+        self.bword = 0
+        self.l2_wait = 0
+        self.mq = 0
+        self.mvalid = 0
+        self.bi = deque()        # L2 evictions waiting for the L1 snoop port
+        self.bi_sub = 0
+        self.back_invals = 0
+        # Line transfers through L2 and L2 evictions (model statistics)
+        self.line_reads = 0
+        self.line_writes = 0
+        self.l2_evictions = 0
+
+    @property
+    def mready(self):
+        return int(self.bstate == B_IDLE)
+
+    @property
+    def l1_snoop(self):
+        return int(self.INCLUSION == 1 and len(self.bi) > 0)
+
+    @property
+    def l1_snoop_address(self):
+        return (self.bi[0] if self.bi else 0) + self.bi_sub * self.L1_LINE
+
+    @property
+    def l2_snoop(self):
+        return int(self.bstate == B_DROP)
+
+    @property
+    def l2_snoop_address(self):
+        return self.baddr & ~(self.L1_LINE - 1)
+
+    def busy(self):
+        return self.bstate != B_IDLE or bool(self.bi)
+
+    def outputs(self, l2_hit_miss):
+        """``(rden, wren, address, din)`` on the L2 CPU port."""
+        ack = self.l2_wait and l2_hit_miss
+        last = ack and self.bword == self.WORDS - 1
+        cur = 0 if last else self.bword + (1 if ack else 0)
+        rden = int(self.bstate == B_READ and not last)
+        wren = int(self.bstate == B_WRITE and not last)
+        word_mask = (1 << self.WIDTH) - 1
+        address = (self.baddr + cur * (self.WIDTH // 8)) & word_mask
+        return rden, wren, address, (self.bdata >> (cur * self.WIDTH)) & word_mask
+
+    def step(self, l1_mem, l1_snoop_done, l1_snoop_hit, l2_hit_miss, l2_q,
+             l2_snoop_done, l2_evict, l2_evict_address):
+        """One edge; ``l1_mem`` is the L1's ``(mdout, mrdaddress, mrden,
+        mwraddress, mwren)``."""
+        mdout, mrdaddress, mrden, mwraddress, mwren = l1_mem
+        rden, wren, _, _ = self.outputs(l2_hit_miss)
+        ack = self.l2_wait and l2_hit_miss
+        width = self.WIDTH
+        self.mvalid = 0
+        self.l2_wait = int(rden or wren)
+        state = self.bstate
+        if state == B_IDLE:
+            if mwren:
+                self.baddr, self.bdata = mwraddress, mdout
+                self.bstate = B_WRITE
+            elif mrden:
+                self.baddr = mrdaddress
+                self.bstate = B_READ
+        elif state in (B_READ, B_WRITE) and ack:
+            shift = self.bword * width
+            if state == B_READ:
+                self.bdata = (self.bdata & ~(((1 << width) - 1) << shift)) | (l2_q << shift)
+            if self.bword == self.WORDS - 1:
+                self.bword = 0
+                line_end = (self.baddr + self.MWIDTH // 8) & (self.L1_LINE - 1) == 0
+                if state == B_READ:
+                    self.mq = self.bdata
+                    self.mvalid = 1
+                    self.line_reads += line_end
+                else:
+                    self.line_writes += line_end
+                drop = state == B_READ and self.INCLUSION == 2 and line_end
+                self.bstate = B_DROP if drop else B_IDLE
+            else:
+                self.bword += 1
+        elif state == B_DROP and l2_snoop_done:
+            self.bstate = B_IDLE
+
+        if l2_evict:
+            self.l2_evictions += 1
+            if self.INCLUSION == 1:
+                self.bi.append(l2_evict_address)
+        if l1_snoop_done and self.bi:
+            self.back_invals += l1_snoop_hit
+            if self.bi_sub == self.SUBLINES - 1:
+                self.bi_sub = 0
+                self.bi.popleft()
+            else:
+                self.bi_sub += 1
+
+
+# Default levels of CacheHierarchy in design.v: a 2 KiB L1 with 8-byte
+# lines and a 128 KiB 8-way L2 with 32-byte lines
+L1_PARAMS = CacheParams(NSETS=64, INDEX_WIDTH=6, TAG_WIDTH=23)
+L2_PARAMS = CacheParams(NWAYS=8, NSETS=512, INDEX_WIDTH=9, TAG_WIDTH=18, OFFSET_WIDTH=5, BURST=4)
+
+INCLUSION_NAMES = ("non-inclusive", "inclusive", "exclusive")
+
+
+class HierarchySystem:
+    """``CacheHierarchy`` + ``Ram``: an L1 ``CacheModel`` whose memory port
+    drives an L2 ``CacheModel`` through an ``L2BridgeModel``.
+
+    ``l1``/``l2`` are the ``CacheParams`` of the levels (the snoop,
+    EVICT_ALL and L1 HANDSHAKE settings are derived from ``inclusion``).
+    """
+
+    def __init__(self, l1=L1_PARAMS, l2=L2_PARAMS, inclusion=0, ram_depth=20, ram=None):
+        if inclusion not in (0, 1, 2):
+            raise ValueError("inclusion must be 0 (non-inclusive), 1 (inclusive) or 2 (exclusive)")
+        l1_line = l1.LINE_WIDTH // 8
+        l2_line = l2.LINE_WIDTH // 8
+        if l1_line > l2_line or l1.MWIDTH % l1.WIDTH:
+            raise ValueError("the L1 line may not be larger than the L2 line")
+        if l1.NMSHR or l1.PIPE or l2.NMSHR or l2.PIPE or inclusion == 1 and (l1.VICTIM or l2.PREFETCH) \
+                or inclusion == 2 and l2.VICTIM:
+            raise ValueError("unsupported level parameters for this policy (see CacheHierarchy)")
+        self.inclusion = inclusion
+        self.l1 = CacheModel(replace(l1, HANDSHAKE=1, SNOOP=int(inclusion == 1),
+                                     EVICT_ALL=int(inclusion == 2)))
+        same_line = int(l1_line == l2_line)
+        self.l2 = CacheModel(replace(l2, SNOOP=(2 if same_line else 1) if inclusion == 2 else 0,
+                                     LINE_WRITES=same_line))
+        self.bridge = L2BridgeModel(l1.WIDTH, l1.MWIDTH, l1_line, l2_line, inclusion)
+        self.ram = RamModel(WIDTH=l2.MWIDTH, DEPTH=ram_depth) if ram is None else ram
+        self.cycle = 0
+        self.accesses = 0
+        self.hits = 0
+
+    def reset(self):
+        """Reset everything and wait until both levels are ready."""
+        self.l1.reset()
+        self.l2.reset()
+        self.bridge.reset()
+        self.ram.reset()
+        self.cycle += max(self.l1.finish_init(), self.l2.finish_init())
+
+    def step(self, rden=0, wren=0, address=0, din=0):
+        """One rising clock edge of the whole hierarchy."""
+        l1, l2, b, ram = self.l1, self.l2, self.bridge, self.ram
+        l2_in = b.outputs(l2.hit_miss)
+        mq, mvalid, mready = ram.data_out, ram.valid_out, ram.ready
+        ram.step(l2.mdout, l2.mwraddress if l2.mwren else l2.mrdaddress, l2.mwren, l2.mrden)
+        l1_mem = (l1.mdout, l1.mrdaddress, l1.mrden, l1.mwraddress, l1.mwren)
+        l1_sn = (l1.snoop_done, l1.snoop_hit)
+        l2_out = (l2.hit_miss, l2.q, l2.snoop_done, l2.evict, l2.evict_address)
+        l2.step(*l2_in, mq, mready, mvalid, b.l2_snoop, b.l2_snoop_address)
+        l1.step(rden, wren, address, din, b.mq, b.mready, b.mvalid, b.l1_snoop, b.l1_snoop_address)
+        b.step(l1_mem, *l1_sn, *l2_out)
+        self.cycle += 1
+
+    def busy(self):
+        return self.l1.busy() or self.l2.busy() or self.bridge.busy()
+
+    def stream(self, addresses, wrens=None, dins=None):
+        """Issue every request and hold it until ``hit_miss``, then run until
+        both levels are idle.  Returns ``(hits, misses, cycles)`` of L1."""
+        step = self.step
+        l1 = self.l1
+        hits = misses = 0
+        start = self.cycle
+        if wrens is None:
+            wrens = repeat(0)
+        if dins is None:
+            dins = repeat(0)
+        for address, wren, din in zip(addresses, wrens, dins):
+            rden = 0 if wren else 1
+            n = 0
+            while True:
+                step(rden, wren, address, din)
+                n += 1
+                if l1.hit_miss:
+                    break
+            if n == 1:
+                hits += 1
+            else:
+                misses += 1
+        while self.busy():
+            step()
+        self.accesses += hits + misses
+        self.hits += hits
+        return hits, misses, self.cycle - start
+
+    def stats(self):
+        """Per-level statistics (one dict per level).  ``accesses`` are CPU
+        requests for L1 and L1 line transfers (fetches + write-backs) for
+        L2, so ``miss_rate`` is the local miss rate of the level.  L2
+        ``misses`` are the lines it fetched (an L1 victim that takes an L2
+        line without a fetch is not counted)."""
+        l1, l2, b = self.l1, self.l2, self.bridge
+        l2_accesses = b.line_reads + b.line_writes
+        l2_misses = l2.demand_misses - l2.write_allocs
+        return [
+            dict(level="L1", accesses=self.accesses, misses=self.accesses - self.hits,
+                 miss_rate=(self.accesses - self.hits) / max(self.accesses, 1),
+                 writebacks=l1.dirty_evictions, back_invals=b.back_invals),
+            dict(level="L2", accesses=l2_accesses, misses=l2_misses,
+                 miss_rate=l2_misses / max(l2_accesses, 1),
+                 writebacks=l2.dirty_evictions, evictions=b.l2_evictions),
+        ]
+
+
+
+# CoherentBus states
+X_IDLE = 0
+X_OWNED = 1
+X_SNOOP = 2
+X_READ = 3
+X_FWD = 4
+X_FLUSH = 5
+
+
+class MesiBusModel:
+    """Model of ``CoherentBus``: round-robin bus ownership, snoops of the
+    other caches, cache-to-cache transfer of Modified lines and their flush
+    to memory.  ``core_inputs()`` / ``mem_outputs()`` give the combinational
+    outputs of the current state; the counters are attributes."""
+
+    def __init__(self, NCORES=2, WIDTH=32, MWIDTH=64, BURST=1):
+        self.NCORES = NCORES
+        self.WIDTH = WIDTH
+        self.MWIDTH = MWIDTH
+        self.BURST = BURST
+        self._beat_low = (MWIDTH // 8).bit_length() - 1
+        self._line_mask = MWIDTH * BURST // 8 - 1
+        self.reset()
+
+    def reset(self):
+        self.xstate = X_IDLE
+        self.owner = 0
+        self.x_addr = 0
+        self.x_excl = 0
+        self.x_shared = 0
+        self.x_dirty = 0
+        self.x_data = 0
+        self.sn_wait = 0   # bit per cache still to answer the snoop
+        self.xbeat = 0
+        self.fwd_valid = 0
+        self.fwd_q = 0
+        self.bus_reads = 0
+        self.bus_readx = 0
+        self.invalidations = 0
+        self.interventions = 0
+        self.flushes = 0   # Modified lines written to memory after a shared read (model statistic)
+
+    @property
+    def owned(self):
+        return self.xstate in (X_OWNED, X_SNOOP, X_READ, X_FWD)
+
+    def busy(self):
+        return self.xstate != X_IDLE
+
+    def core_inputs(self, core, own_mwren, mq, mready, mvalid):
+        """``(mq, mready, mvalid, snoop, snoop_address, snoop_share, mgnt,
+        mshared)`` of cache ``core``; ``own_mwren`` is the owner's mwren."""
+        state = self.xstate
+        mine = core == self.owner
+        fwd = state == X_FWD
+        c_mready = mine and (state == X_OWNED and own_mwren and mready
+                             or state == X_READ and mready or fwd)
+        c_mvalid = mine and (state == X_READ and mvalid or fwd and self.fwd_valid)
+        snoop = state == X_SNOOP and self.sn_wait >> core & 1
+        return (self.fwd_q if fwd else mq, int(bool(c_mready)), int(bool(c_mvalid)), int(snoop),
+                self.x_addr, int(not self.x_excl), int(mine and self.owned), self.x_shared)
+
+    def mem_outputs(self, c_mem):
+        """``(mdout, mrdaddress, mrden, mwraddress, mwren)`` to memory;
+        ``c_mem`` holds the caches' memory port outputs."""
+        mdout, mrdaddress, mrden, mwraddress, mwren = c_mem[self.owner]
+        if self.xstate == X_FLUSH:
+            beat = self.xbeat
+            return ((self.x_data >> (beat * self.MWIDTH)) & ((1 << self.MWIDTH) - 1), mrdaddress, 0,
+                    self.x_addr | (beat << self._beat_low), 1)
+        return (mdout, mrdaddress, int(self.xstate == X_READ and mrden),
+                mwraddress, int(self.xstate == X_OWNED and mwren))
+
+    def step(self, c_mem, c_snoop, c_mreq, c_mexcl, mready, mvalid):
+        """One edge; ``c_snoop`` holds ``(snoop_done, snoop_hit,
+        snoop_dirty, snoop_data)`` per cache."""
+        state = self.xstate
+        owner = self.owner
+        _, own_rdaddress, own_mrden, _, _ = c_mem[owner]
+        fwd_valid = self.fwd_valid
+        self.fwd_valid = 0
+        if state == X_IDLE:
+            for k in range(1, self.NCORES + 1):
+                i = (owner + k) % self.NCORES
+                if c_mreq[i]:
+                    self.owner = i
+                    self.xstate = X_OWNED
+                    break
+        elif state == X_OWNED:
+            if own_mrden:
+                self.x_addr = own_rdaddress & ~self._line_mask
+                self.x_excl = c_mexcl[owner]
+                self.x_shared = 0
+                self.x_dirty = 0
+                self.sn_wait = ((1 << self.NCORES) - 1) & ~(1 << owner)
+                self.xstate = X_SNOOP
+            elif not c_mreq[owner]:
+                self.xstate = X_IDLE
+        elif state == X_SNOOP:
+            wait = self.sn_wait
+            for k, (done, hit, dirty, data) in enumerate(c_snoop):
+                if done and wait >> k & 1:
+                    self.x_shared |= hit
+                    self.invalidations += self.x_excl and hit
+                    if dirty:
+                        self.x_dirty = 1
+                        self.interventions += 1
+                        self.x_data = data
+                    self.sn_wait &= ~(1 << k)
+            if not wait:
+                if self.x_excl:
+                    self.bus_readx += 1
+                else:
+                    self.bus_reads += 1
+                self.xbeat = 0
+                self.xstate = X_FWD if self.x_dirty else X_READ
+        elif state == X_READ:
+            if mvalid:
+                self._next_beat(X_IDLE)
+        elif state == X_FWD:
+            # One beat back per beat asked for, a cycle later
+            if own_mrden:
+                self.fwd_valid = 1
+                beat = (own_rdaddress >> self._beat_low) % self.BURST
+                self.fwd_q = (self.x_data >> (beat * self.MWIDTH)) & ((1 << self.MWIDTH) - 1)
+            if fwd_valid:
+                self._next_beat(X_IDLE if self.x_excl else X_FLUSH)
+        elif state == X_FLUSH:
+            if mready:
+                if self.xbeat == self.BURST - 1:
+                    self.flushes += 1
+                self._next_beat(X_IDLE)
+
+    def _next_beat(self, next_state):
+        if self.xbeat == self.BURST - 1:
+            self.xbeat = 0
+            self.xstate = next_state
+        else:
+            self.xbeat += 1
+
+
+class CoherentSystem:
+    """``CoherentCaches`` + ``Ram``: ``ncores`` MESI ``CacheModel``s on a
+    ``MesiBusModel`` in front of one memory (a ``LatencyRamModel`` or any
+    model with its ``ready`` / ``valid_out`` handshake).
+
+    ``params`` are the per-core cache parameters (HANDSHAKE and MESI are
+    set here, the defaults match ``CoherentCaches``).  Besides the bus
+    counters it tracks, per core, coherence misses: misses to lines the
+    core lost to another core's write (model statistic).
+    """
+
+    def __init__(self, params=L1_PARAMS, ncores=4, ram_depth=20, ram=None):
+        if params.NMSHR or params.PIPE or params.WBUF or params.VICTIM or params.PREFETCH or params.SNOOP:
+            raise ValueError("MESI caches are blocking caches without WBUF, VICTIM, PREFETCH or SNOOP")
+        params = replace(params, HANDSHAKE=1, MESI=1)
+        self.params = params
+        self.ncores = ncores
+        self.caches = [CacheModel(params) for _ in range(ncores)]
+        self.bus = MesiBusModel(ncores, params.WIDTH, params.MWIDTH, params.BURST)
+        self.ram = LatencyRamModel(params.MWIDTH, ram_depth) if ram is None else ram
+        self.cycle = 0
+        self._clear_stats()
+
+    def _clear_stats(self):
+        n = self.ncores
+        self.accesses = [0] * n
+        self.misses = [0] * n
+        self.coherence_misses = [0] * n
+        self.lost = [set() for _ in range(n)]   # lines taken out by other cores' writes
+
+    def reset(self):
+        """Reset everything and wait until the caches are ready."""
+        for c in self.caches:
+            c.reset()
+        self.bus.reset()
+        self.ram.reset()
+        self.cycle += max(c.finish_init() for c in self.caches)
+        self._clear_stats()
+
+    def step(self, requests=()):
+        """One rising clock edge; ``requests`` holds ``(rden, wren, address,
+        din)`` per core (missing cores are idle)."""
+        caches, bus, ram = self.caches, self.bus, self.ram
+        reqs = list(requests) + [(0, 0, 0, 0)] * (self.ncores - len(requests))
+        c_mem = [(c.mdout, c.mrdaddress, c.mrden, c.mwraddress, c.mwren) for c in caches]
+        c_snoop = [(c.snoop_done, c.snoop_hit, c.snoop_dirty, c.snoop_data) for c in caches]
+        c_mreq = [c.mreq(r, w, a) for c, (r, w, a, _) in zip(caches, reqs)]
+        c_mexcl = [int(bool(w)) for _, w, _, _ in reqs]
+        mq, mvalid, mready = ram.data_out, ram.valid_out, ram.ready
+        own_mwren = c_mem[bus.owner][4]
+        inputs = [bus.core_inputs(i, own_mwren, mq, mready, mvalid) for i in range(self.ncores)]
+        if bus.xstate == X_SNOOP and bus.x_excl:
+            line = bus.x_addr >> self.params.OFFSET_WIDTH
+            for i, (done, hit, _, _) in enumerate(c_snoop):
+                if done and hit and bus.sn_wait >> i & 1:
+                    self.lost[i].add(line)
+        mdout, mrdaddress, mrden, mwraddress, mwren = bus.mem_outputs(c_mem)
+        ram.step(mdout, mwraddress if mwren else mrdaddress, mwren, mrden)
+        for c, req, inp in zip(caches, reqs, inputs):
+            c.step(*req, *inp)
+        bus.step(c_mem, c_snoop, c_mreq, c_mexcl, mready, mvalid)
+        self.cycle += 1
+
+    def busy(self):
+        return self.bus.busy() or any(c.busy() for c in self.caches)
+
+    def stream(self, traces):
+        """Run one trace per core, ``(addresses, wrens, dins)`` (``wrens`` /
+        ``dins`` may be None); every core holds its request until
+        ``hit_miss`` and then issues its next one.  Returns the cycles until
+        all cores are done and the caches idle."""
+        start = self.cycle
+        offset = self.params.OFFSET_WIDTH
+        its = [zip(a, repeat(0) if w is None else w, repeat(0) if d is None else d)
+               for a, w, d in traces]
+        its += [iter(())] * (self.ncores - len(its))
+        idle = (0, 0, 0, 0)
+        cur = [idle] * self.ncores
+        before = [0] * self.ncores
+
+        def issue(i):
+            nxt = next(its[i], None)
+            if nxt is None:
+                cur[i] = idle
+                return
+            address, wren, din = nxt
+            cur[i] = (0 if wren else 1, 1 if wren else 0, address, din)
+            before[i] = self.caches[i].demand_misses
+
+        for i in range(self.ncores):
+            issue(i)
+        while any(r is not idle for r in cur):
+            self.step(cur)
+            for i, c in enumerate(self.caches):
+                if cur[i] is idle or not c.hit_miss:
+                    continue
+                self.accesses[i] += 1
+                if c.demand_misses != before[i]:
+                    self.misses[i] += 1
+                    line = cur[i][2] >> offset
+                    if line in self.lost[i]:
+                        self.lost[i].discard(line)
+                        self.coherence_misses[i] += 1
+                issue(i)
+        while self.busy():
+            self.step()
+        return self.cycle - start
+
+    def stats(self):
+        """Per-core accesses / misses / coherence misses and the bus
+        traffic: line fetches for reads and writes (including upgrades of
+        Shared lines), copies invalidated, Modified lines sent cache to
+        cache, and the lines read from and written to memory."""
+        bus = self.bus
+        caches = self.caches
+        fetches = bus.bus_reads + bus.bus_readx
+        return dict(
+            accesses=sum(self.accesses), misses=sum(self.misses),
+            coherence_misses=sum(self.coherence_misses),
+            miss_rate=sum(self.misses) / max(sum(self.accesses), 1),
+            per_core=[dict(accesses=a, misses=m, coherence_misses=cm)
+                      for a, m, cm in zip(self.accesses, self.misses, self.coherence_misses)],
+            bus_reads=bus.bus_reads, bus_readx=bus.bus_readx,
+            upgrades=sum(c.upgrades for c in caches),
+            invalidations=bus.invalidations, interventions=bus.interventions,
+            mem_reads=fetches - bus.interventions,
+            mem_writes=sum(c.dirty_evictions for c in caches) + bus.flushes,
+        )
+
+
+# Access sequence of tb_cache_system.v: (address, wren, din)
+TB_SEQUENCE = (
+    [(a, 0, 0) for a in (0x0100, 0x0200, 0x0300, 0x0400, 0x0500)]
+    + [(a, 0, 0) for a in (0x0100, 0x0200, 0x0300, 0x0400)]
+    + [(a, 0, 0) for a in (0x0600, 0x0800, 0x0600, 0x0800, 0x0a00)]
+    + [(0x0a00, 1, 0x0dda4444)]
+    + [(a, 0, 0) for a in (0x0400, 0x0600, 0x0800, 0x0c00)]
+)
+
+
+if __name__ == "__main__":
+    import os
+
+    system = CacheSystem()
+    system.ram.load_memh(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Test1.mem"))
+    for address, wren, din in TB_SEQUENCE:
+        hit, q, cycles = system.access(address, wren, din)
+        print(f"{'WR' if wren else 'RD'} 0x{address:04x}: {'HIT ' if hit else 'MISS'} "
+              f"q=0x{q:08x} ({cycles} cycles)")
+    print(f"RAM[0x0a00] = 0x{system.ram.mem[0x0a00]:08x}")
@@ -3,6 +3,8 @@ import matplotlib.patches as patches
 import matplotlib.path as mpath
 import numpy as np
 
+from cache_model import CacheParams
+
 # ==========================================
 # Draw Logic Gate Helpers
 # ==========================================
@@ -101,43 +103,52 @@ def draw_bus_label(ax, x, y, text, color='black'):
 # Main Drawing
 # ==========================================
 
-def visualize_hardware():
+def visualize_hardware(params=CacheParams(), path=None):
     fig, ax = plt.subplots(figsize=(18, 12))
     ax.set_aspect('equal')
+    p = params
+    n_ways = p.NWAYS
+    if p.WSEL_WIDTH > 1:
+        word_select = f"Offset [{p.OFFSET_HIGH}:{p.OFFSET_WIDTH - p.WSEL_WIDTH}]"
+    else:
+        word_select = f"Offset [{p.OFFSET_HIGH}]"
     
+    ways_x = [3 + 5 * i for i in range(n_ways)] # Centers
+    center = (ways_x[0] + ways_x[-1]) / 2
+    dx = center - 10.5 # the address register sits over the ways
+
     # -----------------------------
     # 1. Address Register (Top)
     # -----------------------------
     y_addr = 14
-    ax.add_patch(patches.Rectangle((4, y_addr), 12, 1, facecolor='white', edgecolor='black', lw=2))
-    ax.text(10, y_addr+1.2, "CPU Physical Address [31:0]", ha='center', fontsize=12, weight='bold')
+    ax.add_patch(patches.Rectangle((4 + dx, y_addr), 12, 1, facecolor='white', edgecolor='black', lw=2))
+    ax.text(10 + dx, y_addr+1.2, f"CPU Physical Address [{p.WIDTH - 1}:0]", ha='center', fontsize=12, weight='bold')
     
     # Fields
     # Tag
-    ax.fill_between([4, 10], y_addr, y_addr+1, color='#ffccbc', alpha=0.5)
-    ax.text(7, y_addr+0.5, "Tag [31:13]\n(19 bits)", ha='center', va='center', fontsize=9)
+    ax.fill_between([4 + dx, 10 + dx], y_addr, y_addr+1, color='#ffccbc', alpha=0.5)
+    ax.text(7 + dx, y_addr+0.5, f"Tag [{p.TAG_HIGH}:{p.TAG_LOW}]\n({p.TAG_WIDTH} bits)", ha='center', va='center', fontsize=9)
     # Index
-    ax.fill_between([10, 14], y_addr, y_addr+1, color='#fff9c4', alpha=0.5)
-    ax.text(12, y_addr+0.5, "Index [12:3]\n(10 bits)", ha='center', va='center', fontsize=9)
+    ax.fill_between([10 + dx, 14 + dx], y_addr, y_addr+1, color='#fff9c4', alpha=0.5)
+    ax.text(12 + dx, y_addr+0.5, f"Index [{p.INDEX_HIGH}:{p.INDEX_LOW}]\n({p.INDEX_WIDTH} bits)", ha='center', va='center', fontsize=9)
     # Offset
-    ax.fill_between([14, 16], y_addr, y_addr+1, color='#e1bee7', alpha=0.5)
-    ax.text(15, y_addr+0.5, "Offset\n[2:0]", ha='center', va='center', fontsize=9)
+    ax.fill_between([14 + dx, 16 + dx], y_addr, y_addr+1, color='#e1bee7', alpha=0.5)
+    ax.text(15 + dx, y_addr+0.5, f"Offset\n[{p.OFFSET_HIGH}:0]", ha='center', va='center', fontsize=9)
 
     # Decode Lines
     # Index selects the SET. We represent "One Set" (Set K).
-    ax.annotate("Index selects\nSet K", xy=(12, y_addr), xytext=(12, 11), 
+    ax.annotate("Index selects\nSet K", xy=(12 + dx, y_addr), xytext=(12 + dx, 11), 
                 arrowprops=dict(arrowstyle="->", linestyle="dashed"), ha='center')
 
     # Tag Bus Line
     y_bus = 12.5
-    ax.plot([7, 7], [y_addr, y_bus], 'k-', lw=1.5)
-    ax.plot([2, 18], [y_bus, y_bus], 'k-', lw=1.5) # Horizontal Bus
-    draw_bus_label(ax, 3, y_bus, "19")
+    ax.plot([7 + dx, 7 + dx], [y_addr, y_bus], 'k-', lw=1.5)
+    ax.plot([min(2, 7 + dx), ways_x[-1]], [y_bus, y_bus], 'k-', lw=1.5) # Horizontal Bus
+    draw_bus_label(ax, 3, y_bus, str(p.TAG_WIDTH))
 
     # -----------------------------
     # 2. Cache Ways (Columns)
     # -----------------------------
-    ways_x = [3, 8, 13, 18] # Centers
     way_width = 4
     y_array = 8
     
@@ -152,7 +163,7 @@ def visualize_hardware():
         ax.text(xc, y_array + 2.2, f"WAY {way_id}", ha='center', weight='bold', color='#546e7a')
 
         # Memory Line (The Row for Set K)
-        # Structure: Valid(1) | Dirty(1) | LRU(2) | Tag(19) | Data(64)
+        # Structure: Valid(1) | Dirty(1) | LRU | Tag | Data (one line)
         
         # Visual Block
         bw = way_width - 0.2
@@ -167,14 +178,14 @@ def visualize_hardware():
         
         # Tag
         ax.add_patch(patches.Rectangle((bx+0.4, by), 1.6, bh, fc='#ffccbc', ec='black'))
-        ax.text(bx+1.2, by+0.5, f"tag{way_id}\n[19]", ha='center', va='center', fontsize=8)
+        ax.text(bx+1.2, by+0.5, f"tag{way_id}\n[{p.TAG_WIDTH}]", ha='center', va='center', fontsize=8)
 
         # Data (Put below or beside? Beside is tight. Let's put Data BELOW tag/valid row)
         # Verilog: mem1[index] checks tag1[index].
         # Drawing data block separately
         y_data = y_array - 1.5
         ax.add_patch(patches.Rectangle((bx, y_data), bw, 1.0, fc='#c8e6c9', ec='black'))
-        ax.text(xc, y_data+0.5, f"mem{way_id} [64 bits]", ha='center', va='center', fontfamily='monospace')
+        ax.text(xc, y_data+0.5, f"mem{way_id} [{p.LINE_WIDTH} bits]", ha='center', va='center', fontfamily='monospace')
         
         # Logic Connections
         # 1. Comparator (Tag Match)
@@ -216,40 +227,45 @@ def visualize_hardware():
     # -----------------------------
     # 3. Output MUX
     # -----------------------------
-    mux = draw_mux_trapezoid(ax, 10.5, 3, 14, 2, label="4-Way MUX\nSelected by Hit1..Hit4")
+    mux = draw_mux_trapezoid(ax, center, 3, 5 * n_ways - 6, 2,
+                             label=f"{n_ways}-Way MUX\nSelected by Hit1..Hit{n_ways}")
     
     # Route Data to MUX
     for i, minp in enumerate(mux_inputs):
         # Data path
         ax.plot([minp['data_x'], minp['data_x']], [minp['data_y'], mux['top_left'][1]], 'g-', lw=2)
-        draw_bus_label(ax, minp['data_x'], 4, "64", 'green')
+        draw_bus_label(ax, minp['data_x'], 4, str(p.LINE_WIDTH), 'green')
     
     # Output of Mux
     ax.plot([mux['out'][0], mux['out'][0]], [mux['out'][1], 1], 'b-', lw=3)
-    draw_bus_label(ax, mux['out'][0]+0.2, 1.5, "64", 'blue')
+    draw_bus_label(ax, mux['out'][0]+0.2, 1.5, str(p.LINE_WIDTH), 'blue')
     
     # -----------------------------
     # 4. Word Select MUX (Offset)
     # -----------------------------
-    word_mux = draw_mux_trapezoid(ax, 10.5, 0, 4, 1.5, "Word Select")
-    ax.plot([10.5, 10.5], [1, 0.75], 'b-', lw=3) # input from big mux
+    word_mux = draw_mux_trapezoid(ax, center, 0, 4, 1.5, "Word Select")
+    ax.plot([center, center], [1, 0.75], 'b-', lw=3) # input from big mux
     
     # Offset Control
-    ax.annotate("Offset [2]", xy=(12.5, 0), xytext=(15, 0), 
+    ax.annotate(word_select, xy=(center + 2, 0), xytext=(center + 4.5, 0), 
                 arrowprops=dict(arrowstyle="->"), ha='center')
     
     # Final Output
-    ax.arrow(10.5, -0.75, 0, -0.5, head_width=0.3, color='blue', lw=2)
-    ax.text(10.5, -1.5, "q [31:0] (Data Out)", ha='center', weight='bold', fontsize=14, color='blue')
+    ax.arrow(center, -0.75, 0, -0.5, head_width=0.3, color='blue', lw=2)
+    ax.text(center, -1.5, f"q [{p.WIDTH - 1}:0] (Data Out)", ha='center', weight='bold', fontsize=14, color='blue')
 
     # -----------------------------
     # Layout Limits
     # -----------------------------
-    ax.set_xlim(0, 21)
+    ax.set_xlim(min(0, dx), max(ways_x[-1] + 3, center + 10.5))
     ax.set_ylim(-2, 16)
     ax.axis('off')
-    plt.title("Hardware Schematic: 4-Way Set Associative Cache", fontsize=18, pad=20)
+    plt.title(f"Hardware Schematic: {n_ways}-Way Set Associative Cache", fontsize=18, pad=20)
     plt.tight_layout()
+    if path:
+        plt.savefig(path, dpi=150)
+        plt.close(fig)
+        return
     plt.savefig('cache_schematic.png', dpi=150)
     plt.show()
 
@@ -0,0 +1,516 @@
+"""
+Lockstep co-simulation of the RTL ``Cache`` + ``Ram`` against the Python
+model, and of the multi-cache testbenches against their system models.
+
+    python cosim.py ../traces/tb_cache_system.trc     # runs Icarus (iverilog on PATH)
+    python cosim.py --workload random --accesses 100000
+    python cosim.py --log cosim.log                   # log of an earlier +cosim run
+    python cosim.py --handshake --latency 3 --jitter 2 --col-bits 5 --outstanding 2 x.trc
+    python cosim.py --tb banked --seed 3 -P NBANKS=4 -P NSETS=16 -P INDEX_WIDTH=4
+
+tb_cache_system.v run with ``+cosim=<file>`` writes one line per clock edge
+out of reset.  The line holds the inputs the cache sampled and hit_miss,
+mrden, mwren, q, mrdaddress, mwraddress and mdout after the edge.  It also
+holds valid, dirty, LRU and tag of every way of the addressed set.  Here the
+file is a FIFO, so the RTL and the model run side by side.
+
+The log is read in batches of whole lines, and every batch is decoded to
+NumPy columns at once.  The model (``CacheSystem`` with the tb parameters
+and Test1.mem) is then stepped with the logged inputs of each line, and its
+outputs are compared with the RTL's.  With --handshake the tb is built with
+HANDSHAKE = 1 (Cache with the ready/valid memory interface on a LatencyRam
+with the given timing) and the model runs on a ``LatencyRamModel``; pass the
+same options with --log as the tb run had.  At the first difference the RTL is
+stopped.  The script prints both sides of the cycle and the addressed set
+of both, then exits with status 1.
+
+--tb runs one of the random-stimulus testbenches instead (``TBS``: banked is
+tb_banked_cache.v on ``BankedCacheSystem``, hierarchy tb_cache_hierarchy.v
+on ``HierarchySystem``, coherent tb_coherent_caches.v on ``CoherentSystem``),
+with +seed / +requests and -P parameter overrides.  Their logs start with a
+"# <tb> NAME=value ..." line, from which the model is built, so --log needs
+no other options for them.
+Every other line is one hex value per signal, the inputs and then the
+outputs after the edge; all outputs are compared.
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import replace
+
+import numpy as np
+
+from cache_model import (STATE_NAMES, TB_PARAMS, TB_RAM_DEPTH, BankedCacheSystem, CacheParams,
+                         CacheSystem, CoherentSystem, HierarchySystem, LatencyRamModel)
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+OUTPUTS = ("hit_miss", "mrden", "mwren", "q", "mrdaddress", "mwraddress", "mdout")
+
+# Lines read per batch
+BATCH = 1 << 14
+
+# ASCII -> digit value, -1 for x / z and anything else
+_DIGITS = np.full(256, -1, dtype=np.int64)
+for _i, _c in enumerate(b"0123456789abcdef"):
+    _DIGITS[_c] = _i
+    _DIGITS[ord(chr(_c).upper())] = _i
+
+
+def layout(line, nways=TB_PARAMS.NWAYS):
+    """Columns of a log line: ``[(name, offset, width, base)]``.
+
+    Bit tokens are split into one column per bit; the field widths come
+    from the line itself, so they follow the tb's ADDR_WIDTH."""
+    tokens = line.split(b" ")
+    bits = [("rden", "wren"), None, None, ("hit_miss", "mrden", "mwren"), None, None, None, None]
+    names = ["", "address", "din", "", "q", "mrdaddress", "mwraddress", "mdout"]
+    for w in range(nways):
+        bits += [(f"valid{w}", f"dirty{w}"), None, None]
+        names += ["", f"lru{w}", f"tag{w}"]
+    if len(tokens) != len(names):
+        raise ValueError(f"not a cosim log line: {line!r}")
+    cols, offset = [], 0
+    for tok, name, bit in zip(tokens, names, bits):
+        if bit:
+            cols += [(b, offset + i, 1, 2) for i, b in enumerate(bit)]
+        else:
+            cols.append((name, offset, len(tok), 16))
+        offset += len(tok) + 1
+    return cols
+
+
+def decode(block, cols, width):
+    """NumPy columns ``{name: values}`` of a block of whole log lines;
+    digits that are x / z make the value -1.  Fields of more than 15
+    digits (MWIDTH = 64 beats) are decoded 15 digits at a time into Python
+    ints, so they stay exact."""
+    a = np.frombuffer(block, dtype=np.uint8).reshape(-1, width)
+    out = {}
+    for name, offset, n, base in cols:
+        digits = _DIGITS[a[:, offset:offset + n]]
+        value = None
+        for lo in range(0, n, 15):
+            part = np.zeros(len(a), dtype=np.int64)
+            for j in range(lo, min(lo + 15, n)):
+                part = part * base + digits[:, j]
+            if value is None:
+                value = part
+            else:
+                value = value.astype(object) * base ** (min(lo + 15, n) - lo) + part
+        out[name] = np.where((digits < 0).any(axis=1), -1, value)
+    return out
+
+
+class Divergence(Exception):
+    pass
+
+
+class Cosim:
+    """Steps the model along a cosim log and compares every line."""
+
+    def __init__(self, mem=os.path.join(ROOT, "Test1.mem"), ram=None):
+        """``ram``: LatencyRam parameters (``{name: value}``) of a tb run with
+        HANDSHAKE = 1; ``None`` is the fixed-timing Ram."""
+        if ram is None:
+            self.system = CacheSystem(replace(TB_PARAMS, PERF=1))
+        else:
+            latency_ram = LatencyRamModel(TB_PARAMS.MWIDTH, TB_RAM_DEPTH, **ram)
+            self.system = CacheSystem(replace(TB_PARAMS, PERF=1, HANDSHAKE=1), ram=latency_ram)
+        self.system.cache.reset()
+        self.system.ram.reset()
+        self.system.ram.load_memh(mem)
+        self.cycles = self.requests = 0
+        self.cols = self.width = None
+
+    def feed(self, block):
+        """Compare a block of whole lines; raises ``Divergence``."""
+        if self.cols is None:
+            first = block[:block.index(b"\n")]
+            self.cols, self.width = layout(first.rstrip(b"\r")), len(first) + 1
+        rtl = decode(block, self.cols, self.width)
+        masks = {name: (1 << (4 * n if base == 16 else 1)) - 1
+                 for name, _, n, base in self.cols}
+        step = self.system.step
+        c = self.system.cache
+        got = zip(*(rtl[name].tolist() for name in OUTPUTS))
+        inputs = zip(rtl["rden"].tolist(), rtl["wren"].tolist(),
+                     rtl["address"].tolist(), rtl["din"].tolist())
+        out_masks = [masks[name] for name in OUTPUTS]
+        for i, ((rden, wren, address, din), rtl_out) in enumerate(zip(inputs, got)):
+            step(rden, wren, address, din)
+            model = (c.hit_miss, c.mrden, c.mwren, c.q, c.mrdaddress, c.mwraddress, c.mdout)
+            if any(m & k != r for m, k, r in zip(model, out_masks, rtl_out)):
+                raise Divergence(self.report(i, rtl, model, masks))
+            self.requests += c.hit_miss and (rden or wren)
+        self.cycles += len(rtl["rden"])
+
+    def report(self, i, rtl, model, masks):
+        """Both sides of line ``i`` of the batch and the addressed set."""
+        p, c = self.system.params, self.system.cache
+        row = {name: int(col[i]) for name, col in rtl.items()}
+        show = lambda v, name: "x" if v < 0 else f"{v:0{(masks[name].bit_length() + 3) // 4}x}"
+        rw = "WR" if row["wren"] else "RD" if row["rden"] else "--"
+        lines = [f"divergence at cycle {self.cycles + i} after reset, "
+                 f"model state {STATE_NAMES[c.state]}",
+                 f"  request {rw} address {show(row['address'], 'address')} "
+                 f"din {show(row['din'], 'din')}",
+                 f"  {'signal':<12}{'rtl':>10}{'model':>10}"]
+        for name, m in zip(OUTPUTS, model):
+            r = row[name]
+            lines.append(f"  {name:<12}{show(r, name):>10}{show(m & masks[name], name):>10}"
+                         + ("  <--" if r != m & masks[name] else ""))
+        _, index, _ = p.split(row["address"] if row["address"] >= 0 else 0)
+        lines.append(f"  set {index} after the edge ({p.NWAYS} ways)")
+        lines.append(f"  {'way':<5}{'rtl v d lru tag':>18}{'model v d lru tag':>20}   model data")
+        for w in range(p.NWAYS):
+            line = (index << c._way_shift) + w
+            r = " ".join(show(row[f"{f}{w}"], f"{f}{w}") for f in ("valid", "dirty", "lru", "tag"))
+            m = f"{c.valid[line]} {c.dirty[line]} {c.lru[line]:x} {c.tag[line]:0{(p.TAG_WIDTH + 3) // 4}x}"
+            data = " ".join(f"{c.data[line * c._wpb + k]:08x}" for k in range(c._wpb))
+            lines.append(f"  {w:<5}{r:>18}{m:>20}   {data}")
+        return "\n".join(lines)
+
+
+class TbCosim:
+    """Steps a system model along the log of a random-stimulus tb and
+    compares every line.  Subclasses name the log columns (``inputs`` and
+    ``outputs``), build the model from the tb parameters and implement
+    ``step()`` (returns the requests that saw hit_miss) and
+    ``model_outputs()``."""
+
+    TB = None
+    INPUTS = OUTPUTS = ()
+
+    def __init__(self, params):
+        self.params = params
+        self.inputs, self.outputs = list(self.INPUTS), list(self.OUTPUTS)
+        self.cycles = self.requests = 0
+        self.cols = self.width = None
+
+    @staticmethod
+    def cache_params(p, prefix=""):
+        """``CacheParams`` from the tb parameters ``<prefix>NWAYS`` etc."""
+        return CacheParams(**{k: p[prefix + k] for k in (
+            "NWAYS", "NSETS", "MWIDTH", "INDEX_WIDTH", "TAG_WIDTH", "OFFSET_WIDTH", "BURST", "PLRU")})
+
+    @staticmethod
+    def latency_ram(p, width):
+        """The tb's LatencyRam, zeroed like the RTL one."""
+        return LatencyRamModel(width, p["ADDR_WIDTH"], p["LATENCY"], p["JITTER"],
+                               COL_BITS=p["COL_BITS"], OUTSTANDING=p["OUTSTANDING"])
+
+    def feed(self, block):
+        """Compare a block of whole lines; raises ``Divergence``."""
+        names = self.inputs + self.outputs
+        if self.cols is None:
+            first = block[:block.index(b"\n")]
+            tokens = first.rstrip(b"\r").split(b" ")
+            if len(tokens) != len(names):
+                raise ValueError(f"not a {self.TB} cosim log line: {first!r}")
+            self.cols, offset = [], 0
+            for name, tok in zip(names, tokens):
+                self.cols.append((name, offset, len(tok), 16))
+                offset += len(tok) + 1
+            self.width = len(first) + 1
+        rtl = decode(block, self.cols, self.width)
+        masks = [(1 << 4 * n) - 1 for _, _, n, _ in self.cols[len(self.inputs):]]
+        n_in = len(self.inputs)
+        for i, row in enumerate(zip(*(rtl[name].tolist() for name in names))):
+            self.requests += self.step(row[:n_in])
+            model = self.model_outputs()
+            if any(m & k != r for m, k, r in zip(model, masks, row[n_in:])):
+                raise Divergence(self.report(i, row, model, masks))
+        self.cycles += len(rtl[names[0]])
+
+    def report(self, i, row, model, masks):
+        """Both sides of line ``i`` of the batch."""
+        n_in = len(self.inputs)
+        show = lambda v, k: "x" if v < 0 else f"{v:0{(k.bit_length() + 3) // 4}x}"
+        lines = [f"divergence at cycle {self.cycles + i} after reset",
+                 "  " + " ".join(f"{name}={'x' if v < 0 else f'{v:x}'}"
+                                 for name, v in zip(self.inputs, row))]
+        lines.append(f"  {'signal':<16}{'rtl':>18}{'model':>18}")
+        for name, r, m, k in zip(self.outputs, row[n_in:], model, masks):
+            lines.append(f"  {name:<16}{show(r, k):>18}{show(m & k, k):>18}"
+                         + ("  <--" if r != m & k else ""))
+        return "\n".join(lines + self.state())
+
+    def state(self):
+        """Extra model state for ``report()``, as lines."""
+        return []
+
+
+class BankedCosim(TbCosim):
+    """tb_banked_cache.v on ``BankedCacheSystem``."""
+
+    TB = "tb_banked_cache"
+    INPUTS = ("rden_a", "wren_a", "address_a", "din_a", "rden_b", "wren_b", "address_b", "din_b")
+    OUTPUTS = ("hit_miss_a", "q_a", "hit_miss_b", "q_b", "mrden", "mwren", "mrdaddress",
+               "mwraddress", "mdout", "mready", "mvalid", "mq", "bank_conflicts")
+
+    def __init__(self, params):
+        super().__init__(params)
+        p = params
+        self.system = BankedCacheSystem(self.cache_params(p), p["NBANKS"],
+                                        ram=self.latency_ram(p, p["MWIDTH"]),
+                                        rq_slots=p["RQ_SLOTS"])
+        # Out of reset, before the banks have cleared their sets
+        for c in self.system.banks:
+            c.reset()
+        self.system.ram.reset()
+
+    def step(self, i):
+        s = self.system
+        s.step(i[0:4], i[4:8])
+        return int(bool(s.hit_miss_a and (i[0] or i[1]))) + int(bool(s.hit_miss_b and (i[4] or i[5])))
+
+    def model_outputs(self):
+        s = self.system
+        _, mrden, mwren, mrdaddress, mwraddress, mdout = s.mem_port()
+        return (s.hit_miss_a, s.q_a, s.hit_miss_b, s.q_b, mrden, mwren, mrdaddress,
+                mwraddress, mdout, s.ram.ready, s.ram.valid_out, s.ram.data_out, s.conflicts)
+
+    def state(self):
+        s = self.system
+        return [f"  model: bank states {' '.join(STATE_NAMES[c.state] for c in s.banks)}, "
+                f"memory port bank {s.mem_owner}, reads in flight for banks {list(s.rq)}"]
+
+
+class HierarchyCosim(TbCosim):
+    """tb_cache_hierarchy.v on ``HierarchySystem``."""
+
+    TB = "tb_cache_hierarchy"
+    INPUTS = ("rden", "wren", "address", "din")
+    OUTPUTS = ("hit_miss", "q", "l1_mrden", "l1_mwren", "l1_mready", "l1_mvalid", "l1_snoop",
+               "l1_snoop_address", "l2_rden", "l2_wren", "l2_address", "l2_hit_miss", "l2_snoop",
+               "mrden", "mwren", "mrdaddress", "mwraddress", "mdout", "mready", "mvalid", "mq",
+               "l1_misses", "l2_misses", "back_invals")
+
+    def __init__(self, params):
+        super().__init__(params)
+        p = params
+        l2 = replace(self.cache_params(p, "L2_"), HANDSHAKE=p["HANDSHAKE"])
+        ram = self.latency_ram(p, l2.MWIDTH) if p["HANDSHAKE"] else None
+        self.system = HierarchySystem(self.cache_params(p, "L1_"), l2, p["INCLUSION"],
+                                      ram_depth=p["ADDR_WIDTH"], ram=ram)
+        # Out of reset, before the levels have cleared their sets
+        for level in (self.system.l1, self.system.l2):
+            level.reset()
+
+    def step(self, i):
+        self.system.step(*i)
+        return int(bool(self.system.l1.hit_miss and (i[0] or i[1])))
+
+    def model_outputs(self):
+        s = self.system
+        l1, l2, b, ram = s.l1, s.l2, s.bridge, s.ram
+        l2_rden, l2_wren, l2_address, _ = b.outputs(l2.hit_miss)
+        return (l1.hit_miss, l1.q, l1.mrden, l1.mwren, b.mready, b.mvalid, b.l1_snoop,
+                b.l1_snoop_address if b.l1_snoop else 0, l2_rden, l2_wren, l2_address,
+                l2.hit_miss, b.l2_snoop, l2.mrden, l2.mwren, l2.mrdaddress, l2.mwraddress,
+                l2.mdout, ram.ready, ram.valid_out, ram.data_out, l1.demand_misses,
+                l2.demand_misses, b.back_invals)
+
+    def state(self):
+        s = self.system
+        return [f"  model: L1 {STATE_NAMES[s.l1.state]}, L2 {STATE_NAMES[s.l2.state]}, "
+                f"bridge state {s.bridge.bstate}, back-invalidations queued "
+                f"{[f'{a:x}' for a in s.bridge.bi]}"]
+
+
+class CoherentCosim(TbCosim):
+    """tb_coherent_caches.v on ``CoherentSystem``."""
+
+    TB = "tb_coherent_caches"
+    OUTPUTS = ("mrden", "mwren", "mrdaddress", "mwraddress", "mdout", "mready", "mvalid", "mq",
+               "bus_reads", "bus_readx", "invalidations", "interventions")
+    CORE_INPUTS = ("rden", "wren", "address", "din")
+    CORE_OUTPUTS = ("hit_miss", "q", "snoop", "mgnt", "demand_misses")
+
+    def __init__(self, params):
+        super().__init__(params)
+        p = params
+        n = self.ncores = p["NCORES"]
+        self.inputs = [f"{name}{c}" for c in range(n) for name in self.CORE_INPUTS]
+        self.outputs = [f"{name}{c}" for c in range(n) for name in self.CORE_OUTPUTS] + self.outputs
+        self.system = CoherentSystem(self.cache_params(p), n, ram=self.latency_ram(p, p["MWIDTH"]))
+        # Out of reset, before the caches have cleared their sets
+        for c in self.system.caches:
+            c.reset()
+
+    def step(self, i):
+        reqs = [i[4 * c:4 * c + 4] for c in range(self.ncores)]
+        self.system.step(reqs)
+        return sum(1 for c, (rden, wren, _, _) in zip(self.system.caches, reqs)
+                   if c.hit_miss and (rden or wren))
+
+    def model_outputs(self):
+        s = self.system
+        bus, ram = s.bus, s.ram
+        c_mem = [(c.mdout, c.mrdaddress, c.mrden, c.mwraddress, c.mwren) for c in s.caches]
+        own_mwren = c_mem[bus.owner][4]
+        out = []
+        for k, c in enumerate(s.caches):
+            inp = bus.core_inputs(k, own_mwren, ram.data_out, ram.ready, ram.valid_out)
+            out += [c.hit_miss, c.q, inp[3], inp[6], c.demand_misses]
+        mdout, mrdaddress, mrden, mwraddress, mwren = bus.mem_outputs(c_mem)
+        return out + [mrden, mwren, mrdaddress, mwraddress, mdout, ram.ready, ram.valid_out,
+                      ram.data_out, bus.bus_reads, bus.bus_readx, bus.invalidations,
+                      bus.interventions]
+
+    def state(self):
+        s = self.system
+        return [f"  model: cache states {' '.join(STATE_NAMES[c.state] for c in s.caches)}, "
+                f"bus state {s.bus.xstate} owner {s.bus.owner} line {s.bus.x_addr:x}"]
+
+
+# --tb name -> TbCosim
+TBS = {"banked": BankedCosim, "hierarchy": HierarchyCosim, "coherent": CoherentCosim}
+
+
+def tb_cosim(header):
+    """The ``TbCosim`` of a log's "# <tb> NAME=value ..." first line."""
+    tokens = header.decode().split()
+    by_module = {c.TB: c for c in TBS.values()}
+    if len(tokens) < 2 or tokens[0] != "#" or tokens[1] not in by_module:
+        raise ValueError(f"not a cosim log header: {header!r}")
+    return by_module[tokens[1]]({k: int(v) for k, v in (t.split("=") for t in tokens[2:])})
+
+
+def compare(stream, cosim, batch=BATCH):
+    """Feed a binary stream of log lines to ``cosim`` in batches."""
+    rest = b""
+    while True:
+        block = stream.read(batch * 80)
+        if not block:
+            break
+        block = rest + block
+        cut = block.rfind(b"\n") + 1
+        block, rest = block[:cut], block[cut:]
+        if block:
+            cosim.feed(block)
+    if rest.strip():
+        cosim.feed(rest + b"\n")
+
+
+def run_rtl(addresses, writes, data, cosim, tb_params=None):
+    """Run tb_cache_system.v on a trace with the cosim log on a FIFO,
+    comparing while it runs."""
+    from bench_workloads import RtlBench
+    if shutil.which("iverilog") is None:
+        sys.exit("iverilog not found: run tb_cache_system.v with +cosim=<file> and pass --log")
+    rtl = RtlBench(tb_params)
+    try:
+        fifo = os.path.join(rtl.dir, "cosim.fifo")
+        os.mkfifo(fifo)
+        memh = rtl.stimulus(addresses, writes, data)
+        proc = subprocess.Popen(rtl.command(memh, "+cosim=" + fifo), cwd=rtl.dir,
+                                stdout=subprocess.DEVNULL)
+        try:
+            with open(fifo, "rb") as f:
+                compare(f, cosim)
+        finally:
+            proc.kill()
+            proc.wait()
+    finally:
+        rtl.close()
+
+
+def run_tb(tb, tb_params=None, plusargs=()):
+    """Run a random-stimulus tb with the cosim log on a FIFO, comparing
+    while it runs; returns its ``TbCosim``.  The tb's own summary line goes
+    to stdout."""
+    if shutil.which("iverilog") is None:
+        sys.exit(f"iverilog not found: run {tb}.v with +cosim=<file> and pass --log")
+    d = tempfile.mkdtemp(prefix="cosim_")
+    try:
+        vvp = os.path.join(d, "tb.vvp")
+        overrides = [f"-P{tb}.{k}={v}" for k, v in (tb_params or {}).items()]
+        subprocess.run(["iverilog", "-o", vvp, *overrides, os.path.join(ROOT, "design.v"),
+                        os.path.join(ROOT, tb + ".v")], check=True)
+        fifo = os.path.join(d, "cosim.fifo")
+        os.mkfifo(fifo)
+        proc = subprocess.Popen(["vvp", "-n", vvp, "-none", "+cosim=" + fifo, *plusargs], cwd=d)
+        try:
+            with open(fifo, "rb") as f:
+                cosim = tb_cosim(f.readline())
+                compare(f, cosim)
+            proc.wait()
+        finally:
+            proc.kill()
+            proc.wait()
+    finally:
+        shutil.rmtree(d, ignore_errors=True)
+    return cosim
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("trace", nargs="?", help="binary trace to run")
+    ap.add_argument("--workload", help="bench_workloads.py workload to run instead")
+    ap.add_argument("--accesses", type=int, default=50_000, help="accesses of --workload")
+    ap.add_argument("--log", help="compare an existing +cosim log ('-' = stdin) instead")
+    ap.add_argument("--handshake", action="store_true",
+                    help="Cache HANDSHAKE = 1 on a LatencyRam (tb parameter HANDSHAKE)")
+    ap.add_argument("--latency", type=int, default=1, help="LatencyRam LATENCY")
+    ap.add_argument("--jitter", type=int, default=0, help="LatencyRam JITTER")
+    ap.add_argument("--col-bits", type=int, default=0, help="LatencyRam COL_BITS (row buffer)")
+    ap.add_argument("--outstanding", type=int, default=4, help="LatencyRam OUTSTANDING")
+    ap.add_argument("--tb", choices=sorted(TBS), help="run a random-stimulus testbench instead")
+    ap.add_argument("--seed", type=int, help="--tb stimulus seed (+seed)")
+    ap.add_argument("--requests", type=int, help="--tb requests per port (+requests)")
+    ap.add_argument("-P", dest="param", action="append", default=[], metavar="NAME=VALUE",
+                    help="--tb parameter override, repeatable")
+    args = ap.parse_args()
+
+    ram = tb_params = None
+    if args.handshake:
+        ram = dict(LATENCY=args.latency, JITTER=args.jitter, COL_BITS=args.col_bits,
+                   OUTSTANDING=args.outstanding)
+        tb_params = dict(HANDSHAKE=1, **ram)
+    elif (args.latency, args.jitter, args.col_bits, args.outstanding) != (1, 0, 0, 4):
+        ap.error("the LatencyRam timing needs --handshake")
+    if args.tb is None and (args.seed is not None or args.requests is not None or args.param):
+        ap.error("--seed, --requests and -P go with --tb")
+    t = time.perf_counter()
+    try:
+        if args.tb:
+            plusargs = [f"+{k}={v}" for k, v in (("seed", args.seed), ("requests", args.requests))
+                        if v is not None]
+            tb_params = dict(kv.split("=", 1) for kv in args.param)
+            cosim = run_tb(TBS[args.tb].TB, tb_params, plusargs)
+        elif args.log:
+            f = sys.stdin.buffer if args.log == "-" else open(args.log, "rb")
+            with f:
+                # The random-stimulus tbs start with a header line
+                cosim = tb_cosim(f.readline()) if f.peek(1)[:1] == b"#" else Cosim(ram=ram)
+                compare(f, cosim)
+        else:
+            cosim = Cosim(ram=ram)
+            if args.workload:
+                from bench_workloads import workload
+                addresses, writes = workload(args.workload, args.accesses, 16 << 10)
+                data = np.random.default_rng(1).integers(0, 1 << 32, len(addresses), dtype=np.uint32)
+            elif args.trace:
+                from trace_format import open_trace
+                trace = open_trace(args.trace)
+                addresses, writes, data = trace["address"], trace["op"], trace["data"]
+            else:
+                ap.error("give a trace, --workload or --log")
+            run_rtl(addresses, writes, data, cosim, tb_params)
+    except Divergence as e:
+        print(e)
+        sys.exit(1)
+    seconds = time.perf_counter() - t
+    print(f"{cosim.cycles} cycles, {cosim.requests} requests: RTL and model agree "
+          f"({cosim.cycles / max(seconds, 1e-9):.0f} cycles/s)")
+
+
+if __name__ == "__main__":
+    main()
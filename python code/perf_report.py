@@ -0,0 +1,115 @@
+"""
+Decode the ``Cache`` performance counters (PERF = 1) into a report.
+
+The counters are read through the CSR port (map in design.v and the
+``PERF_*`` constants of cache_model.py).  tb_cache_system.v reads all of
+them at the end of a run and prints one ``perf <addr> <value>`` line each
+(hex), so a simulation log can be decoded directly; the same counters come
+out of the Python model for a trace, with the addresses cut to the tb's
+ADDR_WIDTH bits as the tb does.
+
+    vvp sim.vvp +trace=x.memh | python perf_report.py -     # RTL run
+    python perf_report.py sim.log
+    python perf_report.py --trace x.trc                      # model run (TB_PARAMS)
+"""
+
+import argparse
+import sys
+from dataclasses import replace
+
+from cache_model import (PERF_CLEAR, PERF_COUNTERS, PERF_EVICTIONS, PERF_READ_HITS,
+                         PERF_READ_MISSES, PERF_STATE, PERF_WRITE_HITS, PERF_WRITE_MISSES,
+                         PERF_WRITEBACKS, STATE_NAMES, TB_PARAMS, TB_RAM_DEPTH,
+                         CacheSystem)
+
+
+def parse_log(lines):
+    """Counter values from the ``perf <addr> <value>`` lines of a log."""
+    values = [0] * PERF_COUNTERS
+    for line in lines:
+        fields = line.split()
+        if len(fields) == 3 and fields[0] == "perf":
+            addr = int(fields[1], 16)
+            if addr < PERF_COUNTERS:
+                values[addr] = int(fields[2], 16)
+    return values
+
+
+def model_counters(path, params=TB_PARAMS, ram_depth=TB_RAM_DEPTH, limit=None):
+    """Counter values after replaying a binary trace through the model.
+
+    tb_cache_system.v drives only the low ADDR_WIDTH (``ram_depth``) bits of
+    every trace address, so the model gets the same."""
+    from trace_format import open_trace
+    trace = open_trace(path)[:limit]
+    system = CacheSystem(replace(params, PERF=1), ram_depth=ram_depth)
+    system.reset()
+    system.cache.csr_write(PERF_CLEAR)   # leave out the INIT cycles
+    addresses = trace["address"] & ((1 << ram_depth) - 1)
+    system.run(addresses.tolist(), trace["op"].tolist(), trace["data"].tolist())
+    return [system.cache.csr_read(a) for a in range(PERF_COUNTERS)]
+
+
+def decode(values):
+    """Counter values (indexed by CSR address) to a dict of named counts
+    and the derived rates."""
+    rh, wh = values[PERF_READ_HITS], values[PERF_WRITE_HITS]
+    rm, wm = values[PERF_READ_MISSES], values[PERF_WRITE_MISSES]
+    states = {name: values[PERF_STATE + s] for s, name in enumerate(STATE_NAMES)}
+    cycles = sum(states.values())
+    reads, writes = rh + rm, wh + wm
+    accesses = reads + writes
+    misses = rm + wm
+    return dict(
+        read_hits=rh, write_hits=wh, read_misses=rm, write_misses=wm,
+        writebacks=values[PERF_WRITEBACKS], evictions=values[PERF_EVICTIONS],
+        accesses=accesses, cycles=cycles, states=states,
+        hit_rate=(rh + wh) / max(accesses, 1),
+        read_miss_rate=rm / max(reads, 1),
+        write_miss_rate=wm / max(writes, 1),
+        # Cycles the FSM was away from IDLE per miss (write-backs, fetches,
+        # buffer drains and prefetches included)
+        miss_penalty=(cycles - states["IDLE"]) / max(misses, 1),
+        writebacks_per_miss=values[PERF_WRITEBACKS] / max(misses, 1),
+    )
+
+
+def report(r):
+    lines = [
+        f"accesses     {r['accesses']:>12}   hit rate        {r['hit_rate']:.4f}",
+        f"read hits    {r['read_hits']:>12}   read miss rate  {r['read_miss_rate']:.4f}",
+        f"write hits   {r['write_hits']:>12}   write miss rate {r['write_miss_rate']:.4f}",
+        f"read misses  {r['read_misses']:>12}   miss penalty    {r['miss_penalty']:.2f} cycles",
+        f"write misses {r['write_misses']:>12}   writebacks/miss {r['writebacks_per_miss']:.3f}",
+        f"writebacks   {r['writebacks']:>12}",
+        f"evictions    {r['evictions']:>12}",
+        f"cycles       {r['cycles']:>12}",
+        "",
+        f"{'state':<12}{'cycles':>12}{'share':>8}",
+    ]
+    for name, n in r["states"].items():
+        lines.append(f"{name:<12}{n:>12}{n / max(r['cycles'], 1):>8.1%}")
+    return "\n".join(lines)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("log", nargs="?", help="simulation log with perf lines ('-' = stdin)")
+    ap.add_argument("--trace", help="binary trace to run through the model instead")
+    ap.add_argument("--limit", type=int, help="records of the trace")
+    args = ap.parse_args()
+    if args.trace:
+        values = model_counters(args.trace, limit=args.limit)
+    elif args.log:
+        if args.log == "-":
+            values = parse_log(sys.stdin)
+        else:
+            with open(args.log) as f:
+                values = parse_log(f)
+    else:
+        ap.error("give a log file or --trace")
+    print(report(decode(values)))
+
+
+if __name__ == "__main__":
+    main()
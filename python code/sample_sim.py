@@ -0,0 +1,325 @@
+"""
+Sampled simulation of huge traces: estimate miss rate and cycles from a few
+hundred representative intervals instead of the whole trace.
+
+    python sample_sim.py big.trc                         # 30 clusters x 3 samples
+    python sample_sim.py big.trc --interval 1000000 --clusters 20 --per-cluster 4
+    python sample_sim.py big.trc --model cycle           # CacheSystem.run() per sample
+    python sample_sim.py big.trc --full                  # also run it all, to see the error
+
+The trace (trace_format.py, mmapped) is cut into intervals of --interval
+records.  Traces hold data addresses only, with no PCs, so there are no basic
+block vectors.  Each interval gets an address-signature vector instead: the
+4 KiB pages it touches hashed into --dims buckets, plus locality shares.  The
+signature is built from only the first --signature-share of the interval,
+so that pass reads a fraction of the file.  k-means groups the vectors into
+--clusters phases.
+
+Each cluster is sampled with its representative interval (the one nearest
+its centre) and --per-cluster - 1 random members.  Every sample starts from
+an empty cache, is warmed up with the --warmup records before it, and is
+then measured.  The representative is not a random draw, so it is a stratum
+of its own (one interval, known exactly); the rest of its cluster is a
+stratum estimated from the random members.  The strata means, weighted by
+size in records, give the estimate.  The reported 95% interval adds two
+parts:
+- sampling: the stratified-sampling interval, from the variance of the
+  random members with a finite-population correction.  Clusters with one
+  random member use the pooled variance; when every cluster has one, that is
+  the mean square of random member minus representative, an upper estimate.
+- warm-up: lines filled into empty ways while a sample is measured, per
+  record.  A cold cache only misses more than the full run, and only on such
+  fills, so with LRU this bounds the bias of the miss rate (for cycles, the
+  miss cycles of those fills; the other policies take it as an estimate).
+
+If the samples with their warm-ups would simulate as many records as the
+trace has, the whole trace is simulated instead, with a warning.
+"""
+
+import argparse
+import sys
+import time
+from dataclasses import replace
+
+import numpy as np
+
+from cache_model import CacheParams, CacheSystem
+from trace_format import CHUNK, open_trace
+from trace_sim import HIT_CYCLES, MISS_CYCLES, POLICIES, TraceSimulator
+
+Z95 = 1.96
+
+
+def signatures(trace, interval, params, dims=32, share=1 / 8):
+    """``(vectors, lengths)``: one address-signature row per interval and
+    its record count.
+
+    A row is the interval's accesses to 4 KiB pages hashed into ``dims``
+    buckets (normalized), followed by four locality features in [0, 1]:
+    distinct lines and distinct pages per access, the share of accesses to
+    the same or the next line, and the share of writes.  Hashing pages
+    rather than lines keeps the size of the footprint in the histogram.
+    Random accesses over 16 KiB and over 4 MiB both give a flat line
+    histogram, but they cover a different number of page buckets."""
+    n = len(trace)
+    count = -(-n // interval)
+    lengths = np.full(count, interval, dtype=np.int64)
+    lengths[-1] = n - (count - 1) * interval
+    look = max(1, int(interval * share))
+    bits = (dims - 1).bit_length()
+    page_shift = np.uint64(max(0, 12 - params.OFFSET_WIDTH))
+    vectors = np.zeros((count, dims + 4))
+    per_chunk = max(1, CHUNK // look)
+    for first in range(0, count, per_chunk):
+        ids = range(first, min(count, first + per_chunk))
+        parts = [trace[i * interval:i * interval + min(look, lengths[i])] for i in ids]
+        sizes = np.array([len(p) for p in parts])
+        part = np.concatenate(parts)
+        rows = len(parts)
+        row = np.repeat(np.arange(rows), sizes)
+        line = part["address"].astype(np.uint64) >> np.uint64(params.OFFSET_WIDTH)
+        bucket = (((line >> page_shift) * np.uint64(0x9E3779B1)) & np.uint64(0xFFFFFFFF)) >> np.uint64(32 - bits)
+        hist = np.bincount(row * dims + bucket.astype(np.int64) % dims,
+                           minlength=rows * dims).reshape(rows, dims)
+        v = vectors[first:first + rows]
+        v[:, :dims] = hist / sizes[:, None]
+        for k, key in enumerate((line, line >> page_shift)):
+            keys = (row.astype(np.uint64) << np.uint64(48)) | (key & np.uint64((1 << 48) - 1))
+            keys.sort()
+            first_seen = np.concatenate(([True], keys[1:] != keys[:-1]))
+            v[:, dims + k] = np.bincount((keys[first_seen] >> np.uint64(48)).astype(np.int64),
+                                         minlength=rows) / sizes
+        step = np.diff(line.astype(np.int64), prepend=0)
+        near = ((step == 0) | (step == 1)) & (np.diff(row, prepend=-1) == 0)
+        v[:, dims + 2] = np.bincount(row, weights=near, minlength=rows) / sizes
+        v[:, dims + 3] = np.bincount(row, weights=part["op"] != 0, minlength=rows) / sizes
+    return vectors, lengths
+
+
+def kmeans(x, k, iters=100, seed=0):
+    """``(labels, centres)`` of Lloyd's k-means with k-means++ seeding."""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(x))
+    centres = [x[rng.integers(len(x))]]
+    d2 = ((x - centres[0]) ** 2).sum(axis=1)
+    for _ in range(1, k):
+        p = d2 / d2.sum() if d2.sum() > 0 else None
+        centres.append(x[rng.choice(len(x), p=p)])
+        d2 = np.minimum(d2, ((x - centres[-1]) ** 2).sum(axis=1))
+    centres = np.array(centres)
+    labels = None
+    xx = (x * x).sum(axis=1)[:, None]
+    for _ in range(iters):
+        # |x - c|^2 without an intervals x clusters x dims temporary
+        dist = xx - 2 * x @ centres.T + (centres * centres).sum(axis=1)
+        new = dist.argmin(axis=1)
+        if labels is not None and (new == labels).all():
+            break
+        labels = new
+        for c in range(k):
+            members = x[labels == c]
+            if len(members):
+                centres[c] = members.mean(axis=0)
+    return labels, centres
+
+
+def pick(x, labels, centres, per_cluster, seed=0):
+    """``{cluster: [interval, ...]}``: the interval nearest each centre
+    first, then random other members."""
+    rng = np.random.default_rng(seed)
+    samples = {}
+    for c in range(len(centres)):
+        members = np.flatnonzero(labels == c)
+        if not len(members):
+            continue
+        rep = members[((x[members] - centres[c]) ** 2).sum(axis=1).argmin()]
+        rest = members[members != rep]
+        extra = rng.choice(rest, min(per_cluster - 1, len(rest)), replace=False)
+        samples[c] = [int(rep)] + sorted(int(i) for i in extra)
+    return samples
+
+
+def measure(trace, start, stop, warmup, params, model="fast", policy="lru"):
+    """``(miss rate, cycles per access, cold fills per access)`` of
+    ``trace[start:stop]`` on a cache warmed up with the ``warmup`` records
+    before it.  Cold fills are lines that went into an empty way."""
+    warm = trace[max(0, start - warmup):start]
+    part = trace[start:stop]
+    n = max(len(part), 1)
+    if model == "fast":
+        sim = TraceSimulator(params, policy)
+        if len(warm):
+            sim.feed(warm["address"], warm["op"])
+        valid = np.count_nonzero(sim.valid)
+        r = sim.feed(part["address"], part["op"])
+        return r.miss_rate, r.amat, (np.count_nonzero(sim.valid) - valid) / n
+    system = CacheSystem(params)
+    system.reset()
+    if len(warm):
+        system.run(warm["address"].tolist(), warm["op"].tolist(), warm["data"].tolist())
+    valid = sum(system.cache.valid)
+    _, misses, _, cycles = system.run(part["address"].tolist(), part["op"].tolist(),
+                                      part["data"].tolist())
+    return misses / n, cycles / n, (sum(system.cache.valid) - valid) / n
+
+
+def estimate(values, samples, labels, lengths):
+    """Stratified estimate ``(mean, half-width of the 95% interval)`` of a
+    per-record rate from ``{interval: value}``.
+
+    ``samples[c][0]``, the representative, is a stratum of one interval;
+    the random members ``samples[c][1:]`` estimate the rest of cluster
+    ``c``.  A cluster without random members stands in for its rest with
+    the representative and the pooled variance; with no random members at
+    all the half-width is nan."""
+    total = lengths.sum()
+    strata = []
+    for c, ids in samples.items():
+        members = labels == c
+        rep = ids[0]
+        rest = (lengths[members].sum() - lengths[rep]) / total
+        v = np.array([values[i] for i in ids[1:]])
+        strata.append((lengths[rep] / total, values[rep], rest, v, int(members.sum()) - 1))
+    within = [((v - v.mean()) ** 2).sum() if len(v) else 0.0 for *_, v, _ in strata]
+    dof = sum(max(len(v) - 1, 0) for *_, v, _ in strata)
+    single = [(v[0] - value) ** 2 for _, value, _, v, _ in strata if len(v) == 1]
+    if dof:
+        pooled = sum(within) / dof
+    elif single:
+        pooled = float(np.mean(single))
+    else:
+        pooled = float("nan")
+    mean = var = 0.0
+    for (rep_weight, value, weight, v, size), ss in zip(strata, within):
+        mean += rep_weight * value
+        if not size:
+            continue
+        mean += weight * (v.mean() if len(v) else value)
+        k = max(len(v), 1)
+        s2 = ss / (k - 1) if k > 1 else pooled
+        var += weight * weight * s2 / k * (1 - k / size)
+    return mean, Z95 * var ** 0.5
+
+
+def sample(trace, params=CacheParams(), interval=100_000, clusters=30, per_cluster=3,
+           warmup=None, dims=32, share=1 / 8, model="fast", policy="lru", seed=0):
+    """Sampled run of a trace; returns a dict with the estimates.
+
+    When ``clusters * per_cluster * (interval + warmup)`` records are at
+    least the trace, the whole trace is simulated instead: the dict then
+    has ``full`` set and zero-width intervals."""
+    warmup = interval if warmup is None else warmup
+    n = len(trace)
+    intervals = -(-n // interval)
+    planned = min(clusters, intervals) * per_cluster * (interval + warmup)
+    if planned >= n:
+        miss_rate, cpa = full(trace, params, model, policy)
+        return dict(records=n, intervals=intervals, clusters=0, samples=0, simulated=n,
+                    planned=planned, full=True,
+                    miss_rate=miss_rate, miss_rate_ci=0.0, miss_rate_warmup=0.0,
+                    cycles_per_access=cpa, cycles_per_access_ci=0.0,
+                    cycles_per_access_warmup=0.0, cycles=cpa * n, cycles_ci=0.0)
+    x, lengths = signatures(trace, interval, params, dims, share)
+    labels, centres = kmeans(x, clusters, seed=seed)
+    samples = pick(x, labels, centres, per_cluster, seed)
+    miss, cpa, cold = {}, {}, {}
+    simulated = 0
+    for ids in samples.values():
+        for i in ids:
+            start = i * interval
+            miss[i], cpa[i], cold[i] = measure(trace, start, start + lengths[i], warmup,
+                                               params, model, policy)
+            simulated += lengths[i] + min(warmup, start)
+    miss_rate, miss_ci = estimate(miss, samples, labels, lengths)
+    cycles, cycles_ci = estimate(cpa, samples, labels, lengths)
+    miss_warmup = estimate(cold, samples, labels, lengths)[0]
+    cycles_warmup = miss_warmup * (MISS_CYCLES + params.BURST - 1 - HIT_CYCLES)
+    return dict(records=n, intervals=len(lengths), clusters=len(samples),
+                samples=sum(len(s) for s in samples.values()), simulated=int(simulated),
+                planned=planned, full=False,
+                miss_rate=miss_rate, miss_rate_ci=miss_ci + miss_warmup,
+                miss_rate_warmup=miss_warmup,
+                cycles_per_access=cycles, cycles_per_access_ci=cycles_ci + cycles_warmup,
+                cycles_per_access_warmup=cycles_warmup,
+                cycles=cycles * n, cycles_ci=(cycles_ci + cycles_warmup) * n)
+
+
+def full(trace, params=CacheParams(), model="fast", policy="lru"):
+    """``(miss rate, cycles per access)`` of the whole trace, chunk by chunk."""
+    if model == "fast":
+        sim = TraceSimulator(params, policy)
+    else:
+        system = CacheSystem(params)
+        system.reset()
+    misses = cycles = 0
+    for i in range(0, len(trace), CHUNK):
+        part = trace[i:i + CHUNK]
+        if model == "fast":
+            r = sim.feed(part["address"], part["op"])
+            misses += r.misses
+            cycles += r.cycles
+        else:
+            _, m, _, c = system.run(part["address"].tolist(), part["op"].tolist(),
+                                    part["data"].tolist())
+            misses += m
+            cycles += c
+    return misses / max(len(trace), 1), cycles / max(len(trace), 1)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("trace")
+    ap.add_argument("--interval", type=int, default=100_000, help="records per interval")
+    ap.add_argument("--clusters", type=int, default=30, help="k of k-means")
+    ap.add_argument("--per-cluster", type=int, default=3, help="samples per cluster")
+    ap.add_argument("--warmup", type=int, help="warm-up records per sample (default: --interval)")
+    ap.add_argument("--dims", type=int, default=32, help="signature buckets")
+    ap.add_argument("--signature-share", type=float, default=1 / 8,
+                    help="part of each interval read for its signature")
+    ap.add_argument("--model", choices=("fast", "cycle"), default="fast",
+                    help="trace_sim.TraceSimulator or CacheSystem.run()")
+    ap.add_argument("--policy", choices=POLICIES, default="lru", help="replacement (fast model)")
+    ap.add_argument("--ways", type=int, help="NWAYS (default: design.v's)")
+    ap.add_argument("--sets", type=int, help="NSETS (default: design.v's)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--full", action="store_true", help="also simulate the whole trace")
+    args = ap.parse_args()
+
+    params = CacheParams()
+    if args.ways or args.sets:
+        from sweep import make_params
+        params = make_params(args.ways or params.NWAYS, args.sets or params.NSETS, params.MWIDTH)
+    if args.model == "cycle":
+        params = replace(params, PLRU=int(args.policy == "plru"))
+    trace = open_trace(args.trace)
+
+    t = time.perf_counter()
+    r = sample(trace, params, args.interval, args.clusters, args.per_cluster, args.warmup,
+               args.dims, args.signature_share, args.model, args.policy, args.seed)
+    seconds = time.perf_counter() - t
+    if r["full"]:
+        print(f"warning: the samples would simulate {r['planned']} records, not fewer than "
+              f"the {r['records']} of the trace; simulated the whole trace", file=sys.stderr)
+        print(f"{r['records']} records, all simulated")
+    else:
+        print(f"{r['records']} records, {r['intervals']} intervals, {r['clusters']} clusters, "
+              f"{r['samples']} samples: {r['simulated']} records simulated "
+              f"({r['simulated'] / max(r['records'], 1):.2%})")
+    print(f"miss rate          {r['miss_rate']:.5f} +- {r['miss_rate_ci']:.5f} "
+          f"(warm-up {r['miss_rate_warmup']:.5f})")
+    print(f"cycles per access  {r['cycles_per_access']:.4f} +- {r['cycles_per_access_ci']:.4f} "
+          f"(warm-up {r['cycles_per_access_warmup']:.4f})")
+    print(f"cycles             {r['cycles']:.4g} +- {r['cycles_ci']:.3g}")
+    print(f"time               {seconds:.2f} s")
+    if args.full and not r["full"]:
+        t = time.perf_counter()
+        miss_rate, cpa = full(trace, params, args.model, args.policy)
+        full_seconds = time.perf_counter() - t
+        print(f"full run           miss rate {miss_rate:.5f}  cycles per access {cpa:.4f}  "
+              f"{full_seconds:.2f} s ({full_seconds / max(seconds, 1e-9):.1f}x)")
+        print(f"error              miss rate {r['miss_rate'] - miss_rate:+.5f}  "
+              f"cycles per access {r['cycles_per_access'] - cpa:+.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Parallel design-space sweep over Cache parameters.
+
+Every point of the NWAYS x NSETS x MWIDTH x replacement-policy grid is
+simulated with trace_sim.simulate() on a process pool.  The trace is copied
+once into a shared memory block; workers map it read-only instead of having
+it pickled to them with every task.
+
+    python sweep.py --ways 1,2,4,8 --sets 256,1024,4096 --mwidth 64,128 \
+        --policy lru,fifo -o sweep.csv trace.trc
+"""
+
+import argparse
+import csv
+import itertools
+import os
+import sys
+from multiprocessing import Pool, shared_memory
+
+import numpy as np
+
+from cache_model import CacheParams
+from trace_format import open_trace
+from trace_sim import POLICIES, simulate
+
+COLUMNS = ("NWAYS", "NSETS", "MWIDTH", "policy", "size_bytes",
+           "miss_rate", "misses", "writebacks", "amat")
+
+
+def make_params(nways, nsets, mwidth, width=32):
+    """``CacheParams`` with the address widths derived like design.v's defaults:
+    one block is MWIDTH/8 bytes of OFFSET, the rest of the address is TAG."""
+    offset_width = max(0, (mwidth // 8 - 1).bit_length())
+    index_width = (nsets - 1).bit_length()
+    if 1 << index_width != nsets:
+        raise ValueError(f"NSETS={nsets} is not a power of two")
+    return CacheParams(NWAYS=nways, NSETS=nsets, WIDTH=width, MWIDTH=mwidth,
+                       INDEX_WIDTH=index_width,
+                       TAG_WIDTH=width - index_width - offset_width,
+                       OFFSET_WIDTH=offset_width,
+                       WORD1=width // 8 - 1, WORD2=2 * width // 8 - 1)
+
+
+def grid(ways, sets, mwidths, policies):
+    """All ``(CacheParams, policy)`` points of the sweep."""
+    return [(make_params(w, s, m), p)
+            for w, s, m, p in itertools.product(ways, sets, mwidths, policies)]
+
+
+# ----------------------------------------------------------------------
+# Worker side
+# ----------------------------------------------------------------------
+_shm = None
+_trace = None
+
+
+def _attach(name, n):
+    global _shm, _trace
+    _shm = shared_memory.SharedMemory(name=name)
+    addresses = np.ndarray((n,), dtype=np.uint64, buffer=_shm.buf)
+    ops = np.ndarray((n,), dtype=np.bool_, buffer=_shm.buf, offset=8 * n)
+    addresses.flags.writeable = False
+    ops.flags.writeable = False
+    _trace = (addresses, ops)
+
+
+def _run_point(point):
+    params, policy = point
+    addresses, ops = _trace
+    r = simulate(addresses, ops, params, policy)
+    return {
+        "NWAYS": params.NWAYS,
+        "NSETS": params.NSETS,
+        "MWIDTH": params.MWIDTH,
+        "policy": policy,
+        "size_bytes": params.NWAYS * params.NSETS * params.MWIDTH // 8,
+        "miss_rate": r.miss_rate,
+        "misses": r.misses,
+        "writebacks": r.writebacks,
+        "amat": r.amat,
+    }
+
+
+# ----------------------------------------------------------------------
+# Driver
+# ----------------------------------------------------------------------
+def run_sweep(addresses, ops, points, processes=None):
+    """Simulate every ``(params, policy)`` point; returns one dict per point
+    (in the order of ``points``)."""
+    addresses = np.asarray(addresses, dtype=np.uint64)
+    n = addresses.size
+    ops = np.zeros(n, dtype=np.bool_) if ops is None else np.asarray(ops, dtype=np.bool_)
+
+    shm = shared_memory.SharedMemory(create=True, size=max(1, 9 * n))
+    try:
+        np.ndarray((n,), dtype=np.uint64, buffer=shm.buf)[:] = addresses
+        np.ndarray((n,), dtype=np.bool_, buffer=shm.buf, offset=8 * n)[:] = ops
+        with Pool(processes, initializer=_attach, initargs=(shm.name, n)) as pool:
+            return pool.map(_run_point, points, chunksize=1)
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def write_table(rows, out=sys.stdout, fmt="text"):
+    """Write sweep rows as CSV or as an aligned text table."""
+    if fmt == "csv":
+        writer = csv.DictWriter(out, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+        return
+    cells = [COLUMNS] + [
+        (str(r["NWAYS"]), str(r["NSETS"]), str(r["MWIDTH"]), r["policy"],
+         str(r["size_bytes"]), f"{r['miss_rate']:.5f}", str(r["misses"]),
+         str(r["writebacks"]), f"{r['amat']:.3f}")
+        for r in rows
+    ]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(COLUMNS))]
+    for row in cells:
+        out.write("  ".join(c.rjust(w) for c, w in zip(row, widths)) + "\n")
+
+
+def load_trace(path):
+    """Load ``(addresses, ops)`` from a binary trace (see trace_format.py), a
+    .npy file (addresses only) or a .npz file with ``addresses`` and optional
+    ``ops`` arrays."""
+    if not path.endswith((".npy", ".npz")):
+        trace = open_trace(path)
+        return trace["address"], trace["op"]
+    data = np.load(path)
+    if isinstance(data, np.ndarray):
+        return data, None
+    return data["addresses"], data["ops"] if "ops" in data else None
+
+
+def _int_list(text):
+    return [int(v, 0) for v in text.split(",")]
+
+
+def _policy_list(text):
+    policies = text.split(",")
+    for policy in policies:
+        if policy not in POLICIES:
+            raise argparse.ArgumentTypeError(
+                f"unknown policy {policy!r} (choose from {', '.join(POLICIES)})")
+    return policies
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sweep Cache parameters over a trace.")
+    parser.add_argument("trace", nargs="?", help="trace file (synthetic if omitted)")
+    parser.add_argument("--ways", type=_int_list, default=[1, 2, 4, 8],
+                        help="NWAYS values, comma-separated (default 1,2,4,8)")
+    parser.add_argument("--sets", type=_int_list, default=[256, 1024, 4096],
+                        help="NSETS values, comma-separated powers of two (default 256,1024,4096)")
+    parser.add_argument("--mwidth", type=_int_list, default=[64],
+                        help="MWIDTH values in bits, comma-separated (default 64)")
+    parser.add_argument("--policy", type=_policy_list, default=["lru"],
+                        help=f"replacement policies, comma-separated, of {', '.join(POLICIES)} (default lru)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="worker processes (default: one per CPU)")
+    parser.add_argument("-o", "--output", help="write CSV here instead of a table on stdout")
+    args = parser.parse_args(argv)
+
+    if args.trace:
+        addresses, ops = load_trace(args.trace)
+    else:
+        rng = np.random.default_rng(0)
+        n = 1_000_000
+        addresses = np.where(rng.random(n) < 0.9,
+                             rng.integers(0, 1 << 16, n),
+                             rng.integers(0, 1 << 24, n))
+        ops = rng.random(n) < 0.3
+
+    points = grid(args.ways, args.sets, args.mwidth, args.policy)
+    rows = run_sweep(addresses, ops, points, args.jobs)
+    if args.output:
+        with open(args.output, "w", newline="") as f:
+            write_table(rows, f, "csv")
+    else:
+        write_table(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Binary access-trace format shared by the RTL testbench and the Python models.
+
+A trace file is a 16-byte header followed by packed 9-byte records::
+
+    header : magic "CTRC" | version u8 | reserved (11 bytes)
+    record : address u32 LE | data u32 LE | op u8 (0 = read, 1 = write)
+
+The record count is implied by the file size, so traces can be appended to
+while they are written.  ``open_trace()`` maps the file with mmap and returns
+a NumPy structured view of the records: no parsing and no copy, and multi-GB
+traces are paged in on demand.  ``chunks()`` walks such a view in bounded
+pieces for consumers that need contiguous arrays.
+
+For the RTL the trace is converted to a $readmemh-compatible stimulus file
+(one ``{op[7:0], din[31:0], address[31:0]}`` hex word per line) that
+tb_cache_system.v streams with $fscanf.
+
+    python trace_format.py tb      tb_cache_system.trc   # the old hand-timed sequence
+    python trace_format.py memh    in.trc out.memh       # RTL stimulus
+    python trace_format.py info    in.trc                # record count, op mix
+    python trace_format.py replay  in.trc                # run through the Python models
+"""
+
+import mmap
+import sys
+
+import numpy as np
+
+MAGIC = b"CTRC"
+VERSION = 1
+HEADER_SIZE = 16
+
+OP_READ = 0
+OP_WRITE = 1
+
+RECORD = np.dtype([("address", "<u4"), ("data", "<u4"), ("op", "u1")])
+
+# Records converted per step by the chunked helpers
+CHUNK = 1 << 20
+
+
+def _header():
+    return MAGIC + bytes([VERSION]) + bytes(HEADER_SIZE - len(MAGIC) - 1)
+
+
+class TraceWriter:
+    """Append records to a trace file without holding the trace in memory."""
+
+    def __init__(self, path):
+        self._f = open(path, "wb")
+        self._f.write(_header())
+
+    def append(self, address, op=OP_READ, data=0):
+        rec = np.zeros(1, dtype=RECORD)
+        rec[0] = (address, data, op)
+        self._f.write(rec.tobytes())
+
+    def extend(self, addresses, ops=None, data=None):
+        n = len(addresses)
+        rec = np.empty(n, dtype=RECORD)
+        rec["address"] = addresses
+        rec["data"] = 0 if data is None else data
+        rec["op"] = OP_READ if ops is None else np.asarray(ops).astype(np.uint8)
+        self._f.write(rec.tobytes())
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_trace(path, addresses, ops=None, data=None):
+    """Write a whole trace given as arrays."""
+    with TraceWriter(path) as w:
+        for i in range(0, len(addresses), CHUNK):
+            w.extend(addresses[i:i + CHUNK],
+                     None if ops is None else ops[i:i + CHUNK],
+                     None if data is None else data[i:i + CHUNK])
+
+
+def open_trace(path):
+    """Map a trace file and return its records as a read-only NumPy view."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path}: not a cache trace file")
+        size = f.seek(0, 2)
+        if size == HEADER_SIZE:
+            return np.zeros(0, dtype=RECORD)
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    version = mm[len(MAGIC)]
+    if version != VERSION:
+        raise ValueError(f"{path}: unsupported trace version {version}")
+    n = (size - HEADER_SIZE) // RECORD.itemsize
+    return np.frombuffer(mm, dtype=RECORD, count=n, offset=HEADER_SIZE)
+
+
+def chunks(trace, size=CHUNK):
+    """Yield ``(addresses, ops, data)`` arrays of at most ``size`` records."""
+    for i in range(0, len(trace), size):
+        part = trace[i:i + size]
+        yield part["address"], part["op"], part["data"]
+
+
+def simulate_file(path, params=None, policy="lru"):
+    """Stream a trace file through ``trace_sim`` and return hit/miss totals
+    ``(accesses, misses, writebacks, cycles)``."""
+    from cache_model import CacheParams
+    from trace_sim import TraceSimulator
+
+    sim = TraceSimulator(params or CacheParams(), policy)
+    accesses = misses = writebacks = cycles = 0
+    for addresses, ops, _ in chunks(open_trace(path)):
+        r = sim.feed(addresses, ops)
+        accesses += r.accesses
+        misses += r.misses
+        writebacks += r.writebacks
+        cycles += r.cycles
+    return accesses, misses, writebacks, cycles
+
+
+def replay(system, path):
+    """Run a trace file through ``CacheSystem.run()`` (cache_model.py); returns
+    ``(hits, misses, writebacks, cycles)``."""
+    totals = [0, 0, 0, 0]
+    for addresses, ops, data in chunks(open_trace(path)):
+        part = system.run(addresses.tolist(), ops.tolist(), data.tolist())
+        totals = [a + b for a, b in zip(totals, part)]
+    return tuple(totals)
+
+
+def write_memh(trace, path):
+    """Write the ``$readmemh`` stimulus file used by tb_cache_system.v."""
+    with open(path, "w") as f:
+        for addresses, ops, data in chunks(trace):
+            f.write("".join(f"{o:02x}{d:08x}{a:08x}\n"
+                            for a, o, d in zip(addresses.tolist(), ops.tolist(), data.tolist())))
+
+
+def main(argv):
+    if len(argv) < 2:
+        sys.exit(__doc__)
+    cmd, args = argv[0], argv[1:]
+    if cmd == "tb":
+        from cache_model import TB_SEQUENCE
+        addresses, ops, data = zip(*TB_SEQUENCE)
+        write_trace(args[0], addresses, ops, data)
+    elif cmd == "memh":
+        write_memh(open_trace(args[0]), args[1])
+    elif cmd == "info":
+        trace = open_trace(args[0])
+        writes = sum(int(np.count_nonzero(o)) for _, o, _ in chunks(trace))
+        print(f"{len(trace)} records, {len(trace) - writes} reads, {writes} writes")
+    elif cmd == "replay":
+        import os
+        from cache_model import CacheSystem
+        system = CacheSystem()
+        system.ram.load_memh(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Test1.mem"))
+        hits, misses, writebacks, cycles = replay(system, args[0])
+        total = hits + misses
+        print(f"{total} accesses: {hits} hits, {misses} misses, {writebacks} writebacks, "
+              f"{cycles} cycles ({cycles / max(total, 1):.2f} cycles/access)")
+    else:
+        sys.exit(__doc__)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,317 @@
+"""
+NumPy trace-driven hit/miss simulator for the Cache in design.v.
+
+The whole trace is decoded into TAG / INDEX / OFFSET in one vectorized pass,
+using the same TAG_LOW / INDEX_LOW / OFFSET_WIDTH layout as the RTL.  Sets
+never interact, so accesses are grouped by set and every set is simulated on
+its own: the sets are stepped in lockstep ("round r" is the r-th access of
+every set), which turns the per-access work into NumPy operations across all
+sets.  Once only a few sets still have accesses left (skewed traces), the
+remaining tails are finished with a plain Python loop per set.
+
+Requests follow the same protocol as ``CacheSystem.access()`` in
+cache_model.py (the request is held until ``hit_miss``), so the per-access
+hit/miss and writeback results match the cycle-accurate model exactly.
+"""
+
+import random
+from dataclasses import dataclass
+
+import numpy as np
+
+from cache_model import CacheParams
+
+# Below this many active sets the lockstep rounds cost more than they save
+SCALAR_TAIL = 32
+
+# Replacement policies; "lru" and "plru" (tree pseudo-LRU, PLRU=1) are the
+# ones the RTL implements
+POLICIES = ("lru", "plru", "fifo", "random")
+
+# Cycles per request under the hold-until-hit_miss protocol (see the FSM),
+# for one-beat lines; every extra beat adds a FETCH (and WRITE_BACK) cycle
+HIT_CYCLES = 1
+MISS_CYCLES = 6       # IDLE, MISS, FETCH, FETCH_WAIT, REFILL, IDLE (hit)
+WRITEBACK_CYCLES = 1  # extra WRITE_BACK state for a dirty victim
+
+
+@dataclass
+class TraceResult:
+    """Per-access outcome of a trace, in the original trace order."""
+
+    hit: np.ndarray        # bool, True if the first lookup hit
+    writeback: np.ndarray  # bool, True if the access evicted a dirty line
+    burst: int = 1         # memory beats per line (CacheParams.BURST)
+    way: np.ndarray = None  # way that hit or was refilled
+
+    @property
+    def accesses(self):
+        return len(self.hit)
+
+    @property
+    def misses(self):
+        return int(self.accesses - np.count_nonzero(self.hit))
+
+    @property
+    def writebacks(self):
+        return int(np.count_nonzero(self.writeback))
+
+    @property
+    def miss_rate(self):
+        return self.misses / self.accesses if self.accesses else 0.0
+
+    @property
+    def cycles(self):
+        """Total clock cycles the RTL FSM needs for the trace (blocking,
+        without write buffer, victim cache or prefetcher: NMSHR = WBUF =
+        VICTIM = PREFETCH = 0)."""
+        hits = self.accesses - self.misses
+        extra = self.burst - 1
+        return (hits * HIT_CYCLES + self.misses * (MISS_CYCLES + extra)
+                + self.writebacks * WRITEBACK_CYCLES * self.burst)
+
+    @property
+    def amat(self):
+        """Average memory access time in cycles."""
+        return self.cycles / self.accesses if self.accesses else 0.0
+
+
+def split_addresses(addresses, params=CacheParams()):
+    """Vectorized ``address[TAG_HIGH:TAG_LOW]`` / ``[INDEX_HIGH:INDEX_LOW]`` /
+    ``[OFFSET_HIGH:0]`` for a whole trace."""
+    a = np.asarray(addresses, dtype=np.uint64) & np.uint64((1 << params.WIDTH) - 1)
+    tag = a >> np.uint64(params.TAG_LOW)
+    index = (a >> np.uint64(params.INDEX_LOW)) & np.uint64((1 << params.INDEX_WIDTH) - 1)
+    offset = a & np.uint64((1 << params.OFFSET_WIDTH) - 1)
+    return tag, index.astype(np.intp), offset
+
+
+class TraceSimulator:
+    """Set-state of a cache that traces can be fed to chunk by chunk.
+
+    Feeding a trace in several pieces gives exactly the same results as
+    feeding it at once, so traces larger than memory can be streamed.
+    """
+
+    def __init__(self, params=CacheParams(), policy="lru", seed=0):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown replacement policy {policy!r}")
+        self.params = params
+        self.policy = policy
+        shape = (params.NSETS, params.NWAYS)
+        self.tags = np.zeros(shape, dtype=np.uint64)
+        self.valid = np.zeros(shape, dtype=bool)
+        self.dirty = np.zeros(shape, dtype=bool)
+        # Per-set access number of the last use (LRU) or fill (FIFO)
+        self.stamp = np.zeros(shape, dtype=np.int64)
+        # Tree pseudo-LRU bits, heap order (bit 0 = root, 0 = victim on the left)
+        self.tree = np.zeros(params.NSETS, dtype=np.int64)
+        if policy == "plru" and params.NWAYS & (params.NWAYS - 1):
+            raise ValueError("tree pseudo-LRU needs a power-of-two NWAYS")
+        self.seen = np.zeros(params.NSETS, dtype=np.int64)
+        self.rng = np.random.default_rng(seed)
+        self.pick = random.Random(seed).randrange
+
+    def feed(self, addresses, ops=None):
+        """Simulate the next piece of the trace and return its ``TraceResult``.
+
+        ``addresses`` is an integer array of CPU addresses, ``ops`` an
+        optional array that is non-zero for writes (all reads when omitted).
+        """
+        params = self.params
+        tag, index, _ = split_addresses(addresses, params)
+        if tag.size and int(tag.max()) >> params.TAG_WIDTH:
+            raise ValueError("address tag does not fit in TAG_WIDTH bits")
+        n = tag.size
+        wren = np.zeros(n, dtype=bool) if ops is None else np.asarray(ops).astype(bool)
+
+        # Group by set, keeping program order inside every set (a stable sort
+        # of 16-bit keys is a radix sort in NumPy)
+        key = index.astype(np.uint16) if params.NSETS <= 1 << 16 else index
+        order = np.argsort(key, kind="stable")
+        s_tag = tag[order]
+        s_wren = wren[order]
+        counts = np.bincount(index, minlength=params.NSETS)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+        s_hit = np.zeros(n, dtype=bool)
+        s_wb = np.zeros(n, dtype=bool)
+        s_way = np.zeros(n, dtype=np.int8 if params.NWAYS <= 128 else np.int64)
+        self._simulate_sets(s_tag, s_wren, counts, starts, s_hit, s_wb, s_way)
+        self.seen += counts
+
+        hit = np.empty(n, dtype=bool)
+        wb = np.empty(n, dtype=bool)
+        hit[order] = s_hit
+        wb[order] = s_wb
+        way = np.empty_like(s_way)
+        way[order] = s_way
+        return TraceResult(hit, wb, params.BURST, way)
+
+    def _simulate_sets(self, s_tag, s_wren, counts, starts, s_hit, s_wb, s_way):
+        """Simulate every set; results are written into ``s_hit``/``s_wb``/``s_way``.
+
+        The RTL fills invalid ways first (lowest way number) and otherwise
+        evicts the way whose counter is 3.  Because every filled line is
+        touched by the held request right after REFILL, the counters always
+        rank the ways by recency, so a last-use stamp per way gives the same
+        victim.  FIFO keeps the stamp of the fill instead of the last use.
+        Tree pseudo-LRU walks the tree bits to a leaf for the victim and
+        points the bits on the path of every accessed way away from it.
+        """
+        nways = self.params.NWAYS
+        lru = self.policy == "lru"
+        rand = self.policy == "random"
+        plru = self.policy == "plru"
+        levels = nways.bit_length() - 1
+        rng = self.rng
+
+        # State rows are kept in "most accesses first" order, so the sets
+        # still active in round r are always the first n_act rows (views, no
+        # gathers).  They are scattered back into set order at the end.
+        sets = np.argsort(-counts, kind="stable")
+        active = counts[sets]
+        first = starts[sets]
+        seen = self.seen[sets]
+        tags = self.tags[sets]
+        valid = self.valid[sets]
+        dirty = self.dirty[sets]
+        stamp = self.stamp[sets]
+        tree = self.tree[sets]
+        rows = np.arange(len(sets))
+
+        r = 0
+        while True:
+            n_act = int(np.searchsorted(-active, -r, side="left"))
+            if n_act == 0 or n_act < SCALAR_TAIL:
+                break
+            R = rows[:n_act]
+            p = first[:n_act] + r
+            t = s_tag[p]
+            w = s_wren[p]
+            v = valid[:n_act]
+
+            match = v & (tags[:n_act] == t[:, None])
+            hit = match.any(axis=1)
+            # Victim: first invalid way, else the least recently used one
+            inval = ~v
+            if rand:
+                full = rng.integers(0, nways, n_act)
+            elif plru:
+                bits = tree[:n_act]
+                node = np.zeros(n_act, dtype=np.int64)
+                for _ in range(levels):
+                    node = 2 * node + 1 + ((bits >> node) & 1)
+                full = node - (nways - 1)
+            else:
+                full = stamp[:n_act].argmin(axis=1)
+            victim = np.where(inval.any(axis=1), inval.argmax(axis=1), full)
+            way = np.where(hit, match.argmax(axis=1), victim)
+
+            miss = ~hit
+            old_dirty = dirty[R, way]
+            s_hit[p] = hit
+            s_wb[p] = miss & v[R, way] & old_dirty
+            s_way[p] = way
+            tags[R, way] = t
+            v[R, way] = True
+            dirty[R, way] = np.where(miss, w, old_dirty | w)
+            now = seen[:n_act] + (r + 1)
+            if lru:
+                stamp[R, way] = now
+            elif plru:
+                bits = tree[:n_act]
+                node = way + (nways - 1)
+                for _ in range(levels):
+                    parent = (node - 1) >> 1
+                    left = (node & 1).astype(np.int64)  # odd nodes are left children
+                    bits &= ~(1 << parent)
+                    bits |= left << parent
+                    node = parent
+            else:
+                stamp[R[miss], way[miss]] = now[miss]
+            r += 1
+
+        # Scalar tails of the sets that still have accesses left
+        way_list = list(range(nways))
+        pick = self.pick
+        for k in range(n_act):
+            t_list = tags[k].tolist()
+            v_list = valid[k].tolist()
+            d_list = dirty[k].tolist()
+            st_list = stamp[k].tolist()
+            bits = int(tree[k])
+            base = int(first[k])
+            offset = int(seen[k]) - base + 1
+            for i in range(base + r, base + int(active[k])):
+                t = int(s_tag[i])
+                w = bool(s_wren[i])
+                for way in way_list:
+                    if v_list[way] and t_list[way] == t:
+                        s_hit[i] = True
+                        s_way[i] = way
+                        d_list[way] = d_list[way] or w
+                        if lru:
+                            st_list[way] = i + offset
+                        break
+                else:
+                    if False in v_list:
+                        way = v_list.index(False)
+                    elif rand:
+                        way = pick(nways)
+                    elif plru:
+                        node = 0
+                        for _ in range(levels):
+                            node = 2 * node + 1 + ((bits >> node) & 1)
+                        way = node - (nways - 1)
+                    else:
+                        way = st_list.index(min(st_list))
+                    s_wb[i] = v_list[way] and d_list[way]
+                    s_way[i] = way
+                    t_list[way] = t
+                    v_list[way] = True
+                    d_list[way] = w
+                    st_list[way] = i + offset
+                if plru:
+                    node = way + nways - 1
+                    for _ in range(levels):
+                        parent = (node - 1) >> 1
+                        bits = (bits & ~(1 << parent)) | ((node & 1) << parent)
+                        node = parent
+            tags[k] = t_list
+            valid[k] = v_list
+            dirty[k] = d_list
+            stamp[k] = st_list
+            tree[k] = bits
+
+        self.tags[sets] = tags
+        self.valid[sets] = valid
+        self.dirty[sets] = dirty
+        self.stamp[sets] = stamp
+        self.tree[sets] = tree
+
+
+def simulate(addresses, ops=None, params=CacheParams(), policy="lru", seed=0):
+    """Simulate a whole trace from a cold cache and return a ``TraceResult``.
+
+    ``policy`` is one of ``POLICIES``; ``seed`` only matters for "random".
+    """
+    return TraceSimulator(params, policy, seed).feed(addresses, ops)
+
+
+if __name__ == "__main__":
+    import time
+
+    rng = np.random.default_rng(0)
+    n = 2_000_000
+    # Mostly a 64 KiB working set with some far references
+    addresses = np.where(rng.random(n) < 0.9,
+                         rng.integers(0, 1 << 16, n),
+                         rng.integers(0, 1 << 24, n))
+    ops = rng.random(n) < 0.3
+    t0 = time.perf_counter()
+    result = simulate(addresses, ops)
+    dt = time.perf_counter() - t0
+    print(f"{result.accesses} accesses, miss rate {result.miss_rate:.4f}, "
+          f"{result.writebacks} writebacks, AMAT {result.amat:.2f} cycles "
+          f"({result.accesses / dt / 1e6:.1f} M accesses/s)")
@@ -0,0 +1,349 @@
+"""
+Cache statistics from a tb_cache_system.v waveform (wave.vcd) in one pass.
+
+The testbench dumps every signal with $dumpvars, so the VCD grows to many
+GB.  This tool maps the file with mmap and never reads it into memory.  It
+keeps no signal database either.  The header gives the identifier codes of
+the seven ``Cache`` signals it needs: hit_miss, rden, wren, address, mrden,
+mwren and currentState.  NumPy then picks the value changes of just those
+codes out of the file, a window at a time.  Python only sees the tracked
+changes, not the clock toggles and the rest of the design.
+
+The clock is not tracked either.  Its first two rising edges give the period
+and phase, and the posedges between two changes are counted arithmetically.
+At every posedge the inputs are taken from before the edge and hit_miss from
+after it, as in the RTL:
+- a request starts on the first edge with rden / wren high;
+- it ends on the edge that sets hit_miss;
+- it is a hit when that is the edge it started on.
+
+Memory traffic is the mrden / mwren beats (mdout width from the header).
+State occupancy is the cycles spent in each FSM state.
+
+    python vcd_stats.py wave.vcd
+    python vcd_stats.py wave.vcd --scope tb_cache_system.dut_cache --period 10
+"""
+
+import argparse
+import mmap
+import re
+from collections import Counter
+
+import numpy as np
+
+from cache_model import STATE_NAMES
+
+SIGNALS = ("hit_miss", "rden", "wren", "address", "mrden", "mwren", "currentState")
+HIT_MISS, RDEN, WREN, ADDRESS, MRDEN, MWREN, STATE = range(len(SIGNALS))
+
+# x / z read as 0
+_XZ0 = bytes.maketrans(b"xzXZ", b"0000")
+
+# Bytes of the file looked at per NumPy pass
+CHUNK = 1 << 25
+
+_VALUE_CHARS = np.frombuffer(b"01xzXZ", dtype=np.uint8)
+
+_UNITS_NS = {"s": 1e9, "ms": 1e6, "us": 1e3, "ns": 1.0, "ps": 1e-3, "fs": 1e-6}
+
+
+def parse_header(mm):
+    """``(scopes, ns_per_unit, body)`` of a mapped VCD: ``scopes`` maps the
+    dotted scope path to ``{name: (code, width)}``; ``body`` is the offset
+    of the first value change."""
+    end = mm.find(b"$enddefinitions")
+    if end < 0:
+        raise ValueError("not a VCD file (no $enddefinitions)")
+    tokens = mm[:end].decode("ascii", "replace").split()
+    scopes, path = {}, []
+    ns_per_unit = 1.0
+    i = 0
+    while i < len(tokens):
+        tok = tokens[i]
+        if tok == "$scope":
+            path.append(tokens[i + 2])
+            scopes.setdefault(".".join(path), {})
+            i += 3
+        elif tok == "$upscope":
+            path.pop()
+        elif tok == "$var":
+            width, code, name = int(tokens[i + 2]), tokens[i + 3], tokens[i + 4]
+            scopes.setdefault(".".join(path), {}).setdefault(name, (code, width))
+            i += 5
+        elif tok == "$timescale":
+            spec = "".join(tokens[i + 1:tokens.index("$end", i)])
+            num = re.match(r"\d+", spec).group()
+            ns_per_unit = int(num) * _UNITS_NS[spec[len(num):]]
+        i += 1
+    return scopes, ns_per_unit, mm.find(b"\n", end) + 1
+
+
+def find_scope(scopes, scope=None):
+    """The scope holding the ``Cache`` signals: ``scope`` if given, else the
+    only one that has all of ``SIGNALS``."""
+    if scope is None:
+        found = [s for s, names in scopes.items() if all(n in names for n in SIGNALS)]
+        if len(found) != 1:
+            raise ValueError("pick the Cache scope with --scope: "
+                             + (", ".join(found) or "none has all of " + " ".join(SIGNALS)))
+        scope = found[0]
+    names = scopes.get(scope)
+    if names is None:
+        raise ValueError(f"no scope {scope!r}")
+    missing = [n for n in SIGNALS + ("clk",) if n not in names]
+    if missing:
+        raise ValueError(f"{scope}: no {', '.join(missing)}")
+    return scope, names
+
+
+def _time_before(mm, pos):
+    """Timestamp of the last ``#t`` line before ``pos``."""
+    h = mm.rfind(b"\n#", 0, pos)
+    return int(mm[h + 2:mm.find(b"\n", h + 2)]) if h >= 0 else 0
+
+
+def changes(mm, body, codes, chunk=CHUNK):
+    """Yield ``(time, code, value)`` for every value change of the given
+    identifier codes, in file order (x / z bits read as 0).
+
+    The file is scanned in windows of about ``chunk`` bytes with NumPy:
+    line ends are found with one comparison.  Only the lines whose last
+    character ends a tracked code are looked at more closely.  The
+    timestamps are parsed only for windows that have tracked changes."""
+    buf = np.frombuffer(mm, dtype=np.uint8)
+    last_chars = np.array(sorted({c[-1] for c in codes}), dtype=np.uint8)
+    time = 0
+    start = body - 1                     # the newline before the first line
+    while start < len(buf) - 1:
+        stop = mm.rfind(b"\n", start + 1, start + chunk) + 1 or len(buf)
+        win = buf[start:stop]
+        nl = np.flatnonzero(win == 10)
+        begins, ends = nl[:-1] + 1, nl[1:]
+        ends = ends - (win[ends - 1] == 13)                 # CRLF
+        stamps = begins[win[begins] == ord("#")]
+        cand = np.flatnonzero(np.isin(win[ends - 1], last_chars))
+        at_b, at_e, at_code = [], [], []
+        for i, code in enumerate(codes):
+            n = len(code)
+            b, e = begins[cand], ends[cand]
+            ok = e - b > n
+            for j, ch in enumerate(code):
+                ok &= win[np.maximum(e - n + j, 0)] == ch
+            sep = win[np.maximum(e - n - 1, 0)]
+            scalar = ok & (e - b == n + 1) & np.isin(win[b], _VALUE_CHARS)
+            vector = ok & (win[b] == ord("b")) & (sep == ord(" "))
+            hit = scalar | vector
+            at_b.append(b[hit])
+            at_e.append(e[hit] - n)
+            at_code += [i] * int(hit.sum())
+        line = np.concatenate(at_b)
+        if len(line):
+            order = np.argsort(line, kind="stable")
+            line = line[order]
+            code_at = np.concatenate(at_e)[order] + start
+            which = np.array(at_code)[order]
+            stamp = np.searchsorted(stamps, line) - 1
+            parsed = -1
+            for pos, code_pos, i, s in zip((line + start).tolist(), code_at.tolist(),
+                                           which.tolist(), stamp.tolist()):
+                if s > parsed:
+                    p = start + int(stamps[s]) + 1
+                    time = int(mm[p:p + 24].split(None, 1)[0])
+                    parsed = s
+                if mm[pos] == 98:                           # "b"
+                    value = int(mm[pos + 1:code_pos - 1].translate(_XZ0), 2)
+                else:
+                    value = int(mm[pos] == 49)              # "1"
+                yield time, codes[i], value
+        if len(stamps):
+            p = start + int(stamps[-1]) + 1
+            time = int(mm[p:p + 24].split(None, 1)[0])
+        start = stop - 1
+
+
+def clock(mm, body, code):
+    """``(period, phase)`` of the clock from its first two rising edges."""
+    rises = []
+    for time, _, value in changes(mm, body, [code], chunk=1 << 20):
+        if value:
+            rises.append(time)
+            if len(rises) == 2:
+                return rises[1] - rises[0], rises[0]
+    raise ValueError("the clock has fewer than two rising edges")
+
+
+class _Edges:
+    """Counters fed one posedge (or a run of identical posedges) at a time."""
+
+    def __init__(self):
+        self.states = [0] * len(STATE_NAMES)
+        self.read_beats = self.write_beats = 0
+        self.hits = [0, 0]                       # [read, write]
+        self.latency = [Counter(), Counter()]    # miss latency in cycles
+        self.start = None                        # edge the open request started on
+        self.write = 0
+
+    def run(self, k, n, v):
+        """``n`` posedges from edge ``k`` with the signal values ``v`` before
+        and after every one of them."""
+        self.states[v[STATE]] += n
+        self.read_beats += n * v[MRDEN]
+        self.write_beats += n * v[MWREN]
+        if not (v[RDEN] or v[WREN]):
+            self.start = None
+        elif v[HIT_MISS]:
+            self._done(k, v[WREN])
+            self.hits[v[WREN] != 0] += n - 1
+        elif self.start is None:
+            self.start, self.write = k, v[WREN] != 0
+
+    def edge(self, k, pre, post):
+        """Posedge ``k`` where some signals change: inputs and state before
+        it, hit_miss after it."""
+        self.states[pre[STATE]] += 1
+        self.read_beats += pre[MRDEN]
+        self.write_beats += pre[MWREN]
+        if not (pre[RDEN] or pre[WREN]):
+            self.start = None
+        elif post[HIT_MISS]:
+            self._done(k, pre[WREN])
+        elif self.start is None:
+            self.start, self.write = k, pre[WREN] != 0
+
+    def _done(self, k, wren):
+        if self.start is None:
+            self.hits[wren != 0] += 1
+        elif self.start == k:
+            self.hits[self.write] += 1
+        else:
+            self.latency[self.write][k - self.start + 1] += 1
+        self.start = None
+
+
+def analyze(path, scope=None, period=None):
+    """Stream a VCD and return the statistics as a dict.  ``period`` is the
+    clock period in ns (taken from the clock when None)."""
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        scopes, ns_per_unit, body = parse_header(mm)
+        scope, names = find_scope(scopes, scope)
+        clk_period, phase = clock(mm, body, names["clk"][0].encode())
+        if period is not None:
+            clk_period = round(period / ns_per_unit)
+        mwidth = names.get("mdout", (None, 32))[1]
+
+        # Identifier code -> tracked signals (Icarus gives connected nets one code)
+        index = {}
+        for i, name in enumerate(SIGNALS):
+            index.setdefault(names[name][0].encode(), []).append(i)
+
+        stats = _Edges()
+        cur = [0] * len(SIGNALS)
+        done_t = -1                      # changes up to this time are in cur
+        pending, t = [], 0
+
+        def edges_before(t_end, inclusive=False):
+            # Posedges in (done_t, t_end) (or (done_t, t_end]) with cur unchanged
+            first = max(0, (done_t - phase) // clk_period + 1)
+            stop = (t_end - phase) // clk_period
+            if not inclusive and t_end >= phase and (t_end - phase) % clk_period == 0:
+                stop -= 1
+            if stop >= first:
+                stats.run(first, stop - first + 1, cur)
+
+        def apply(t):
+            nonlocal done_t
+            edges_before(t)
+            if t >= phase and (t - phase) % clk_period == 0:
+                pre = cur[:]
+                for i, v in pending:
+                    cur[i] = v
+                stats.edge((t - phase) // clk_period, pre, cur)
+            else:
+                for i, v in pending:
+                    cur[i] = v
+            done_t = t
+
+        for time, code, value in changes(mm, body, list(index)):
+            if time != t:
+                if pending:
+                    apply(t)
+                    pending = []
+                t = time
+            for i in index[code]:
+                pending.append((i, value))
+        if pending:
+            apply(t)
+        end = _time_before(mm, len(mm))
+        if end > done_t:
+            edges_before(end, inclusive=True)
+    finally:
+        mm.close()
+
+    cycles = sum(stats.states)
+    read_misses, write_misses = (sum(c.values()) for c in stats.latency)
+    accesses = sum(stats.hits) + read_misses + write_misses
+    ns = cycles * clk_period * ns_per_unit
+    beat = mwidth // 8
+    return dict(
+        scope=scope, period_ns=clk_period * ns_per_unit, cycles=cycles,
+        read_hits=stats.hits[0], write_hits=stats.hits[1],
+        read_misses=read_misses, write_misses=write_misses, accesses=accesses,
+        hit_rate=sum(stats.hits) / max(accesses, 1),
+        read_latency=dict(sorted(stats.latency[0].items())),
+        write_latency=dict(sorted(stats.latency[1].items())),
+        read_bytes=stats.read_beats * beat, write_bytes=stats.write_beats * beat,
+        # bytes / ns = GB/s
+        read_bandwidth=stats.read_beats * beat / max(ns, 1e-9),
+        write_bandwidth=stats.write_beats * beat / max(ns, 1e-9),
+        states=dict(zip(STATE_NAMES, stats.states)),
+    )
+
+
+def _histogram(title, hist, width=40):
+    n = sum(hist.values())
+    if not n:
+        return [f"{title}: none"]
+    mean = sum(k * v for k, v in hist.items()) / n
+    lines = [f"{title}: {n} misses, mean {mean:.2f} cycles, max {max(hist)}"]
+    top = max(hist.values())
+    for k, v in hist.items():
+        lines.append(f"  {k:>6} {v:>10}  {'#' * max(1, round(v * width / top))}")
+    return lines
+
+
+def report(r):
+    lines = [
+        f"scope {r['scope']}, clock {r['period_ns']:g} ns, {r['cycles']} cycles",
+        "",
+        f"accesses     {r['accesses']:>12}   hit rate  {r['hit_rate']:.4f}",
+        f"read hits    {r['read_hits']:>12}   read misses  {r['read_misses']:>10}",
+        f"write hits   {r['write_hits']:>12}   write misses {r['write_misses']:>10}",
+        "",
+        *_histogram("read miss latency", r["read_latency"]),
+        *_histogram("write miss latency", r["write_latency"]),
+        "",
+        f"memory read  {r['read_bytes']:>12} B  {r['read_bytes'] / max(r['cycles'], 1):.3f} B/cycle"
+        f"  {r['read_bandwidth'] * 1e3:.1f} MB/s",
+        f"memory write {r['write_bytes']:>12} B  {r['write_bytes'] / max(r['cycles'], 1):.3f} B/cycle"
+        f"  {r['write_bandwidth'] * 1e3:.1f} MB/s",
+        "",
+        f"{'state':<12}{'cycles':>12}{'share':>8}",
+    ]
+    for name, n in r["states"].items():
+        lines.append(f"{name:<12}{n:>12}{n / max(r['cycles'], 1):>8.1%}")
+    return "\n".join(lines)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("vcd", nargs="?", default="wave.vcd")
+    ap.add_argument("--scope", help="dotted path of the Cache instance (default: the only one)")
+    ap.add_argument("--period", type=float, help="clock period in ns (default: from clk)")
+    args = ap.parse_args()
+    print(report(analyze(args.vcd, args.scope, args.period)))
+
+
+if __name__ == "__main__":
+    main()
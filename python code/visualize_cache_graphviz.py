@@ -1,11 +1,19 @@
-try:
+import os
+
+from cache_model import CacheParams
+
+def create_cache_schematic(params=CacheParams(), path=None):
     from graphviz import Digraph
-except ImportError:
-    print("Graphviz not installed. Please install it using 'pip install graphviz' and ensure Graphviz executables are in your PATH.")
-    exit(1)
 
-def create_cache_schematic():
-    dot = Digraph('CacheSchematic', comment='4-Way Set Associative Cache')
+    p = params
+    n_ways = p.NWAYS
+    size = p.NSETS * p.NWAYS * p.LINE_WIDTH
+    if p.WSEL_WIDTH > 1:
+        word_select = f"Offset[{p.OFFSET_HIGH}:{p.OFFSET_WIDTH - p.WSEL_WIDTH}]"
+    else:
+        word_select = f"Offset[{p.OFFSET_HIGH}]"
+
+    dot = Digraph('CacheSchematic', comment=f'{n_ways}-Way Set Associative Cache')
     # Orthogonal edges for schematic look
     dot.attr(rankdir='TB', splines='ortho', nodesep='1.2', ranksep='1.2', bgcolor='white')
     dot.attr('node', fontname='Helvetica', shape='none')
@@ -41,13 +49,13 @@ def create_cache_schematic():
     # ------------------------------------------------------------------
     params_label = f'''<<TABLE BORDER="1" CELLBORDER="0" CELLSPACING="0" CELLPADDING="5" BGCOLOR="white">
         <TR><TD COLSPAN="2" BGCOLOR="#37474F"><FONT COLOR="white"><B>Cache Parameters (Cache.v)</B></FONT></TD></TR>
-        <TR><TD ALIGN="LEFT">SIZE</TD><TD ALIGN="RIGHT">256 KB (32*1024*8)</TD></TR>
-        <TR><TD ALIGN="LEFT">NWAYS</TD><TD ALIGN="RIGHT">4</TD></TR>
-        <TR><TD ALIGN="LEFT">NSETS</TD><TD ALIGN="RIGHT">1024</TD></TR>
-        <TR><TD ALIGN="LEFT">BLOCK_SIZE</TD><TD ALIGN="RIGHT">64 bits</TD></TR>
-        <TR><TD ALIGN="LEFT">INDEX_WIDTH</TD><TD ALIGN="RIGHT">10</TD></TR>
-        <TR><TD ALIGN="LEFT">TAG_WIDTH</TD><TD ALIGN="RIGHT">19</TD></TR>
-        <TR><TD ALIGN="LEFT">OFFSET_WIDTH</TD><TD ALIGN="RIGHT">3</TD></TR>
+        <TR><TD ALIGN="LEFT">SIZE</TD><TD ALIGN="RIGHT">{size // 8192} KB ({size} bits)</TD></TR>
+        <TR><TD ALIGN="LEFT">NWAYS</TD><TD ALIGN="RIGHT">{p.NWAYS}</TD></TR>
+        <TR><TD ALIGN="LEFT">NSETS</TD><TD ALIGN="RIGHT">{p.NSETS}</TD></TR>
+        <TR><TD ALIGN="LEFT">BLOCK_SIZE</TD><TD ALIGN="RIGHT">{p.LINE_WIDTH} bits</TD></TR>
+        <TR><TD ALIGN="LEFT">INDEX_WIDTH</TD><TD ALIGN="RIGHT">{p.INDEX_WIDTH}</TD></TR>
+        <TR><TD ALIGN="LEFT">TAG_WIDTH</TD><TD ALIGN="RIGHT">{p.TAG_WIDTH}</TD></TR>
+        <TR><TD ALIGN="LEFT">OFFSET_WIDTH</TD><TD ALIGN="RIGHT">{p.OFFSET_WIDTH}</TD></TR>
     </TABLE>>'''
     dot.node('Legend', label=params_label, pos='0,0!')
 
@@ -57,9 +65,9 @@ def create_cache_schematic():
     # ------------------------------------------------------------------
     addr_label = f'''<<TABLE BORDER="0" CELLBORDER="1" CELLSPACING="0" CELLPADDING="8">
         <TR>
-            <TD BGCOLOR="{c_tag}" PORT="tag" WIDTH="150"><B>Tag [31:13]</B><BR/>(19 bits)</TD>
-            <TD BGCOLOR="{c_index}" PORT="index" WIDTH="100"><B>Index [12:3]</B><BR/>(10 bits)</TD>
-            <TD BGCOLOR="{c_offset}" PORT="offset" WIDTH="80"><B>Offset [2:0]</B><BR/>(3 bits)</TD>
+            <TD BGCOLOR="{c_tag}" PORT="tag" WIDTH="150"><B>Tag [{p.TAG_HIGH}:{p.TAG_LOW}]</B><BR/>({p.TAG_WIDTH} bits)</TD>
+            <TD BGCOLOR="{c_index}" PORT="index" WIDTH="100"><B>Index [{p.INDEX_HIGH}:{p.INDEX_LOW}]</B><BR/>({p.INDEX_WIDTH} bits)</TD>
+            <TD BGCOLOR="{c_offset}" PORT="offset" WIDTH="80"><B>Offset [{p.OFFSET_HIGH}:0]</B><BR/>({p.OFFSET_WIDTH} bits)</TD>
         </TR>
     </TABLE>>'''
     dot.node('Address', label=addr_label)
@@ -71,7 +79,7 @@ def create_cache_schematic():
     with dot.subgraph(name='cluster_main') as c:
         c.attr(style='invis')
         
-        for i in range(1, 5):
+        for i in range(1, n_ways + 1):
             way_id = f'Way{i}'
             
             # HTML Table
@@ -112,7 +120,7 @@ def create_cache_schematic():
                     <TD BORDER="0">...</TD><TD BORDER="0">...</TD><TD BORDER="0">...</TD><TD BORDER="0">...</TD><TD BORDER="0">...</TD><TD BORDER="0">...</TD>
                 </TR>
                 <TR>
-                    <TD>1023</TD>
+                    <TD>{p.NSETS - 1}</TD>
                     <TD BGCOLOR="{c_valid}"></TD>
                     <TD BGCOLOR="{c_dirty}"></TD>
                     <TD BGCOLOR="{c_lru}"></TD>
@@ -128,7 +136,7 @@ def create_cache_schematic():
     # 4. Logic (Comparators, Gates)
     # ------------------------------------------------------------------
     
-    for i in range(1, 5):
+    for i in range(1, n_ways + 1):
         # Comparator
         comp_id = f'Comp{i}'
         dot.node(comp_id, label='=', shape='circle', style='filled', fillcolor=c_comp, width='0.5', fixedsize='true')
@@ -145,7 +153,7 @@ def create_cache_schematic():
         dot.edge('Address:tag', comp_id, color=c_line_tag, penwidth='2.0')
         
         # Tag Way -> Comparator
-        dot.edge(f'Way{i}:tag_k', comp_id, label='19', color=c_line_tag, penwidth='2.0')
+        dot.edge(f'Way{i}:tag_k', comp_id, label=str(p.TAG_WIDTH), color=c_line_tag, penwidth='2.0')
         
         # Enable/Valid -> AND
         dot.edge(f'Way{i}:v_k', and_id, label='1', color=c_line_ctrl)
@@ -155,8 +163,8 @@ def create_cache_schematic():
 
 
     # Global Index routing (dashed)
-    for i in range(1, 5):
-        dot.edge('Address:index', f'Way{i}:v_k', style='dashed', color=c_line_index, label='10', constraint='false')
+    for i in range(1, n_ways + 1):
+        dot.edge('Address:index', f'Way{i}:v_k', style='dashed', color=c_line_index, label=str(p.INDEX_WIDTH), constraint='false')
 
 
     # ------------------------------------------------------------------
@@ -168,22 +176,18 @@ def create_cache_schematic():
     dot.node('HitMissOut', label='hit_miss', shape='plaintext', fontcolor=c_line_hit)
     
     # MUX
+    mux_inputs = "".join(f'<TD PORT="in{i + 1}">{i:0{p.LRU_WIDTH}b}</TD>' for i in range(n_ways))
     mux_label = f'''<<TABLE BORDER="0" CELLBORDER="1" CELLSPACING="0" BGCOLOR="{c_data}">
-    <TR><TD COLSPAN="4" PORT="top"><B>4-to-1 MUX</B></TD></TR>
-    <TR>
-        <TD PORT="in1">00</TD>
-        <TD PORT="in2">01</TD>
-        <TD PORT="in3">10</TD>
-        <TD PORT="in4">11</TD>
-    </TR>
-    <TR><TD COLSPAN="4" PORT="out">Data Width = 64</TD></TR>
+    <TR><TD COLSPAN="{n_ways}" PORT="top"><B>{n_ways}-to-1 MUX</B></TD></TR>
+    <TR>{mux_inputs}</TR>
+    <TR><TD COLSPAN="{n_ways}" PORT="out">Data Width = {p.LINE_WIDTH}</TD></TR>
     </TABLE>>'''
     dot.node('Mux', label=mux_label)
     
-    dot.node('OutputQ', label='q [31:0]', shape='note', style='filled', fillcolor=c_offset)
+    dot.node('OutputQ', label=f'q [{p.WIDTH - 1}:0]', shape='note', style='filled', fillcolor=c_offset)
 
     # Connections
-    for i in range(1, 5):
+    for i in range(1, n_ways + 1):
         and_id = f'And{i}'
         
         # Hit -> OR
@@ -193,23 +197,27 @@ def create_cache_schematic():
         dot.edge(and_id, 'Mux:top', color=c_line_hit, style='dotted')
         
         # Data -> Mux In
-        dot.edge(f'Way{i}:data_k', f'Mux:in{i}', color=c_line_data, label='64', penwidth='2.0')
+        dot.edge(f'Way{i}:data_k', f'Mux:in{i}', color=c_line_data, label=str(p.LINE_WIDTH), penwidth='2.0')
 
     # Final Output
     dot.edge('OrGate', 'HitMissOut', color=c_line_hit, penwidth='2.0')
     
     # Word Select Logic (Offset)
-    # Mux Out (64) -> Word Select -> Q (32)
+    # Mux Out (line) -> Word Select -> Q (word)
     dot.node('WordMux', label='Word Select', shape='invtrapezium', style='filled', fillcolor=c_offset)
     
-    dot.edge('Mux:out', 'WordMux', color=c_line_data, label='64')
-    dot.edge('Address:offset', 'WordMux', color=c_line_data, label='Offset[3]')
-    dot.edge('WordMux', 'OutputQ', color=c_line_data, label='32')
+    dot.edge('Mux:out', 'WordMux', color=c_line_data, label=str(p.LINE_WIDTH))
+    dot.edge('Address:offset', 'WordMux', color=c_line_data, label=word_select)
+    dot.edge('WordMux', 'OutputQ', color=c_line_data, label=str(p.WIDTH))
 
     # Render
-    output_filename = 'cache_schematic_graphviz_refined'
-    dot.render(output_filename, format='png', cleanup=True)
-    print(f"Schematic generated: {output_filename}.png")
+    output_filename, ext = os.path.splitext(path or 'cache_schematic_graphviz_refined.png')
+    dot.render(output_filename, format=ext[1:], cleanup=True)
+    print(f"Schematic generated: {output_filename}{ext}")
 
 if __name__ == "__main__":
-    create_cache_schematic()
+    try:
+        create_cache_schematic()
+    except ImportError:
+        print("Graphviz not installed. Please install it using 'pip install graphviz' and ensure Graphviz executables are in your PATH.")
+        exit(1)
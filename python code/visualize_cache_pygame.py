@@ -1,11 +1,54 @@
-import pygame
+"""
+Cache schematic driven by the Python model replaying a trace.
+
+    python visualize_cache_pygame.py                             # random workload, tb cache
+    python visualize_cache_pygame.py ../traces/tb_cache_system.trc
+    python visualize_cache_pygame.py --workload matmul --accesses 2000000
+    python visualize_cache_pygame.py --design                    # design.v defaults
+
+Every request of the trace goes through ``CacheSystem``.  The schematic shows
+the set addressed by the last request: the valid, dirty, LRU and tag bits of
+every way, and the word each way feeds to the multiplexor.  On a hit, the
+matching way, its comparator and its AND gate light up.  On a miss, the
+refilled way is marked.  A dirty victim is marked too, with the address of
+the line written back.
+
+    space              play / pause
+    right / left       one request forward / back
+    up / down          twice / half the requests per frame
+    home / end         start / end of the trace
+    page down / up     10% forward / back (or click the bar)
+    esc                quit
+
+The wires, gates and empty tables are drawn once, to a background surface.
+A frame redraws only the regions whose contents changed, restoring them from
+the background first, and passes just those rectangles to
+``pygame.display.update()``.  While playing, requests run in batches through
+``CacheSystem.run()``.  Batches are capped so a frame stays within its 60 FPS
+budget, and only the last request of a batch is shown.  Seeking restores the
+nearest of at most 64 model snapshots and replays from there.
+"""
+
+import argparse
+import copy
+import os
 import sys
+import time
+from dataclasses import dataclass
+
+import numpy as np
+import pygame
+
+from cache_model import TB_PARAMS, CacheParams, CacheSystem
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
 
 # Initialize Pygame
 pygame.init()
 
 # Constants
 WIDTH, HEIGHT = 1600, 1000
+FPS = 60
 BACKGROUND_COLOR = (255, 255, 255)
 TEXT_COLOR = (0, 0, 0)
 LINE_COLOR = (0, 0, 0)
@@ -40,15 +83,18 @@ COLOR_DATA_LINE = (63, 81, 181)     # #3F51B5 (Blue)
 COLOR_INDEX_LINE = (56, 142, 60)    # Green
 COLOR_TAG_LINE = (230, 74, 25)      # Dark Orange
 
+# Events of the last request
+COLOR_HIT = (105, 240, 174)         # #69F0AE (Green)
+COLOR_MISS = (255, 138, 128)        # #FF8A80 (Light Red)
+COLOR_WRITEBACK = (255, 171, 64)    # #FFAB40 (Orange)
+COLOR_PROGRESS = (144, 164, 174)    # #90A4AE (Blue Grey)
+
 # Fonts
 FONT_MAIN = pygame.font.SysFont('Arial', 14)
 FONT_BOLD = pygame.font.SysFont('Arial', 14, bold=True)
 FONT_LARGE = pygame.font.SysFont('Arial', 18, bold=True)
 FONT_SMALL = pygame.font.SysFont('Arial', 12)
 
-screen = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("Cache Hardware Schematic (Colorful)")
-
 def draw_text(surface, text, x, y, font=FONT_MAIN, color=TEXT_COLOR, align="center"):
     text_obj = font.render(str(text), True, color)
     rect = text_obj.get_rect()
@@ -66,198 +112,279 @@ def draw_box(surface, x, y, w, h, color, text=None, font=FONT_MAIN, border_width
     if text:
         draw_text(surface, text, x + w//2, y + h//2, font)
 
-def draw_comparator(surface, x, y, r=20):
-    pygame.draw.circle(surface, COLOR_COMP, (x, y), r)
+def draw_comparator(surface, x, y, r=20, color=COLOR_COMP):
+    pygame.draw.circle(surface, color, (x, y), r)
     pygame.draw.circle(surface, LINE_COLOR, (x, y), r, 2)
     draw_text(surface, "=", x, y, FONT_LARGE)
     return (x, y, r)
 
-def main():
-    running = True
-    clock = pygame.time.Clock()
 
-    while running:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
+@dataclass
+class Event:
+    """What the last replayed request did."""
+
+    position: int
+    address: int
+    wren: int
+    index: int
+    offset: int
+    hit: bool
+    way: int               # way that hit or was refilled
+    q: int
+    writeback: int = -1    # address of the dirty victim written back, or -1
+
+
+class Replay:
+    """A trace replayed through ``CacheSystem`` with seeking."""
+
+    SNAPSHOTS = 64
+
+    def __init__(self, params, addresses, writes, data, mem=None):
+        self.params = params
+        self.addresses, self.writes, self.data = addresses, writes, data
+        self.n = len(addresses)
+        self.system = CacheSystem(params)
+        self.system.reset()
+        if mem:
+            self.system.ram.load_memh(mem)
+        self.pos = self.hits = self.misses = self.writebacks = 0
+        self.last = None
+        # Snapshots every ``every`` requests, taken the first time a
+        # replay passes them
+        self.every = max(1 << 16, -(-self.n // self.SNAPSHOTS))
+        self.snapshots = {0: self._snapshot()}
+
+    def _snapshot(self):
+        return copy.deepcopy((self.system, self.hits, self.misses, self.writebacks))
+
+    def _moved(self, k, hits, misses, writebacks):
+        self.pos += k
+        self.hits += hits
+        self.misses += misses
+        self.writebacks += writebacks
+        if self.pos % self.every == 0 and self.pos not in self.snapshots:
+            self.snapshots[self.pos] = self._snapshot()
+
+    def advance(self, n):
+        """Run the next ``n`` requests.  The last one goes through
+        ``access()`` alone so that ``last`` describes it."""
+        n = min(n, self.n - self.pos)
+        while n > 1:
+            i = self.pos
+            j = i + min(n - 1, self.every - i % self.every)
+            hits, misses, writebacks, _ = self.system.run(
+                self.addresses[i:j].tolist(), self.writes[i:j].tolist(), self.data[i:j].tolist())
+            self._moved(j - i, hits, misses, writebacks)
+            n -= j - i
+        if n:
+            self._one()
+
+    def _one(self):
+        system, c, p = self.system, self.system.cache, self.params
+        i = self.pos
+        address, wren, din = int(self.addresses[i]), int(self.writes[i]), int(self.data[i])
+        tag, index, offset = c.decode(address)
+        base = index << c._way_shift
+        tags = [c.tag[base + w] for w in range(p.NWAYS)]
+        evictions = c.dirty_evictions
+        hit, q, _ = system.access(address, wren, din)
+        way = c.find(base, tag)
+        writeback = c.dirty_evictions - evictions
+        self.last = Event(i, address, wren, index, offset, hit, way, q,
+                          tags[way] << p.TAG_LOW | index << p.INDEX_LOW if writeback else -1)
+        self._moved(1, hit, not hit, writeback)
+
+    def seek(self, target):
+        """Replay up to request ``target`` (0 = before the first)."""
+        target = min(max(target, 0), self.n)
+        base = max(k for k in self.snapshots if k <= target)
+        if target < self.pos or base > self.pos:
+            self.system, self.hits, self.misses, self.writebacks = copy.deepcopy(self.snapshots[base])
+            self.pos = base
+            self.last = None
+        self.advance(target - self.pos)
+
+
+class Schematic:
+    """The cache drawing for one parameter set.
+
+    Everything that does not depend on the model state is drawn once to
+    ``background``; ``draw()`` repaints the regions that changed since the
+    last call and returns their rectangles."""
+
+    def __init__(self, params):
+        self.params = p = params
+        self.background = pygame.Surface((WIDTH, HEIGHT))
+        self.drawn = {}
+        self.regions = {}
+        surface = self.background
+        surface.fill(BACKGROUND_COLOR)
 
-        screen.fill(BACKGROUND_COLOR)
-        
         # ------------------------------------------------------------------
         # 1. Address Register (Top)
         # ------------------------------------------------------------------
         addr_x = WIDTH // 2 - 250
         addr_y = 50
         h = 40
-        
-        draw_text(screen, "Physical Address [31:0]", WIDTH//2, 20, FONT_LARGE)
-        
-        # Tag Box (19 bits)
-        draw_box(screen, addr_x, addr_y, 200, h, COLOR_ADDR_TAG, "Tag [31:13]", FONT_BOLD)
-        # Index Box (10 bits)
-        draw_box(screen, addr_x + 200, addr_y, 200, h, COLOR_ADDR_INDEX, "Index [12:3]", FONT_BOLD)
-        # Offset Box (3 bits)
-        draw_box(screen, addr_x + 400, addr_y, 100, h, COLOR_ADDR_OFFSET, "Offset [2:0]", FONT_BOLD)
-        
+        tag_high = p.TAG_LOW + p.TAG_WIDTH - 1
+
+        draw_text(surface, f"Physical Address [{p.WIDTH - 1}:0]", WIDTH//2, 20, FONT_LARGE)
+        self.address_fields = [
+            (pygame.Rect(addr_x, addr_y, 200, h), COLOR_ADDR_TAG, f"Tag [{tag_high}:{p.TAG_LOW}]"),
+            (pygame.Rect(addr_x + 200, addr_y, 200, h), COLOR_ADDR_INDEX,
+             f"Index [{p.TAG_LOW - 1}:{p.INDEX_LOW}]"),
+            (pygame.Rect(addr_x + 400, addr_y, 100, h), COLOR_ADDR_OFFSET,
+             f"Offset [{p.INDEX_LOW - 1}:0]"),
+        ]
+        for rect, color, label in self.address_fields:
+            draw_box(surface, *rect, color, label, FONT_BOLD)
+        self.regions["address"] = pygame.Rect(addr_x, addr_y, 500, h + 1)
+
         # Wires from Address
         tag_wire_start = (addr_x + 100, addr_y + h)
         index_wire_start = (addr_x + 300, addr_y + h)
-        
+
         # Bus Labels
-        pygame.draw.line(screen, COLOR_TAG_LINE, tag_wire_start, (tag_wire_start[0], 250), 3)
-        draw_text(screen, "/ 19", tag_wire_start[0] - 15, 120, FONT_SMALL, COLOR_TAG_LINE)
-        
-        pygame.draw.line(screen, COLOR_INDEX_LINE, index_wire_start, (index_wire_start[0], 180), 3)
-        draw_text(screen, "/ 10", index_wire_start[0] + 15, 120, FONT_SMALL, COLOR_INDEX_LINE)
+        pygame.draw.line(surface, COLOR_TAG_LINE, tag_wire_start, (tag_wire_start[0], 250), 3)
+        draw_text(surface, f"/ {p.TAG_WIDTH}", tag_wire_start[0] - 15, 120, FONT_SMALL, COLOR_TAG_LINE)
+
+        pygame.draw.line(surface, COLOR_INDEX_LINE, index_wire_start, (index_wire_start[0], 180), 3)
+        draw_text(surface, f"/ {p.INDEX_WIDTH}", index_wire_start[0] + 15, 120, FONT_SMALL, COLOR_INDEX_LINE)
 
         # ------------------------------------------------------------------
         # 2. Cache Ways (Tables)
         # ------------------------------------------------------------------
         way_y_start = 220
-        way_width = 300
         way_gap = 50
-        total_ways_width = 4 * way_width + 3 * way_gap
+        way_width = min(300, (WIDTH - 100) // p.NWAYS - way_gap)
+        total_ways_width = p.NWAYS * way_width + (p.NWAYS - 1) * way_gap
         start_x = (WIDTH - total_ways_width) // 2
-        
-        # Columns widths
-        col_idx_w = 60
-        col_v_w = 40
-        col_tag_w = 100
-        col_data_w = 100
-        
-        row_h = 30
-        
-        selected_row_y = 0 
-        
-        ways_info = [] 
-        
-        for i in range(4):
+
+        # Columns: Index, V, D, LRU, Tag, Data
+        self.columns = [way_width * w // 300 for w in (50, 25, 25, 40, 70, 90)]
+        headers = ["Index", "V", "D", "LRU", "Tag", "Data"]
+
+        row_h = self.row_h = 30
+        last_set = p.NSETS - 1
+
+        ways_info = []
+
+        for i in range(p.NWAYS):
             wx = start_x + i * (way_width + way_gap)
             wy = way_y_start
-            
-            # Header
-            draw_box(screen, wx, wy, col_idx_w, row_h, COLOR_WAY_HEADER, f"Index", FONT_BOLD)
-            draw_box(screen, wx+col_idx_w, wy, col_v_w, row_h, COLOR_WAY_HEADER, "V", FONT_BOLD)
-            draw_box(screen, wx+col_idx_w+col_v_w, wy, col_tag_w, row_h, COLOR_WAY_HEADER, f"Tag", FONT_BOLD)
-            draw_box(screen, wx+col_idx_w+col_v_w+col_tag_w, wy, col_data_w, row_h, COLOR_WAY_HEADER, "Data", FONT_BOLD)
-            
-            wy += row_h
-            
-            # Row 0
-            draw_box(screen, wx, wy, col_idx_w, row_h, COLOR_WAY_ROW_NORMAL, "0")
-            draw_box(screen, wx+col_idx_w, wy, col_v_w, row_h, COLOR_WAY_ROW_NORMAL, "")
-            draw_box(screen, wx+col_idx_w+col_v_w, wy, col_tag_w, row_h, COLOR_WAY_ROW_NORMAL, "")
-            draw_box(screen, wx+col_idx_w+col_v_w+col_tag_w, wy, col_data_w, row_h, COLOR_WAY_ROW_NORMAL, "")
-            wy += row_h
-            
-            # Row 1
-            draw_box(screen, wx, wy, col_idx_w, row_h, COLOR_WAY_ROW_NORMAL, "1")
-            draw_box(screen, wx+col_idx_w, wy, col_v_w, row_h, COLOR_WAY_ROW_NORMAL, "")
-            draw_box(screen, wx+col_idx_w+col_v_w, wy, col_tag_w, row_h, COLOR_WAY_ROW_NORMAL, "")
-            draw_box(screen, wx+col_idx_w+col_v_w+col_tag_w, wy, col_data_w, row_h, COLOR_WAY_ROW_NORMAL, "")
+
+            draw_text(surface, f"Way {i}", wx, wy - 20, FONT_BOLD, align="left")
+            self._row(surface, wx, wy, headers, [COLOR_WAY_HEADER] * 6, FONT_BOLD)
             wy += row_h
-            
+
+            # Rows 0 and 1
+            for row in ("0", "1"):
+                self._row(surface, wx, wy, [row], [COLOR_WAY_ROW_NORMAL] * 6)
+                wy += row_h
+
             # Dots
-            draw_text(screen, "...", wx + way_width//2, wy + 15, FONT_BOLD)
+            draw_text(surface, "...", wx + way_width//2, wy + 15, FONT_BOLD)
             wy += row_h
-            
-            # Selected Row (Index K)
+
+            # Selected row (the addressed set), filled in by draw()
             selected_row_y = wy + row_h//2
-            draw_box(screen, wx, wy, col_idx_w, row_h, COLOR_CELL_INDEX, "K", FONT_BOLD)
-            draw_box(screen, wx+col_idx_w, wy, col_v_w, row_h, COLOR_CELL_VALID, f"v{i+1}")
-            draw_box(screen, wx+col_idx_w+col_v_w, wy, col_tag_w, row_h, COLOR_CELL_TAG, f"tag{i+1}")
-            draw_box(screen, wx+col_idx_w+col_v_w+col_tag_w, wy, col_data_w, row_h, COLOR_CELL_DATA, f"mem{i+1}")
-            
-            # Points
-            v_pt = (wx + col_idx_w + col_v_w//2, wy + row_h//2)
-            tag_pt = (wx + col_idx_w + col_v_w + col_tag_w//2, wy + row_h//2)
-            data_pt = (wx + col_idx_w + col_v_w + col_tag_w + col_data_w//2, wy + row_h//2)
-            
+            self.regions[f"way{i}"] = pygame.Rect(wx - 2, wy - 2, way_width + 4, row_h + 4)
+
+            # Points (bottom edges of the selected row's cells)
+            x = wx + sum(self.columns[:1])
+            v_pt = (x + self.columns[1]//2, wy + row_h)
+            x = wx + sum(self.columns[:4])
+            tag_pt = (x + self.columns[4]//2, wy + row_h)
+            data_pt = (x + self.columns[4] + self.columns[5]//2, wy + row_h)
+
             ways_info.append({
+                'x': wx,
+                'y': wy,
                 'v': v_pt,
                 'tag': tag_pt,
                 'data': data_pt,
                 'way_center_x': wx + way_width//2,
                 'tag_center_x': tag_pt[0]
             })
-            
+
             wy += row_h
-            
+
             # Dots
-            draw_text(screen, "...", wx + way_width//2, wy + 15, FONT_BOLD)
+            draw_text(surface, "...", wx + way_width//2, wy + 15, FONT_BOLD)
             wy += row_h
-            
-            # Row 1023
-            draw_box(screen, wx, wy, col_idx_w, row_h, COLOR_WAY_ROW_NORMAL, "1023")
-            draw_box(screen, wx+col_idx_w, wy, col_v_w, row_h, COLOR_WAY_ROW_NORMAL, "")
-            draw_box(screen, wx+col_idx_w+col_v_w, wy, col_tag_w, row_h, COLOR_WAY_ROW_NORMAL, "")
-            draw_box(screen, wx+col_idx_w+col_v_w+col_tag_w, wy, col_data_w, row_h, COLOR_WAY_ROW_NORMAL, "")
-            
+
+            # Last row
+            self._row(surface, wx, wy, [str(last_set)], [COLOR_WAY_ROW_NORMAL] * 6)
+
+        self.ways_info = ways_info
+
         # ------------------------------------------------------------------
         # 3. Connections - Index & Tag
         # ------------------------------------------------------------------
         # Route Index Wire
-        pygame.draw.line(screen, COLOR_INDEX_LINE, index_wire_start, (index_wire_start[0], selected_row_y), 3)
-        pygame.draw.line(screen, COLOR_INDEX_LINE, (start_x - 50, selected_row_y), (start_x + total_ways_width, selected_row_y), 3) 
-        for i in range(4):
-            wx = start_x + i * (way_width + way_gap)
-            pygame.draw.circle(screen, COLOR_INDEX_LINE, (wx, selected_row_y), 5) 
-            
+        pygame.draw.line(surface, COLOR_INDEX_LINE, index_wire_start, (index_wire_start[0], selected_row_y), 3)
+        pygame.draw.line(surface, COLOR_INDEX_LINE, (start_x - 50, selected_row_y), (start_x + total_ways_width, selected_row_y), 3)
+        for info in ways_info:
+            pygame.draw.circle(surface, COLOR_INDEX_LINE, (info['x'], selected_row_y), 5)
+
         # Main Tag Bus Horizontal
-        pygame.draw.line(screen, COLOR_TAG_LINE, (tag_wire_start[0], 200), (WIDTH - 100, 200), 3)
-        pygame.draw.line(screen, COLOR_TAG_LINE, (tag_wire_start[0], 200), tag_wire_start, 3) 
-        
+        pygame.draw.line(surface, COLOR_TAG_LINE, (tag_wire_start[0], 200), (WIDTH - 100, 200), 3)
+        pygame.draw.line(surface, COLOR_TAG_LINE, (tag_wire_start[0], 200), tag_wire_start, 3)
+
         # ------------------------------------------------------------------
         # 4. Logic Gates (Below Ways)
         # ------------------------------------------------------------------
         logic_y_start = 550
-        
+
         mux_inputs = []
         hits = []
-        
+
         for i, info in enumerate(ways_info):
             # Comparator
             comp_x = info['tag_center_x']
             comp_y = logic_y_start
-            
+
             # Line from Way Tag to Comparator
-            pygame.draw.line(screen, COLOR_TAG_LINE, info['tag'], (comp_x, comp_y - 20), 2)
-            pygame.draw.circle(screen, COLOR_TAG_LINE, info['tag'], 3)
-            
+            pygame.draw.line(surface, COLOR_TAG_LINE, info['tag'], (comp_x, comp_y - 20), 2)
+            pygame.draw.circle(surface, COLOR_TAG_LINE, info['tag'], 3)
+
             # Line from Address Tag Bus to Comparator
-            pygame.draw.line(screen, COLOR_TAG_LINE, (comp_x - 15, 200), (comp_x - 15, comp_y - 20), 2)
-            pygame.draw.circle(screen, COLOR_TAG_LINE, (comp_x - 15, 200), 3) 
-            
-            draw_comparator(screen, comp_x, comp_y)
-            
+            pygame.draw.line(surface, COLOR_TAG_LINE, (comp_x - 15, 200), (comp_x - 15, comp_y - 20), 2)
+            pygame.draw.circle(surface, COLOR_TAG_LINE, (comp_x - 15, 200), 3)
+
             # AND Gate (Below Comparator)
             and_y = comp_y + 80
-            
+
             # Valid Bit Routing
-            pygame.draw.line(screen, LINE_COLOR, info['v'], (info['v'][0], and_y), 2)
-            pygame.draw.circle(screen, LINE_COLOR, info['v'], 3)
-            
+            pygame.draw.line(surface, LINE_COLOR, info['v'], (info['v'][0], and_y), 2)
+            pygame.draw.circle(surface, LINE_COLOR, info['v'], 3)
+
             and_x = (info['v'][0] + comp_x) // 2
-            
+
             # Connect Comparator Out -> And
-            pygame.draw.line(screen, LINE_COLOR, (comp_x, comp_y + 20), (comp_x, and_y), 2) 
-            pygame.draw.line(screen, LINE_COLOR, (comp_x, and_y), (and_x + 10, and_y), 2)
-            
+            pygame.draw.line(surface, LINE_COLOR, (comp_x, comp_y + 20), (comp_x, and_y), 2)
+            pygame.draw.line(surface, LINE_COLOR, (comp_x, and_y), (and_x + 10, and_y), 2)
+
             # Connect Valid -> And
-            pygame.draw.line(screen, LINE_COLOR, (info['v'][0], and_y), (and_x - 10, and_y), 2) 
-            
-            # Draw Gate
-            draw_box(screen, and_x - 20, and_y, 40, 30, COLOR_AND, "&")
-            
+            pygame.draw.line(surface, LINE_COLOR, (info['v'][0], and_y), (and_x - 10, and_y), 2)
+
+            # Comparator and gate are filled in by draw()
+            info['comp'] = (comp_x, comp_y)
+            info['and'] = pygame.Rect(and_x - 20, and_y, 40, 30)
+            draw_comparator(surface, comp_x, comp_y)
+            draw_box(surface, *info['and'], COLOR_AND, "&")
+            self.regions[f"gate{i}"] = pygame.Rect(comp_x - 21, comp_y - 21, 42, 42)
+            self.regions[f"and{i}"] = info['and'].inflate(2, 2)
+
             hits.append((and_x, and_y + 30))
-            
+
             # Data Routing for MUX
             data_x = info['data'][0]
             mux_inputs.append(data_x)
-            
-            pygame.draw.line(screen, COLOR_DATA_LINE, info['data'], (data_x, 700), 2)
-            pygame.draw.circle(screen, COLOR_DATA_LINE, info['data'], 3)
-            
+
+            pygame.draw.line(surface, COLOR_DATA_LINE, info['data'], (data_x, 700), 2)
+            pygame.draw.circle(surface, COLOR_DATA_LINE, info['data'], 3)
+
         # ------------------------------------------------------------------
         # 5. MUX & Final Output
         # ------------------------------------------------------------------
@@ -265,38 +392,247 @@ def main():
         mux_h = 60
         mux_x = WIDTH // 2 - mux_w // 2
         mux_y = 700
-        
-        draw_box(screen, mux_x, mux_y, mux_w, mux_h, COLOR_MUX, "4-to-1 Multiplexor", FONT_LARGE)
-        
+
+        draw_box(surface, mux_x, mux_y, mux_w, mux_h, COLOR_MUX, f"{p.NWAYS}-to-1 Multiplexor", FONT_LARGE)
+
         # Connect Data lines to MUX
         for dx in mux_inputs:
-            pygame.draw.line(screen, COLOR_DATA_LINE, (dx, 650), (dx, mux_y), 2)
-            
+            pygame.draw.line(surface, COLOR_DATA_LINE, (dx, 650), (dx, mux_y), 2)
+
         # OR Gate
         or_x = mux_x - 100
         or_y = mux_y + 20
-        draw_box(screen, or_x, or_y, 40, 40, COLOR_OR, "OR") 
-        
+        self.or_gate = pygame.Rect(or_x, or_y, 40, 40)
+        draw_box(surface, *self.or_gate, COLOR_OR, "OR")
+
         # Route Hits
         for hx, hy in hits:
             # Route to OR gate
-            pygame.draw.line(screen, COLOR_HIT_LINE, (hx, hy), (hx, or_y - 10), 2) 
-            pygame.draw.line(screen, COLOR_HIT_LINE, (hx, or_y - 10), (or_x + 20, or_y - 10), 2) 
-            pygame.draw.line(screen, COLOR_HIT_LINE, (or_x + 20, or_y - 10), (or_x + 20, or_y), 2) 
-            
+            pygame.draw.line(surface, COLOR_HIT_LINE, (hx, hy), (hx, or_y - 10), 2)
+            pygame.draw.line(surface, COLOR_HIT_LINE, (hx, or_y - 10), (or_x + 20, or_y - 10), 2)
+            pygame.draw.line(surface, COLOR_HIT_LINE, (or_x + 20, or_y - 10), (or_x + 20, or_y), 2)
+
             # Route to MUX (Select)
-            pygame.draw.line(screen, COLOR_HIT_LINE, (hx, hy + 20), (mux_x, hy + 80), 1)
-            
+            pygame.draw.line(surface, COLOR_HIT_LINE, (hx, hy + 20), (mux_x, hy + 80), 1)
+
         # Output OR Gate -> hit_miss
-        pygame.draw.line(screen, COLOR_HIT_LINE, (or_x + 20, or_y + 40), (or_x + 20, or_y + 80), 3)
-        draw_text(screen, "hit_miss", or_x + 20, or_y + 90, FONT_BOLD, COLOR_HIT_LINE)
-            
+        pygame.draw.line(surface, COLOR_HIT_LINE, (or_x + 20, or_y + 40), (or_x + 20, or_y + 80), 3)
+        draw_text(surface, "hit_miss", or_x + 20, or_y + 90, FONT_BOLD, COLOR_HIT_LINE)
+        self.regions["result"] = pygame.Rect(or_x - 60, or_y - 1, 160, 145)
+
         # Output Mux -> Data
-        pygame.draw.line(screen, COLOR_DATA_LINE, (WIDTH//2, mux_y + mux_h), (WIDTH//2, mux_y + mux_h + 50), 4)
-        draw_text(screen, "Data (q)", WIDTH//2, mux_y + mux_h + 60, FONT_LARGE, COLOR_DATA_LINE)
+        pygame.draw.line(surface, COLOR_DATA_LINE, (WIDTH//2, mux_y + mux_h), (WIDTH//2, mux_y + mux_h + 50), 4)
+        draw_text(surface, "Data (q)", WIDTH//2, mux_y + mux_h + 60, FONT_LARGE, COLOR_DATA_LINE)
+        self.q_pos = (WIDTH//2, mux_y + mux_h + 85)
+        self.regions["q"] = pygame.Rect(WIDTH//2 - 150, mux_y + mux_h + 72, 300, 26)
+
+        # ------------------------------------------------------------------
+        # 6. Status, Progress Bar & Keys (Bottom)
+        # ------------------------------------------------------------------
+        self.regions["status"] = pygame.Rect(50, 890, WIDTH - 100, 24)
+        self.bar = pygame.Rect(50, 925, WIDTH - 100, 16)
+        self.regions["progress"] = self.bar.inflate(2, 2)
+        draw_text(surface, "space play/pause   left/right step   up/down speed   "
+                  "home/end/page up/page down or click the bar: seek   esc quit",
+                  WIDTH//2, 965, FONT_SMALL)
+
+    def _row(self, surface, x, y, texts, colors, font=FONT_MAIN):
+        for i, (w, color) in enumerate(zip(self.columns, colors)):
+            draw_box(surface, x, y, w, self.row_h, color, texts[i] if i < len(texts) else None, font)
+            x += w
+
+    def state(self, replay, playing, speed, fps):
+        """Contents of every region, the keys ``draw()`` compares."""
+        p, c, e = self.params, replay.system.cache, replay.last
+        contents = {}
+        n = max(replay.n, 1)
+        contents["progress"] = self.bar.w * replay.pos // n
+        rate = replay.hits / max(replay.hits + replay.misses, 1)
+        contents["status"] = (
+            f"{'playing' if playing else 'paused'}   request {replay.pos:,} / {replay.n:,}   "
+            f"hits {replay.hits:,}   misses {replay.misses:,}   writebacks {replay.writebacks:,}   "
+            f"hit rate {rate:.4f}   {speed:g} requests/frame   {fps:.0f} FPS")
+        if e is None:
+            for key in self.regions:
+                contents.setdefault(key, None)
+            return contents
+        tag_digits = (p.TAG_WIDTH + 3) // 4
+        tag = (e.address >> p.TAG_LOW) & ((1 << p.TAG_WIDTH) - 1)
+        contents["address"] = (f"{tag:0{tag_digits}x}", str(e.index), str(e.offset))
+        base = e.index << c._way_shift
+        sel = e.offset >> c._sel_shift
+        for w in range(p.NWAYS):
+            line = base + w
+            row = (str(e.index), str(c.valid[line]), str(c.dirty[line]), str(c.lru[line]),
+                   f"{c.tag[line]:0{tag_digits}x}", f"{c.data[line * c._wpb + sel]:08x}")
+            mark = None
+            if w == e.way:
+                mark = "hit" if e.hit else "writeback" if e.writeback >= 0 else "miss"
+            contents[f"way{w}"] = (row, mark)
+            # The lookup, before a miss refilled the set
+            match = e.hit and w == e.way
+            contents[f"gate{w}"] = match
+            contents[f"and{w}"] = match
+        if e.hit:
+            result = ("HIT",)
+        elif e.writeback >= 0:
+            result = ("MISS", f"writeback {e.writeback:#x}")
+        else:
+            result = ("MISS",)
+        contents["result"] = result
+        contents["q"] = f"{'WR' if e.wren else 'RD'} {e.address:#x}  q = {e.q:08x}"
+        return contents
+
+    def draw(self, surface, contents):
+        """Repaint the regions whose contents changed; returns their rects."""
+        rects = []
+        for key, value in contents.items():
+            if key in self.drawn and self.drawn[key] == value:
+                continue
+            self.drawn[key] = value
+            rect = self.regions[key]
+            surface.blit(self.background, rect, rect)
+            self._draw(surface, key, value)
+            rects.append(rect)
+        return rects
+
+    def _draw(self, surface, key, value):
+        if key == "progress":
+            pygame.draw.rect(surface, COLOR_WAY_HEADER, self.bar)
+            pygame.draw.rect(surface, COLOR_PROGRESS, (*self.bar.topleft, value, self.bar.h))
+            pygame.draw.rect(surface, LINE_COLOR, self.bar, 1)
+        elif key == "status":
+            draw_text(surface, value, *self.regions[key].topleft, FONT_MAIN, align="left")
+        elif value is None:
+            if key.startswith("way"):
+                info = self.ways_info[int(key[3:])]
+                self._row(surface, info['x'], info['y'], ["K"],
+                          [COLOR_CELL_INDEX, COLOR_CELL_VALID, COLOR_CELL_VALID,
+                           COLOR_CELL_VALID, COLOR_CELL_TAG, COLOR_CELL_DATA], FONT_BOLD)
+        elif key == "address":
+            for (rect, color, label), field in zip(self.address_fields, value):
+                draw_box(surface, *rect, color, f"{label} = {field}", FONT_BOLD)
+        elif key.startswith("way"):
+            info = self.ways_info[int(key[3:])]
+            row, mark = value
+            self._row(surface, info['x'], info['y'], row,
+                      [COLOR_CELL_INDEX, COLOR_CELL_VALID, COLOR_CELL_VALID,
+                       COLOR_CELL_VALID, COLOR_CELL_TAG, COLOR_CELL_DATA])
+            if mark:
+                color = {"hit": COLOR_HIT, "miss": COLOR_MISS, "writeback": COLOR_WRITEBACK}[mark]
+                pygame.draw.rect(surface, color, self.regions[key], 4)
+        elif key.startswith("gate"):
+            info = self.ways_info[int(key[4:])]
+            draw_comparator(surface, *info['comp'], color=COLOR_HIT if value else COLOR_COMP)
+        elif key.startswith("and"):
+            info = self.ways_info[int(key[3:])]
+            draw_box(surface, *info['and'], COLOR_HIT if value else COLOR_AND, "&")
+        elif key == "result":
+            draw_box(surface, *self.or_gate, COLOR_HIT if value[0] == "HIT" else COLOR_MISS, "OR")
+            x, y = self.or_gate.centerx, self.or_gate.bottom + 65
+            draw_text(surface, value[0], x, y, FONT_LARGE,
+                      COLOR_INDEX_LINE if value[0] == "HIT" else COLOR_HIT_LINE)
+            if len(value) > 1:
+                draw_text(surface, value[1], x, y + 20, FONT_SMALL, COLOR_TAG_LINE)
+        elif key == "q":
+            draw_text(surface, value, *self.q_pos, FONT_BOLD, COLOR_DATA_LINE)
+
+
+def render(params=CacheParams(), path="cache_schematic_pygame.png"):
+    """Save the schematic with empty ways, without opening a window."""
+    schematic = Schematic(params)
+    surface = schematic.background.copy()
+    schematic.draw(surface, {f"way{w}": None for w in range(params.NWAYS)})
+    pygame.image.save(surface, path)
+
+
+def load(args, params):
+    """``(addresses, writes, data)`` arrays of the trace to replay."""
+    if args.trace:
+        from trace_format import open_trace
+        trace = open_trace(args.trace)
+        return trace["address"], trace["op"], trace["data"]
+    from bench_workloads import workload
+    addresses, writes = workload(args.workload, args.accesses, args.footprint)
+    data = np.random.default_rng(1).integers(0, 1 << 32, len(addresses), dtype=np.uint32)
+    return addresses, writes, data
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("trace", nargs="?", help="binary trace to replay")
+    ap.add_argument("--workload", default="random", help="bench_workloads.py workload to replay instead")
+    ap.add_argument("--accesses", type=int, default=1_000_000, help="accesses of --workload")
+    ap.add_argument("--footprint", type=int, default=16 << 10, help="bytes --workload touches")
+    ap.add_argument("--design", action="store_true",
+                    help="design.v default parameters instead of tb_cache_system.v's")
+    args = ap.parse_args()
+
+    params = CacheParams() if args.design else TB_PARAMS
+    # The tb's Ram starts out with Test1.mem
+    mem = None if args.design else os.path.join(ROOT, "Test1.mem")
+    replay = Replay(params, *load(args, params), mem=mem)
+
+    screen = pygame.display.set_mode((WIDTH, HEIGHT))
+    pygame.display.set_caption("Cache Hardware Schematic (Colorful)")
+    schematic = Schematic(params)
+    schematic.background = schematic.background.convert()
+    screen.blit(schematic.background, (0, 0))
+    pygame.display.flip()
+
+    running = True
+    playing = False
+    speed = 1              # requests per frame while playing
+    rate = 0.0             # measured requests per second of CacheSystem.run()
+    budget = 0.5 / FPS     # seconds of a frame given to the model
+    clock = pygame.time.Clock()
+
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.KEYDOWN:
+                step = max(1, replay.n // 10)
+                if event.key == pygame.K_ESCAPE:
+                    running = False
+                elif event.key == pygame.K_SPACE:
+                    playing = not playing
+                elif event.key == pygame.K_RIGHT:
+                    playing = False
+                    replay.advance(1)
+                elif event.key == pygame.K_LEFT:
+                    playing = False
+                    replay.seek(replay.pos - 1)
+                elif event.key == pygame.K_UP:
+                    speed = min(speed * 2, 1 << 20)
+                elif event.key == pygame.K_DOWN:
+                    speed = max(speed // 2, 1)
+                elif event.key == pygame.K_HOME:
+                    replay.seek(0)
+                elif event.key == pygame.K_END:
+                    replay.seek(replay.n)
+                elif event.key == pygame.K_PAGEDOWN:
+                    replay.seek(replay.pos + step)
+                elif event.key == pygame.K_PAGEUP:
+                    replay.seek(replay.pos - step)
+            elif (event.type == pygame.MOUSEBUTTONDOWN and event.button == 1
+                  or event.type == pygame.MOUSEMOTION and event.buttons[0]):
+                if schematic.regions["progress"].collidepoint(event.pos):
+                    bar = schematic.bar
+                    replay.seek((event.pos[0] - bar.x) * replay.n // bar.w)
+
+        if playing:
+            n = speed if rate == 0 else max(1, min(speed, int(rate * budget)))
+            t = time.perf_counter()
+            replay.advance(n)
+            if n > 1:
+                rate = n / max(time.perf_counter() - t, 1e-9)
+            playing = replay.pos < replay.n
 
-        pygame.display.flip()
-        clock.tick(30)
+        rects = schematic.draw(screen, schematic.state(replay, playing, speed, clock.get_fps()))
+        if rects:
+            pygame.display.update(rects)
+        clock.tick(FPS)
 
     pygame.quit()
     sys.exit()
@@ -16,21 +16,20 @@ module Ram #(
     localparam DEPTH_MEM = 1 << DEPTH;
     reg [WIDTH-1:0] mem [0:DEPTH_MEM-1];
 
+    // The contents start out zero (simulation only; RamModel does the same)
     integer i;
     initial begin
-        for (i = 0; i < DEPTH_MEM; i=i+1) begin
-            mem[i] <= 0;
+        for (i = 0; i < DEPTH_MEM; i = i + 1) begin
+            mem[i] = 0;
         end
     end
 
-    integer k;
+    // reset_n only clears the output registers; the contents are kept
+    // (load them with $readmemh)
     always @(posedge clk or negedge reset_n) begin
         if (!reset_n) begin
             data_out <= 0;
             valid_out <= 1'b0;
-            for (k = 0; k < DEPTH_MEM; k=k+1) begin
-                mem[k] <= 0;
-            end
         end
         else begin
             valid_out <= 1'b0;
@@ -0,0 +1,247 @@
+`timescale 1ns/1ps
+
+// BankedCache on a LatencyRam under random two-port traffic, checked
+// against BankedCacheSystem by "python code/cosim.py --tb banked".
+//
+// Every port issues +requests=<n> random reads and writes (+seed=<n>) and
+// holds each one until its hit_miss, with an idle cycle now and then.  The
+// addresses are words of the 2^ADDR_WIDTH bytes of memory, HOT_BYTES of
+// them most of the time, so the ports meet on a bank, ask for a bank that
+// is working on the other port's miss and evict dirty lines, and with
+// BURST > 1 and LATENCY > 1 the read beats of both banks are in flight at
+// once.  Override the parameters with -P.
+module tb_banked_cache;
+
+    // BankedCache
+    parameter NBANKS = 2;
+    parameter NWAYS = 2;
+    parameter NSETS = 8;
+    parameter INDEX_WIDTH = 3;
+    parameter OFFSET_WIDTH = 4;
+    parameter MWIDTH = 64;
+    parameter BURST = 2;
+    parameter PLRU = 0;
+    parameter RQ_SLOTS = 4;
+    // LatencyRam
+    parameter ADDR_WIDTH = 12;
+    parameter LATENCY = 3;
+    parameter JITTER = 2;
+    parameter COL_BITS = 0;
+    parameter OUTSTANDING = 4;
+    // Stimulus
+    parameter HOT_BYTES = 256;
+    parameter TIMEOUT = 10000;      // cycles a request may wait for hit_miss
+
+    localparam WIDTH = 32;
+    localparam TAG_WIDTH = WIDTH - INDEX_WIDTH - OFFSET_WIDTH;
+
+    reg clk;
+    reg reset_n;
+
+    // CPU ports, port 0 = A, port 1 = B
+    reg  [1:0]       rden;
+    reg  [1:0]       wren;
+    reg  [WIDTH-1:0] address [0:1];
+    reg  [WIDTH-1:0] din [0:1];
+    wire [1:0]       hit_miss;
+    wire [WIDTH-1:0] q_a, q_b;
+    wire             ready;
+    wire [31:0]      bank_conflicts;
+
+    // Memory port
+    wire [MWIDTH-1:0] mdout;
+    wire [WIDTH-1:0]  mrdaddress;
+    wire              mrden;
+    wire [WIDTH-1:0]  mwraddress;
+    wire              mwren;
+    wire [MWIDTH-1:0] mq;
+    wire              mready;
+    wire              mvalid;
+
+    BankedCache #(
+        .NBANKS(NBANKS),
+        .NWAYS(NWAYS),
+        .NSETS(NSETS),
+        .WIDTH(WIDTH),
+        .MWIDTH(MWIDTH),
+        .INDEX_WIDTH(INDEX_WIDTH),
+        .TAG_WIDTH(TAG_WIDTH),
+        .OFFSET_WIDTH(OFFSET_WIDTH),
+        .BURST(BURST),
+        .PLRU(PLRU),
+        .RQ_SLOTS(RQ_SLOTS)
+    ) dut (
+        .clk(clk),
+        .reset_n(reset_n),
+        .address_a(address[0]),
+        .din_a(din[0]),
+        .rden_a(rden[0]),
+        .wren_a(wren[0]),
+        .hit_miss_a(hit_miss[0]),
+        .q_a(q_a),
+        .address_b(address[1]),
+        .din_b(din[1]),
+        .rden_b(rden[1]),
+        .wren_b(wren[1]),
+        .hit_miss_b(hit_miss[1]),
+        .q_b(q_b),
+        .ready(ready),
+        .mdout(mdout),
+        .mrdaddress(mrdaddress),
+        .mrden(mrden),
+        .mwraddress(mwraddress),
+        .mwren(mwren),
+        .mq(mq),
+        .mready(mready),
+        .mvalid(mvalid),
+        .bank_conflicts(bank_conflicts)
+    );
+
+    // The memory starts out zero, as the model's
+    LatencyRam #(
+        .WIDTH(MWIDTH),
+        .DEPTH(ADDR_WIDTH),
+        .LATENCY(LATENCY),
+        .JITTER(JITTER),
+        .COL_BITS(COL_BITS),
+        .OUTSTANDING(OUTSTANDING)
+    ) dut_ram (
+        .clk(clk),
+        .reset_n(reset_n),
+        .data_in(mdout),
+        .adress(mwren ? mwraddress[ADDR_WIDTH-1:0] : mrdaddress[ADDR_WIDTH-1:0]),
+        .write_enable(mwren),
+        .read_enable(mrden),
+        .ready(mready),
+        .data_out(mq),
+        .valid_out(mvalid)
+    );
+
+    always #5 clk = ~clk;
+
+    // Random stimulus
+    integer seed, requests;
+    integer issued [0:1];
+    integer done [0:1];
+    integer waited [0:1];
+    integer p, cycles;
+    reg running, finished;
+
+    // Lockstep co-simulation log (+cosim=<file>): a "# tb_banked_cache
+    // NAME=value ..." line with the parameters the model needs, then one
+    // line per clock edge out of reset with the inputs of both ports and,
+    // after the edge, hit_miss / q of both ports, the memory port, the
+    // LatencyRam outputs and bank_conflicts
+    reg [8*256-1:0] cosim_file;
+    integer cosim_fd;
+    reg [1:0] c_rden, c_wren;
+    reg [WIDTH-1:0] c_address_a, c_din_a, c_address_b, c_din_b;
+
+    // Coverage of the arbitration paths, printed at the end
+    integer n_sticky, n_routed;
+    wire [31:0] rq_next = (dut.rq_head == RQ_SLOTS - 1) ? 0 : dut.rq_head + 1;
+
+    initial begin
+        clk = 0;
+        reset_n = 0;
+        rden = 0;
+        wren = 0;
+        for (p = 0; p < 2; p = p + 1) begin
+            address[p] = 0;
+            din[p] = 0;
+            issued[p] = 0;
+            done[p] = 0;
+            waited[p] = 0;
+        end
+        running = 0;
+        finished = 0;
+        cycles = 0;
+        n_sticky = 0;
+        n_routed = 0;
+        if (!$value$plusargs("seed=%d", seed))
+            seed = 1;
+        if (!$value$plusargs("requests=%d", requests))
+            requests = 20000;
+        cosim_fd = 0;
+        if ($value$plusargs("cosim=%s", cosim_file)) begin
+            cosim_fd = $fopen(cosim_file, "w");
+            $fwrite(cosim_fd, "# tb_banked_cache NBANKS=%0d NWAYS=%0d NSETS=%0d INDEX_WIDTH=%0d TAG_WIDTH=%0d OFFSET_WIDTH=%0d MWIDTH=%0d BURST=%0d PLRU=%0d RQ_SLOTS=%0d ADDR_WIDTH=%0d LATENCY=%0d JITTER=%0d COL_BITS=%0d OUTSTANDING=%0d\n",
+                    NBANKS, NWAYS, NSETS, INDEX_WIDTH, TAG_WIDTH, OFFSET_WIDTH, MWIDTH, BURST,
+                    PLRU, RQ_SLOTS, ADDR_WIDTH, LATENCY, JITTER, COL_BITS, OUTSTANDING);
+        end
+
+        #10 reset_n = 1;
+        wait (ready);   // the banks clear their sets after reset
+        @(negedge clk);
+        running = 1;
+        wait (finished);
+        // Let the last write-backs reach the memory
+        repeat (4 * BURST + LATENCY + JITTER) @(posedge clk);
+        #1;
+        $display("%0d requests, %0d cycles, %0d bank conflicts (%0d on a bank held for a miss), %0d read beats with another bank's read queued behind",
+                 2 * requests, cycles, bank_conflicts, n_sticky, n_routed);
+        if (cosim_fd)
+            $fclose(cosim_fd);
+        $finish;
+    end
+
+    // A port takes its next request right after hit_miss, or now and then
+    // an idle cycle first: a word of the hot bytes (3 in 4) or of all the
+    // memory, written 1 time in 3
+    always @(posedge clk) if (running) begin
+        #1;
+        cycles = cycles + 1;
+        for (p = 0; p < 2; p = p + 1) begin
+            if ((rden[p] || wren[p]) && hit_miss[p]) begin
+                rden[p] = 0;
+                wren[p] = 0;
+                done[p] = done[p] + 1;
+            end
+            if (rden[p] || wren[p]) begin
+                waited[p] = waited[p] + 1;
+                if (waited[p] == TIMEOUT) begin
+                    $display("port %0d: no hit_miss in %0d cycles for 0x%h", p, TIMEOUT, address[p]);
+                    $finish;
+                end
+            end
+            else if (issued[p] < requests && $unsigned($random(seed)) % 8 != 0) begin
+                if ($unsigned($random(seed)) % 4 != 0)
+                    address[p] = ($unsigned($random(seed)) % HOT_BYTES) & ~3;
+                else
+                    address[p] = ($unsigned($random(seed)) % (1 << ADDR_WIDTH)) & ~3;
+                din[p] = $random(seed);
+                wren[p] = $unsigned($random(seed)) % 3 == 0;
+                rden[p] = !wren[p];
+                issued[p] = issued[p] + 1;
+                waited[p] = 0;
+            end
+        end
+        finished = done[0] == requests && done[1] == requests;
+    end
+
+    always @(posedge clk) if (reset_n) begin
+        if (dut.conflict && dut.sticky)
+            n_sticky = n_sticky + 1;
+        if (mvalid && dut.rq_count > 1 && dut.rq_bank[dut.rq_head] != dut.rq_bank[rq_next])
+            n_routed = n_routed + 1;
+    end
+
+    // Sampled half a step after the edge: the stimulus above changes #1
+    // after it
+    always @(posedge clk) if (cosim_fd && reset_n) begin
+        c_rden = rden;
+        c_wren = wren;
+        c_address_a = address[0];
+        c_din_a = din[0];
+        c_address_b = address[1];
+        c_din_b = din[1];
+        #0.5;
+        $fwrite(cosim_fd, "%b %b %h %h %b %b %h %h %b %h %b %h %b %b %h %h %h %b %b %h %h\n",
+                c_rden[0], c_wren[0], c_address_a, c_din_a,
+                c_rden[1], c_wren[1], c_address_b, c_din_b,
+                hit_miss[0], q_a, hit_miss[1], q_b,
+                mrden, mwren, mrdaddress, mwraddress, mdout,
+                mready, mvalid, mq, bank_conflicts);
+    end
+
+endmodule
@@ -0,0 +1,275 @@
+`timescale 1ns/1ps
+
+// CacheHierarchy under random requests, checked against HierarchySystem by
+// "python code/cosim.py --tb hierarchy".
+//
+// +requests=<n> random reads and writes (+seed=<n>), each held until
+// hit_miss, with an idle cycle now and then.  The addresses are words of
+// the 2^ADDR_WIDTH bytes of memory, HOT_BYTES of them most of the time:
+// four times what the L1 holds and as much as the L2, so both levels evict
+// all the time.  That drives the path of every INCLUSION: L2 victims
+// snooped out of the L1 (1), the L2 dropping the lines the L1 fetched and
+// the L1 writing back every victim (2).  The default levels have different
+// line sizes; L2_OFFSET_WIDTH = 3 and L2_BURST = 1 make them equal.
+// Override the parameters with -P.
+module tb_cache_hierarchy;
+
+    parameter INCLUSION = 1;
+    // L1
+    parameter L1_NWAYS = 2;
+    parameter L1_NSETS = 8;
+    parameter L1_INDEX_WIDTH = 3;
+    parameter L1_OFFSET_WIDTH = 3;
+    parameter L1_MWIDTH = 64;
+    parameter L1_BURST = 1;
+    parameter L1_PLRU = 0;
+    // L2
+    parameter L2_NWAYS = 2;
+    parameter L2_NSETS = 8;
+    parameter L2_INDEX_WIDTH = 3;
+    parameter L2_OFFSET_WIDTH = 5;
+    parameter MWIDTH = 64;
+    parameter L2_BURST = 4;
+    parameter L2_PLRU = 0;
+    // Memory: 0 = Ram, 1 = LatencyRam with the read timing below
+    parameter HANDSHAKE = 1;
+    parameter ADDR_WIDTH = 12;
+    parameter LATENCY = 3;
+    parameter JITTER = 2;
+    parameter COL_BITS = 0;
+    parameter OUTSTANDING = 4;
+    // Stimulus
+    parameter HOT_BYTES = 512;
+    parameter TIMEOUT = 10000;      // cycles a request may wait for hit_miss
+
+    localparam WIDTH = 32;
+    localparam L1_TAG_WIDTH = WIDTH - L1_INDEX_WIDTH - L1_OFFSET_WIDTH;
+    localparam L2_TAG_WIDTH = WIDTH - L2_INDEX_WIDTH - L2_OFFSET_WIDTH;
+
+    reg clk;
+    reg reset_n;
+
+    // CPU port
+    reg              rden;
+    reg              wren;
+    reg  [WIDTH-1:0] address;
+    reg  [WIDTH-1:0] din;
+    wire             hit_miss;
+    wire [WIDTH-1:0] q;
+    wire             ready;
+    wire [31:0]      l1_misses, l2_misses, back_invals;
+
+    // L2 memory port
+    wire [MWIDTH-1:0] mdout;
+    wire [WIDTH-1:0]  mrdaddress;
+    wire              mrden;
+    wire [WIDTH-1:0]  mwraddress;
+    wire              mwren;
+    wire [MWIDTH-1:0] mq;
+    wire              mready;
+    wire              mvalid;
+
+    CacheHierarchy #(
+        .WIDTH(WIDTH),
+        .INCLUSION(INCLUSION),
+        .L1_NWAYS(L1_NWAYS),
+        .L1_NSETS(L1_NSETS),
+        .L1_INDEX_WIDTH(L1_INDEX_WIDTH),
+        .L1_TAG_WIDTH(L1_TAG_WIDTH),
+        .L1_OFFSET_WIDTH(L1_OFFSET_WIDTH),
+        .L1_MWIDTH(L1_MWIDTH),
+        .L1_BURST(L1_BURST),
+        .L1_PLRU(L1_PLRU),
+        .L2_NWAYS(L2_NWAYS),
+        .L2_NSETS(L2_NSETS),
+        .L2_INDEX_WIDTH(L2_INDEX_WIDTH),
+        .L2_TAG_WIDTH(L2_TAG_WIDTH),
+        .L2_OFFSET_WIDTH(L2_OFFSET_WIDTH),
+        .MWIDTH(MWIDTH),
+        .L2_BURST(L2_BURST),
+        .L2_PLRU(L2_PLRU),
+        .HANDSHAKE(HANDSHAKE)
+    ) dut (
+        .clk(clk),
+        .reset_n(reset_n),
+        .address(address),
+        .din(din),
+        .rden(rden),
+        .wren(wren),
+        .hit_miss(hit_miss),
+        .q(q),
+        .ready(ready),
+        .mdout(mdout),
+        .mrdaddress(mrdaddress),
+        .mrden(mrden),
+        .mwraddress(mwraddress),
+        .mwren(mwren),
+        .mq(mq),
+        .mready(mready),
+        .mvalid(mvalid),
+        .l1_misses(l1_misses),
+        .l2_misses(l2_misses),
+        .back_invals(back_invals)
+    );
+
+    // The memory starts out zero, as the model's
+    wire [ADDR_WIDTH-1:0] ram_address = mwren ? mwraddress[ADDR_WIDTH-1:0] : mrdaddress[ADDR_WIDTH-1:0];
+    generate if (HANDSHAKE) begin : lat
+    LatencyRam #(
+        .WIDTH(MWIDTH),
+        .DEPTH(ADDR_WIDTH),
+        .LATENCY(LATENCY),
+        .JITTER(JITTER),
+        .COL_BITS(COL_BITS),
+        .OUTSTANDING(OUTSTANDING)
+    ) dut_ram (
+        .clk(clk),
+        .reset_n(reset_n),
+        .data_in(mdout),
+        .adress(ram_address),
+        .write_enable(mwren),
+        .read_enable(mrden),
+        .ready(mready),
+        .data_out(mq),
+        .valid_out(mvalid)
+    );
+    end else begin : fixed
+    assign mready = 1'b1;
+    Ram #(
+        .WIDTH(MWIDTH),
+        .DEPTH(ADDR_WIDTH)
+    ) dut_ram (
+        .clk(clk),
+        .reset_n(reset_n),
+        .data_in(mdout),
+        .adress(ram_address),
+        .write_enable(mwren),
+        .read_enable(mrden),
+        .data_out(mq),
+        .valid_out(mvalid)
+    );
+    end endgenerate
+
+    always #5 clk = ~clk;
+
+    // Random stimulus
+    integer seed, requests;
+    integer issued, done, waited, cycles;
+    reg running, finished;
+
+    // Lockstep co-simulation log (+cosim=<file>): a "# tb_cache_hierarchy
+    // NAME=value ..." line with the parameters the model needs, then one
+    // line per clock edge out of reset with the CPU request and, after the
+    // edge, hit_miss / q, the L1 memory port and snoop port, the L2 CPU
+    // port and snoop request as the bridge drives them, the L2 memory port,
+    // the memory outputs and the three counters.  The L1 snoop address is
+    // logged as 0 while there is no snoop (it is a stale queue entry then).
+    reg [8*256-1:0] cosim_file;
+    integer cosim_fd;
+    reg c_rden, c_wren;
+    reg [WIDTH-1:0] c_address, c_din;
+
+    // Coverage of the inclusion paths, printed at the end
+    integer n_l1_wb, n_l2_drops;
+
+    initial begin
+        clk = 0;
+        reset_n = 0;
+        rden = 0;
+        wren = 0;
+        address = 0;
+        din = 0;
+        issued = 0;
+        done = 0;
+        waited = 0;
+        running = 0;
+        finished = 0;
+        cycles = 0;
+        n_l1_wb = 0;
+        n_l2_drops = 0;
+        if (!$value$plusargs("seed=%d", seed))
+            seed = 1;
+        if (!$value$plusargs("requests=%d", requests))
+            requests = 20000;
+        cosim_fd = 0;
+        if ($value$plusargs("cosim=%s", cosim_file)) begin
+            cosim_fd = $fopen(cosim_file, "w");
+            $fwrite(cosim_fd, "# tb_cache_hierarchy INCLUSION=%0d L1_NWAYS=%0d L1_NSETS=%0d L1_INDEX_WIDTH=%0d L1_TAG_WIDTH=%0d L1_OFFSET_WIDTH=%0d L1_MWIDTH=%0d L1_BURST=%0d L1_PLRU=%0d L2_NWAYS=%0d L2_NSETS=%0d L2_INDEX_WIDTH=%0d L2_TAG_WIDTH=%0d L2_OFFSET_WIDTH=%0d L2_MWIDTH=%0d L2_BURST=%0d L2_PLRU=%0d HANDSHAKE=%0d ADDR_WIDTH=%0d LATENCY=%0d JITTER=%0d COL_BITS=%0d OUTSTANDING=%0d\n",
+                    INCLUSION, L1_NWAYS, L1_NSETS, L1_INDEX_WIDTH, L1_TAG_WIDTH, L1_OFFSET_WIDTH,
+                    L1_MWIDTH, L1_BURST, L1_PLRU, L2_NWAYS, L2_NSETS, L2_INDEX_WIDTH, L2_TAG_WIDTH,
+                    L2_OFFSET_WIDTH, MWIDTH, L2_BURST, L2_PLRU, HANDSHAKE, ADDR_WIDTH, LATENCY,
+                    JITTER, COL_BITS, OUTSTANDING);
+        end
+
+        #10 reset_n = 1;
+        wait (ready);   // both levels clear their sets after reset
+        @(negedge clk);
+        running = 1;
+        wait (finished);
+        // Let the last write-backs reach the memory
+        repeat (8 * L2_BURST + LATENCY + JITTER) @(posedge clk);
+        #1;
+        $display("%0d requests, %0d cycles, %0d L1 misses, %0d L2 misses, %0d back-invalidations, %0d L2 drops, %0d L1 write-back beats",
+                 requests, cycles, l1_misses, l2_misses, back_invals, n_l2_drops, n_l1_wb);
+        if (cosim_fd)
+            $fclose(cosim_fd);
+        $finish;
+    end
+
+    // The next request right after hit_miss, or now and then an idle cycle
+    // first: a word of the hot bytes (3 in 4) or of all the memory, written
+    // 1 time in 3
+    always @(posedge clk) if (running) begin
+        #1;
+        cycles = cycles + 1;
+        if ((rden || wren) && hit_miss) begin
+            rden = 0;
+            wren = 0;
+            done = done + 1;
+        end
+        if (rden || wren) begin
+            waited = waited + 1;
+            if (waited == TIMEOUT) begin
+                $display("no hit_miss in %0d cycles for 0x%h", TIMEOUT, address);
+                $finish;
+            end
+        end
+        else if (issued < requests && $unsigned($random(seed)) % 8 != 0) begin
+            if ($unsigned($random(seed)) % 4 != 0)
+                address = ($unsigned($random(seed)) % HOT_BYTES) & ~3;
+            else
+                address = ($unsigned($random(seed)) % (1 << ADDR_WIDTH)) & ~3;
+            din = $random(seed);
+            wren = $unsigned($random(seed)) % 3 == 0;
+            rden = !wren;
+            issued = issued + 1;
+            waited = 0;
+        end
+        finished = done == requests;
+    end
+
+    always @(posedge clk) if (reset_n) begin
+        if (dut.l1_mwren && dut.l1_mready)
+            n_l1_wb = n_l1_wb + 1;
+        if (dut.l2_snoop_done)
+            n_l2_drops = n_l2_drops + 1;
+    end
+
+    // Sampled half a step after the edge: the stimulus above changes #1
+    // after it
+    always @(posedge clk) if (cosim_fd && reset_n) begin
+        c_rden = rden;
+        c_wren = wren;
+        c_address = address;
+        c_din = din;
+        #0.5;
+        $fwrite(cosim_fd, "%b %b %h %h %b %h %b %b %b %b %b %h %b %b %h %b %b %b %b %h %h %h %b %b %h %h %h %h\n",
+                c_rden, c_wren, c_address, c_din, hit_miss, q,
+                dut.l1_mrden, dut.l1_mwren, dut.l1_mready, dut.l1_mvalid,
+                dut.l1_snoop, dut.l1_snoop ? dut.l1_snoop_address : {WIDTH{1'b0}},
+                dut.l2_rden, dut.l2_wren, dut.l2_address, dut.l2_hit_miss, dut.l2_snoop,
+                mrden, mwren, mrdaddress, mwraddress, mdout, mready, mvalid, mq,
+                l1_misses, l2_misses, back_invals);
+    end
+
+endmodule
@@ -10,6 +10,13 @@ module tb_cache_system;
                                // We need to map 16 to Cache.v's expected width if necessary.
                                // Cache.v defaults to WIDTH=32 for address?
                                // Let's override Cache parameters.
+    // Memory: 0 = Ram with fixed timing, 1 = Cache with HANDSHAKE = 1 on a
+    // LatencyRam with the read timing below (override with -P)
+    parameter HANDSHAKE = 0;
+    parameter LATENCY = 1;
+    parameter JITTER = 0;
+    parameter COL_BITS = 0;
+    parameter OUTSTANDING = 4;
     
     // Signals
     reg clk;
@@ -21,6 +28,14 @@ module tb_cache_system;
     
     wire [WIDTH-1:0] q;
     wire hit_miss;
+    wire ready;
+
+    // Performance counter CSR port
+    reg [4:0] csr_addr;
+    reg csr_rden;
+    reg csr_wren;
+    reg [31:0] csr_wdata;
+    wire [31:0] csr_rdata;
     
     // RAM Interface Signals form Cache
     wire [MWIDTH-1:0] mdout;
@@ -37,6 +52,7 @@ module tb_cache_system;
     wire ram_read_enable;
     wire [MWIDTH-1:0] ram_data_out;
     wire ram_valid_out;
+    wire ram_ready;
 
     // Cache Instance
     // Note: Cache default ADDR width is WIDTH=32. We can drive it with 32.
@@ -51,7 +67,9 @@ module tb_cache_system;
       .BLOCK_SIZE(MWIDTH), // Check logic
       .INDEX_WIDTH(6),
       .TAG_WIDTH(8),
-      .OFFSET_WIDTH(3)
+      .OFFSET_WIDTH(3),
+      .HANDSHAKE(HANDSHAKE),
+      .PERF(1)
       
     ) dut_cache (
         .clk(clk),
@@ -62,13 +80,22 @@ module tb_cache_system;
         .wren(wren),
         .hit_miss(hit_miss),
         .q(q),
+        .ready(ready),
         
         .mdout(mdout),
         .mrdaddress(mrdaddress),
         .mrden(mrden),
         .mwraddress(mwraddress),
         .mwren(mwren),
-        .mq(mq)
+        .mq(mq),
+        .mready(ram_ready),
+        .mvalid(ram_valid_out),
+
+        .csr_addr(csr_addr),
+        .csr_rden(csr_rden),
+        .csr_wren(csr_wren),
+        .csr_wdata(csr_wdata),
+        .csr_rdata(csr_rdata)
     );
 
     // RAM Interconnect Logic
@@ -93,7 +120,33 @@ module tb_cache_system;
   wire d2;
   wire d3;
   wire d4;
-      // RAM Module
+      // RAM Module (Test1.mem is loaded 25 ns in, after reset)
+    generate if (HANDSHAKE) begin : lat
+    LatencyRam #(
+        .WIDTH(MWIDTH),
+        .DEPTH(ADDR_WIDTH),
+        .LATENCY(LATENCY),
+        .JITTER(JITTER),
+        .COL_BITS(COL_BITS),
+        .OUTSTANDING(OUTSTANDING)
+    ) dut_ram (
+        .clk(clk),
+        .reset_n(reset_n),
+        .data_in(ram_data_in),
+        .adress(ram_address),
+        .write_enable(ram_write_enable),
+        .read_enable(ram_read_enable),
+        .ready(ram_ready),
+        .data_out(ram_data_out),
+        .valid_out(ram_valid_out)
+    );
+    initial begin
+        #25 $readmemh("Test1.mem", dut_ram.mem);
+        $monitor("Time: %0t | RAM[0x0a00] updated to: %h",
+                 $time, lat.dut_ram.mem[16'h0a00]);
+    end
+    end else begin : fixed
+    assign ram_ready = 1'b1;
     Ram #(
         .WIDTH(MWIDTH),   // RAM stores BLOCKS (64 bits)
         .DEPTH(ADDR_WIDTH) // 16 bits address
@@ -107,20 +160,52 @@ module tb_cache_system;
         .data_out(ram_data_out),
         .valid_out(ram_valid_out)
     );
-	assign l1=dut_cache.lru1[0];
-  	assign l2=dut_cache.lru2[0];
-  	assign l3=dut_cache.lru3[0];
-  	assign l4=dut_cache.lru4[0];
-  	assign m1=dut_cache.mem1[0];
-  	assign m2=dut_cache.mem2[0];
-  	assign m3=dut_cache.mem3[0];
-  	assign m4=dut_cache.mem4[0];
-  	assign d1=dut_cache.dirty1[0];
-    assign d2=dut_cache.dirty2[0];
-    assign d3=dut_cache.dirty3[0];
-    assign d4=dut_cache.dirty4[0];
+    initial begin
+        #25 $readmemh("Test1.mem", dut_ram.mem);
+        $monitor("Time: %0t | RAM[0x0a00] updated to: %h",
+                 $time, fixed.dut_ram.mem[16'h0a00]);
+    end
+    end endgenerate
+	assign l1=dut_cache.way[0].lru[0];
+  	assign l2=dut_cache.way[1].lru[0];
+  	assign l3=dut_cache.way[2].lru[0];
+  	assign l4=dut_cache.way[3].lru[0];
+  	assign m1=dut_cache.way[0].mem[0];
+  	assign m2=dut_cache.way[1].mem[0];
+  	assign m3=dut_cache.way[2].mem[0];
+  	assign m4=dut_cache.way[3].mem[0];
+  	assign d1=dut_cache.way[0].dirty[0];
+    assign d2=dut_cache.way[1].dirty[0];
+    assign d3=dut_cache.way[2].dirty[0];
+    assign d4=dut_cache.way[3].dirty[0];
     // Clock
     always #5 clk = ~clk;
+
+    // Trace replay
+    // Stimulus is one {op[7:0], din[31:0], address[31:0]} hex word per line,
+    // generated from a binary trace by "python code/trace_format.py memh".
+    // The file is streamed with $fscanf, so it is never loaded as a whole.
+    // Every request is held until hit_miss goes high, back to back.
+    // Override the file with +trace=<path>, print each request with +verbose.
+    reg [71:0] rec;
+    reg [8*256-1:0] trace_file;
+    integer fd;
+    integer n_req, n_hit, n_cycles, req_cycles;
+    integer i;
+    reg first_hit;
+    reg verbose;
+
+    // Lockstep co-simulation log (+cosim=<file>): one line per clock edge
+    // out of reset with the inputs the cache sampled, its outputs after the
+    // edge and the addressed set; "python code/cosim.py" replays it on the
+    // model and stops at the first difference
+    reg [8*256-1:0] cosim_file;
+    integer cosim_fd;
+    reg c_rden, c_wren;
+    reg [ADDR_WIDTH-1:0] c_address;
+    reg [WIDTH-1:0] c_din;
+    wire [5:0] c_index = c_address[8:3];   // INDEX_WIDTH = 6 above OFFSET_WIDTH = 3
+
 	initial begin
       	clk = 0;
       address=0;
@@ -128,110 +213,103 @@ module tb_cache_system;
       rden=0;
       wren=0;
       din=0;
+      csr_addr = 0;
+      csr_rden = 0;
+      csr_wren = 0;
+      csr_wdata = 0;
+      n_req = 0;
+      n_hit = 0;
+      n_cycles = 0;
+      verbose = $test$plusargs("verbose");
+      cosim_fd = 0;
+      if ($value$plusargs("cosim=%s", cosim_file))
+        cosim_fd = $fopen(cosim_file, "w");
+      if (!$value$plusargs("trace=%s", trace_file))
+        trace_file = "traces/tb_cache_system.memh";
 
         #10 reset_n=1;
      
   
       	#15;
-        $readmemh("Test1.mem",dut_ram.mem);
-      	#10
-        address = 16'h0100;
-        rden = 1;
-      #15 rden=0;
-      #33
-      address = 16'h0200;
-        rden = 1;
-      #15 rden=0;
-      #32
-      address = 16'h0300;
-        rden = 1;
-      #15rden=0;
-      #33
-      address = 16'h0400;
-        rden = 1;
-      #15 rden=0;
-      #33
-      address = 16'h0500;
-        rden = 1;
-      #15 rden=0;
-      #50
-      // Hits:
-      address = 16'h0100;
-        rden = 1;
-      #10 rden = 0;
-      #10
-      
-      address = 16'h0200;
-        rden = 1;
-     
-       #10 rden = 0;
-      #10
-      
-      address = 16'h0300;
-        rden = 1;
-   
-      #10 rden = 0;
-      #10
-      
-      address = 16'h0400;
-        rden = 1;
-      #30
-      address = 16'h0600;
-        rden = 1;
-      #15 rden=0;
-      #33
-      address = 16'h0800;
-        rden = 1;
-      #15 rden=0;
-      #70
-      address = 16'h0600;
-              rden = 1;
-            #10 rden = 0;
-            #10
-            
-            address = 16'h0800;
-              rden = 1;
-           
-             #10 rden = 0;
-            #10
- 
-      address = 16'h0a00;
-        rden = 1;
-      #15 rden=0;
-      #70;
-      
-      address=16'h0a00;
-      din= 32'h 0dda_4444;
-      wren = 1;
-      #12 wren=0;
-      #50;
-      address = 16'h0400;
-        rden = 1;
-     
-       #12 rden = 0;
-      #12
-      
-      address = 16'h0600;
-        rden = 1;
-   
-      #12 rden = 0;
-      #12
-      
-      address = 16'h0800;
-        rden = 1;
-      #12 rden = 0;
-      #50;
-      address = 16'h0c00;
-      rden = 1;
-      #12 rden=1;
-      #80;
+        wait (ready);   // the cache clears its sets after reset
+
+      // Clear the performance counters (PERF_CLEAR) so they cover the trace
+      @(negedge clk);
+      csr_addr = 5'd31;
+      csr_wren = 1;
+      @(negedge clk);
+      csr_wren = 0;
+
+      fd = $fopen(trace_file, "r");
+      if (fd == 0) begin
+        $display("Cannot open trace %0s", trace_file);
+        $finish;
+      end
+
+      while ($fscanf(fd, "%h\n", rec) == 1) begin
+        @(negedge clk);
+        address = rec[ADDR_WIDTH-1:0];
+        din = rec[63:32];
+        wren = rec[64];
+        rden = !rec[64];
+        @(posedge clk); #1;
+        first_hit = hit_miss;
+        req_cycles = 1;
+        while (!hit_miss) begin
+          @(posedge clk); #1;
+          req_cycles = req_cycles + 1;
+        end
+        rden = 0;
+        wren = 0;
+        n_req = n_req + 1;
+        n_hit = n_hit + first_hit;
+        n_cycles = n_cycles + req_cycles;
+        if (verbose)
+          $display("%s 0x%h: %s q=0x%h (%0d cycles)", rec[64] ? "WR" : "RD",
+                   address, first_hit ? "HIT " : "MISS", q, req_cycles);
+      end
+      $fclose(fd);
+
+      #20;
+      $display("%0d requests, %0d hits, %0d misses, %0d cycles",
+               n_req, n_hit, n_req - n_hit, n_cycles);
+
+      // Performance counters, one "perf <addr> <value>" line each; decode
+      // with "python code/perf_report.py"
+      for (i = 0; i < 16; i = i + 1) begin
+        @(negedge clk);
+        csr_addr = i;
+        csr_rden = 1;
+        @(posedge clk); #1;
+        csr_rden = 0;
+        $display("perf %02h %08h", i, csr_rdata);
+      end
+      if (cosim_fd)
+        $fclose(cosim_fd);
     	$finish;
       
     end
-    initial begin
-    $monitor("Time: %0t | RAM[0x0a00] updated to: %h", 
-             $time, dut_ram.mem[16'h0a00]);
-end
+    // Sampled half a step after the edge: the stimulus above changes #1
+    // after it
+    always @(posedge clk) if (cosim_fd && reset_n) begin
+      c_rden = rden;
+      c_wren = wren;
+      c_address = address;
+      c_din = din;
+      #0.5;
+      $fwrite(cosim_fd, "%b%b %h %h %b%b%b %h %h %h %h %b%b %h %h %b%b %h %h %b%b %h %h %b%b %h %h\n",
+              c_rden, c_wren, c_address, c_din, hit_miss, mrden, mwren,
+              q, mrdaddress, mwraddress, mdout,
+              dut_cache.way[0].valid[c_index], dut_cache.way[0].dirty[c_index],
+              dut_cache.way[0].lru[c_index], dut_cache.way[0].tag[c_index],
+              dut_cache.way[1].valid[c_index], dut_cache.way[1].dirty[c_index],
+              dut_cache.way[1].lru[c_index], dut_cache.way[1].tag[c_index],
+              dut_cache.way[2].valid[c_index], dut_cache.way[2].dirty[c_index],
+              dut_cache.way[2].lru[c_index], dut_cache.way[2].tag[c_index],
+              dut_cache.way[3].valid[c_index], dut_cache.way[3].dirty[c_index],
+              dut_cache.way[3].lru[c_index], dut_cache.way[3].tag[c_index]);
+    end
+
     initial begin
         $dumpfile("wave.vcd");
         $dumpvars;
@@ -0,0 +1,235 @@
+`timescale 1ns/1ps
+
+// CoherentCaches on a LatencyRam under random requests from every core,
+// checked against CoherentSystem by "python code/cosim.py --tb coherent".
+//
+// Every core issues +requests=<n> random reads and writes (+seed=<n>) and
+// holds each one until its hit_miss, with an idle cycle now and then.  The
+// addresses are words of the 2^ADDR_WIDTH bytes of memory, HOT_BYTES of
+// them, shared by all cores, most of the time: the cores read and write
+// the same lines, so there are Shared fills, upgrades, invalidations and
+// Modified lines sent cache to cache all the time, and the small caches
+// evict dirty lines too.  Override the parameters with -P.
+module tb_coherent_caches;
+
+    // CoherentCaches
+    parameter NCORES = 4;
+    parameter NWAYS = 2;
+    parameter NSETS = 4;
+    parameter INDEX_WIDTH = 2;
+    parameter OFFSET_WIDTH = 3;
+    parameter MWIDTH = 64;
+    parameter BURST = 1;
+    parameter PLRU = 0;
+    // LatencyRam
+    parameter ADDR_WIDTH = 12;
+    parameter LATENCY = 2;
+    parameter JITTER = 2;
+    parameter COL_BITS = 0;
+    parameter OUTSTANDING = 2;
+    // Stimulus
+    parameter HOT_BYTES = 256;
+    parameter TIMEOUT = 10000;      // cycles a request may wait for hit_miss
+
+    localparam WIDTH = 32;
+    localparam TAG_WIDTH = WIDTH - INDEX_WIDTH - OFFSET_WIDTH;
+
+    reg clk;
+    reg reset_n;
+
+    // CPU ports, packed core-major
+    reg  [NCORES-1:0]       rden;
+    reg  [NCORES-1:0]       wren;
+    reg  [NCORES*WIDTH-1:0] address;
+    reg  [NCORES*WIDTH-1:0] din;
+    wire [NCORES-1:0]       hit_miss;
+    wire [NCORES*WIDTH-1:0] q;
+    wire [NCORES-1:0]       ready;
+    wire [NCORES*32-1:0]    demand_misses;
+    wire [31:0]             bus_reads, bus_readx, invalidations, interventions;
+
+    // Memory port
+    wire [MWIDTH-1:0] mdout;
+    wire [WIDTH-1:0]  mrdaddress;
+    wire              mrden;
+    wire [WIDTH-1:0]  mwraddress;
+    wire              mwren;
+    wire [MWIDTH-1:0] mq;
+    wire              mready;
+    wire              mvalid;
+
+    CoherentCaches #(
+        .NCORES(NCORES),
+        .NWAYS(NWAYS),
+        .NSETS(NSETS),
+        .WIDTH(WIDTH),
+        .MWIDTH(MWIDTH),
+        .INDEX_WIDTH(INDEX_WIDTH),
+        .TAG_WIDTH(TAG_WIDTH),
+        .OFFSET_WIDTH(OFFSET_WIDTH),
+        .BURST(BURST),
+        .PLRU(PLRU)
+    ) dut (
+        .clk(clk),
+        .reset_n(reset_n),
+        .address(address),
+        .din(din),
+        .rden(rden),
+        .wren(wren),
+        .hit_miss(hit_miss),
+        .q(q),
+        .ready(ready),
+        .mdout(mdout),
+        .mrdaddress(mrdaddress),
+        .mrden(mrden),
+        .mwraddress(mwraddress),
+        .mwren(mwren),
+        .mq(mq),
+        .mready(mready),
+        .mvalid(mvalid),
+        .demand_misses(demand_misses),
+        .bus_reads(bus_reads),
+        .bus_readx(bus_readx),
+        .invalidations(invalidations),
+        .interventions(interventions)
+    );
+
+    // The memory starts out zero, as the model's
+    LatencyRam #(
+        .WIDTH(MWIDTH),
+        .DEPTH(ADDR_WIDTH),
+        .LATENCY(LATENCY),
+        .JITTER(JITTER),
+        .COL_BITS(COL_BITS),
+        .OUTSTANDING(OUTSTANDING)
+    ) dut_ram (
+        .clk(clk),
+        .reset_n(reset_n),
+        .data_in(mdout),
+        .adress(mwren ? mwraddress[ADDR_WIDTH-1:0] : mrdaddress[ADDR_WIDTH-1:0]),
+        .write_enable(mwren),
+        .read_enable(mrden),
+        .ready(mready),
+        .data_out(mq),
+        .valid_out(mvalid)
+    );
+
+    always #5 clk = ~clk;
+
+    // Random stimulus
+    integer seed, requests;
+    integer issued [0:NCORES-1];
+    integer done [0:NCORES-1];
+    integer waited [0:NCORES-1];
+    integer c, n_done, cycles;
+    reg running, finished;
+
+    // Lockstep co-simulation log (+cosim=<file>): a "# tb_coherent_caches
+    // NAME=value ..." line with the parameters the model needs, then one
+    // line per clock edge out of reset with the request of every core and,
+    // after the edge, hit_miss, q, snoop, mgnt and demand_misses of every
+    // core, the memory port, the LatencyRam outputs and the bus counters
+    reg [8*256-1:0] cosim_file;
+    integer cosim_fd, k;
+    reg [NCORES-1:0] c_rden, c_wren;
+    reg [NCORES*WIDTH-1:0] c_address, c_din;
+
+    initial begin
+        clk = 0;
+        reset_n = 0;
+        rden = 0;
+        wren = 0;
+        address = 0;
+        din = 0;
+        for (c = 0; c < NCORES; c = c + 1) begin
+            issued[c] = 0;
+            done[c] = 0;
+            waited[c] = 0;
+        end
+        running = 0;
+        finished = 0;
+        cycles = 0;
+        if (!$value$plusargs("seed=%d", seed))
+            seed = 1;
+        if (!$value$plusargs("requests=%d", requests))
+            requests = 10000;
+        cosim_fd = 0;
+        if ($value$plusargs("cosim=%s", cosim_file)) begin
+            cosim_fd = $fopen(cosim_file, "w");
+            $fwrite(cosim_fd, "# tb_coherent_caches NCORES=%0d NWAYS=%0d NSETS=%0d INDEX_WIDTH=%0d TAG_WIDTH=%0d OFFSET_WIDTH=%0d MWIDTH=%0d BURST=%0d PLRU=%0d ADDR_WIDTH=%0d LATENCY=%0d JITTER=%0d COL_BITS=%0d OUTSTANDING=%0d\n",
+                    NCORES, NWAYS, NSETS, INDEX_WIDTH, TAG_WIDTH, OFFSET_WIDTH, MWIDTH, BURST,
+                    PLRU, ADDR_WIDTH, LATENCY, JITTER, COL_BITS, OUTSTANDING);
+        end
+
+        #10 reset_n = 1;
+        wait (&ready);   // the caches clear their sets after reset
+        @(negedge clk);
+        running = 1;
+        wait (finished);
+        // Let the last flush reach the memory
+        repeat (4 * BURST + LATENCY + JITTER) @(posedge clk);
+        #1;
+        $display("%0d requests, %0d cycles, %0d bus reads, %0d bus read-exclusives, %0d invalidations, %0d interventions",
+                 NCORES * requests, cycles, bus_reads, bus_readx, invalidations, interventions);
+        if (cosim_fd)
+            $fclose(cosim_fd);
+        $finish;
+    end
+
+    // A core takes its next request right after hit_miss, or now and then
+    // an idle cycle first: a word of the hot bytes (3 in 4) or of all the
+    // memory, written 1 time in 3
+    always @(posedge clk) if (running) begin
+        #1;
+        cycles = cycles + 1;
+        n_done = 0;
+        for (c = 0; c < NCORES; c = c + 1) begin
+            if ((rden[c] || wren[c]) && hit_miss[c]) begin
+                rden[c] = 0;
+                wren[c] = 0;
+                done[c] = done[c] + 1;
+            end
+            if (rden[c] || wren[c]) begin
+                waited[c] = waited[c] + 1;
+                if (waited[c] == TIMEOUT) begin
+                    $display("core %0d: no hit_miss in %0d cycles for 0x%h",
+                             c, TIMEOUT, address[c*WIDTH +: WIDTH]);
+                    $finish;
+                end
+            end
+            else if (issued[c] < requests && $unsigned($random(seed)) % 8 != 0) begin
+                if ($unsigned($random(seed)) % 4 != 0)
+                    address[c*WIDTH +: WIDTH] = ($unsigned($random(seed)) % HOT_BYTES) & ~3;
+                else
+                    address[c*WIDTH +: WIDTH] = ($unsigned($random(seed)) % (1 << ADDR_WIDTH)) & ~3;
+                din[c*WIDTH +: WIDTH] = $random(seed);
+                wren[c] = $unsigned($random(seed)) % 3 == 0;
+                rden[c] = !wren[c];
+                issued[c] = issued[c] + 1;
+                waited[c] = 0;
+            end
+            n_done = n_done + (done[c] == requests);
+        end
+        finished = n_done == NCORES;
+    end
+
+    // Sampled half a step after the edge: the stimulus above changes #1
+    // after it
+    always @(posedge clk) if (cosim_fd && reset_n) begin
+        c_rden = rden;
+        c_wren = wren;
+        c_address = address;
+        c_din = din;
+        #0.5;
+        for (k = 0; k < NCORES; k = k + 1)
+            $fwrite(cosim_fd, "%b %b %h %h ", c_rden[k], c_wren[k],
+                    c_address[k*WIDTH +: WIDTH], c_din[k*WIDTH +: WIDTH]);
+        for (k = 0; k < NCORES; k = k + 1)
+            $fwrite(cosim_fd, "%b %h %b %b %h ", hit_miss[k], q[k*WIDTH +: WIDTH],
+                    dut.snoop[k], dut.c_mgnt[k], demand_misses[k*32 +: 32]);
+        $fwrite(cosim_fd, "%b %b %h %h %h %b %b %h %h %h %h %h\n",
+                mrden, mwren, mrdaddress, mwraddress, mdout, mready, mvalid, mq,
+                bus_reads, bus_readx, invalidations, interventions);
+    end
+
+endmodule